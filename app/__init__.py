@@ -57,6 +57,13 @@ def create_app():
     except Exception as e:
         app.logger.error(f"Error configuring mappers: {e}")
 
+    # Registers the Coupon flush listeners that keep user_coupon_summary current.
+    from app.analytics import user_summary  # noqa: F401
+    # Registers the Company listeners that invalidate the company matching index.
+    from app.utils import company_index  # noqa: F401
+    # Registers the email outbox listener that records newsletter delivery results.
+    from app.utils import newsletter_dispatch  # noqa: F401
+
     migrate.init_app(app, db)
     login_manager.init_app(app)
     login_manager.login_message = "עליך להתחבר כדי לגשת לעמוד זה"
@@ -146,9 +153,12 @@ def create_app():
     def apple_touch_icon():
         return app.send_static_file("icons/apple-touch-icon.png")
 
+    from app.utils.user_identity import load_user_identity
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # Slim cached snapshot; the full User row is loaded only if a view needs it
+        return load_user_identity(user_id)
 
     # Register Israel time filter
     from app.routes.coupons_routes import to_israel_time_filter
@@ -245,6 +255,11 @@ def create_app():
     from app.template_helpers import register_template_helpers
     register_template_helpers(app)
 
+    # Jobs and scripts have no outbox thread; they send queued email as their
+    # app context ends (registered after db so it runs before the session is removed).
+    from app.utils.email_outbox import init_outbox
+    init_outbox(app)
+
     # Cron endpoints are machine-to-machine and must not require CSRF tokens.
     # (They are protected via API tokens / secrets instead.)
     # A failure here must abort startup: silently keeping CSRF on these
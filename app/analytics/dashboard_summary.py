@@ -0,0 +1,230 @@
+"""
+סיכומי דשבורד לעמוד הבית (profile.index).
+
+במקום לטעון את כל הקופונים של המשתמש ל-ORM ולחשב סכומים ב-Python, כל
+הנתונים המצטברים (סכומים, ספירות לפי סטטוס/סוג, נתוני חברות וציר זמן
+חודשי) מחושבים בשאילתה מקובצת אחת, והכרטיסים המוצגים נטענים בנפרד עם מגבלה.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import case, extract, func, or_
+
+from app.extensions import db
+from app.models import Coupon
+from app.utils.status_reconciler import reconcile_coupon_statuses
+
+ACTIVE_STATUS = "פעיל"
+
+# Default number of coupon cards rendered on the home page.
+DEFAULT_CARDS_LIMIT = 120
+
+
+def _countable_filter():
+    """Coupons that count toward the user's totals (same rule as the home page)."""
+    return (Coupon.is_for_sale == False) & (Coupon.exclude_saving != True)  # noqa: E712
+
+
+def _num(value):
+    return float(value) if value is not None else 0.0
+
+
+def refresh_stale_statuses(user_id):
+    """
+    מעדכן סטטוס רק לקופונים של המשתמש שהסטטוס השמור שלהם שגוי, בפקודות UPDATE
+    ברמת סט (ראו app.utils.status_reconciler). מחזיר את מספר הקופונים שעודכנו.
+    """
+    counts = reconcile_coupon_statuses(user_ids=[user_id])
+    return counts["used"] + counts["expired"] + counts["reactivated"]
+
+
+def get_dashboard_summary(user_id):
+    """
+    מחזיר את כל הנתונים המצטברים של עמוד הבית משאילתה מקובצת אחת.
+
+    השאילתה מקבצת לפי (חברה, סטטוס, חד-פעמי, למכירה, חודש הוספה), כך שמספר
+    השורות תלוי במספר החברות והחודשים ולא במספר הקופונים.
+    """
+    is_countable = case((_countable_filter(), 1), else_=0)
+    year = extract("year", Coupon.date_added)
+    month = extract("month", Coupon.date_added)
+    rows = (
+        db.session.query(
+            Coupon.company.label("company"),
+            Coupon.status.label("status"),
+            Coupon.is_one_time.label("is_one_time"),
+            Coupon.is_for_sale.label("is_for_sale"),
+            is_countable.label("countable"),
+            year.label("year"),
+            month.label("month"),
+            func.count(Coupon.id).label("count"),
+            func.sum(func.coalesce(Coupon.value, 0)).label("total_value"),
+            func.sum(func.coalesce(Coupon.used_value, 0)).label("used_value"),
+            func.sum(
+                func.coalesce(Coupon.value, 0) - func.coalesce(Coupon.used_value, 0)
+            ).label("remaining_value"),
+            func.sum(
+                case(
+                    (Coupon.value > Coupon.used_value, Coupon.value - Coupon.used_value),
+                    else_=0,
+                )
+            ).label("positive_remaining"),
+            func.sum(
+                case((Coupon.value > Coupon.cost, Coupon.value - Coupon.cost), else_=0)
+            ).label("savings"),
+            func.min(Coupon.expiration).label("earliest_expiration"),
+        )
+        .filter(Coupon.user_id == user_id)
+        .group_by(
+            Coupon.company,
+            Coupon.status,
+            Coupon.is_one_time,
+            Coupon.is_for_sale,
+            is_countable,
+            year,
+            month,
+        )
+        .all()
+    )
+
+    summary = {
+        "total_remaining": 0.0,
+        "total_savings": 0.0,
+        "total_coupons_value": 0.0,
+        "total_used_value": 0.0,
+        "total_coupons_count": 0,
+        "active_count": 0,
+        "active_one_time_count": 0,
+        "used_count": 0,
+        "one_time_count": 0,
+        "for_sale_count": 0,
+        "companies": {},
+        "monthly": {},
+    }
+
+    for row in rows:
+        if row.is_for_sale:
+            summary["for_sale_count"] += row.count
+        if not row.countable:
+            continue
+
+        is_active = row.status == ACTIVE_STATUS
+        summary["total_coupons_count"] += row.count
+        summary["total_remaining"] += _num(row.positive_remaining)
+        summary["total_savings"] += _num(row.savings)
+        summary["total_coupons_value"] += _num(row.total_value)
+        summary["total_used_value"] += _num(row.used_value)
+        if row.is_one_time:
+            summary["one_time_count"] += row.count
+        if is_active and row.is_one_time:
+            summary["active_one_time_count"] += row.count
+        elif is_active:
+            summary["active_count"] += row.count
+        else:
+            summary["used_count"] += row.count
+
+        company = row.company or ""
+        stats = summary["companies"].setdefault(
+            company,
+            {
+                "total_value": 0.0,
+                "used_value": 0.0,
+                "remaining_value": 0.0,
+                "savings": 0.0,
+                "count": 0,
+                "one_time_count": 0,
+                "non_one_time_count": 0,
+                "active_coupons": 0,
+                "earliest_expiration": None,
+            },
+        )
+        stats["total_value"] += _num(row.total_value)
+        stats["used_value"] += _num(row.used_value)
+        stats["remaining_value"] += _num(row.remaining_value)
+        stats["savings"] += _num(row.savings)
+        stats["count"] += row.count
+        if row.is_one_time:
+            stats["one_time_count"] += row.count
+        else:
+            stats["non_one_time_count"] += row.count
+        if is_active:
+            stats["active_coupons"] += row.count
+            if row.earliest_expiration and (
+                stats["earliest_expiration"] is None
+                or row.earliest_expiration < stats["earliest_expiration"]
+            ):
+                stats["earliest_expiration"] = row.earliest_expiration
+
+        if row.year is None or row.month is None:
+            continue
+        month_key = f"{int(row.year):04d}-{int(row.month):02d}"
+        month_stats = summary["monthly"].setdefault(
+            month_key,
+            {
+                "savings": 0.0,
+                "count": 0,
+                "original_value": 0.0,
+                "remaining_value": 0.0,
+                "companies": set(),
+                "one_time_count": 0,
+                "non_one_time_count": 0,
+            },
+        )
+        month_stats["savings"] += _num(row.savings)
+        month_stats["count"] += row.count
+        month_stats["original_value"] += _num(row.total_value)
+        month_stats["remaining_value"] += _num(row.remaining_value)
+        month_stats["companies"].add(company)
+        if row.is_one_time:
+            month_stats["one_time_count"] += row.count
+        else:
+            month_stats["non_one_time_count"] += row.count
+
+    return summary
+
+
+def get_dashboard_cards(user_id, limit=DEFAULT_CARDS_LIMIT, options=()):
+    """
+    טוען רק את הכרטיסים שמוצגים בעמוד הבית (פעילים, חד-פעמיים פעילים, למכירה),
+    עד `limit` קופונים, מהחדש לישן. קופונים שנוצלו/פגו לא נטענים כלל.
+
+    מחזיר dict עם active / active_one_time / for_sale ו-remaining_count
+    (כמה כרטיסים נוספים לא נטענו).
+    """
+    visible_filter = or_(
+        Coupon.is_for_sale == True,  # noqa: E712
+        _countable_filter() & (Coupon.status == ACTIVE_STATUS),
+    )
+    query = Coupon.query.options(*options).filter(
+        Coupon.user_id == user_id, visible_filter
+    )
+    coupons = query.order_by(Coupon.date_added.desc()).limit(limit + 1).all()
+
+    remaining_count = 0
+    if len(coupons) > limit:
+        coupons = coupons[:limit]
+        remaining_count = query.order_by(None).count() - limit
+
+    return {
+        "active": [c for c in coupons if not c.is_for_sale and not c.is_one_time],
+        "active_one_time": [c for c in coupons if not c.is_for_sale and c.is_one_time],
+        "for_sale": [c for c in coupons if c.is_for_sale],
+        "remaining_count": remaining_count,
+    }
+
+
+def get_expiring_coupons(user_id, days=7):
+    """קופונים פעילים (שנספרים בסיכום) שתוקפם פג בתוך `days` הימים הקרובים."""
+    today = date.today()
+    return (
+        Coupon.query.filter(
+            Coupon.user_id == user_id,
+            _countable_filter(),
+            Coupon.status == ACTIVE_STATUS,
+            Coupon.expiration.isnot(None),
+            Coupon.expiration >= today,
+            Coupon.expiration <= today + timedelta(days=days),
+        )
+        .order_by(Coupon.expiration.asc())
+        .all()
+    )
@@ -0,0 +1,319 @@
+"""
+תחזוקה אינקרמנטלית של טבלת user_coupon_summary.
+
+כל flush של Coupon דרך ה-ORM (יצירה, מחיקה, עדכון שימוש/סטטוס, ייבוא
+עסקאות) מתורגם ל-delta לשורת הסיכום של המשתמש, שנכתב באותה טרנזקציה.
+כשאין מספיק מידע ל-delta (ערך קודם לא נטען, שורה חסרה) מחשבים מחדש את
+שורות המשתמש מתוך טבלת coupon. כותבים שעוקפים את ה-ORM צריכים לקרוא ל-
+rebuild_user_summaries (או לסקריפט scripts/rebuild_user_coupon_summary.py).
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import case, delete, event, func, insert, literal, select, update
+from sqlalchemy.orm import Session, attributes
+
+from app.extensions import db
+from app.models import Coupon, UserCouponSummary
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUS = "פעיל"
+
+CATEGORY_COUNTABLE = "countable"
+CATEGORY_FOR_SALE = "for_sale"
+CATEGORY_EXCLUDED = "excluded"
+ALL_CATEGORIES = (CATEGORY_COUNTABLE, CATEGORY_FOR_SALE, CATEGORY_EXCLUDED)
+
+SUMMARY_COLUMNS = (
+    "coupon_count",
+    "active_count",
+    "active_one_time_count",
+    "one_time_count",
+    "total_value",
+    "used_value",
+    "remaining_value",
+    "savings",
+)
+
+# Coupon attributes that feed the summary; changes to anything else are ignored.
+_TRACKED_ATTRS = (
+    "user_id",
+    "value",
+    "cost",
+    "used_value",
+    "status",
+    "is_one_time",
+    "is_for_sale",
+    "exclude_saving",
+)
+
+_PENDING_KEY = "user_coupon_summary_pending"
+
+
+def _category(values):
+    if values["is_for_sale"]:
+        return CATEGORY_FOR_SALE
+    if values["exclude_saving"]:
+        return CATEGORY_EXCLUDED
+    return CATEGORY_COUNTABLE
+
+
+def _contribution(values):
+    value = values["value"] or 0
+    used_value = values["used_value"] or 0
+    cost = values["cost"] or 0
+    is_active = values["status"] == ACTIVE_STATUS
+    is_one_time = bool(values["is_one_time"])
+    return {
+        "coupon_count": 1,
+        "active_count": int(is_active and not is_one_time),
+        "active_one_time_count": int(is_active and is_one_time),
+        "one_time_count": int(is_one_time),
+        "total_value": value,
+        "used_value": used_value,
+        "remaining_value": max(value - used_value, 0),
+        "savings": max(value - cost, 0),
+    }
+
+
+def _aggregate_select(user_ids=None):
+    """SELECT שמחשב את שורות הסיכום ישירות מטבלת coupon (לבנייה מחדש)."""
+    category = case(
+        (Coupon.is_for_sale == True, CATEGORY_FOR_SALE),  # noqa: E712
+        (Coupon.exclude_saving == True, CATEGORY_EXCLUDED),  # noqa: E712
+        else_=CATEGORY_COUNTABLE,
+    )
+    is_active = Coupon.status == ACTIVE_STATUS
+    is_one_time = func.coalesce(Coupon.is_one_time, False) == True  # noqa: E712
+    stmt = select(
+        Coupon.user_id,
+        category,
+        func.count(Coupon.id),
+        func.sum(case((is_active & ~is_one_time, 1), else_=0)),
+        func.sum(case((is_active & is_one_time, 1), else_=0)),
+        func.sum(case((is_one_time, 1), else_=0)),
+        func.coalesce(func.sum(Coupon.value), 0),
+        func.coalesce(func.sum(Coupon.used_value), 0),
+        func.sum(
+            case(
+                (Coupon.value > Coupon.used_value, Coupon.value - Coupon.used_value),
+                else_=0,
+            )
+        ),
+        func.sum(
+            case((Coupon.value > Coupon.cost, Coupon.value - Coupon.cost), else_=0)
+        ),
+        literal(datetime.now(timezone.utc), UserCouponSummary.updated_at.type),
+    ).where(Coupon.user_id.isnot(None)).group_by(Coupon.user_id, category)
+    if user_ids is not None:
+        stmt = stmt.where(Coupon.user_id.in_(user_ids))
+    return stmt
+
+
+def _rebuild(connection, user_ids=None):
+    table = UserCouponSummary.__table__
+    delete_stmt = delete(table)
+    if user_ids is not None:
+        delete_stmt = delete_stmt.where(table.c.user_id.in_(user_ids))
+    connection.execute(delete_stmt)
+    connection.execute(
+        insert(table).from_select(
+            ["user_id", "category", *SUMMARY_COLUMNS, "updated_at"],
+            _aggregate_select(user_ids),
+        )
+    )
+
+
+def rebuild_user_summaries(user_ids=None):
+    """
+    מחשב מחדש את שורות הסיכום מתוך טבלת coupon (כל המשתמשים אם user_ids=None).
+    לא מבצע commit - האחריות על הקורא.
+    """
+    if user_ids is not None:
+        user_ids = [uid for uid in set(user_ids) if uid is not None]
+        if not user_ids:
+            return
+    _rebuild(db.session.connection(), user_ids)
+
+
+def get_user_summary(user_id, categories=ALL_CATEGORIES):
+    """
+    קריאת PK של שורות הסיכום של המשתמש, מסוכמות לקטגוריות המבוקשות.
+    משתמש בלי קופונים מקבל אפסים.
+    """
+    totals = dict.fromkeys(SUMMARY_COLUMNS, 0)
+    rows = UserCouponSummary.query.filter(
+        UserCouponSummary.user_id == user_id,
+        UserCouponSummary.category.in_(categories),
+    ).all()
+    for row in rows:
+        for column in SUMMARY_COLUMNS:
+            totals[column] += getattr(row, column) or 0
+    return totals
+
+
+# ----------------------------------------------------------------------------
+# Incremental maintenance (ORM events)
+# ----------------------------------------------------------------------------
+
+def _pending(session):
+    return session.info.setdefault(
+        _PENDING_KEY, {"deltas": {}, "rebuild": set(), "previous": {}}
+    )
+
+
+def _add(pending, values, sign):
+    key = (values["user_id"], _category(values))
+    bucket = pending["deltas"].setdefault(key, dict.fromkeys(SUMMARY_COLUMNS, 0))
+    for column, amount in _contribution(values).items():
+        bucket[column] += sign * amount
+
+
+def _current_values(target):
+    state_dict = attributes.instance_dict(target)
+    if any(attr not in state_dict for attr in _TRACKED_ATTRS):
+        return None
+    return {attr: state_dict[attr] for attr in _TRACKED_ATTRS}
+
+
+def _previous_values(target):
+    """ערכי העמודות לפני העדכון, או None אם ערך קודם לא היה טעון."""
+    loaded = _pending(Session.object_session(target))["previous"].pop(id(target), None)
+    if loaded is not None:
+        return loaded
+    state = attributes.instance_state(target)
+    values = {}
+    for attr in _TRACKED_ATTRS:
+        history = state.attrs[attr].history
+        if history.deleted:
+            values[attr] = history.deleted[0]
+        elif history.unchanged:
+            values[attr] = history.unchanged[0]
+        else:
+            return None
+    return values
+
+
+def _has_tracked_changes(target):
+    state = attributes.instance_state(target)
+    return any(state.attrs[attr].history.has_changes() for attr in _TRACKED_ATTRS)
+
+
+def _history_is_complete(target):
+    state = attributes.instance_state(target)
+    for attr in _TRACKED_ATTRS:
+        history = state.attrs[attr].history
+        if not (history.deleted or history.unchanged):
+            return False
+    return True
+
+
+def _load_previous_values(mapper, connection, target):
+    """
+    Assigning an attribute that was expired (e.g. after a commit) leaves no old
+    value in its history. Instead of loading it on every set, the tracked
+    columns are read once here, before the flush changes the row, and only
+    for coupons whose history is incomplete.
+    """
+    if _history_is_complete(target):
+        return
+    columns = [mapper.columns[attr] for attr in _TRACKED_ATTRS]
+    coupon_id = attributes.instance_state(target).identity[0]
+    row = connection.execute(
+        select(*columns).where(Coupon.__table__.c.id == coupon_id)
+    ).first()
+    if row is not None:
+        _pending(Session.object_session(target))["previous"][id(target)] = dict(
+            zip(_TRACKED_ATTRS, row)
+        )
+
+
+@event.listens_for(Coupon, "before_update")
+def _coupon_updating(mapper, connection, target):
+    if _has_tracked_changes(target):
+        _load_previous_values(mapper, connection, target)
+
+
+@event.listens_for(Coupon, "before_delete")
+def _coupon_deleting(mapper, connection, target):
+    _load_previous_values(mapper, connection, target)
+
+
+@event.listens_for(Coupon, "after_insert")
+def _coupon_inserted(mapper, connection, target):
+    pending = _pending(Session.object_session(target))
+    values = _current_values(target)
+    if values is None:
+        pending["rebuild"].add(attributes.instance_dict(target).get("user_id"))
+    else:
+        _add(pending, values, 1)
+
+
+@event.listens_for(Coupon, "after_update")
+def _coupon_updated(mapper, connection, target):
+    if not _has_tracked_changes(target):
+        return
+    pending = _pending(Session.object_session(target))
+    old_values = _previous_values(target)
+    new_values = _current_values(target)
+    if old_values is None or new_values is None:
+        pending["rebuild"].add(attributes.instance_dict(target).get("user_id"))
+        if old_values is not None:
+            pending["rebuild"].add(old_values["user_id"])
+        return
+    _add(pending, old_values, -1)
+    _add(pending, new_values, 1)
+
+
+@event.listens_for(Coupon, "after_delete")
+def _coupon_deleted(mapper, connection, target):
+    pending = _pending(Session.object_session(target))
+    values = _previous_values(target)
+    if values is None:
+        pending["rebuild"].add(attributes.instance_dict(target).get("user_id"))
+    else:
+        _add(pending, values, -1)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_pending(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    table = UserCouponSummary.__table__
+    rebuild = {uid for uid in pending["rebuild"] if uid is not None}
+    connection = session.connection()
+    try:
+        with connection.begin_nested():
+            for (user_id, category), delta in pending["deltas"].items():
+                if user_id is None or user_id in rebuild:
+                    continue
+                if not any(delta.values()):
+                    continue
+                result = connection.execute(
+                    update(table)
+                    .where(table.c.user_id == user_id, table.c.category == category)
+                    .values(
+                        updated_at=datetime.now(timezone.utc),
+                        **{col: table.c[col] + delta[col] for col in SUMMARY_COLUMNS},
+                    )
+                )
+                if result.rowcount == 0:
+                    # First coupon in this category (or the row was never built).
+                    rebuild.add(user_id)
+            if rebuild:
+                _rebuild(connection, sorted(rebuild))
+    except Exception:
+        # The summary is derived data; never fail the coupon write because of it.
+        logger.exception(
+            "Failed to update user_coupon_summary for users %s",
+            sorted({key[0] for key in pending["deltas"]} | rebuild),
+        )
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
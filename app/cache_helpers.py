@@ -80,4 +80,7 @@ def invalidate_user_caches(user_id):
         cache.delete_memoized(User.get_by_email_cached, user.email)
     
     # Clear user-specific caches
-    clear_user_cache(user_id)
\ No newline at end of file
+    clear_user_cache(user_id)
+
+    from app.utils.user_identity import invalidate_user_identity
+    invalidate_user_identity(user_id)
\ No newline at end of file
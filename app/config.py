@@ -102,6 +102,18 @@ class Config:
         "ALLOW_INSECURE_OAUTH_TRANSPORT", False
     )
 
+    # Send queued email from this process: a background thread in each web
+    # process (started from wsgi.py), and a flush at the end of the app context
+    # in RQ jobs and scripts. Off means this process never sends queued email.
+    EMAIL_OUTBOX_WORKER = _get_bool_env("EMAIL_OUTBOX_WORKER", True)
+
+    # Maximum number of coupon cards rendered on the home page
+    INDEX_CARDS_LIMIT = _get_int_env("INDEX_CARDS_LIMIT", 120)
+
+    # Coupons scraped concurrently by the batch auto-update task. Live Chrome
+    # instances are capped separately (SCRAPER_MAX_CHROME / SCRAPER_MAX_PER_SITE).
+    AUTO_UPDATE_WORKERS = _get_int_env("AUTO_UPDATE_WORKERS", 3)
+
     # Login abuse protection
     LOGIN_MAX_ATTEMPTS = _get_int_env("LOGIN_MAX_ATTEMPTS", 6)
     LOGIN_WINDOW_SECONDS = _get_int_env("LOGIN_WINDOW_SECONDS", 600)
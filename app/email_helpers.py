@@ -1,10 +1,12 @@
+import logging
 import os
-from datetime import datetime
-from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from flask import current_app, render_template, url_for, request
 from itsdangerous import URLSafeTimedSerializer
-from pprint import pprint
+
+from app.utils.email_outbox import BrevoError, enqueue_email, send_now, timestamped_subject
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 BREVO_API_KEY = os.getenv("BREVO_API_KEY")
@@ -12,32 +14,23 @@ SENDER_EMAIL = os.getenv("SENDER_EMAIL")
 SENDER_NAME = "Coupon Master"
 
 
-def _get_brevo_client():
-    """Lazily import the Brevo (SendinBlue) SDK."""
-    try:
-        import sib_api_v3_sdk  # type: ignore
-        from sib_api_v3_sdk.rest import ApiException  # type: ignore
-
-        return sib_api_v3_sdk, ApiException
-    except ImportError:
-        return None, None
-
 
 def send_html_email(
-    api_key: str,
-    sender_email: str,
-    sender_name: str,
-    recipient_email: str,
-    recipient_name: str,
-    subject: str,
-    html_content: str,
+    api_key: str = None,
+    sender_email: str = None,
+    sender_name: str = None,
+    recipient_email: str = None,
+    recipient_name: str = None,
+    subject: str = None,
+    html_content: str = None,
     add_timestamp: bool = True,
 ):
     """
-    Sends an HTML email using the Brevo (SendinBlue) API.
+    Sends an HTML email right away through the pooled Brevo transport
+    (app/utils/email_outbox.py). Prefer send_email, which queues it.
 
     Parameters:
-    - api_key (str): Your Brevo API key.
+    - api_key (str): Brevo API key (default: BREVO_API_KEY).
     - sender_email (str): Sender's email address.
     - sender_name (str): Sender's name.
     - recipient_email (str): Recipient's email address.
@@ -50,42 +43,19 @@ def send_html_email(
     - dict: API response if successful.
     - None: If an exception occurs.
     """
-    sib_api_v3_sdk, ApiException = _get_brevo_client()
-    if sib_api_v3_sdk is None or ApiException is None:
-        raise ImportError(
-            "sib_api_v3_sdk is not installed. Please install the Brevo SDK to send emails."
-        )
-
-    configuration = sib_api_v3_sdk.Configuration()
-    configuration.api_key["api-key"] = api_key
-
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(
-        sib_api_v3_sdk.ApiClient(configuration)
-    )
-
-    if add_timestamp:
-        israel_tz = ZoneInfo("Asia/Jerusalem")
-        israel_time = datetime.now(israel_tz)
-        final_subject = f"{subject} - {israel_time.strftime('%d%m%Y %H:%M')}"
-    else:
-        final_subject = subject
-
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": recipient_email, "name": recipient_name}],
-        sender={"email": sender_email, "name": sender_name},
-        subject=final_subject,
-        html_content=html_content,
-    )
-
+    final_subject = timestamped_subject(subject) if add_timestamp else subject
     try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        pprint(api_response)
-        return api_response
-    except ApiException as e:
-        print(
-            "Exception when calling TransactionalEmailsApi->send_transac_email: %s\n"
-            % e
+        return send_now(
+            sender_email=sender_email,
+            sender_name=sender_name,
+            recipient_email=recipient_email,
+            recipient_name=recipient_name,
+            subject=final_subject,
+            html_content=html_content,
+            api_key=api_key,
         )
+    except BrevoError as e:
+        logger.error(f"Brevo send to {recipient_email} failed: {e}")
         return None
 
 
@@ -99,7 +69,7 @@ def send_email(
     add_timestamp=True,
 ):
     """
-    Sends a general email.
+    Queues a general email in email_outbox; the outbox worker sends it.
 
     :param sender_email: Sender's email address
     :param sender_name: Sender's name
@@ -109,18 +79,15 @@ def send_email(
     :param html_content: HTML content of the email
     :param add_timestamp: Whether to add timestamp to subject line
     """
-    api_key = BREVO_API_KEY
-
+    final_subject = timestamped_subject(subject) if add_timestamp else subject
     try:
-        send_html_email(
-            api_key=api_key,
-            sender_email=sender_email,
-            sender_name=sender_name,
+        enqueue_email(
             recipient_email=recipient_email,
             recipient_name=recipient_name,
-            subject=subject,
+            subject=final_subject,
             html_content=html_content,
-            add_timestamp=add_timestamp,
+            sender_email=sender_email,
+            sender_name=sender_name,
         )
     except Exception as e:
         raise Exception(f"Error sending email: {e}")
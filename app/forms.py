@@ -539,7 +539,7 @@ class ApproveTransactionForm(FlaskForm):
     submit = SubmitField("אשר עסקה")
 
     def validate_code(self, field):
-        if field.data and Coupon.query.filter_by(code=field.data.strip()).first():
+        if field.data and Coupon.find_by_code(field.data):
             raise ValidationError("קוד קופון זה כבר קיים. אנא בחר קוד אחר.")
 
 
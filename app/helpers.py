@@ -11,8 +11,7 @@ from datetime import datetime
 from datetime import datetime as dt, timezone, date
 from dotenv import load_dotenv
 from flask import current_app, render_template, url_for, flash
-from functools import lru_cache
-from pprint import pprint
+from contextlib import contextmanager
 from app.extensions import db
 from app.models import (
     Coupon,
@@ -39,6 +38,24 @@ import os
 from datetime import datetime
 from app.models import Company
 import logging
+from app.utils.scrape_limits import get_scrape_limiter
+from app.utils.driver_pool import get_driver_pool
+from app.utils.transaction_ingest import ingest_coupon_transactions
+from app.utils.multipass_fetchers import (
+    MULTIPASS_BALANCE_URL,
+    MULTIPASS_RECAPTCHA_SITE_KEY,
+    fetch_multipass_tables,
+    fetcher_metrics,
+    solve_capsolver_recaptcha,
+)
+from app.utils.email_outbox import BrevoError, enqueue_email, send_now, timestamped_subject
+from app.utils.gpt_cache import (
+    billable_usage,
+    cached_chat_completion,
+    gpt_cache_key,
+    image_digest,
+    normalize_text_input,
+)
 
 load_dotenv()
 BREVO_API_KEY = os.getenv("BREVO_API_KEY")
@@ -128,6 +145,39 @@ def _create_chrome_driver(chrome_options, debug_print=None):
     return driver, cleanup_profile
 
 
+def _acquire_scrape_driver(chrome_options, driver_lease=None, debug_print=None):
+    """
+    Return (driver, release). With a DriverLease the driver comes from the warm
+    pool and release() is a no-op (the lease hands it back); otherwise a fresh
+    driver is created and release() quits it and removes its profile.
+    """
+    if driver_lease is not None:
+        driver = driver_lease.get(
+            lambda: _create_chrome_driver(chrome_options, debug_print)
+        )
+        return driver, lambda: None
+
+    driver, cleanup_profile = _create_chrome_driver(chrome_options, debug_print)
+
+    def release():
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        cleanup_profile()
+
+    return driver, release
+
+
+@contextmanager
+def _scrape_driver(chrome_options, driver_lease=None, debug_print=None):
+    driver, release = _acquire_scrape_driver(chrome_options, driver_lease, debug_print)
+    try:
+        yield driver
+    finally:
+        release()
+
+
 def _apply_buyme_cf_clearance(driver, debug_print=None):
     clearance = os.getenv("BUYME_CF_CLEARANCE")
     if not clearance:
@@ -160,17 +210,6 @@ def _apply_buyme_cf_clearance(driver, debug_print=None):
         return False
 
 
-@lru_cache(maxsize=1)
-def _get_brevo_client():
-    """Lazily import the Brevo (SendinBlue) SDK."""
-    try:
-        import sib_api_v3_sdk  # type: ignore
-        from sib_api_v3_sdk.rest import ApiException  # type: ignore
-
-        return sib_api_v3_sdk, ApiException
-    except ImportError:
-        return None, None
-
 # ----------------------------------------------------------------
 #  Helper function for creating notifications
 # ----------------------------------------------------------------
@@ -866,100 +905,35 @@ def process_multipass_json(coupon, transactions_data):
         # ----------------------------------------------------------------------
         # Common Stage: Database Comparison and Update
         # ----------------------------------------------------------------------
-        
-        # Retrieve existing data from the database (only reference_number)
-        existing_data = pd.read_sql_query(
-            """
-            SELECT reference_number
-            FROM coupon_transaction
-            WHERE coupon_id = %(coupon_id)s
-            """,
-            db.engine,
-            params={"coupon_id": coupon.id},
-        )
-        
-        existing_refs = set(existing_data["reference_number"].astype(str))
         df["reference_number"] = df["reference_number"].astype(str)
-        
-        # Filter out existing transactions
-        df_new = df[~df["reference_number"].isin(existing_refs)]
-        
+        ingest = ingest_coupon_transactions(
+            coupon, df, source="Multipass", update_value=True, commit=False
+        )
+        df_new = df[df["reference_number"].isin(ingest["inserted_refs"])]
         if df_new.empty:
             print(f"No new transactions to add for coupon {coupon.code}.")
-            # Even if no new transactions, we should update the total used value just in case
-            # But let's follow the pattern of get_coupon_data and return empty df
-        else:
-            # Add new transactions
-            for idx, row in df_new.iterrows():
-                transaction_date = row.get("transaction_date")
-                if pd.isna(transaction_date) or str(transaction_date) in ['NaT', 'NaN', 'nat', 'nan']:
-                   transaction_date = None
-                   
-                try:
-                    transaction = CouponTransaction(
-                        coupon_id=coupon.id,
-                        transaction_date=transaction_date,
-                        location=row.get("location", ""),
-                        recharge_amount=row.get("recharge_amount", 0.0),
-                        usage_amount=row.get("usage_amount", 0.0),
-                        reference_number=row.get("reference_number", ""),
-                        source="Multipass"
-                    )
-                    db.session.add(transaction)
-                except ValueError as e:
-                    print(f"Skipping invalid transaction: {e}")
-                    continue
-        
-        # Update total usage in the database (re-calculate from all transactions)
-        # However, to be safe and ensure we catching everything, we commit the new transactions first
-        db.session.commit()
-        
-        # Update total usage AND total value (recharge) in the database
-        db.session.commit()
-        
+
         # Self-healing: Ensure ALL transactions for this coupon that match the references 
         # in the current JSON are marked as 'Multipass'. This fixes issues where
         # transactions might have been inserted with source='User' (default) and are hidden by the UI.
         try:
              all_refs = df["reference_number"].unique().tolist()
              if all_refs:
-                 from sqlalchemy import text
-                 # Use text() for raw SQL update
-                 update_query = text("""
-                     UPDATE coupon_transaction 
-                     SET source = 'Multipass' 
-                     WHERE coupon_id = :coupon_id 
-                     AND reference_number IN :refs
-                 """)
-                 # For SQLite/PostgreSQL compatibility with IN clause using tuple
-                 db.session.execute(update_query, {"coupon_id": coupon.id, "refs": tuple(all_refs)})
-                 db.session.commit()
+                 with db.session.begin_nested():
+                     db.session.execute(
+                         CouponTransaction.__table__.update()
+                         .where(
+                             CouponTransaction.coupon_id == coupon.id,
+                             CouponTransaction.reference_number.in_(all_refs),
+                             CouponTransaction.source != "Multipass",
+                         )
+                         .values(source="Multipass")
+                     )
                  if DEBUG_MODE:
                      print(f"Ensured source='Multipass' for {len(all_refs)} transactions.")
         except Exception as e:
             print(f"Error healing transaction sources: {e}")
 
-        # Calculate totals from ALL transactions including the new ones
-        totals = (
-            db.session.query(
-                func.sum(CouponTransaction.usage_amount).label('total_usage'),
-                func.sum(CouponTransaction.recharge_amount).label('total_recharge')
-            )
-            .filter_by(coupon_id=coupon.id)
-            .first()
-        )
-        
-        total_used = totals.total_usage or 0.0
-        total_recharged = totals.total_recharge or 0.0
-        
-        # Update coupon fields
-        # Ideally, value = total_recharged, used_value = total_used
-        # However, we should be careful not to overwrite manual values if no recharge history exists
-        if total_recharged > 0:
-            coupon.value = float(total_recharged)
-            
-        coupon.used_value = float(total_used)
-        
         # Update last_scraped timestamp
         coupon.last_scraped = datetime.now(timezone.utc)
         
@@ -1037,7 +1011,18 @@ def get_coupon_data_with_retry(coupon, max_retries=3, save_directory="automatic_
         try:
             logger.info(f"Attempt {attempt + 1}/{max_retries} for coupon {coupon.code}")
             
-            result = get_coupon_data(coupon, save_directory)
+            # Bounded by the process-wide Chrome cap and the per-site cap; the
+            # driver is leased from the warm pool when it is enabled.
+            site = coupon.auto_download_details
+            pool = get_driver_pool()
+            with get_scrape_limiter().slot(site):
+                if pool is None:
+                    result = get_coupon_data(coupon, save_directory)
+                else:
+                    with pool.lease(site) as driver_lease:
+                        result = get_coupon_data(
+                            coupon, save_directory, driver_lease=driver_lease
+                        )
             
             if result is not None:
                 attempt_duration = (datetime.now() - attempt_start).total_seconds()
@@ -3980,30 +3965,40 @@ def normalize_multipass_dataframe(df, coupon_number, debug_print=lambda *_: None
 
     df.rename(columns=rename_map, inplace=True)
 
-    def _parse_currency(value):
-        if pd.isna(value):
-            return 0.0
-        text = str(value)
+    def _parse_currency(series):
+        # Vectorized equivalent of float() over the digits, dots and minus signs
+        # left after stripping currency marks; anything unparsable becomes 0.0.
+        # Amount columns repeat a lot (₪0.00 on every other row), so each
+        # distinct cell is parsed once.
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
         text = (
-            text.replace("₪", "")
-            .replace("\u20aa", "")
-            .replace(",", "")
-            .replace("\u200e", "")
-            .replace("\u200f", "")
-            .replace("−", "-")
+            pd.Series(uniques, dtype=object)
+            .astype(str)
+            .str.replace("\u2212", "-", regex=False)
+            .str.replace(r"[^\d.\-]", "", regex=True)
+        )
+        values = pd.to_numeric(text, errors="coerce").astype(float)
+        # to_numeric only knows ASCII digits; retry the few leftovers with float().
+        leftovers = values.isna() & text.str.len().gt(0)
+        if leftovers.any():
+            def _to_float(value):
+                try:
+                    return float(value)
+                except ValueError:
+                    return float("nan")
+
+            values[leftovers] = text[leftovers].map(_to_float)
+        parsed = values.fillna(0.0).to_numpy()
+        return pd.Series(
+            np.where(codes >= 0, parsed[codes] if len(parsed) else 0.0, 0.0),
+            index=series.index,
+            dtype=float,
         )
-        text = "".join(ch for ch in text if ch.isdigit() or ch in ".-")
-        if not text or text in {"-", ""}:
-            return 0.0
-        try:
-            return float(text)
-        except ValueError:
-            return 0.0
 
     numeric_columns = ["recharge_amount", "original_amount", "usage_amount", "discount"]
     for column in numeric_columns:
         if column in df.columns:
-            df[column] = df[column].apply(_parse_currency)
+            df[column] = _parse_currency(df[column])
         else:
             df[column] = 0.0
 
@@ -4030,13 +4025,13 @@ def normalize_multipass_dataframe(df, coupon_number, debug_print=lambda *_: None
         .str.replace(r"\s+", "", regex=True)
     )
 
-    def _ensure_reference(row):
-        value = row["reference_number"]
-        if value in {"", "-", "nan", "None"}:
-            return f"{coupon_number}|{int(row.name) + 1}"
-        return value
-
-    df["reference_number"] = df.apply(_ensure_reference, axis=1)
+    # Rows without a reference get "<coupon_number>|<row label + 1>".
+    missing_reference = df["reference_number"].isin(["", "-", "nan", "None"])
+    if missing_reference.any():
+        fallback = f"{coupon_number}|" + (
+            pd.Series(df.index, index=df.index).astype(int) + 1
+        ).astype(str)
+        df["reference_number"] = df["reference_number"].mask(missing_reference, fallback)
     df.reset_index(drop=True, inplace=True)
 
     debug_print(
@@ -4045,7 +4040,7 @@ def normalize_multipass_dataframe(df, coupon_number, debug_print=lambda *_: None
     return df
 
 
-def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html"):
+def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html", driver_lease=None):
     # Import required modules at function level
     import os
     import time
@@ -4104,53 +4099,51 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
     if coupon_kind == "Max":
         chrome_options.add_argument("--blink-settings=imagesEnabled=false")
 
-    def solve_capsolver_recaptcha(api_key, website_url, website_key):
-        import requests
-        import time
-        debug_print("Requesting Capsolver to solve reCAPTCHA...")
-        payload = {
-            "clientKey": api_key,
-            "task": {
-                "type": "ReCaptchaV2TaskProxyless",
-                "websiteURL": website_url,
-                "websiteKey": website_key
-            }
-        }
-        try:
-            res = requests.post("https://api.capsolver.com/createTask", json=payload).json()
-            if res.get("errorId") != 0:
-                debug_print(f"Capsolver createTask error: {res.get('errorDescription')}")
-                return None
-            
-            task_id = res.get("taskId")
-            while True:
-                time.sleep(3)
-                res = requests.post("https://api.capsolver.com/getTaskResult", json={
-                    "clientKey": api_key,
-                    "taskId": task_id
-                }).json()
-                
-                status = res.get("status")
-                if status == "ready":
-                    debug_print("Capsolver solved reCAPTCHA successfully.")
-                    return res.get("solution", {}).get("gRecaptchaResponse")
-                elif status == "failed" or res.get("errorId") != 0:
-                    debug_print(f"Capsolver getTaskResult error: {res.get('errorDescription')}")
-                    return None
-        except Exception as ex:
-            debug_print(f"Capsolver exception: {ex}")
+    df = None  # DataFrame to hold the scraped data
+    # Set only when the source proves the scrape holds the whole history
+    # (e.g. Multipass paged until Next was disabled); gates pruning below.
+    history_complete = False
+
+    # -------------------- Multipass fast path (HTTP only) --------------------
+    multipass_fetched = None
+    if coupon_kind == "Multipass":
+        multipass_fetched = fetch_multipass_tables(
+            str(coupon_number).replace("-", ""), debug_print
+        )
+
+    if multipass_fetched is not None:
+        parsed_tables, page_html, fetcher_name = multipass_fetched
+        debug_print(f"Multipass data fetched via {fetcher_name}; skipping Selenium")
+        # The fetchers raise instead of returning a truncated history.
+        history_complete = True
+        df = normalize_multipass_dataframe(
+            pd.concat(parsed_tables, ignore_index=True),
+            str(coupon_number).replace("-", ""),
+            debug_print,
+        )
+        if df is None or df.empty:
+            debug_print("Multipass DataFrame is empty after normalization")
             return None
 
-    df = None  # DataFrame to hold the scraped data
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        html_path = os.path.join(
+            save_directory, f"multipass_{coupon_number}_{timestamp}.html"
+        )
+        with open(html_path, "w", encoding="utf-8") as file:
+            file.write(page_html)
+        debug_print(f"Saved Multipass HTML snapshot to {html_path}")
 
     # -------------------- Handling Multipass Scenario --------------------
-    if coupon_kind == "Multipass":
+    elif coupon_kind == "Multipass":
         driver = None
         parsed_tables = []
         cleaned_coupon_number = str(coupon_number).replace("-", "")
+        selenium_started = time.monotonic()
         try:
             debug_print("Initializing Selenium for Multipass")
-            driver = webdriver.Chrome(options=chrome_options)
+            driver, release_driver = _acquire_scrape_driver(
+                chrome_options, driver_lease, debug_print
+            )
             driver.get("https://multipass.co.il/GetBalance")
             wait = WebDriverWait(driver, 30)
 
@@ -4165,9 +4158,10 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             if capsolver_key:
                 debug_print("CAPSOLVER_API_KEY found, attempting to solve reCAPTCHA automatically.")
                 token = solve_capsolver_recaptcha(
-                    capsolver_key, 
-                    "https://multipass.co.il/GetBalance", 
-                    "6LeqFAgsAAAAAALL04uUwCrtSk-jibWHfzjFr0af"
+                    capsolver_key,
+                    MULTIPASS_BALANCE_URL,
+                    MULTIPASS_RECAPTCHA_SITE_KEY,
+                    debug_print,
                 )
                 if token:
                     driver.execute_script(f'document.getElementById("g-recaptcha-response").innerHTML="{token}";')
@@ -4236,6 +4230,7 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
                 next_class = next_button.get_attribute("class") or ""
                 if disabled_attr or "aspNetDisabled" in next_class:
                     debug_print("Next page disabled; ending pagination.")
+                    history_complete = True
                     break
 
                 driver.execute_script("arguments[0].scrollIntoView(true);", next_button)
@@ -4269,15 +4264,17 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             debug_print(
                 f"An error occurred during Selenium operations (Multipass): {e}"
             )
-            if driver:
-                driver.quit()
+            if driver_lease is not None:
+                driver_lease.discard()
             return None
         finally:
+            fetcher_metrics.record(
+                "selenium",
+                "success" if df is not None and not df.empty else "error",
+                time.monotonic() - selenium_started,
+            )
             if driver:
-                try:
-                    driver.quit()
-                except Exception:
-                    pass
+                release_driver()
 
     # -------------------- Handling Max Scenario --------------------
     elif coupon_kind == "Max":
@@ -4320,7 +4317,7 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             debug_print(f"Final Chrome binary setting: {chrome_bin}")
             debug_print("=== END CHROME DEBUG ===")
             
-            with webdriver.Chrome(options=chrome_options) as driver:
+            with _scrape_driver(chrome_options, driver_lease, debug_print) as driver:
                 wait = WebDriverWait(driver, 30)
                 driver.get("https://www.max.co.il/gift-card-transactions/main")
 
@@ -4447,11 +4444,12 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             debug_print(f"An error occurred during Selenium operations (Max): {e}")
             traceback.print_exc()
             df = None
+            if driver_lease is not None:
+                driver_lease.discard()
 
     # -------------------- Handling BuyMe Scenario --------------------
     elif coupon_kind.lower() == "buyme":
         driver = None
-        cleanup_chrome_profile = None
         try:
             debug_print("Initializing Selenium for BuyMe")
 
@@ -4461,8 +4459,8 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             chrome_options.add_argument("--no-sandbox")
             chrome_options.add_argument("--disable-dev-shm-usage")
             chrome_options.add_argument("--disable-features=VizDisplayCompositor")
-            driver, cleanup_chrome_profile = _create_chrome_driver(
-                chrome_options, debug_print
+            driver, release_driver = _acquire_scrape_driver(
+                chrome_options, driver_lease, debug_print
             )
             _apply_buyme_cf_clearance(driver, debug_print)
 
@@ -4555,7 +4553,7 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             with open(after_click_file, "w", encoding="utf-8") as f:
                 f.write(driver.page_source)
             debug_print(f"Saved after-click HTML to {after_click_file}")
-            driver.quit()
+            release_driver()
             driver = None
 
             # Extract load details from the before-click HTML
@@ -4699,14 +4697,11 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
             debug_print(f"An error occurred during Selenium operations (BuyMe): {e}")
             traceback.print_exc()
             df = None
+            if driver_lease is not None:
+                driver_lease.discard()
         finally:
             if driver:
-                try:
-                    driver.quit()
-                except Exception:
-                    pass
-            if cleanup_chrome_profile:
-                cleanup_chrome_profile()
+                release_driver()
 
     # -------------------- Unsupported Coupon Type --------------------
     else:
@@ -4719,82 +4714,38 @@ def get_coupon_data(coupon, save_directory="automatic_coupon_update/input_html")
         return None
         
     try:
-        debug_print("Retrieving existing transactions from the database")
-        existing_data = pd.read_sql_query(
-            """
-            SELECT reference_number
-            FROM coupon_transaction
-            WHERE coupon_id = %(coupon_id)s
-            """,
-            db.engine,
-            params={"coupon_id": coupon.id},
-        )
-
-        debug_print("Checking if database entries differ from scraped data")
-        if len(existing_data) != len(df):
-            if len(existing_data) > 0:
-                debug_print(
-                    "Existing entries differ in number, deleting current records"
-                )
-                db.session.execute(
-                    text("DELETE FROM coupon_transaction WHERE coupon_id = :coupon_id"),
-                    {"coupon_id": coupon.id},
-                )
-                db.session.commit()
-                existing_data = pd.read_sql_query(
-                    """
-                    SELECT reference_number
-                    FROM coupon_transaction
-                    WHERE coupon_id = %(coupon_id)s
-                    """,
-                    db.engine,
-                    params={"coupon_id": coupon.id},
-                )
+        # Check for invalid data before proceeding
+        if 'location' in df.columns and df['location'].astype(str).str.contains('לא נמצאו רשומות מתאימות').any():
+            debug_print("Found 'לא נמצאו רשומות מתאימות' in location, treating as no new data.")
+            return None
 
-        existing_refs = set(existing_data["reference_number"].astype(str))
         df["reference_number"] = df["reference_number"].astype(str)
-        df_new = df[~df["reference_number"].isin(existing_refs)]
+        debug_print(f"Upserting {len(df)} scraped transactions")
+        if not history_complete:
+            debug_print("Scrape not known to be complete; keeping transactions missing from it")
+        ingest = ingest_coupon_transactions(
+            coupon, df, source=coupon_kind, history_complete=history_complete,
+            recompute_always=False, commit=False,
+        )
 
-        if df_new.empty:
+        if not ingest["inserted"] and not ingest["pruned"]:
             debug_print(
                 "No new transactions to add (all references already exist in DB)."
             )
             return None
 
-        # Check for invalid data before proceeding
-        if 'location' in df_new.columns and df_new['location'].str.contains('לא נמצאו רשומות מתאימות').any():
-            debug_print("Found 'לא נמצאו רשומות מתאימות' in location, treating as no new data.")
-            return None
-
-        debug_print(f"Adding {len(df_new)} new transactions to the database")
-        for idx, row in df_new.iterrows():
-            transaction = CouponTransaction(
-                coupon_id=coupon.id,
-                transaction_date=row.get("transaction_date"),
-                location=row.get("location", ""),
-                recharge_amount=row.get("recharge_amount", 0.0),
-                usage_amount=row.get("usage_amount", 0.0),
-                reference_number=row.get("reference_number", ""),
-                source=coupon_kind,
-            )
-            db.session.add(transaction)
-
-        debug_print("Calculating total used value from transactions")
-        total_used = (
-            db.session.query(func.sum(CouponTransaction.usage_amount))
-            .filter_by(coupon_id=coupon.id)
-            .scalar()
-            or 0.0
-        )
-        coupon.used_value = float(total_used)
         debug_print("Updating coupon status")
         update_coupon_status(coupon)
         db.session.commit()
 
         debug_print(
-            f"Transactions for coupon {coupon.code} have been updated in the database."
+            f"Transactions for coupon {coupon.code} have been updated in the database "
+            f"({ingest['inserted']} new, {ingest['pruned']} removed)."
         )
-        return df_new
+        # The scraped table, as a "something changed" signal. The coupon's total is
+        # coupon.used_value (set by the ingest from all stored transactions), not
+        # the sum of this table: manual and unpruned rows are kept.
+        return df
     except Exception as e:
         debug_print(f"An error occurred during database operations: {e}")
         traceback.print_exc()
@@ -4871,20 +4822,21 @@ def convert_coupon_data(file_path):
 
 
 def send_html_email(
-    api_key: str,
-    sender_email: str,
-    sender_name: str,
-    recipient_email: str,
-    recipient_name: str,
-    subject: str,
-    html_content: str,
+    api_key: str = None,
+    sender_email: str = None,
+    sender_name: str = None,
+    recipient_email: str = None,
+    recipient_name: str = None,
+    subject: str = None,
+    html_content: str = None,
     add_timestamp: bool = True,
 ):
     """
-    Sends an HTML email using the Brevo (SendinBlue) API.
+    Sends an HTML email right away through the pooled Brevo transport
+    (app/utils/email_outbox.py). Prefer send_email, which queues it.
 
     Parameters:
-    - api_key (str): Your Brevo API key.
+    - api_key (str): Brevo API key (default: BREVO_API_KEY).
     - sender_email (str): Sender's email address.
     - sender_name (str): Sender's name.
     - recipient_email (str): Recipient's email address.
@@ -4897,45 +4849,19 @@ def send_html_email(
     - dict: API response if successful.
     - None: If an exception occurs.
     """
-    sib_api_v3_sdk, ApiException = _get_brevo_client()
-    if sib_api_v3_sdk is None or ApiException is None:
-        raise ImportError("sib_api_v3_sdk is not installed. Please install the Brevo SDK to send emails.")
-
-    # Configure API key authorization
-    configuration = sib_api_v3_sdk.Configuration()
-    configuration.api_key["api-key"] = api_key
-
-    # Create an instance of the TransactionalEmailsApi
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(
-        sib_api_v3_sdk.ApiClient(configuration)
-    )
-
-    # Define the email parameters
-    if add_timestamp:
-        # Use Israel timezone (UTC+3)
-        israel_tz = ZoneInfo('Asia/Jerusalem')
-        israel_time = datetime.now(israel_tz)
-        final_subject = f"{subject} - {israel_time.strftime('%d%m%Y %H:%M')}"
-    else:
-        final_subject = subject
-    
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": recipient_email, "name": recipient_name}],
-        sender={"email": sender_email, "name": sender_name},
-        subject=final_subject,
-        html_content=html_content,
-    )
-
+    final_subject = timestamped_subject(subject) if add_timestamp else subject
     try:
-        # Send the email
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        pprint(api_response)
-        return api_response
-    except ApiException as e:
-        print(
-            "Exception when calling TransactionalEmailsApi->send_transac_email: %s\n"
-            % e
+        return send_now(
+            sender_email=sender_email,
+            sender_name=sender_name,
+            recipient_email=recipient_email,
+            recipient_name=recipient_name,
+            subject=final_subject,
+            html_content=html_content,
+            api_key=api_key,
         )
+    except BrevoError as e:
+        logger.error(f"Brevo send to {recipient_email} failed: {e}")
         return None
 
 
@@ -4943,7 +4869,7 @@ def send_email(
     sender_email, sender_name, recipient_email, recipient_name, subject, html_content, add_timestamp=True
 ):
     """
-    Sends a general email.
+    Queues a general email in email_outbox; the outbox worker sends it.
 
     :param sender_email: Sender's email address
     :param sender_name: Sender's name
@@ -4953,19 +4879,15 @@ def send_email(
     :param html_content: HTML content of the email
     :param add_timestamp: Whether to add timestamp to subject line
     """
-    # Add the API key directly within the function
-    api_key = BREVO_API_KEY
-
+    final_subject = timestamped_subject(subject) if add_timestamp else subject
     try:
-        send_html_email(
-            api_key=api_key,
-            sender_email=sender_email,
-            sender_name=sender_name,
+        enqueue_email(
             recipient_email=recipient_email,
             recipient_name=recipient_name,
-            subject=subject,
+            subject=final_subject,
             html_content=html_content,
-            add_timestamp=add_timestamp,
+            sender_email=sender_email,
+            sender_name=sender_name,
         )
     except Exception as e:
         raise Exception(f"Error sending email: {e}")
@@ -5137,7 +5059,11 @@ def extract_coupon_detail_sms(coupon_text, companies_list):
 
     # Call the OpenAI API
     try:
-        response = openai.ChatCompletion.create(
+        cache_key = gpt_cache_key(
+            "sms", normalize_text_input(coupon_text), companies_list, "gpt-4o"
+        )
+        response, cache_hit = cached_chat_completion(
+            cache_key,
             model="gpt-4o",  # שינוי למודל החזק יותר
             messages=[
                 {"role": "system", "content": "אנא ספק פלט JSON לפי הכלי שסופק."},
@@ -5165,9 +5091,8 @@ def extract_coupon_detail_sms(coupon_text, companies_list):
 
         # Create another DataFrame with pricing data
         pricing_data = {
-            "prompt_tokens": response["usage"]["prompt_tokens"],
-            "completion_tokens": response["usage"]["completion_tokens"],
-            "total_tokens": response["usage"]["total_tokens"],
+            **billable_usage(response, cache_hit),
+            "cache_hit": cache_hit,
             "id": response["id"],
             "object": response["object"],
             "created": dt.utcfromtimestamp(response["created"]).strftime(
@@ -5180,15 +5105,18 @@ def extract_coupon_detail_sms(coupon_text, companies_list):
         }
 
         # Calculate exchange rate
-        try:
-            exchange_rate_response = requests.get(
-                "https://api.exchangerate-api.com/v4/latest/USD"
-            )
-            exchange_rate_data = exchange_rate_response.json()
-            usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
-        except Exception as e:
-            print(f"Error fetching exchange rate: {e}")
-            usd_to_ils_rate = 3.75  # Default value
+        if cache_hit:
+            usd_to_ils_rate = 3.75  # Nothing is billed, skip the lookup
+        else:
+            try:
+                exchange_rate_response = requests.get(
+                    "https://api.exchangerate-api.com/v4/latest/USD"
+                )
+                exchange_rate_data = exchange_rate_response.json()
+                usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
+            except Exception as e:
+                print(f"Error fetching exchange rate: {e}")
+                usd_to_ils_rate = 3.75  # Default value
 
         # Calculate prices
         pricing_data["cost_usd"] = pricing_data["total_tokens"] * 0.00004
@@ -5322,7 +5250,11 @@ def extract_coupon_detail_image_proccess(client_id, image_path, companies_list):
                 """
 
                 try:
-                    response = openai.ChatCompletion.create(
+                    cache_key = gpt_cache_key(
+                        "image_file", image_digest(base64_image=base64_image), companies_list, "gpt-4o"
+                    )
+                    response, cache_hit = cached_chat_completion(
+                        cache_key,
                         model="gpt-4o",  # שינוי למודל החזק יותר
                         messages=[
                             {
@@ -5373,9 +5305,8 @@ def extract_coupon_detail_image_proccess(client_id, image_path, companies_list):
                     coupon_df = pd.DataFrame([coupon_data])
 
                     pricing_data = {
-                        "prompt_tokens": response["usage"]["prompt_tokens"],
-                        "completion_tokens": response["usage"]["completion_tokens"],
-                        "total_tokens": response["usage"]["total_tokens"],
+                        **billable_usage(response, cache_hit),
+                        "cache_hit": cache_hit,
                         "id": response["id"],
                         "object": response["object"],
                         "created": datetime.fromtimestamp(
@@ -5386,14 +5317,17 @@ def extract_coupon_detail_image_proccess(client_id, image_path, companies_list):
                         "response_text": json.dumps(coupon_data, ensure_ascii=False),
                     }
 
-                    try:
-                        exchange_rate_response = requests.get(
-                            "https://api.exchangerate-api.com/v4/latest/USD"
-                        )
-                        exchange_rate_data = exchange_rate_response.json()
-                        usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
-                    except Exception:
-                        usd_to_ils_rate = 3.75
+                    if cache_hit:
+                        usd_to_ils_rate = 3.75  # Nothing is billed, skip the lookup
+                    else:
+                        try:
+                            exchange_rate_response = requests.get(
+                                "https://api.exchangerate-api.com/v4/latest/USD"
+                            )
+                            exchange_rate_data = exchange_rate_response.json()
+                            usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
+                        except Exception:
+                            usd_to_ils_rate = 3.75
 
                     pricing_data["cost_usd"] = pricing_data["total_tokens"] * 0.00004
                     pricing_data["cost_ils"] = (
@@ -5526,7 +5460,11 @@ def extract_coupon_from_base64_image(base64_image, image_format, companies_list)
         """
         
         try:
-            response = openai.ChatCompletion.create(
+            cache_key = gpt_cache_key(
+                "image_base64", image_digest(base64_image=base64_image), companies_list, "gpt-4o"
+            )
+            response, cache_hit = cached_chat_completion(
+                cache_key,
                 model="gpt-4o",  # שינוי למודל החזק יותר
                 messages=[
                     {
@@ -5573,9 +5511,8 @@ def extract_coupon_from_base64_image(base64_image, image_format, companies_list)
             coupon_df = pd.DataFrame([coupon_data])
             
             pricing_data = {
-                "prompt_tokens": response["usage"]["prompt_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "total_tokens": response["usage"]["total_tokens"],
+                **billable_usage(response, cache_hit),
+                "cache_hit": cache_hit,
                 "id": response["id"],
                 "object": response["object"],
                 "created": datetime.fromtimestamp(
@@ -5586,14 +5523,17 @@ def extract_coupon_from_base64_image(base64_image, image_format, companies_list)
                 "response_text": json.dumps(coupon_data, ensure_ascii=False),
             }
             
-            try:
-                exchange_rate_response = requests.get(
-                    "https://api.exchangerate-api.com/v4/latest/USD"
-                )
-                exchange_rate_data = exchange_rate_response.json()
-                usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
-            except Exception:
-                usd_to_ils_rate = 3.75
+            if cache_hit:
+                usd_to_ils_rate = 3.75  # Nothing is billed, skip the lookup
+            else:
+                try:
+                    exchange_rate_response = requests.get(
+                        "https://api.exchangerate-api.com/v4/latest/USD"
+                    )
+                    exchange_rate_data = exchange_rate_response.json()
+                    usd_to_ils_rate = exchange_rate_data["rates"]["ILS"]
+                except Exception:
+                    usd_to_ils_rate = 3.75
             
             pricing_data["cost_usd"] = pricing_data["total_tokens"] * 0.00004
             pricing_data["cost_ils"] = pricing_data["cost_usd"] * usd_to_ils_rate
@@ -5744,198 +5684,16 @@ def process_coupons_excel(file_path, user):
        2) missing_optional_fields_messages: List of messages about missing optional fields,
        3) new_coupons: List of Coupon objects that were successfully added to the database.
     """
-    from app.models import Coupon, Company, Tag, coupon_tags
-    from datetime import datetime
-    import pandas as pd
     import os
-    from sqlalchemy import func
     from app.extensions import db
     from flask import flash
-    from sqlalchemy.exc import IntegrityError
+    from app.utils.excel_importer import import_coupons_excel
 
     try:
-        # Read the Excel file with dtype as string to avoid NaT or unwanted type issues
-        df = pd.read_excel(file_path, dtype=str)
-
-        # Load existing tags from the database (cache them in a dict by name)
-        existing_tags = {tag.name: tag for tag in Tag.query.all()}
-        cache_tags = existing_tags.copy()
-
-        invalid_coupons = []
-        missing_optional_fields_messages = []
-        new_coupons = []
-
-        for index, row in df.iterrows():
-            try:
-                # Reading the coupon data from the row (as strings)
-                # Handle code with nan check
-                code_raw = row.get("קוד קופון", "")
-                code = "" if pd.isna(code_raw) else str(code_raw).strip()
-                
-                # Handle value with nan check
-                value_raw = row.get("ערך מקורי", "")
-                value_str = "" if pd.isna(value_raw) else str(value_raw).strip()
-                
-                # Handle cost with nan check
-                cost_raw = row.get("עלות", "")
-                cost_str = "" if pd.isna(cost_raw) else str(cost_raw).strip()
-                
-                # Handle company name with nan check
-                company_raw = row.get("חברה", "")
-                company_name = "" if pd.isna(company_raw) else str(company_raw).strip()
-                # Handle description with nan check
-                description_raw = row.get("תיאור", "")
-                description = "" if pd.isna(description_raw) else str(description_raw).strip()
-                
-                # Handle date string with nan check
-                date_raw = row.get("תאריך תפוגה", "")
-                date_str = "" if pd.isna(date_raw) else str(date_raw).strip()
-
-                # Reading additional fields with nan checks
-                one_time_raw = row.get("קוד לשימוש חד פעמי", "False")
-                one_time_str = "False" if pd.isna(one_time_raw) else str(one_time_raw).strip()
-                
-                # Handle purpose with nan check
-                purpose_raw = row.get("מטרת הקופון", "")
-                purpose = "" if pd.isna(purpose_raw) else str(purpose_raw).strip()
-                
-                # Handle tags with nan check
-                tags_raw = row.get("תגיות", "")
-                tags_field = "" if pd.isna(tags_raw) else str(tags_raw).strip()
-
-                # *** New fields with proper nan handling ***
-                source_raw = row.get("מאיפה קיבלת את הקופון", "")
-                source_val = "" if pd.isna(source_raw) else str(source_raw).strip()
-                
-                buyme_url_raw = row.get("כתובת URL של הקופון ל-BuyMe", "")
-                buyme_url_val = "" if pd.isna(buyme_url_raw) else str(buyme_url_raw).strip()
-                
-                strauss_url_raw = row.get("כתובת URL של הקופון שטראוס פלוס", "")
-                strauss_url_val = "" if pd.isna(strauss_url_raw) else str(strauss_url_raw).strip()
-                
-                xgiftcard_url_raw = row.get("כתובת URL של הקופון מXgiftcard", "")
-                xgiftcard_url_val = "" if pd.isna(xgiftcard_url_raw) else str(xgiftcard_url_raw).strip()
-
-                # Check for missing fields
-                missing_fields = []
-                if not code:
-                    missing_fields.append("קוד קופון")
-                if not value_str:
-                    missing_fields.append("ערך מקורי")
-                if not cost_str:
-                    missing_fields.append("עלות")
-                if not company_name:
-                    missing_fields.append("חברה")
-
-                if missing_fields:
-                    invalid_coupons.append(
-                        f'שורה {index + 2}: חסרים שדות חובה: {", ".join(missing_fields)}'
-                    )
-                    continue
-
-                # Try to convert value and cost to floats
-                try:
-                    # Ensure value_str is stripped if it is a string
-                    if isinstance(value_str, str):
-                        value_str = value_str.strip()
-                    value = float(value_str) if value_str else 0.0
-                except ValueError:
-                    invalid_coupons.append(
-                        f"שורה {index + 2}: ערך מקורי אינו מספר תקין ({value_str})."
-                    )
-                    continue
-
-                try:
-                    # Ensure cost_str is stripped if it is a string
-                    if isinstance(cost_str, str):
-                        cost_str = cost_str.strip()
-                    cost = float(cost_str) if cost_str else 0.0
-                except ValueError:
-                    invalid_coupons.append(
-                        f"שורה {index + 2}: עלות אינה מספר תקין ({cost_str})."
-                    )
-                    continue
-
-                # Parse expiration date
-                try:
-                    if not date_str.strip():
-                        expiration = None
-                    else:
-                        expiration = None
-                        possible_formats = ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y"]
-                        for fmt in possible_formats:
-                            try:
-                                dt = datetime.strptime(date_str, fmt)
-                                expiration = dt.date()
-                                break
-                            except ValueError:
-                                pass
-                        if expiration is None:
-                            missing_optional_fields_messages.append(
-                                f'שורה {index + 2}: תאריך תפוגה בפורמט לא תקין (הוזן "{date_str}"). הוגדר כ-None.'
-                            )
-                            expiration = None
-                except Exception as e:
-                    expiration = None
-
-                # Handle one_time as a boolean
-                is_one_time = False
-                if isinstance(one_time_str, bool):
-                    is_one_time = one_time_str
-                else:
-                    lower_str = one_time_str.lower().strip()
-                    if lower_str in ["true", "1", "כן"]:
-                        is_one_time = True
-                    else:
-                        is_one_time = False
-
-                # Handle the company: create it if it doesn't exist
-                company = Company.query.filter_by(name=company_name).first()
-                if not company:
-                    company = Company(name=company_name, image_path="default_logo.png")
-                    db.session.add(company)
-
-                # Handle tags: find the most common tag or create a new one
-                most_common_tag = (
-                    db.session.query(Tag)
-                    .join(coupon_tags, Tag.id == coupon_tags.c.tag_id)
-                    .join(Coupon, Coupon.id == coupon_tags.c.coupon_id)
-                    .filter(func.lower(Coupon.company) == func.lower(company_name))
-                    .group_by(Tag.id)
-                    .order_by(func.count(Tag.id).desc())
-                    .first()
-                )
-
-                if not most_common_tag:
-                    tag_name_for_company = f"Tag for {company_name}"
-                    most_common_tag = Tag(name=tag_name_for_company, count=1)
-                    db.session.add(most_common_tag)
-                else:
-                    most_common_tag.count += 1
-
-                # Create the coupon and add it to the session
-                new_coupon = Coupon(
-                    code=code,
-                    value=value,
-                    cost=cost,
-                    company=company.name,
-                    description=str(description),
-                    expiration=expiration,
-                    user_id=user.id,
-                    status="פעיל",  # Default status
-                    is_one_time=is_one_time,
-                    purpose=purpose,
-                    source=source_val,  # The new value
-                    buyme_coupon_url=buyme_url_val,  # The new value
-                    strauss_coupon_url=strauss_url_val,  # The new value
-                    xgiftcard_coupon_url=xgiftcard_url_val,  # The new value
-                )
-                new_coupon.tags.append(most_common_tag)
-                db.session.add(new_coupon)
-                new_coupons.append(new_coupon)
-
-            except Exception as e:
-                invalid_coupons.append(f"שורה {index + 2}: {str(e)}")
+        # Rows are streamed and inserted in chunks; see app/utils/excel_importer.py
+        invalid_coupons, missing_optional_fields_messages, new_coupons = import_coupons_excel(
+            file_path, user
+        )
 
         # Commit all changes to the database
         db.session.commit()
@@ -6156,11 +5914,17 @@ def confirm_password_reset_token(token, expiration=3600):
 def parse_user_usage_text(usage_text, user):
     openai.api_key = os.getenv("OPENAI_API_KEY")
 
-    # Retrieve list of allowed companies from the system
-    companies = {
-        c.name.lower(): c.name for c in Company.query.all()
-    }  # Dictionary for easy lookup
-    companies_str = ", ".join(companies.keys())
+    # Only the companies the text most likely mentions go into the prompt; the
+    # full list is sent when no mention is a confident match.
+    from app.utils.company_index import get_company_index
+
+    prompt_companies, narrowed = get_company_index().prompt_companies(usage_text)
+    companies_str = ", ".join(name.lower() for name in prompt_companies)
+    logger.info(
+        "Usage parsing prompt lists %d companies (%s)",
+        len(prompt_companies),
+        "top-k" if narrowed else "full list",
+    )
 
     # Prompt that requires using only existing companies
     prompt = f"""
@@ -6218,7 +5982,11 @@ def parse_user_usage_text(usage_text, user):
     """
     # Call the GPT API
     try:
-        response = openai.ChatCompletion.create(
+        cache_key = gpt_cache_key(
+            "usage", normalize_text_input(usage_text), prompt_companies, "gpt-4o"
+        )
+        response, cache_hit = cached_chat_completion(
+            cache_key,
             model="gpt-4o",  # שינוי למודל החזק יותר
             messages=[{"role": "user", "content": prompt}],
             functions=[
@@ -6289,9 +6057,8 @@ def parse_user_usage_text(usage_text, user):
                 "%Y-%m-%d %H:%M:%S"
             ),
             "model": response["model"],
-            "prompt_tokens": response["usage"]["prompt_tokens"],
-            "completion_tokens": response["usage"]["completion_tokens"],
-            "total_tokens": response["usage"]["total_tokens"],
+            **billable_usage(response, cache_hit),
+            "cache_hit": cache_hit,
             "cost_usd": 0.0,  # Calculate based on your formula
             "cost_ils": 0.0,
             "exchange_rate": 3.75,
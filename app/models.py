@@ -3,12 +3,17 @@
 import os
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
+import hashlib
+import hmac
 import secrets
+import threading
+from collections import OrderedDict
 
 from flask import url_for
 from flask_login import UserMixin
 from sqlalchemy.types import TypeDecorator, String
 from sqlalchemy.sql import func
+from sqlalchemy.orm import undefer_group, validates
 from cryptography.fernet import Fernet
 try:
     from Crypto.Cipher import AES
@@ -22,6 +27,11 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from typing import Optional
 
 from app.extensions import db, cache  # Assuming you have the db object here
+from app.utils.coupon_ids import (
+    COUPON_ID_COUNTER_NAME,
+    COUPON_ID_SEQUENCE,
+    allocate_coupon_id,
+)
 from sqlalchemy import Column, Integer, String  # Add the missing import
 
 # Load the .env file
@@ -34,6 +44,14 @@ if not ENCRYPTION_KEY:
 
 cipher_suite = Fernet(ENCRYPTION_KEY.encode())
 
+# Key for the coupon-code blind index (Coupon.code_hash). Kept separate from the
+# Fernet key; if not configured explicitly it is derived from ENCRYPTION_KEY so
+# existing deployments get a stable index without a new secret.
+CODE_HASH_KEY = (
+    os.environ.get("CODE_HASH_KEY")
+    or hashlib.sha256(b"coupon-code-blind-index:" + ENCRYPTION_KEY.encode()).hexdigest()
+).encode()
+
 
 def decrypt_with_split_key(encrypted_string):
     """
@@ -111,30 +129,143 @@ def decrypt_with_split_key(encrypted_string):
         return None
 
 
-def generate_unique_coupon_id():
+class DecryptionCache:
     """
-    Generate a unique random ID for coupons between 1000 and 10000
-    Ensures no duplicates by checking existing IDs in database
+    Bounded, thread-safe LRU of ciphertext -> plaintext for EncryptedString.
+
+    Fernet tokens are unique per encryption, so a ciphertext always maps to the
+    same plaintext and entries never go stale. Pages that load many coupons
+    (profile.index, show_coupons) otherwise pay the full Fernet (and, for iOS
+    rows, split-key) decryption cost for every column on every request.
+    A max_size of 0 disables caching.
     """
-    import random
-    
-    max_attempts = 100
-    for _ in range(max_attempts):
-        # Generate random ID between 1000 and 10000
-        random_id = random.randint(1000, 10000)
-        
-        # Check if this ID already exists using raw SQL to avoid circular import
-        result = db.session.execute(
-            db.text("SELECT 1 FROM coupon WHERE id = :id LIMIT 1"),
-            {"id": random_id}
-        ).fetchone()
-        
-        if not result:
-            return random_id
-    
-    # If we couldn't find a unique ID after max_attempts, raise an exception
-    raise RuntimeError("Could not generate unique coupon ID after maximum attempts")
 
+    def __init__(self, max_size):
+        self.max_size = max(int(max_size), 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallback = 0
+        self.failures = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, ciphertext):
+        if not self.enabled:
+            return None
+        with self._lock:
+            plaintext = self._entries.get(ciphertext)
+            if plaintext is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ciphertext)
+            self.hits += 1
+            return plaintext
+
+    def put(self, ciphertext, plaintext):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[ciphertext] = plaintext
+            self._entries.move_to_end(ciphertext)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def record_fallback(self, failed=False):
+        with self._lock:
+            if failed:
+                self.failures += 1
+            else:
+                self.fallback += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.fallback = self.failures = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "fallback": self.fallback,
+                "failures": self.failures,
+            }
+
+
+# ENCRYPTED_VALUE_CACHE_SIZE=0 opts out of caching decrypted values.
+decryption_cache = DecryptionCache(os.environ.get("ENCRYPTED_VALUE_CACHE_SIZE", 20000))
+
+
+def get_decryption_cache_stats():
+    """Hit/miss/fallback counters of the EncryptedString decryption cache."""
+    return decryption_cache.stats()
+
+
+def _decrypt_uncached(value):
+    """(plaintext, True) on success, (value, False) when no method decrypts it."""
+    try:
+        return cipher_suite.decrypt(value.encode()).decode(), True
+    except Exception:
+        pass
+    # Try alternative decryption method (iOS app style)
+    try:
+        decrypted_value = decrypt_with_split_key(value)
+    except Exception:
+        decrypted_value = None
+    if decrypted_value:
+        decryption_cache.record_fallback()
+        return decrypted_value, True
+    decryption_cache.record_fallback(failed=True)
+    return value, False
+
+
+def decrypt_value(value):
+    """
+    Decrypt a value stored by EncryptedString.
+    Tries Fernet first and falls back to the iOS split-key format; values that
+    don't look encrypted (or can't be decrypted) are returned unchanged.
+    Successful results are memoized per process in decryption_cache.
+    """
+    # Decrypt only if the value appears to be encrypted
+    if value is None or not value.startswith("gAAAAA"):
+        return value
+
+    cached = decryption_cache.get(value)
+    if cached is not None:
+        return cached
+
+    plaintext, decrypted = _decrypt_uncached(value)
+    # Failures are not memoized, so a transient key/format problem is retried.
+    if decrypted:
+        decryption_cache.put(value, plaintext)
+    return plaintext
+
+
+def compute_code_hash(code):
+    """
+    Deterministic keyed-HMAC "blind index" of a coupon code.
+
+    Coupon.code is stored with randomized Fernet ciphertext, so it can never be
+    matched in SQL. The hash of the normalized plaintext is stored next to it
+    (Coupon.code_hash) and is what equality lookups filter on.
+    Returns None for empty codes.
+    """
+    if code is None:
+        return None
+    code = str(code)
+    if code.startswith("gAAAAA"):
+        code = decrypt_value(code)
+    normalized = code.strip()
+    if not normalized:
+        return None
+    return hmac.new(CODE_HASH_KEY, normalized.encode("utf-8"), hashlib.sha256).hexdigest()
 
 
 class EncryptedString(TypeDecorator):
@@ -152,30 +283,21 @@ class EncryptedString(TypeDecorator):
         return value
 
     def process_result_value(self, value, dialect):
-        if value is not None:
-            try:
-                # Decrypt only if the value appears to be encrypted
-                if value.startswith("gAAAAA"):
-                    value = value.encode()
-                    decrypted_value = cipher_suite.decrypt(value)
-                    return decrypted_value.decode()
-            except Exception as e:
-                # Try alternative decryption method (iOS app style)
-                try:
-                    # Make sure we pass a string to the alternative function
-                    if isinstance(value, bytes):
-                        value_str = value.decode('utf-8')
-                    else:
-                        value_str = value
-                    decrypted_value = decrypt_with_split_key(value_str)
-                    if decrypted_value:
-                        return decrypted_value
-                except Exception as e2:
-                    pass
-        return value
+        return decrypt_value(value)
 
 
 # Association table for Coupon and Tag (many-to-many)
+# Coupon ID blocks (app/utils/coupon_ids.py). Postgres reserves them with
+# nextval() on the sequence; other databases bump the counter row instead.
+coupon_id_block_seq = db.Sequence(COUPON_ID_SEQUENCE, metadata=db.metadata)
+
+coupon_id_blocks = db.Table(
+    "coupon_id_blocks",
+    db.metadata,
+    db.Column("name", db.String(50), primary_key=True, default=COUPON_ID_COUNTER_NAME),
+    db.Column("next_block", db.BigInteger, nullable=False, default=0),
+)
+
 coupon_tags = db.Table(
     "coupon_tags",
     db.metadata,  # Ensure you're using Flask-SQLAlchemy's metadata
@@ -371,6 +493,17 @@ class Tag(db.Model):
     coupons = db.relationship("Coupon", secondary=coupon_tags, back_populates="tags")
 
 
+# Sensitive Coupon columns that listing pages never render. They are deferred
+# on the mapper (not fetched or decrypted until first access); detail/edit views
+# load them up front with undefer_coupon_details().
+COUPON_DETAILS_GROUP = "coupon_details"
+
+
+def undefer_coupon_details():
+    """Query option that loads the deferred Coupon detail columns in the main query."""
+    return undefer_group(COUPON_DETAILS_GROUP)
+
+
 class Coupon(db.Model):
     """
     Coupons table.
@@ -380,23 +513,28 @@ class Coupon(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=False)
     code = db.Column(EncryptedString(255), nullable=False, unique=True)
-    description = db.Column(EncryptedString, nullable=True)
+    # Blind index of the plaintext code (see compute_code_hash); kept in sync
+    # by _sync_code_hash and used by find_by_code / find_by_codes.
+    code_hash = db.Column(db.String(64), nullable=True, index=True)
+    description = db.deferred(
+        db.Column(EncryptedString, nullable=True), group=COUPON_DETAILS_GROUP
+    )
     value = db.Column(db.Float, nullable=False)
     cost = db.Column(db.Float, nullable=False)
     company = db.Column(db.String(100), nullable=False)
     expiration = db.Column(db.Date, nullable=True)  # Expiration date
     source = db.Column(db.String(255), nullable=True)  # New field for coupon source
-    buyme_coupon_url = db.Column(
-        EncryptedString(255), nullable=True
+    buyme_coupon_url = db.deferred(
+        db.Column(EncryptedString(255), nullable=True), group=COUPON_DETAILS_GROUP
     )  # >>> NEW FIELD: BuyMe Coupon URL <<<
-    strauss_coupon_url = db.Column(
-        EncryptedString(255), nullable=True
+    strauss_coupon_url = db.deferred(
+        db.Column(EncryptedString(255), nullable=True), group=COUPON_DETAILS_GROUP
     )  # >>> NEW FIELD: Strauss Plus Coupon URL <<<
-    xgiftcard_coupon_url = db.Column(
-        EncryptedString(255), nullable=True
+    xgiftcard_coupon_url = db.deferred(
+        db.Column(EncryptedString(255), nullable=True), group=COUPON_DETAILS_GROUP
     )  # >>> NEW FIELD: Xgiftcard Coupon URL <<<
-    xtra_coupon_url = db.Column(
-        EncryptedString(255), nullable=True
+    xtra_coupon_url = db.deferred(
+        db.Column(EncryptedString(255), nullable=True), group=COUPON_DETAILS_GROUP
     )  # >>> NEW FIELD: Xtra Coupon URL (PowerGift) <<<
     date_added = db.Column(
         db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
@@ -424,11 +562,11 @@ class Coupon(db.Model):
     )
 
     # Relevant for specific coupons
-    cvv = db.Column(
-        EncryptedString(4), nullable=True
+    cvv = db.deferred(
+        db.Column(EncryptedString(4), nullable=True), group=COUPON_DETAILS_GROUP
     )  # Maximum length 4 (3 or 4 digits)
-    card_exp = db.Column(
-        EncryptedString(5), nullable=True
+    card_exp = db.deferred(
+        db.Column(EncryptedString(5), nullable=True), group=COUPON_DETAILS_GROUP
     )  # Maximum length 5 (format "MM/YY")
 
     # **Adding the multipass_transactions relationship**
@@ -525,14 +663,135 @@ class Coupon(db.Model):
     
     def __init__(self, **kwargs):
         """
-        Initialize a new coupon with a random unique ID
+        Initialize a new coupon with a non-sequential unique ID
         """
-        # If ID is not explicitly provided, generate a random unique one
+        # If ID is not explicitly provided, take the next one from the
+        # block allocator (no per-coupon query, see app/utils/coupon_ids.py)
         if 'id' not in kwargs:
-            kwargs['id'] = generate_unique_coupon_id()
+            kwargs['id'] = allocate_coupon_id()
         
         super(Coupon, self).__init__(**kwargs)
 
+    @validates("code")
+    def _sync_code_hash(self, key, value):
+        self.code_hash = compute_code_hash(value)
+        return value
+
+    @classmethod
+    def find_by_code(cls, code, query=None):
+        """
+        Find a coupon by its plaintext code using the code_hash blind index.
+        `query` optionally narrows the search (e.g. to one user's coupons).
+        """
+        code_hash = compute_code_hash(code)
+        if not code_hash:
+            return None
+        base_query = query if query is not None else cls.query
+        coupon = base_query.filter(cls.code_hash == code_hash).first()
+        if coupon is None:
+            coupon = cls._match_unindexed({code_hash: code}, base_query).get(code_hash)
+        return coupon
+
+    @classmethod
+    def find_by_codes(cls, codes, query=None):
+        """
+        Bulk version of find_by_code: one indexed query for all codes.
+        Returns a dict of {code: coupon} for the codes that were found.
+        """
+        hash_to_code = {}
+        for code in codes:
+            code_hash = compute_code_hash(code)
+            if code_hash:
+                hash_to_code[code_hash] = code
+        if not hash_to_code:
+            return {}
+
+        base_query = query if query is not None else cls.query
+        by_hash = {
+            coupon.code_hash: coupon
+            for coupon in base_query.filter(cls.code_hash.in_(list(hash_to_code))).all()
+        }
+        missing = {h: c for h, c in hash_to_code.items() if h not in by_hash}
+        if missing:
+            by_hash.update(cls._match_unindexed(missing, base_query))
+
+        return {
+            hash_to_code[code_hash]: coupon for code_hash, coupon in by_hash.items()
+        }
+
+    @classmethod
+    def _match_unindexed(cls, hash_to_code, base_query):
+        """
+        Fallback for rows written without a code_hash (e.g. inserted directly by
+        the iOS app). Only those rows are decrypted. Nothing is written here;
+        scripts/backfill_coupon_code_hash.py (a render.yaml cron job) persists
+        the missing hashes.
+        """
+        found = {}
+        for coupon in base_query.filter(cls.code_hash.is_(None)).all():
+            code_hash = compute_code_hash(coupon.code)
+            if code_hash in hash_to_code and code_hash not in found:
+                found[code_hash] = coupon
+        return found
+
+    @classmethod
+    def backfill_code_hashes(cls, batch_size=500):
+        """
+        Fill in code_hash for rows that have none, in id-ordered batches.
+        The caller commits. Returns the number of rows updated.
+        """
+        table = cls.__table__
+        updated = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(table.c.id, table.c.code)
+                .where(table.c.code_hash.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            db.session.execute(
+                table.update()
+                .where(table.c.id == db.bindparam("row_id"))
+                .values(code_hash=db.bindparam("new_hash")),
+                [{"row_id": row.id, "new_hash": compute_code_hash(row.code)} for row in rows],
+            )
+            updated += len(rows)
+            last_id = rows[-1].id
+
+
+class UserCouponSummary(db.Model):
+    """
+    Per-user coupon totals, one row per (user, category).
+
+    category is "countable" (counts toward savings), "for_sale" or "excluded"
+    (exclude_saving). Rows are maintained incrementally from Coupon flushes
+    by app.analytics.user_summary and can be rebuilt from the coupon table
+    with scripts/rebuild_user_coupon_summary.py.
+    """
+
+    __tablename__ = "user_coupon_summary"
+
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    category = db.Column(db.String(20), primary_key=True)
+    coupon_count = db.Column(db.Integer, nullable=False, default=0)
+    active_count = db.Column(db.Integer, nullable=False, default=0)
+    active_one_time_count = db.Column(db.Integer, nullable=False, default=0)
+    one_time_count = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Float, nullable=False, default=0.0)
+    used_value = db.Column(db.Float, nullable=False, default=0.0)
+    remaining_value = db.Column(db.Float, nullable=False, default=0.0)
+    savings = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
 
 class CouponUsage(db.Model):
     """
@@ -568,6 +827,9 @@ class Notification(db.Model):
     viewed = db.Column(db.Boolean, default=False)
     hide_from_view = db.Column(db.Boolean, default=False, nullable=False)
     shown = db.Column(db.Boolean, default=False, nullable=False)
+    # Optional idempotency key for system notifications (e.g. "coupon:12:expired");
+    # bulk inserts use ON CONFLICT on it so a notification is created only once.
+    dedupe_key = db.Column(db.String(100), nullable=True, unique=True)
 
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user = db.relationship("User", back_populates="notifications", lazy=True)
@@ -757,6 +1019,13 @@ class CouponTransaction(db.Model):
 
     coupon = db.relationship("Coupon", back_populates="multipass_transactions")
 
+    # Placeholder texts the providers render instead of a real transaction row
+    INVALID_TEXTS = ("לא נמצאו רשומות", "לא נמצא", "שגיאה")
+
+    @classmethod
+    def has_invalid_text(cls, value):
+        return bool(value) and any(text in str(value) for text in cls.INVALID_TEXTS)
+
     def __init__(self, **kwargs):
         # Handle invalid transaction_date values before creating the object
         import pandas as pd
@@ -771,17 +1040,11 @@ class CouponTransaction(db.Model):
                 print(f"Warning: Invalid transaction_date '{transaction_date}' converted to None")
         
         # Skip transactions with invalid location or reference_number
-        invalid_texts = ["לא נמצאו רשומות", "לא נמצא", "שגיאה"]
-        
-        if 'location' in kwargs and kwargs['location']:
-            location = str(kwargs['location'])
-            if any(invalid_text in location for invalid_text in invalid_texts):
-                raise ValueError(f"Invalid location data: {location}")
-                
-        if 'reference_number' in kwargs and kwargs['reference_number']:
-            reference_number = str(kwargs['reference_number'])  
-            if any(invalid_text in reference_number for invalid_text in invalid_texts):
-                raise ValueError(f"Invalid reference_number data: {reference_number}")
+        if self.has_invalid_text(kwargs.get('location')):
+            raise ValueError(f"Invalid location data: {kwargs['location']}")
+
+        if self.has_invalid_text(kwargs.get('reference_number')):
+            raise ValueError(f"Invalid reference_number data: {kwargs['reference_number']}")
         
         super(CouponTransaction, self).__init__(**kwargs)
 
@@ -809,6 +1072,8 @@ class GptUsage(db.Model):
     exchange_rate = db.Column(db.Float)
     prompt_text = db.Column(db.Text, nullable=True)
     response_text = db.Column(db.Text, nullable=True)
+    # Served from app.utils.gpt_cache: no tokens were billed for this row.
+    cache_hit = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     user = db.relationship("User", backref="gpt_usage_records")
 
@@ -1105,8 +1370,10 @@ class NewsletterSending(db.Model):
     newsletter_id = db.Column(db.Integer, db.ForeignKey("newsletters.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     sent_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
-    delivery_status = db.Column(db.String(50), default="sent")  # sent, delivered, failed, opened
+    delivery_status = db.Column(db.String(50), default="sent")  # queued, sent, delivered, failed, opened
     error_message = db.Column(db.Text, nullable=True)
+    # email_outbox row of a queued sending; its result is copied back here.
+    outbox_id = db.Column(db.Integer, nullable=True, index=True)
     
     # קשרים
     newsletter = db.relationship("Newsletter", back_populates="sendings")
@@ -1120,6 +1387,43 @@ class NewsletterSending(db.Model):
         return f"<NewsletterSending {self.id}: Newsletter {self.newsletter_id} to User {self.user_id}>"
 
 
+class EmailOutbox(db.Model):
+    """
+    תור מיילים יוצאים: נכתב ע"י enqueue_email ונשלח ע"י drain_outbox
+    (app/utils/email_outbox.py), בקבוצות של Brevo messageVersions.
+    """
+    __tablename__ = "email_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender_email = db.Column(db.String(255), nullable=False)
+    sender_name = db.Column(db.String(255), nullable=True)
+    recipient_email = db.Column(db.String(255), nullable=False)
+    recipient_name = db.Column(db.String(255), nullable=True)
+    subject = db.Column(db.String(998), nullable=False)
+    # Body and params are cleared once the row is sent or failed: they can hold
+    # reset links, unsubscribe tokens and decrypted coupon codes.
+    html_content = db.Column(db.Text, nullable=True)
+    # Per-recipient Brevo params ({{ params.x }} in html_content), as JSON
+    params = db.Column(db.Text, nullable=True)
+    # sha256 of sender + subject + html: rows sharing it go out in one API call
+    template_key = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Earliest time the row may be claimed; also the lease of a 'sending' row
+    next_attempt_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = db.Column(db.Text, nullable=True)
+    message_id = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+    sent_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    def __repr__(self):
+        return f"<EmailOutbox {self.id}: {self.recipient_email} ({self.status})>"
+
+
 class CouponShares(db.Model):
     """
     Coupon shares table - manages coupon sharing lifecycle
@@ -1190,31 +1494,10 @@ class AdminSettings(db.Model):
     
     @classmethod
     def get_setting(cls, key, default=None):
-        """Get a setting value by key"""
-        setting = cls.query.filter_by(setting_key=key).first()
-        if not setting:
-            return default
-        
-        if setting.setting_type == 'boolean':
-            return setting.setting_value.lower() in ['true', '1', 'yes', 'on']
-        elif setting.setting_type == 'integer':
-            try:
-                return int(setting.setting_value)
-            except (ValueError, TypeError):
-                return default
-        elif setting.setting_type == 'float':
-            try:
-                return float(setting.setting_value)
-            except (ValueError, TypeError):
-                return default
-        elif setting.setting_type == 'json':
-            import json
-            try:
-                return json.loads(setting.setting_value)
-            except (ValueError, TypeError):
-                return default
-        else:
-            return setting.setting_value
+        """Get a setting value by key (served from the in-process settings registry)"""
+        from app.utils.settings_registry import get_settings_registry
+
+        return get_settings_registry().get(key, default)
     
     @classmethod
     def set_setting(cls, key, value, setting_type='string', description=None):
@@ -1239,6 +1522,10 @@ class AdminSettings(db.Model):
             setting.description = description
         
         db.session.commit()
+
+        from app.utils.settings_registry import bump_settings_version
+
+        bump_settings_version()
         return setting
 
 
@@ -44,18 +44,8 @@ def get_client_ip():
 
 
 def is_public_registration_enabled():
-    cache_key = "settings:public_registration_enabled:v1"
-    try:
-        cached_value = cache.get(cache_key)
-        if cached_value is not None:
-            return bool(cached_value)
-    except Exception as exc:
-        logger.warning(
-            "Failed reading registration setting from cache '%s': %s",
-            cache_key,
-            exc,
-        )
-
+    # AdminSettings.get_setting is served from the in-process settings
+    # registry, so this no longer needs its own cache entry.
     default = current_app.config.get("PUBLIC_REGISTRATION_ENABLED", True)
     try:
         setting_value = AdminSettings.get_setting("public_registration_enabled", default)
@@ -65,16 +55,7 @@ def is_public_registration_enabled():
             exc,
         )
         return default
-    enabled = _to_bool(setting_value, default)
-    try:
-        cache.set(cache_key, enabled, timeout=30)
-    except Exception as exc:
-        logger.warning(
-            "Failed writing registration setting to cache '%s': %s",
-            cache_key,
-            exc,
-        )
-    return enabled
+    return _to_bool(setting_value, default)
 
 
 def is_api_registration_token_valid(provided_token):
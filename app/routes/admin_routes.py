@@ -181,7 +181,7 @@ def update_coupon_transactions():
     if coupon_id:
         coupon = Coupon.query.get(coupon_id)
     elif coupon_code:
-        coupon = Coupon.query.filter_by(code=coupon_code).first()
+        coupon = Coupon.find_by_code(coupon_code)
 
     if not coupon:
         flash("לא ניתן לעדכן נתונים ללא מזהה קופון תקין.", "danger")
@@ -111,8 +111,8 @@ def update_all_active_coupons():
         try:
             df = get_coupon_data(cpn)
             if df is not None:
-                total_usage = float(df["usage_amount"].sum())
-                cpn.used_value = total_usage
+                # get_coupon_data already set used_value from all stored transactions.
+                total_usage = float(cpn.used_value or 0)
                 update_coupon_status(cpn)
 
                 usage = CouponUsage(
@@ -167,8 +167,8 @@ def update_all_any_coupons():
         try:
             df = get_coupon_data(cpn)
             if df is not None:
-                total_usage = float(df["usage_amount"].sum())
-                cpn.used_value = total_usage
+                # get_coupon_data already set used_value from all stored transactions.
+                total_usage = float(cpn.used_value or 0)
                 update_coupon_status(cpn)
 
                 usage = CouponUsage(
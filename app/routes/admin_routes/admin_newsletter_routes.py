@@ -3,7 +3,8 @@ from flask import Blueprint, redirect, url_for, flash, request, render_template,
 from flask_login import login_required, current_user
 from app.models import Newsletter, NewsletterSending, User
 from app.extensions import db
-from app.helpers import send_html_email, get_current_month_year_hebrew
+from app.helpers import get_current_month_year_hebrew
+from app.utils.newsletter_dispatch import newsletter_audience, start_newsletter_dispatch
 import os
 from functools import wraps
 import logging
@@ -332,172 +333,18 @@ def send_newsletter(newsletter_id):
         selected_users = request.form.getlist("selected_users")
         send_all = request.form.get("send_all") == "on"
         
-        if send_all:
-            # שליחה לכל המשתמשים שמעוניינים בניוזלטר
-            users = User.query.filter_by(is_deleted=False, is_confirmed=True, newsletter_subscription=True).all()
-        elif selected_users:
-            # שליחה למשתמשים נבחרים שמעוניינים בניוזלטר
-            users = User.query.filter(
-                User.id.in_(selected_users), 
-                User.is_deleted==False, 
-                User.is_confirmed==True, 
-                User.newsletter_subscription==True
-            ).all()
-        else:
+        if not send_all and not selected_users:
             flash("יש לבחור לפחות משתמש אחד או לסמן 'שליחה לכולם'.", "warning")
-            users = User.query.filter_by(is_deleted=False, is_confirmed=True, newsletter_subscription=True).all()
+            users = newsletter_audience().all()
             return render_template("admin/admin_send_newsletter.html", newsletter=newsletter, users=users)
-        
-        # ביצוע השליחה
-        success_count = 0
-        error_count = 0
-        
-        for user in users:
-            
-            try:
-                # יצירת קישור ביטול הרשמה
-                unsubscribe_link = generate_unsubscribe_link(user)
-                
-                # יצירת תוכן המייל בהתאם לסוג הניוזלטר
-                if newsletter.newsletter_type == "custom":
-                    # שימוש ב-HTML מותאם אישית
-                    html_content = newsletter.custom_html
-                    
-                    # יצירת קישור ביטול המנוי ועדכון העדפות
-                    unsubscribe_token = generate_unsubscribe_token(user)
-                    preferences_token = generate_preferences_token(user)
-                    unsubscribe_full_link = f"https://couponmasteril.com{url_for('profile.unsubscribe_newsletter', user_id=user.id, token=unsubscribe_token)}"
-                    preferences_full_link = f"https://couponmasteril.com{url_for('profile.preferences_from_email', user_id=user.id, token=preferences_token)}"
-                    
-                    # הוספת תמונה וחלק ביטול המנוי לסוף ה-HTML אם הוא לא קיים
-                    from datetime import datetime
-                    current_year = datetime.now().year
-                    
-                    # תמונה אם קיימת
-                    image_section = ""
-                    if newsletter.image_path:
-                        image_url = f"https://couponmasteril.com/static/{newsletter.image_path}"
-                        image_section = f'''
-                        <br>
-                        <!-- Newsletter Image -->
-                        <div style="text-align: center; margin: 20px 0;">
-                            <img src="{image_url}" alt="תמונת הניוזלטר" style="max-width: 100%; max-height: 300px; border-radius: 10px; box-shadow: 0 5px 15px rgba(0,0,0,0.1);">
-                        </div>
-                        '''
-                    
-                    unsubscribe_section = f'''
-                        {image_section}
-                        <br>
-                        <!-- Footer -->
-                        <div style="max-width: 500px; margin: 20px auto; background-color: #34495e; color: #bdc3c7; text-align: center; padding: 18px 25px; border-radius: 10px; font-family: Arial, sans-serif;">
-                            <p style="margin: 0 0 12px 0; font-size: 14px;"><strong>Coupon Master</strong></p>
-                            <div style="font-size: 12px; color: #95a5a6; margin: 12px 0;">
-                                <p style="margin: 0 0 10px 0;">שלום {user.first_name}, קיבלת את המייל הזה כי אתה רשום לניוזלטר שלנו.</p>
-                                <p style="margin: 0;">
-                                    <a href="{unsubscribe_full_link}" style="color: #95a5a6; text-decoration: underline;">ביטול מנוי</a>
-                                    | 
-                                    <a href="{preferences_full_link}" style="color: #95a5a6; text-decoration: underline;">עדכון העדפות</a>
-                                </p>
-                            </div>
-                            <p style="margin: 12px 0 0 0; font-size: 11px;">© {current_year} Coupon Master. כל הזכויות שמורות.</p>
-                        </div>
-                    '''
-                    
-                    # בדיקה אם יש כבר </body> או </html> ואם כן, להוסיף לפני זה
-                    if '</body>' in html_content:
-                        html_content = html_content.replace('</body>', unsubscribe_section + '</body>')
-                    elif '</html>' in html_content:
-                        html_content = html_content.replace('</html>', unsubscribe_section + '</html>')
-                    else:
-                        html_content += unsubscribe_section
-                    
-                    # החלפת משתנים בסיסיים
-                    html_content = html_content.replace("{{ user.first_name }}", user.first_name)
-                    html_content = html_content.replace("{{ user.last_name }}", user.last_name)
-                    html_content = html_content.replace("{{ user.email }}", user.email)
-                    html_content = html_content.replace("{{ unsubscribe_link }}", unsubscribe_link)
-                    
-                    # החלפת URL התמונה אם קיימת
-                    if newsletter.image_path:
-                        image_url = f"https://couponmasteril.com/static/{newsletter.image_path}"
-                        logger.info(f"Replacing newsletter_image_url with: {image_url}")
-                        html_content = html_content.replace("{{ newsletter_image_url }}", image_url)
-                    else:
-                        logger.info("No image path found, removing newsletter_image_url placeholder")
-                        html_content = html_content.replace("{{ newsletter_image_url }}", "")
-                else:
-                    # שימוש בתבנית המובנית
-                    hebrew_month_year = get_current_month_year_hebrew()
-                    html_content = render_template("emails/newsletter_template.html", 
-                                                 newsletter=newsletter, 
-                                                 user=user,
-                                                 unsubscribe_link=unsubscribe_link,
-                                                 generate_unsubscribe_token=generate_unsubscribe_token,
-                                                 generate_preferences_token=generate_preferences_token,
-                                                 hebrew_month_year=hebrew_month_year)
-                
-                send_html_email(
-                    api_key=os.getenv("BREVO_API_KEY"),
-                    sender_email=os.getenv("SENDER_EMAIL", "noreply@couponmaster.co.il"),
-                    sender_name="Coupon Master",
-                    recipient_email=user.email,
-                    recipient_name=f"{user.first_name} {user.last_name}",
-                    subject=newsletter.title,
-                    html_content=html_content,
-                    add_timestamp=False
-                )
-                
-                # רישום השליחה בבסיס הנתונים
-                existing_sending = NewsletterSending.query.filter_by(
-                    newsletter_id=newsletter.id,
-                    user_id=user.id
-                ).first()
-                
-                if existing_sending:
-                    existing_sending.delivery_status = "sent"
-                    existing_sending.sent_at = datetime.utcnow()
-                    existing_sending.error_message = None
-                else:
-                    sending = NewsletterSending(
-                        newsletter_id=newsletter.id,
-                        user_id=user.id,
-                        delivery_status="sent"
-                    )
-                    db.session.add(sending)
-                success_count += 1
-                
-            except Exception as e:
-                logger.error(f"Failed to send newsletter to {user.email}: {e}")
-                # רישום שליחה כושלת
-                existing_sending = NewsletterSending.query.filter_by(
-                    newsletter_id=newsletter.id,
-                    user_id=user.id
-                ).first()
-                
-                if existing_sending:
-                    existing_sending.delivery_status = "failed"
-                    existing_sending.sent_at = datetime.utcnow()
-                    existing_sending.error_message = str(e)
-                else:
-                    sending = NewsletterSending(
-                        newsletter_id=newsletter.id,
-                        user_id=user.id,
-                        delivery_status="failed",
-                        error_message=str(e)
-                    )
-                    db.session.add(sending)
-                error_count += 1
-        
-        # עדכון מספר השליחות בניוזלטר
-        newsletter.sent_count = success_count
-        newsletter.is_published = True
-        db.session.commit()
-        
-        if error_count > 0:
-            flash(f"הניוזלטר נשלח ל-{success_count} משתמשים, {error_count} שליחות נכשלו.", "warning")
-        else:
-            flash(f"הניוזלטר נשלח בהצלחה ל-{success_count} משתמשים!", "success")
-        
+
+        # השליחה עצמה רצה ברקע (RQ, או thread אם Redis לא זמין) במנות,
+        # ונרשמת ב-NewsletterSending כך שריצה שנקטעה ממשיכה מאיפה שעצרה
+        user_ids = None if send_all else [int(user_id) for user_id in selected_users]
+        recipients_count = newsletter_audience(user_ids).count()
+        start_newsletter_dispatch(newsletter.id, user_ids=user_ids)
+
+        flash(f"הניוזלטר נכנס לתור שליחה ל-{recipients_count} משתמשים. השליחה מתבצעת ברקע.", "success")
         return redirect(url_for("admin_newsletter_bp.manage_newsletters"))
     
     # GET - הצגת עמוד בחירת המשתמשים שמעוניינים בניוזלטר
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from app.extensions import db, csrf
 from app.models import Newsletter, NewsletterSending, User
+from app.utils.expiration_reminders import send_expiration_digests
+from app.utils.newsletter_dispatch import start_newsletter_dispatch
 import logging
 from datetime import datetime, timezone, timedelta
 from functools import wraps
@@ -127,9 +129,7 @@ def send_pending_emails():
                 success = send_newsletter_to_subscribers(newsletter)
                 
                 if success:
-                    # עדכון שהניוזלטר נשלח
-                    newsletter.is_sent = True
-                    db.session.commit()
+                    # is_sent מסומן ע"י ה-job ברקע בסיום השליחה
                     sent_count += 1
                     sent_emails.append({
                         'title': newsletter.title,
@@ -208,10 +208,7 @@ def cron_send_pending_emails():
                 success = send_newsletter_to_subscribers(newsletter)
                 
                 if success:
-                    # עדכון שהניוזלטר נשלח
-                    newsletter.is_sent = True
-                    newsletter.sent_at = current_time
-                    db.session.commit()
+                    # is_sent מסומן ע"י ה-job ברקע בסיום השליחה
                     sent_count += 1
                     sent_emails.append({
                         'id': newsletter.id,
@@ -219,7 +216,7 @@ def cron_send_pending_emails():
                         'scheduled_time': newsletter.scheduled_send_time.strftime('%d/%m/%Y %H:%M'),
                         'sent_count': newsletter.sent_count
                     })
-                    logging.info(f"Newsletter {newsletter.id} ({newsletter.title}) sent successfully to {newsletter.sent_count} users")
+                    logging.info(f"Newsletter {newsletter.id} ({newsletter.title}) dispatch started in the background")
                 else:
                     failed_count += 1
                     failed_emails.append({
@@ -281,240 +278,18 @@ def cron_send_expiration_reminders():
     שולח תזכורות ל-30, 7 ו-1 ימים לפני תפוגה
     """
     try:
-        from datetime import date, timedelta
-        from app.models import Coupon, User, Company
-        from app.helpers import send_email
-        import base64
-        import os
-        
         current_time = datetime.now(timezone.utc)
         today = current_time.date()
         
-        # חיפוש קופונים שצריכים תזכורות
-        # 30 ימים לפני תפוגה
-        date_30_days = today + timedelta(days=30)
-        # 7 ימים לפני תפוגה  
-        date_7_days = today + timedelta(days=7)
-        # יום אחד לפני תפוגה
-        date_1_day = today + timedelta(days=1)
-        
-        sent_count = 0
-        failed_count = 0
-        sent_reminders = []
-        failed_reminders = []
-        
-        # פונקציה לשליחת תזכורת
-        def send_reminder(coupon, user, days_left, reminder_type):
-            try:
-                # הכנת תוכן המייל
-                company_obj = Company.query.filter_by(name=coupon.company).first()
-                logo_filename = (
-                    company_obj.image_path
-                    if company_obj and company_obj.image_path
-                    else "default_logo.png"
-                )
-                
-                # קריאת לוגו החברה
-                logo_filepath = os.path.join(
-                    current_app.root_path, "static", logo_filename
-                )
-                
-                try:
-                    with open(logo_filepath, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                except Exception as e:
-                    logging.warning(f"Could not read logo file {logo_filepath}: {e}")
-                    encoded_string = ""
-                
-                # הכנת נתוני הקופון למייל
-                coupon_data = {
-                    "company": coupon.company,
-                    "company_logo_base64": encoded_string,
-                    "code": coupon.code,
-                    "remaining_value": coupon.remaining_value,
-                    "expiration": coupon.expiration,
-                    "expiration_formatted": datetime.strptime(coupon.expiration, "%Y-%m-%d").strftime("%d/%m/%Y"),
-                    "days_left": days_left,
-                    "coupon_detail_link": f"https://www.couponmasteril.com/coupon_detail/{coupon.id}",
-                }
-                
-                # קביעת כותרת המייל לפי מספר הימים
-                if days_left == 30:
-                    subject = "תזכורת: קופון פג תוקף בעוד 30 יום"
-                elif days_left == 7:
-                    subject = "תזכורת: קופון פג תוקף בעוד שבוע"
-                elif days_left == 1:
-                    subject = "תזכורת דחופה: קופון פג תוקף מחר!"
-                else:
-                    subject = f"תזכורת: קופון פג תוקף בעוד {days_left} ימים"
-                
-                # רינדור תבנית המייל
-                from flask import render_template
-                html_content = render_template(
-                    "emails/coupon_expiration_warning.html",
-                    user={"first_name": user.first_name, "email": user.email},
-                    coupons=[coupon_data],
-                    current_year=today.year,
-                )
-                
-                # שליחת המייל
-                success = send_email(
-                    sender_email="noreply@couponmasteril.com",
-                    sender_name="Coupon Master",
-                    recipient_email=user.email,
-                    recipient_name=f"{user.first_name} {user.last_name}",
-                    subject=subject,
-                    html_content=html_content,
-                )
-                
-                if success:
-                    # עדכון הדגל שהתזכורת נשלחה
-                    if reminder_type == 30:
-                        coupon.reminder_sent_30_days = True
-                    elif reminder_type == 7:
-                        coupon.reminder_sent_7_days = True
-                    elif reminder_type == 1:
-                        coupon.reminder_sent_1_day = True
-                    
-                    db.session.commit()
-                    
-                    return True, None
-                else:
-                    return False, "Email sending failed"
-                    
-            except Exception as e:
-                return False, str(e)
-        
         # לוג תחילת תהליך
         logging.info(f"Expiration reminders cron job started")
         
-        # תזכורות 30 ימים
-        coupons_30_days = Coupon.query.join(User).filter(
-            Coupon.expiration == date_30_days.strftime("%Y-%m-%d"),
-            Coupon.reminder_sent_30_days == False,
-            Coupon.status == 'פעיל',
-            Coupon.is_for_sale == False
-        ).all()
-        
-        for coupon in coupons_30_days:
-            success, error = send_reminder(coupon, coupon.user, 30, 30)
-            if success:
-                sent_count += 1
-                sent_reminders.append({
-                    'type': '30_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'company': coupon.company,
-                    'code': coupon.code
-                })
-            else:
-                failed_count += 1
-                failed_reminders.append({
-                    'type': '30_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'error': error
-                })
-        
-        # תזכורות 7 ימים
-        coupons_7_days = Coupon.query.join(User).filter(
-            Coupon.expiration == date_7_days.strftime("%Y-%m-%d"),
-            Coupon.reminder_sent_7_days == False,
-            Coupon.status == 'פעיל',
-            Coupon.is_for_sale == False
-        ).all()
-        
-        for coupon in coupons_7_days:
-            success, error = send_reminder(coupon, coupon.user, 7, 7)
-            if success:
-                sent_count += 1
-                sent_reminders.append({
-                    'type': '7_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'company': coupon.company,
-                    'code': coupon.code
-                })
-            else:
-                failed_count += 1
-                failed_reminders.append({
-                    'type': '7_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'error': error
-                })
-        
-        # תזכורות יום אחד
-        coupons_1_day = Coupon.query.join(User).filter(
-            Coupon.expiration == date_1_day.strftime("%Y-%m-%d"),
-            Coupon.reminder_sent_1_day == False,
-            Coupon.status == 'פעיל',
-            Coupon.is_for_sale == False
-        ).all()
-        
-        for coupon in coupons_1_day:
-            success, error = send_reminder(coupon, coupon.user, 1, 1)
-            if success:
-                sent_count += 1
-                sent_reminders.append({
-                    'type': '1_day',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'company': coupon.company,
-                    'code': coupon.code
-                })
-            else:
-                failed_count += 1
-                failed_reminders.append({
-                    'type': '1_day',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'error': error
-                })
-        
-        # תזכורות לקופונים שעומדים לפוג בעוד 2-6 ימים (שעדיין לא קיבלו תזכורת)
-        date_2_to_6_days_start = date.today() + timedelta(days=2)
-        date_2_to_6_days_end = date.today() + timedelta(days=6)
-        
-        from sqlalchemy import and_
-        
-        coupons_2_to_6_days = Coupon.query.join(User).filter(
-            and_(
-                Coupon.expiration >= date_2_to_6_days_start.strftime("%Y-%m-%d"),
-                Coupon.expiration <= date_2_to_6_days_end.strftime("%Y-%m-%d")
-            ),
-            Coupon.reminder_sent_7_days == False,
-            Coupon.reminder_sent_1_day == False,
-            Coupon.status == 'פעיל',
-            Coupon.is_for_sale == False
-        ).all()
-        
-        for coupon in coupons_2_to_6_days:
-            # חישוב כמה ימים נשארו
-            exp_date = datetime.strptime(coupon.expiration, '%Y-%m-%d').date()
-            days_left = (exp_date - today).days
-            
-            success, error = send_reminder(coupon, coupon.user, days_left, days_left)
-            if success:
-                sent_count += 1
-                sent_reminders.append({
-                    'type': f'{days_left}_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'company': coupon.company,
-                    'code': coupon.code
-                })
-                # סמן שהתזכורת נשלחה (נשתמש בשדה reminder_sent_7_days)
-                coupon.reminder_sent_7_days = True
-                db.session.commit()
-            else:
-                failed_count += 1
-                failed_reminders.append({
-                    'type': f'{days_left}_days',
-                    'coupon_id': coupon.id,
-                    'user_email': coupon.user.email,
-                    'error': error
-                })
+        # כל התזכורות בשאילתה אחת, מייל מרוכז אחד לכל משתמש ועדכון הדגלים ב-UPDATE אחד לכל דגל
+        result = send_expiration_digests(today)
+        sent_reminders = result['sent']
+        failed_reminders = result['failed']
+        sent_count = len(sent_reminders)
+        failed_count = len(failed_reminders)
         
         # הכנת תגובה מפורטת
         response_data = {
@@ -525,7 +300,8 @@ def cron_send_expiration_reminders():
                 'total_failed': failed_count,
                 'reminders_30_days': len([r for r in sent_reminders if r['type'] == '30_days']),
                 'reminders_7_days': len([r for r in sent_reminders if r['type'] == '7_days']),
-                'reminders_1_day': len([r for r in sent_reminders if r['type'] == '1_day'])
+                'reminders_1_day': len([r for r in sent_reminders if r['type'] == '1_day']),
+                'emails_sent': result['emails']
             },
             'sent_reminders': sent_reminders,
             'failed_reminders': failed_reminders,
@@ -542,6 +318,7 @@ def cron_send_expiration_reminders():
         return jsonify(response_data)
         
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Critical error in cron_send_expiration_reminders: {e}")
         return jsonify({
             'success': False,
@@ -552,170 +329,14 @@ def cron_send_expiration_reminders():
 
 def send_newsletter_to_subscribers(newsletter):
     """
-    שליחת ניוזלטר לכל המשתמשים המנויים
-    מחזירה True אם הצליח, False אם נכשל
+    הפעלת שליחת ניוזלטר לכל המשתמשים המנויים ברקע (app/utils/newsletter_dispatch.py).
+    ה-job מסמן is_sent בסיום; ריצה שנקטעה ממשיכה בהפעלה הבאה בלי לשלוח שוב.
+    מחזירה True אם השליחה הופעלה, False אם נכשל
     """
     try:
-        # קבלת כל המשתמשים שמנויים לניוזלטר
-        subscribed_users = User.query.filter(
-            User.newsletter_subscription == True
-        ).all()
-        
-        if not subscribed_users:
-            logging.warning(f"No subscribed users found for newsletter {newsletter.id}")
-            return True
-        
-        # שליחה לכל משתמש
-        total_sent = 0
-        for user in subscribed_users:
-            try:
-                # בדיקה אם כבר נשלח למשתמש זה
-                existing_sending = NewsletterSending.query.filter_by(
-                    newsletter_id=newsletter.id,
-                    user_id=user.id
-                ).first()
-                
-                if existing_sending:
-                    continue  # כבר נשלח למשתמש זה
-                
-                # שליחת המייל
-                success = send_newsletter_email(newsletter, user)
-                
-                if success:
-                    # תיעוד השליחה
-                    sending = NewsletterSending(
-                        newsletter_id=newsletter.id,
-                        user_id=user.id,
-                        delivery_status='sent'
-                    )
-                    db.session.add(sending)
-                    total_sent += 1
-                else:
-                    # תיעוד שגיאה
-                    sending = NewsletterSending(
-                        newsletter_id=newsletter.id,
-                        user_id=user.id,
-                        delivery_status='failed',
-                        error_message='שגיאה בשליחת המייל'
-                    )
-                    db.session.add(sending)
-                    
-            except Exception as e:
-                logging.error(f"Error sending newsletter to user {user.id}: {e}")
-                # תיעוד שגיאה
-                sending = NewsletterSending(
-                    newsletter_id=newsletter.id,
-                    user_id=user.id,
-                    delivery_status='failed',
-                    error_message=str(e)
-                )
-                db.session.add(sending)
-        
-        # עדכון מספר השליחות בניוזלטר
-        newsletter.sent_count = total_sent
-        db.session.commit()
-        
-        logging.info(f"Newsletter {newsletter.id} sent to {total_sent} users")
+        mode = start_newsletter_dispatch(newsletter.id, mark_sent=True)
+        logging.info(f"Newsletter {newsletter.id} dispatch started ({mode})")
         return True
-        
     except Exception as e:
-        logging.error(f"Error sending newsletter {newsletter.id}: {e}")
-        db.session.rollback()
+        logging.error(f"Error starting newsletter {newsletter.id} dispatch: {e}")
         return False
-
-def send_newsletter_email(newsletter, user):
-    """
-    שליחת מייל ניוזלטר למשתמש ספציפי
-    מחזירה True אם הצליח, False אם נכשל
-    """
-    try:
-        from app.helpers import send_html_email
-        from app.routes.admin_routes.admin_newsletter_routes import generate_unsubscribe_link
-        
-        # הכנת תוכן המייל
-        if newsletter.newsletter_type == 'custom' and newsletter.custom_html:
-            # ניוזלטר מותאם אישית
-            email_content = newsletter.custom_html
-        else:
-            # ניוזלטר מובנה - צריך לרנדר את התבנית
-            email_content = render_newsletter_template(newsletter, user)
-        
-        # הוספת קישור ביטול הרשמה
-        unsubscribe_link = generate_unsubscribe_link(user)
-        if unsubscribe_link not in email_content:
-            email_content += f'<br><br><a href="{unsubscribe_link}">לביטול הרשמה לחץ כאן</a>'
-        
-        # שליחת המייל
-        success = send_html_email(
-            recipient_email=user.email,
-            recipient_name=f"{user.first_name} {user.last_name}",
-            subject=newsletter.title,
-            html_content=email_content,
-            sender_email="noreply@couponmasteril.com",
-            sender_name="Coupon Master"
-        )
-        
-        return success
-        
-    except Exception as e:
-        logging.error(f"Error sending email to user {user.email}: {e}")
-        return False
-
-def render_newsletter_template(newsletter, user):
-    """
-    רינדור תבנית הניוזלטר עבור משתמש ספציפי
-    """
-    try:
-        from flask import render_template_string
-        
-        # תבנית בסיסית לניוזלטר
-        template = """
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>{{ newsletter.title }}</title>
-        </head>
-        <body style="direction: rtl; font-family: Arial, sans-serif; margin: 20px;">
-            {% if newsletter.main_title %}
-            <h1>{{ newsletter.main_title }}</h1>
-            {% endif %}
-            
-            {% if newsletter.additional_title %}
-            <h2>{{ newsletter.additional_title }}</h2>
-            {% endif %}
-            
-            {% if newsletter.content %}
-            <div>{{ newsletter.content|safe }}</div>
-            {% endif %}
-            
-            {% if newsletter.highlight_text %}
-            <div style="background-color: #f0f8ff; padding: 10px; margin: 10px 0; border-right: 4px solid #007bff;">
-                {{ newsletter.highlight_text|safe }}
-            </div>
-            {% endif %}
-            
-            {% if newsletter.telegram_bot_section %}
-            <div style="margin: 20px 0;">
-                <h3>בוט הטלגרם שלנו</h3>
-                {{ newsletter.telegram_bot_section|safe }}
-                {% if newsletter.show_telegram_button %}
-                <br><a href="https://t.me/your_bot" style="background-color: #0088cc; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">הצטרף לבוט</a>
-                {% endif %}
-            </div>
-            {% endif %}
-            
-            {% if newsletter.website_features_section %}
-            <div style="margin: 20px 0;">
-                <h3>תכונות האתר</h3>
-                {{ newsletter.website_features_section|safe }}
-            </div>
-            {% endif %}
-        </body>
-        </html>
-        """
-        
-        return render_template_string(template, newsletter=newsletter, user=user)
-        
-    except Exception as e:
-        logging.error(f"Error rendering newsletter template: {e}")
-        return f"<html><body><h1>{newsletter.title}</h1><p>{newsletter.content or 'תוכן לא זמין'}</p></body></html>"
@@ -2,9 +2,12 @@
 
 from flask import Blueprint, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy import func
+from sqlalchemy.orm import undefer
 from app.models import User, Coupon, Company, CouponRequest, Transaction
 from app.extensions import db, cache
-from datetime import datetime
+from app.analytics.user_summary import get_user_summary
+from datetime import datetime, timedelta
 import logging
 
 from app.activity_logging import log_activity
@@ -294,7 +297,12 @@ def api_get_user_coupons(user_id):
         if current_user.id != user_id and not current_user.is_admin:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        coupons = Coupon.query.filter_by(user_id=user_id).order_by(Coupon.date_added.desc()).all()
+        coupons = (
+            Coupon.query.options(undefer(Coupon.description))
+            .filter_by(user_id=user_id)
+            .order_by(Coupon.date_added.desc())
+            .all()
+        )
         
         coupon_list = []
         for coupon in coupons:
@@ -440,7 +448,7 @@ def api_get_companies():
 def api_get_marketplace_coupons():
     """Get marketplace coupons"""
     try:
-        coupons = Coupon.query.filter_by(
+        coupons = Coupon.query.options(undefer(Coupon.description)).filter_by(
             is_for_sale=True,
             is_available=True,
             status='פעיל'
@@ -498,25 +506,26 @@ def api_get_user_statistics(user_id):
         if current_user.id != user_id and not current_user.is_admin:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        coupons = Coupon.query.filter_by(user_id=user_id).all()
-        
-        total_value = sum(coupon.value for coupon in coupons)
-        total_savings = sum(max(0, coupon.value - coupon.cost) for coupon in coupons)
-        total_used = sum(coupon.used_value for coupon in coupons)
-        total_remaining = sum(coupon.remaining_value for coupon in coupons)
-        
-        active_coupons = [c for c in coupons if c.status == 'פעיל']
-        expiring_soon = [c for c in active_coupons if c.expiration and 
-                        (c.expiration - datetime.now().date()).days <= 7]
-        
+        summary = get_user_summary(user_id)
+        total_value = summary['total_value']
+        total_savings = summary['savings']
+
+        today = datetime.now().date()
+        expiring_soon = db.session.query(func.count(Coupon.id)).filter(
+            Coupon.user_id == user_id,
+            Coupon.status == 'פעיל',
+            Coupon.expiration.isnot(None),
+            Coupon.expiration <= today + timedelta(days=7),
+        ).scalar() or 0
+
         stats = {
             'totalValue': total_value,
             'totalSavings': total_savings,
-            'totalUsed': total_used,
-            'totalRemaining': total_remaining,
-            'totalCoupons': len(coupons),
-            'activeCoupons': len(active_coupons),
-            'expiringSoon': len(expiring_soon),
+            'totalUsed': summary['used_value'],
+            'totalRemaining': summary['remaining_value'],
+            'totalCoupons': summary['coupon_count'],
+            'activeCoupons': summary['active_count'] + summary['active_one_time_count'],
+            'expiringSoon': expiring_soon,
             'averageDiscount': (total_savings / total_value * 100) if total_value > 0 else 0
         }
         
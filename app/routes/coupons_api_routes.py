@@ -5,6 +5,7 @@ import numpy as np
 import pandas as pd
 from flask import current_app, flash, jsonify, redirect, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import undefer
 from sqlalchemy.sql import text
 
 from app.extensions import csrf, db
@@ -17,6 +18,7 @@ from app.models import (
     CouponUsage,
     User,
     UserTourProgress,
+    undefer_coupon_details,
 )
 from app.routes.coupons_routes import coupons_bp
 from app.tasks import dispatch_multipass_github_workflow, trigger_multipass_github_action
@@ -221,7 +223,12 @@ def get_my_coupons():
     try:
         user_id = current_user.id
 
-        coupons = Coupon.query.filter_by(user_id=user_id).limit(3).all()
+        coupons = (
+            Coupon.query.options(undefer(Coupon.description))
+            .filter_by(user_id=user_id)
+            .limit(3)
+            .all()
+        )
 
         coupons_data = []
         for coupon in coupons:
@@ -305,7 +312,7 @@ def api_coupon_detail(coupon_id):
         if not current_user:
             return jsonify({"error": "Invalid user"}), 401
 
-        coupon = Coupon.query.get_or_404(coupon_id)
+        coupon = Coupon.query.options(undefer_coupon_details()).get_or_404(coupon_id)
 
         is_owner = coupon.user_id == current_user.id
 
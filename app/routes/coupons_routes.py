@@ -11,7 +11,7 @@ from flask import (
     send_file,
 )
 from flask_login import login_required, current_user
-from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.orm import joinedload, load_only, undefer
 from sqlalchemy import func, or_, and_
 from werkzeug.utils import secure_filename
 from sqlalchemy.exc import IntegrityError
@@ -42,6 +42,7 @@ from app.models import (
     UserTourProgress,
     CouponShares,
     CouponActiveViewers,
+    undefer_coupon_details,
 )
 from app.forms import (
     ProfileForm,
@@ -78,6 +79,8 @@ from app.helpers import (
 )
 from flask import session
 from app.tasks import enqueue_coupon_status_sync, trigger_multipass_github_action
+from app.analytics.user_summary import rebuild_user_summaries
+from app.utils.company_index import get_company_index, match_company
 
 
 logger = logging.getLogger(__name__)
@@ -87,107 +90,42 @@ coupons_bp = Blueprint("coupons", __name__)
 
 def find_matching_company(company_name_raw):
     """
-    Advanced company matching using fuzzy matching and GPT fallback
-    1. Try fuzzy matching with 80%+ similarity (lowered threshold)
+    Advanced company matching using the company index and GPT fallback
+    1. Exact/alias match, then fuzzy matching (80%+) over n-gram candidates
     2. If no match, use GPT-4 mini for intelligent matching with translation
     3. If still no match, return original name
     """
     debug_print(f"=== STARTING COMPANY MATCHING ===")
     debug_print(f"Input company name: '{company_name_raw}'")
     
-    # Get all companies from database
-    companies = Company.query.all()
-    company_names = [c.name for c in companies]
-    
-    debug_print(f"Found {len(company_names)} companies in database")
-    debug_print(f"Companies list (first 10): {company_names[:10]}")
-    
+    # Exact / alias / n-gram fuzzy match against the shared company index
+    index = get_company_index()
+    company_names = index.names
+
+    debug_print(f"Found {len(company_names)} companies in index")
+
     if not company_names:
         debug_print("No companies found in database, returning original name")
         return company_name_raw
-    
-    # Clean the input name for better matching
+
+    # Clean the input name (also used in the GPT prompt below)
     clean_input = company_name_raw.strip()
-    # Remove common prefixes/suffixes that might interfere
     clean_input = clean_input.replace('₪', '').replace('שח', '').replace('ש״ח', '').strip()
-    # Remove numbers and common words
-    import re
     clean_input = re.sub(r'\d+', '', clean_input).strip()
     clean_input = re.sub(r'\b(קופון|שובר|ל|של|עם|כרטיס|גיפט|gift|card)\b', '', clean_input, flags=re.IGNORECASE).strip()
-    
+
     debug_print(f"Cleaned input name: '{clean_input}'")
-    
-    # Create Hebrew-English translation variations for common cases
-    hebrew_to_english_map = {
-        'דרים קארד': 'dream card',
-        'מקדונלדס': 'mcdonalds',
-        'בורגר קינג': 'burger king',
-        'פיצה האט': 'pizza hut',
-        'דומינוס': 'dominos',
-        'קפה קפה': 'cafe cafe',
-        'רולדין': 'roladin',
-        'קרפור': 'carrefour'
-    }
-    
-    # Create variation list for testing
-    test_variations = [clean_input.lower()]
-    if clean_input.lower() in hebrew_to_english_map:
-        test_variations.append(hebrew_to_english_map[clean_input.lower()])
-        debug_print(f"Added Hebrew-English variation: '{hebrew_to_english_map[clean_input.lower()]}'")
-    
-    debug_print(f"Test variations: {test_variations}")
-    
-    # Step 1: Fuzzy matching with different approaches
-    debug_print("=== STARTING FUZZY MATCHING ===")
-    best_match = None
-    best_score = 0
-    detailed_scores = []
-    
-    for company_name in company_names:
-        company_lower = company_name.lower()
-        max_score_for_company = 0
-        
-        # Test all variations against this company
-        for test_name in test_variations + [company_name_raw.lower()]:
-            if not test_name.strip():
-                continue
-                
-            # Use different fuzzy matching algorithms
-            ratio = fuzz.ratio(test_name, company_lower)
-            partial_ratio = fuzz.partial_ratio(test_name, company_lower)
-            token_sort_ratio = fuzz.token_sort_ratio(test_name, company_lower)
-            token_set_ratio = fuzz.token_set_ratio(test_name, company_lower)
-            
-            # Take the maximum score from all algorithms
-            max_score = max(ratio, partial_ratio, token_sort_ratio, token_set_ratio)
-            max_score_for_company = max(max_score_for_company, max_score)
-            
-            # Special debugging for potential matches
-            if max_score > 70:
-                debug_print(f"  Testing '{test_name}' vs '{company_lower}': {max_score}% (best: {ratio}, {partial_ratio}, {token_sort_ratio}, {token_set_ratio})")
-        
-        detailed_scores.append({
-            'company': company_name,
-            'score': max_score_for_company
-        })
-        
-        if max_score_for_company > best_score:
-            best_score = max_score_for_company
-            best_match = company_name
-    
-    # Sort and show top matches for debugging
-    detailed_scores.sort(key=lambda x: x['score'], reverse=True)
-    debug_print(f"Top 5 fuzzy matches:")
-    for i, match in enumerate(detailed_scores[:5]):
-        debug_print(f"  {i+1}. {match['company']}: {match['score']}%")
-    
-    debug_print(f"Best fuzzy match: '{best_match}' with score: {best_score}%")
-    
-    # Lowered threshold to 80% for better matches
-    if best_score >= 80:
-        debug_print(f"Fuzzy match successful! Using: {best_match}")
+
+    # Step 1: Index matching (exact, alias, then fuzzy over n-gram candidates)
+    debug_print("=== STARTING INDEX MATCHING ===")
+    best_match, best_score = match_company(company_name_raw)
+
+    debug_print(f"Best index match: '{best_match}' with score: {best_score}%")
+
+    if best_match is not None:
+        debug_print(f"Index match successful! Using: {best_match}")
         return best_match
-    
+
     # Step 2: Try GPT-4 mini for intelligent matching
     debug_print("=== STARTING GPT-4 MINI MATCHING ===")
     try:
@@ -1771,7 +1709,7 @@ def add_coupon_with_image_html():
             )
 
             # Check for unique code
-            if Coupon.query.filter_by(code=code).first():
+            if Coupon.find_by_code(code):
                 flash("קוד קופון זה כבר קיים. אנא בחר קוד אחר.", "danger")
                 return redirect(url_for("coupons.add_coupon_with_image_html"))
 
@@ -1983,8 +1921,7 @@ def add_coupon():
 
                 # Get companies list for matching
                 debug_print("Fetching companies for matching")
-                companies = Company.query.order_by(Company.name).all()
-                companies_list = [c.name for c in companies]
+                companies_list = get_company_index().names
                 debug_print(f"Found {len(companies_list)} companies")
 
                 # Extract coupon details from SMS text
@@ -2016,6 +1953,7 @@ def add_coupon():
                             cost_usd=float(pricing_row["cost_usd"]),
                             cost_ils=float(pricing_row["cost_ils"]),
                             exchange_rate=float(pricing_row["exchange_rate"]),
+                            cache_hit=bool(pricing_row.get("cache_hit", False)),
                             prompt_text=np.nan,
                             response_text=np.nan,
                         )
@@ -2260,6 +2198,7 @@ def add_coupon():
                         cost_usd=float(pricing_row["cost_usd"]),
                         cost_ils=float(pricing_row["cost_ils"]),
                         exchange_rate=float(pricing_row["exchange_rate"]),
+                        cache_hit=bool(pricing_row.get("cache_hit", False)),
                         prompt_text=np.nan,
                         response_text=np.nan,
                     )
@@ -3059,7 +2998,7 @@ def add_coupon_with_image():
         )
 
         # בדיקה שהקוד לא קיים כבר
-        if Coupon.query.filter_by(code=code).first():
+        if Coupon.find_by_code(code):
             flash("קוד קופון זה כבר קיים. אנא בחר קוד אחר.", "danger")
             return redirect(url_for("coupons.add_coupon_with_image"))
 
@@ -3260,7 +3199,7 @@ def convert_date_format(date_input):
 @coupons_bp.route("/edit_coupon/<int:id>", methods=["GET", "POST"])
 @login_required
 def edit_coupon(id):
-    coupon = Coupon.query.get_or_404(id)
+    coupon = Coupon.query.options(undefer_coupon_details()).get_or_404(id)
 
     # -- activity log snippet --
     # log_user_activity("edit_coupon_view", coupon.id)
@@ -3500,6 +3439,8 @@ def select_coupons_to_delete():
             Coupon.query.filter(Coupon.id.in_(selected_ids)).delete(
                 synchronize_session=False
             )
+            # Bulk deletes skip the ORM flush hooks that maintain the summary.
+            rebuild_user_summaries([current_user.id])
             db.session.commit()
 
             try:
@@ -3565,7 +3506,7 @@ def coupon_detail(id):
     # ------------------------------------------------------------------
     # 1) Fetch the coupon if the current user is the owner OR has shared access.
     # ------------------------------------------------------------------
-    coupon = Coupon.query.get_or_404(id)
+    coupon = Coupon.query.options(undefer_coupon_details()).get_or_404(id)
     
     # Check if user is owner
     is_owner = coupon.user_id == current_user.id
@@ -4119,7 +4060,11 @@ def export_excel():
     # -- activity log snippet --
     # log_user_activity("export_excel", None)
 
-    coupons = Coupon.query.filter_by(user_id=current_user.id).all()
+    coupons = (
+        Coupon.query.options(undefer_coupon_details())
+        .filter_by(user_id=current_user.id)
+        .all()
+    )
     data = []
     for coupon in coupons:
         data.append(
@@ -5050,7 +4995,9 @@ def update_coupon_transactions():
         if coupon_id:
             coupon = Coupon.query.get(coupon_id)
         elif coupon_code:
-            coupon = Coupon.query.filter_by(code=coupon_code).first()
+            coupon = Coupon.find_by_code(
+                coupon_code, query=Coupon.query.filter_by(user_id=current_user.id)
+            )
 
         if coupon:
             return redirect(url_for("transactions.coupon_detail", id=coupon.id))
@@ -5066,7 +5013,7 @@ def update_coupon_transactions():
     if coupon_id:
         coupon = Coupon.query.get(coupon_id)
     elif coupon_code:
-        coupon = Coupon.query.filter_by(code=coupon_code).first()
+        coupon = Coupon.find_by_code(coupon_code)
 
     if not coupon:
         flash("לא ניתן לעדכן נתונים ללא מזהה קופון תקין.", "danger")
@@ -5168,6 +5115,7 @@ def parse_usage_text():
                         cost_usd=float(row["cost_usd"]),
                         cost_ils=float(row["cost_ils"]),
                         exchange_rate=float(row["exchange_rate"]),
+                        cache_hit=bool(row.get("cache_hit", False)),
                         prompt_text=np.nan,
                         response_text=np.nan,
                     )
@@ -5952,7 +5900,12 @@ def get_my_coupons():
         user_id = current_user.id
         
         # Query the coupons for the current user with a limit of 3
-        coupons = Coupon.query.filter_by(user_id=user_id).limit(3).all()
+        coupons = (
+            Coupon.query.options(undefer(Coupon.description))
+            .filter_by(user_id=user_id)
+            .limit(3)
+            .all()
+        )
         
         # Convert the coupons to a list of dictionaries
         coupons_data = []
@@ -6046,7 +5999,7 @@ def api_coupon_detail(coupon_id):
     """
     try:
         # Fetch the coupon if the current user is the owner OR has shared access
-        coupon = Coupon.query.get_or_404(coupon_id)
+        coupon = Coupon.query.options(undefer_coupon_details()).get_or_404(coupon_id)
         
         # Check if user is owner
         is_owner = coupon.user_id == current_user.id
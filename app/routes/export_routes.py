@@ -8,6 +8,7 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+from sqlalchemy.orm import undefer
 
 from app.models import Coupon
 from app.extensions import db
@@ -57,7 +58,9 @@ def export_excel():
     # log_user_activity("export_excel_view")
 
     search_query = request.args.get("search", "").strip()
-    query = Coupon.query.filter_by(user_id=current_user.id)
+    query = Coupon.query.options(undefer(Coupon.description)).filter_by(
+        user_id=current_user.id
+    )
     
     if search_query:
         query = query.filter(Coupon.company.ilike(f"%{search_query}%"))
@@ -22,6 +22,7 @@ from app.models import (
     CouponRequest,
     Tag,
     Company,
+    undefer_coupon_details,
 )
 from app.helpers import (
     send_coupon_purchase_request_email,
@@ -158,7 +159,7 @@ def marketplace():
 def marketplace_coupon_detail(id):
     # log_user_activity("marketplace_coupon_detail_view", coupon_id=id)
 
-    coupon = Coupon.query.get_or_404(id)
+    coupon = Coupon.query.options(undefer_coupon_details()).get_or_404(id)
     if not coupon.is_available or not coupon.is_for_sale:
         flash("קופון זה אינו זמין במרקטפלייס.", "danger")
         return redirect(url_for("marketplace.marketplace"))
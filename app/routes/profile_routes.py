@@ -1,7 +1,7 @@
 # app/routes/profile_routes.py
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, send_file
 from flask_login import login_required, current_user
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, undefer
 from sqlalchemy import func
 import re
 import os
@@ -42,6 +42,13 @@ from app.forms import (
     ChangePasswordForm,
 )
 from app.helpers import update_coupon_status, get_coupon_data, process_coupons_excel
+from app.analytics.dashboard_summary import (
+    DEFAULT_CARDS_LIMIT,
+    get_dashboard_cards,
+    get_dashboard_summary,
+    get_expiring_coupons,
+    refresh_stale_statuses,
+)
 from app.helpers import send_coupon_purchase_request_email, send_password_change_email
 from sqlalchemy.exc import IntegrityError
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
@@ -276,78 +283,45 @@ def index():
     )  # For example: based on time, returns "Good morning" / "Good evening", etc.
 
     # --------------------------------------------------------------------------------
-    # OPTIMIZED: Single query with eager loading instead of 6 separate queries
+    # 1. OPTIMIZED: Status updates - only coupons whose stored status is stale
     # --------------------------------------------------------------------------------
+    from flask import session
+    from datetime import date
 
-    # Load all user coupons (removed pagination limit)
-    all_user_coupons = Coupon.query.filter(
-        Coupon.user_id == current_user.id
-    ).order_by(Coupon.date_added.desc()).all()
-    
-    has_more_coupons = False
-    remaining_count = 0
-
-    # Filter in memory (much faster than separate DB queries)
-    all_coupons = [
-        c for c in all_user_coupons
-        if not c.is_for_sale and c.exclude_saving != True
-    ]
-    
-    coupons_for_sale = [c for c in all_user_coupons if c.is_for_sale]
-    
-    active_one_time_coupons = [c for c in all_coupons 
-                               if c.status == "פעיל" and c.is_one_time]
-    
-    used_coupons = [c for c in all_coupons 
-                    if c.status != "פעיל"]
-    
-    active_coupons = [c for c in all_coupons 
-                      if c.status == "פעיל" and not c.is_one_time]
+    today = date.today().isoformat()
+    cache_key = f'status_updated_{current_user.id}'
+
+    # Only update statuses if not done today (using session cache)
+    if session.get(cache_key) != today:
+        refresh_stale_statuses(current_user.id)
+        session[cache_key] = today
 
     # --------------------------------------------------------------------------------
-    # 1. Calculate total coupons and savings - INCLUDING BOTH ONE-TIME AND NON-ONE-TIME
+    # 2. Totals, per-company stats and monthly buckets from one aggregated query
     # --------------------------------------------------------------------------------
+    summary = get_dashboard_summary(current_user.id)
 
-    # Calculate total remaining value, savings, and total value
-    total_remaining = sum(
-        max(_num(coupon.value) - _num(coupon.used_value), 0)
-        for coupon in all_coupons
-    )
-    total_savings = sum(
-        max(_num(coupon.value) - _num(coupon.cost), 0)
-        for coupon in all_coupons
-        if _num(coupon.value) > _num(coupon.cost)
-    )
-    total_coupons_value = sum(_num(coupon.value) for coupon in all_coupons)
+    total_remaining = summary["total_remaining"]
+    total_savings = summary["total_savings"]
+    total_coupons_value = summary["total_coupons_value"]
     percentage_savings = (
         (total_savings / total_coupons_value) * 100 if total_coupons_value > 0 else 0
     )
 
     # --------------------------------------------------------------------------------
-    # 3. OPTIMIZED: Status updates with session-based caching
+    # 3. Coupon cards - only the visible categories, capped
     # --------------------------------------------------------------------------------
-    from app.models import clear_status_update_cache
-    from flask import session
-    from datetime import date
-    
-    today = date.today().isoformat()
-    cache_key = f'status_updated_{current_user.id}'
-    
-    # Only update statuses if not done today (using session cache)
-    if session.get(cache_key) != today:
-        all_to_update = all_coupons + coupons_for_sale
-        for coupon in all_to_update:
-            update_coupon_status(coupon)
-        
-        # Mark as updated today in session
-        session[cache_key] = today
-        
-        # Clear cache after processing all coupons
-        clear_status_update_cache()
-        db.session.commit()
-    else:
-        # Status already updated today - skip expensive operations
-        pass
+    # The coupon cards only need cvv/card_exp out of the deferred detail columns.
+    cards = get_dashboard_cards(
+        current_user.id,
+        limit=current_app.config.get("INDEX_CARDS_LIMIT", DEFAULT_CARDS_LIMIT),
+        options=(undefer(Coupon.cvv), undefer(Coupon.card_exp)),
+    )
+    active_coupons = cards["active"]
+    active_one_time_coupons = cards["active_one_time"]
+    coupons_for_sale = cards["for_sale"]
+    remaining_count = cards["remaining_count"]
+    has_more_coupons = remaining_count > 0
 
     # --------------------------------------------------------------------------------
     # 4. Check "Are there coupons expiring in the next 7 days" + show banner once a day
@@ -359,27 +333,7 @@ def index():
         and current_user.dismissed_expiring_alert_at == date.today()
     )
 
-    # Find coupons expiring in the next week (using already loaded data)
-    one_week_from_now = date.today() + timedelta(days=7)
-    today = date.today()
-    
-    expiring_coupons = []
-    for coupon in all_coupons:
-        if (coupon.status == "פעיל" and 
-            coupon.expiration is not None):
-            
-            # Handle expiration date format
-            exp_date = coupon.expiration
-            if isinstance(exp_date, str):
-                try:
-                    exp_date = datetime.strptime(exp_date, "%Y-%m-%d").date()
-                except ValueError:
-                    continue  # Skip invalid dates
-            elif hasattr(exp_date, 'date'):
-                exp_date = exp_date.date()
-            
-            if today <= exp_date <= one_week_from_now:
-                expiring_coupons.append(coupon)
+    expiring_coupons = get_expiring_coupons(current_user.id, days=7)
 
     # Show alert only if there are relevant coupons and user hasn't dismissed the alert today
     show_expiring_alert = len(expiring_coupons) > 0 and not dismissed_today
@@ -401,52 +355,10 @@ def index():
             company_logo_mapping[company_name] = "images/default.png"
 
     # --------------------------------------------------------------------------------
-    # 6. OPTIMIZED: Database aggregation for company statistics instead of Python loops
+    # 6. Company statistics (already aggregated by get_dashboard_summary)
     # --------------------------------------------------------------------------------
-    from sqlalchemy import case
-    
-    # Single aggregated query for company statistics
-    company_stats_query = db.session.query(
-        Coupon.company,
-        func.count(Coupon.id).label('count'),
-        func.sum(Coupon.value).label('total_value'),
-        func.sum(Coupon.used_value).label('used_value'),
-        func.sum(Coupon.value - Coupon.used_value).label('remaining_value'),
-        func.sum(case((Coupon.value > Coupon.cost, Coupon.value - Coupon.cost), else_=0)).label('savings'),
-        func.sum(case((Coupon.is_one_time == True, 1), else_=0)).label('one_time_count'),
-        func.sum(case((Coupon.is_one_time == False, 1), else_=0)).label('non_one_time_count'),
-        func.min(case((Coupon.status == "פעיל", Coupon.expiration), else_=None)).label('earliest_expiration')
-    ).filter(
-        Coupon.user_id == current_user.id,
-        Coupon.is_for_sale == False,
-        Coupon.exclude_saving != True
-    ).group_by(Coupon.company).all()
-    
-    # Convert query results to dictionaries
-    companies_stats = {}
-    company_earliest_expirations = {}
-    company_coupon_types = {}
-    
-    for stat in company_stats_query:
-        company = stat.company or ""
-        companies_stats[company] = {
-            "total_value": _num(stat.total_value),
-            "used_value": _num(stat.used_value),
-            "remaining_value": _num(stat.remaining_value),
-            "savings": _num(stat.savings),
-            "count": stat.count,
-            "one_time_count": int(stat.one_time_count or 0),
-            "non_one_time_count": int(stat.non_one_time_count or 0),
-        }
-        company_coupon_types[company] = {
-            "one_time": int(stat.one_time_count or 0),
-            "non_one_time": int(stat.non_one_time_count or 0)
-        }
-        
-        # Track earliest expiration
-        if stat.earliest_expiration:
-            company_earliest_expirations[company] = stat.earliest_expiration
-    
+    companies_stats = summary["companies"]
+
     # Sort companies by savings amount
     sorted_companies = sorted(
         companies_stats.items(), key=lambda x: x[1]["savings"], reverse=True
@@ -472,41 +384,7 @@ def index():
         "12": "דצמבר",
     }
 
-    # OPTIMIZED: Simplified monthly timeline processing (avoid PostgreSQL complexity)
-    monthly_data = {}
-    
-    # Use memory processing for monthly data (still much faster than original nested loops)
-    for coupon in all_coupons:
-        if hasattr(coupon, "date_added") and coupon.date_added:
-            month_key = coupon.date_added.strftime("%Y-%m")
-
-            if month_key not in monthly_data:
-                monthly_data[month_key] = {
-                    "savings": 0,
-                    "count": 0,
-                    "original_value": 0,
-                    "remaining_value": 0,
-                    "companies": set(),
-                    "one_time_count": 0,
-                    "non_one_time_count": 0,
-                }
-
-            # Add coupon data to the month
-            monthly_data[month_key]["savings"] += max(
-                0, _num(coupon.value) - _num(coupon.cost)
-            )
-            monthly_data[month_key]["count"] += 1
-            monthly_data[month_key]["original_value"] += _num(coupon.value)
-            monthly_data[month_key]["remaining_value"] += (
-                _num(coupon.value) - _num(coupon.used_value)
-            )
-            monthly_data[month_key]["companies"].add(coupon.company or "")
-
-            # Track coupon type
-            if coupon.is_one_time:
-                monthly_data[month_key]["one_time_count"] += 1
-            else:
-                monthly_data[month_key]["non_one_time_count"] += 1
+    monthly_data = summary["monthly"]
 
     # Convert to sorted list for timeline charts
     timeline_data_formatted = []
@@ -562,21 +440,17 @@ def index():
     # 9. Calculate additional metrics for general statistics
     # --------------------------------------------------------------------------------
 
-    # OPTIMIZED: Use already calculated values instead of loops
-    total_coupons_count = len(all_coupons)
-    active_coupons_count = len(active_coupons) + len(active_one_time_coupons)
+    total_coupons_count = summary["total_coupons_count"]
+    active_coupons_count = summary["active_count"] + summary["active_one_time_count"]
     total_companies_count = len(companies_stats)
 
-    # Calculate average usage percentage using existing totals
     average_usage_percentage = 0
     if total_coupons_value > 0:
-        total_used_value = sum(_num(coupon.used_value) for coupon in all_coupons)
-        average_usage_percentage = (total_used_value / total_coupons_value) * 100
+        average_usage_percentage = (
+            summary["total_used_value"] / total_coupons_value
+        ) * 100
 
-    # Use memory filtering instead of loops for counts
-    one_time_count = len(active_one_time_coupons) + len(
-        [c for c in used_coupons if c.is_one_time]
-    )
+    one_time_count = summary["one_time_count"]
     non_one_time_count = total_coupons_count - one_time_count
 
     # --------------------------------------------------------------------------------
@@ -598,26 +472,19 @@ def index():
 
     # OPTIMIZED: Convert companies data to format for JavaScript with pre-calculated values
     
-    # Pre-calculate active coupons per company to avoid repeated loops
-    active_coupons_by_company = {}
-    for coupon in active_coupons + active_one_time_coupons:
-        company = coupon.company or ""
-        active_coupons_by_company[company] = active_coupons_by_company.get(company, 0) + 1
-    
     sorted_company_data = []
     for company, stats in sorted_companies:
         # Get earliest expiration date for this company
         earliest_expiration = None
-        if company in company_earliest_expirations:
-            exp_date = company_earliest_expirations[company]
-            if exp_date:
-                # Handle both string and date objects
-                if isinstance(exp_date, str):
-                    earliest_expiration = exp_date
-                elif hasattr(exp_date, 'strftime'):
-                    earliest_expiration = exp_date.strftime("%Y-%m-%d")
-                else:
-                    earliest_expiration = str(exp_date)
+        exp_date = stats["earliest_expiration"]
+        if exp_date:
+            # Handle both string and date objects
+            if isinstance(exp_date, str):
+                earliest_expiration = exp_date
+            elif hasattr(exp_date, 'strftime'):
+                earliest_expiration = exp_date.strftime("%Y-%m-%d")
+            else:
+                earliest_expiration = str(exp_date)
 
         # Create company data entry
         sorted_company_data.append(
@@ -630,7 +497,7 @@ def index():
                 "coupons_count": stats["count"],
                 "one_time_count": stats["one_time_count"],
                 "non_one_time_count": stats["non_one_time_count"],
-                "active_coupons": active_coupons_by_company.get(company, 0),
+                "active_coupons": stats["active_coupons"],
                 "usage_percentage": (stats["used_value"] / stats["total_value"] * 100)
                 if stats["total_value"] > 0
                 else 0,
@@ -711,7 +578,6 @@ def index():
         percentage_savings=percentage_savings,
         active_coupons=active_coupons,
         active_one_time_coupons=active_one_time_coupons,
-        used_coupons=used_coupons,
         coupons_for_sale=coupons_for_sale,
         company_logo_mapping=company_logo_mapping,
         # Variables relevant for alerts
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify, current_app
 from flask_login import login_required, current_user
-from app.models import TelegramUser
+from sqlalchemy.orm import undefer
+from app.models import Coupon, TelegramUser
 from app.extensions import db
 import secrets
 from datetime import datetime, timezone, timedelta
@@ -194,7 +195,13 @@ def get_telegram_coupons():
     if not telegram_user:
         return jsonify({'success': False, 'error': 'User not verified'}), 403
     user = telegram_user.user
-    coupons = user.coupons if user else []
+    coupons = (
+        Coupon.query.options(undefer(Coupon.description))
+        .filter_by(user_id=user.id)
+        .all()
+        if user
+        else []
+    )
     def coupon_to_dict(c):
         return {
             'id': c.id,
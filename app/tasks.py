@@ -5,6 +5,7 @@ import os
 import logging
 from datetime import datetime
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import zipfile
 import json
@@ -101,126 +102,141 @@ def enqueue_coupon_status_sync(coupon_ids):
     return task_queue.enqueue(sync_coupon_statuses_task, unique_ids, job_timeout=180)
 
 
-def sync_coupon_statuses_task(coupon_ids):
-    """Background task to update coupon statuses without blocking requests."""
+def reconcile_coupon_statuses_task(coupon_ids=None):
+    """Background task: set-based status reconciliation (all coupons by default)."""
     from app import create_app
     from app.extensions import db
-    from app.helpers import update_coupon_status
-    from app.models import Coupon
+    from app.utils.status_reconciler import reconcile_coupon_statuses
 
     app = create_app()
 
     with app.app_context():
-        updated = 0
         try:
-            coupons = Coupon.query.filter(Coupon.id.in_(coupon_ids)).all()
-            for coupon in coupons:
-                previous_status = coupon.status
-                new_status = update_coupon_status(coupon)
-                if new_status != previous_status:
-                    updated += 1
-
-            if updated:
-                db.session.commit()
-            else:
-                db.session.rollback()
-
+            counts = reconcile_coupon_statuses(coupon_ids=coupon_ids)
             return {
                 'success': True,
-                'updated': updated,
-                'total': len(coupons)
+                'updated': counts['used'] + counts['expired'] + counts['reactivated'],
+                **counts,
             }
         except Exception as exc:
             db.session.rollback()
+            logging.getLogger("status_reconciler").error(
+                f"Coupon status reconciliation failed: {exc}"
+            )
             return {
                 'success': False,
                 'error': str(exc),
-                'total': 0
+                'updated': 0
             }
 
+
+def sync_coupon_statuses_task(coupon_ids):
+    """Background task to update coupon statuses without blocking requests."""
+    return reconcile_coupon_statuses_task(coupon_ids)
+
 def update_coupon_task(coupon_id, max_retries=3):
     """
     Background task to update a single coupon
     """
     from app import create_app
+
+    from app.utils.driver_pool import close_driver_pool
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            return _update_coupon(coupon_id, max_retries)
+        finally:
+            close_driver_pool()
+
+
+def _update_coupon(coupon_id, max_retries=3):
+    """Update a single coupon; must run inside an app context."""
     from app.models import Coupon, CouponUsage
     from app.helpers import get_coupon_data_with_retry, update_coupon_status
     from app.extensions import db
     from datetime import datetime, timezone
+
+    logger = logging.getLogger('multipass_updater')
     
-    app = create_app()
-    
-    with app.app_context():
-        logger = logging.getLogger('multipass_updater')
-        
-        coupon = Coupon.query.get(coupon_id)
-        if not coupon:
-            logger.error(f"Coupon with ID {coupon_id} not found")
-            return {'success': False, 'error': f'Coupon {coupon_id} not found'}
+    coupon = Coupon.query.get(coupon_id)
+    if not coupon:
+        logger.error(f"Coupon with ID {coupon_id} not found")
+        return {'success': False, 'error': f'Coupon {coupon_id} not found'}
 
-        try:
-            logger.info(f"Starting background update for coupon {coupon.code}")
+    try:
+        logger.info(f"Starting background update for coupon {coupon.code}")
+        old_usage = coupon.used_value or 0
+        
+        # Get coupon data with retry mechanism
+        df = get_coupon_data_with_retry(coupon, max_retries=max_retries)
+        
+        if df is not None:
+            # get_coupon_data already set used_value to the SUM over all stored transactions.
+            total_usage = float(coupon.used_value or 0)
+            update_coupon_status(coupon)
             
-            # Get coupon data with retry mechanism
-            df = get_coupon_data_with_retry(coupon, max_retries=max_retries)
+            # Log usage
+            usage = CouponUsage(
+                coupon_id=coupon.id,
+                used_amount=total_usage,
+                timestamp=datetime.now(timezone.utc),
+                action="עדכון אוטומטי",
+                details=f"עדכון רקע - שינוי מ-{old_usage} ל-{total_usage}",
+            )
+            db.session.add(usage)
+            db.session.commit()
             
-            if df is not None:
-                total_usage = float(df["usage_amount"].sum())
-                old_usage = coupon.used_value or 0
-                
-                # Update coupon
-                coupon.used_value = total_usage
-                update_coupon_status(coupon)
-                
-                # Log usage
-                usage = CouponUsage(
-                    coupon_id=coupon.id,
-                    used_amount=total_usage,
-                    timestamp=datetime.now(timezone.utc),
-                    action="עדכון אוטומטי",
-                    details=f"עדכון רקע - שינוי מ-{old_usage} ל-{total_usage}",
-                )
-                db.session.add(usage)
-                db.session.commit()
-                
-                logger.info(f"✅ Background update completed for coupon {coupon.code}")
-                coupon_value = float(coupon.value or 0)
-                return {
-                    'success': True,
-                    'coupon_code': coupon.code,
-                    'company': coupon.company,
-                    'old_usage': old_usage,
-                    'new_usage': total_usage,
-                    'user_id': coupon.user_id,
-                    'coupon_value': coupon_value,
-                    'remaining_value': max(coupon_value - total_usage, 0),
-                }
-            else:
-                logger.error(f"❌ Failed to get data for coupon {coupon.code}")
-                return {
-                    'success': False, 
-                    'error': f'No data returned for coupon {coupon.code}',
-                    'coupon_code': coupon.code,
-                    'company': coupon.company
-                }
-                
-        except Exception as e:
-            logger.error(f"💥 Exception in background task for coupon {coupon_id}: {str(e)}")
-            db.session.rollback()
+            logger.info(f"✅ Background update completed for coupon {coupon.code}")
+            coupon_value = float(coupon.value or 0)
+            return {
+                'success': True,
+                'coupon_code': coupon.code,
+                'company': coupon.company,
+                'old_usage': old_usage,
+                'new_usage': total_usage,
+                'user_id': coupon.user_id,
+                'coupon_value': coupon_value,
+                'remaining_value': max(coupon_value - total_usage, 0),
+            }
+        else:
+            logger.error(f"❌ Failed to get data for coupon {coupon.code}")
             return {
                 'success': False, 
-                'error': str(e),
-                'coupon_id': coupon_id
+                'error': f'No data returned for coupon {coupon.code}',
+                'coupon_code': coupon.code,
+                'company': coupon.company
             }
+            
+    except Exception as e:
+        logger.error(f"💥 Exception in background task for coupon {coupon_id}: {str(e)}")
+        db.session.rollback()
+        return {
+            'success': False, 
+            'error': str(e),
+            'coupon_id': coupon_id
+        }
+    finally:
+        try:
+            if coupon:
+                coupon.last_scraped = datetime.now(timezone.utc)
+                db.session.commit()
+                logger.info(f"Updated last_scraped for coupon {coupon.id}")
+        except Exception as e:
+            logger.error(f"Failed to update last_scraped for coupon {coupon_id}: {e}")
+            db.session.rollback()
+
+
+def _update_coupon_in_worker(app, coupon_id, max_retries):
+    """Run _update_coupon on a pool thread with its own app context and session."""
+    from app.extensions import db
+
+    with app.app_context():
+        try:
+            return _update_coupon(coupon_id, max_retries)
         finally:
-            try:
-                if coupon:
-                    coupon.last_scraped = datetime.now(timezone.utc)
-                    db.session.commit()
-                    logger.info(f"Updated last_scraped for coupon {coupon.id}")
-            except Exception as e:
-                logger.error(f"Failed to update last_scraped for coupon {coupon_id}: {e}")
-                db.session.rollback()
+            db.session.remove()
 
 
 def update_multiple_coupons_task(coupon_ids, max_retries=3, run_id=None):
@@ -228,6 +244,7 @@ def update_multiple_coupons_task(coupon_ids, max_retries=3, run_id=None):
     Background task to update multiple coupons
     """
     from app import create_app
+    from app.utils.driver_pool import close_driver_pool, get_driver_pool
     
     app = create_app()
     
@@ -258,33 +275,66 @@ def update_multiple_coupons_task(coupon_ids, max_retries=3, run_id=None):
             'end_time': None
         }
         
-        for i, coupon_id in enumerate(coupon_ids):
-            logger.info(f"Processing coupon {i+1}/{len(coupon_ids)} (ID: {coupon_id})")
-            
-            try:
-                result = update_coupon_task(coupon_id, max_retries)
-                
-                if result['success']:
-                    results['successful'].append(result)
-                    logger.info(f"✅ Coupon {result['coupon_code']} updated successfully")
-                else:
-                    results['failed'].append(result)
-                    logger.error(f"❌ Failed to update coupon {result.get('coupon_code', coupon_id)}: {result['error']}")
-                    
-            except Exception as e:
-                error_result = {
-                    'success': False,
-                    'error': str(e),
-                    'coupon_id': coupon_id
-                }
-                results['failed'].append(error_result)
-                logger.error(f"💥 Exception processing coupon {coupon_id}: {str(e)}")
-        
+        def record(coupon_id, result):
+            if result['success']:
+                results['successful'].append(result)
+                logger.info(f"✅ Coupon {result['coupon_code']} updated successfully")
+            else:
+                results['failed'].append(result)
+                logger.error(f"❌ Failed to update coupon {result.get('coupon_code', coupon_id)}: {result['error']}")
+
+        def record_exception(coupon_id, e):
+            results['failed'].append({
+                'success': False,
+                'error': str(e),
+                'coupon_id': coupon_id
+            })
+            logger.error(f"💥 Exception processing coupon {coupon_id}: {str(e)}")
+
+        workers = min(app.config.get('AUTO_UPDATE_WORKERS', 1), len(coupon_ids))
+        try:
+            if workers <= 1:
+                for i, coupon_id in enumerate(coupon_ids):
+                    logger.info(f"Processing coupon {i+1}/{len(coupon_ids)} (ID: {coupon_id})")
+                    try:
+                        record(coupon_id, _update_coupon(coupon_id, max_retries))
+                    except Exception as e:
+                        record_exception(coupon_id, e)
+            else:
+                # Scrapes are I/O bound (Chrome does the work), so threads sharing
+                # one app are enough; get_scrape_limiter() caps live browsers.
+                logger.info(f"Running batch with {workers} workers")
+                with ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='coupon-update'
+                ) as executor:
+                    futures = {
+                        executor.submit(_update_coupon_in_worker, app, coupon_id, max_retries): coupon_id
+                        for coupon_id in coupon_ids
+                    }
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        coupon_id = futures[future]
+                        logger.info(f"Finished coupon {done}/{len(coupon_ids)} (ID: {coupon_id})")
+                        try:
+                            record(coupon_id, future.result())
+                        except Exception as e:
+                            record_exception(coupon_id, e)
+        finally:
+            # The horse exits with os._exit, so atexit would never quit these.
+            close_driver_pool()
+
         results['end_time'] = datetime.now().isoformat()
         results['success_count'] = len(results['successful'])
         results['failure_count'] = len(results['failed'])
 
         logger.info(f"Batch update completed: {results['success_count']} successful, {results['failure_count']} failed")
+        from app.utils.multipass_fetchers import get_fetcher_stats
+        from app.utils.scrape_limits import get_scrape_limiter
+        pool = get_driver_pool()
+        logger.info(
+            f"Scraper stats: limiter={get_scrape_limiter().stats()}, "
+            f"driver_pool={pool.stats() if pool else 'disabled'}, "
+            f"fetchers={get_fetcher_stats()}"
+        )
 
         # Update run record (if provided)
         if run_id is not None:
@@ -411,6 +461,39 @@ def enqueue_multiple_coupon_updates(coupon_ids, max_retries=3, run_id=None):
     return job
 
 
+def send_newsletter_task(newsletter_id, user_ids=None, mark_sent=False):
+    """Background task: queue a newsletter for its subscribers in resumable chunks."""
+    from app import create_app
+    from app.extensions import db
+    from app.utils.newsletter_dispatch import dispatch_newsletter
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            return {'success': True, **dispatch_newsletter(newsletter_id, user_ids=user_ids, mark_sent=mark_sent)}
+        except Exception as exc:
+            db.session.rollback()
+            logging.getLogger("newsletter_dispatch").error(
+                f"Newsletter {newsletter_id} dispatch failed: {exc}"
+            )
+            raise
+
+
+def enqueue_newsletter_dispatch(newsletter_id, user_ids=None, mark_sent=False):
+    """
+    Enqueue a newsletter send; a failed or interrupted job can simply be
+    enqueued again and continues where it stopped.
+    """
+    return task_queue.enqueue(
+        send_newsletter_task,
+        newsletter_id,
+        user_ids,
+        mark_sent,
+        job_timeout='2h'
+    )
+
+
 def get_job_status(job_id):
     """
     Get the status of a background job
@@ -742,16 +825,15 @@ def trigger_multipass_github_action(coupon_codes):
             'end_time': None
         }
         
-        # Pre-fetch coupons to handle EncryptedString lookup issue
-        # We cannot use filter_by(code=code) because code is encrypted in DB.
-        potential_coupons = Coupon.query.filter(
-            Coupon.auto_download_details == 'Multipass',
-            Coupon.status == 'פעיל'
-        ).all()
-        
-        # Create a map of decrypted code -> coupon object
-        # Accessing c.code triggers decryption
-        db_coupon_map = {c.code: c for c in potential_coupons}
+        # Resolve all artifact codes with one indexed query on the code_hash
+        # blind index (code itself is encrypted and can't be matched in SQL).
+        db_coupon_map = Coupon.find_by_codes(
+            transaction_data_map.keys(),
+            query=Coupon.query.filter(
+                Coupon.auto_download_details == 'Multipass',
+                Coupon.status == 'פעיל'
+            ),
+        )
 
         for failure in github_failures:
             code = failure.get("card_number") or failure.get("coupon_code") or "unknown"
@@ -760,14 +842,8 @@ def trigger_multipass_github_action(coupon_codes):
             failed_count += 1
 
         for code, transactions in transaction_data_map.items():
-            # coupon = Coupon.query.filter_by(code=code).first() # This fails due to encryption
+            # The blind index normalizes whitespace, so " 123 " matches "123"
             coupon = db_coupon_map.get(code)
-            
-            if not coupon:
-                # Try fuzzy matching or stripping whitespace if direct match fails
-                # e.g. " 123 " vs "123"
-                normalized_code = code.strip()
-                coupon = db_coupon_map.get(normalized_code)
                 
             if not coupon:
                 logger.warning(f"Coupon with code {code} not found in DB map during update.")
@@ -0,0 +1,226 @@
+# app/utils/async_db_pool.py
+"""
+מאגר חיבורי asyncpg משותף לבוט הטלגרם.
+
+עד עכשיו כל פונקציה בבוט פתחה asyncpg.connect חדש (TLS + אימות מול Postgres)
+וסגרה אותו בסוף, כך שהודעה אחת פתחה שלושה-ארבעה חיבורים. כאן נוצר מאגר אחד
+ללולאת ה-asyncio של הבוט (בעלייה, או בשימוש הראשון), עם גודל מינימלי/מקסימלי
+וזמן המתנה מוגדרים, ומונים של זמני ההמתנה לחיבור.
+
+PooledConnection מחזיק חיבור מושאל: close() מחזיר אותו למאגר במקום לנתק,
+כך שקוד קיים בסגנון conn = await ...; await conn.close() ממשיך לעבוד כמו שהוא.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Acquires slower than this are logged; they mean the pool is too small.
+SLOW_ACQUIRE_SECONDS = 0.5
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def asyncpg_database_url(database_url=None):
+    """DATABASE_URL without the SQLAlchemy driver suffix, as asyncpg expects."""
+    database_url = database_url or os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set")
+    if database_url.startswith("postgresql+psycopg2://"):
+        database_url = database_url.replace("postgresql+psycopg2://", "postgresql://", 1)
+    return database_url
+
+
+class PooledConnection:
+    """
+    A connection borrowed from an AsyncConnectionPool. Everything but close()
+    goes to the asyncpg connection; close() returns it to the pool. A wrapper
+    dropped without close() (an exception between acquire and close) still
+    hands its connection back when it is garbage collected.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def raw_connection(self):
+        return self._conn
+
+    async def close(self):
+        if self._released:
+            return
+        self._released = True
+        await self._pool.release(self._conn)
+
+    def is_closed(self):
+        return self._released or self._conn.is_closed()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __del__(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool.release_later(self._conn)
+
+
+class AsyncConnectionPool:
+    """
+    Lazily created asyncpg pool bound to the event loop it was created on.
+    If the bot's loop is replaced (e.g. run_until_complete at startup and a
+    new loop for polling), the next acquire builds a fresh pool on that loop.
+    """
+
+    def __init__(self, database_url=None, min_size=None, max_size=None,
+                 acquire_timeout=None, create_pool=None):
+        self.database_url = database_url
+        self.min_size = min_size if min_size is not None else _env_int("TELEGRAM_DB_POOL_MIN_SIZE", 1)
+        self.max_size = max_size if max_size is not None else _env_int("TELEGRAM_DB_POOL_MAX_SIZE", 10)
+        self.max_size = max(self.max_size, self.min_size, 1)
+        self.acquire_timeout = (
+            acquire_timeout if acquire_timeout is not None
+            else _env_float("TELEGRAM_DB_POOL_ACQUIRE_TIMEOUT", 10.0)
+        )
+        self._create_pool = create_pool
+        self._pool = None
+        self._loop = None
+        self._lock = None
+        self.acquires = 0
+        self.timeouts = 0
+        self.slow_acquires = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def _new_pool(self):
+        if self._create_pool is not None:
+            return await self._create_pool(
+                min_size=self.min_size, max_size=self.max_size
+            )
+        import asyncpg
+
+        return await asyncpg.create_pool(
+            asyncpg_database_url(self.database_url),
+            min_size=self.min_size,
+            max_size=self.max_size,
+            # pgbouncer in transaction mode cannot keep prepared statements
+            statement_cache_size=0,
+        )
+
+    async def open(self):
+        """Creates the pool on the running loop if it does not exist there yet."""
+        loop = asyncio.get_running_loop()
+        if self._pool is not None and self._loop is loop:
+            return self._pool
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            # A pool from another (possibly closed) loop cannot be used here.
+            self._pool = None
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await self._new_pool()
+                logger.info(
+                    "Opened asyncpg pool (min=%d, max=%d, acquire timeout=%.1fs)",
+                    self.min_size, self.max_size, self.acquire_timeout,
+                )
+        return self._pool
+
+    async def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            try:
+                await pool.close()
+            except Exception as e:
+                logger.warning(f"Error closing asyncpg pool: {e}")
+
+    async def connection(self):
+        """A PooledConnection; close() it (or use async with) to give it back."""
+        pool = await self.open()
+        started = time.monotonic()
+        try:
+            conn = await pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(
+                "Timed out after %.1fs waiting for a database connection (%s)",
+                self.acquire_timeout, self.stats(),
+            )
+            raise
+        waited = time.monotonic() - started
+        self.acquires += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        if waited >= SLOW_ACQUIRE_SECONDS:
+            self.slow_acquires += 1
+            logger.warning("Waited %.2fs for a database connection", waited)
+        return PooledConnection(self, conn)
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self.connection()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    async def release(self, conn):
+        pool = self._pool
+        if pool is None:
+            # The pool was closed or replaced; just drop the connection.
+            try:
+                await conn.close()
+            except Exception:
+                pass
+            return
+        try:
+            await pool.release(conn)
+        except Exception as e:
+            logger.warning(f"Error releasing database connection: {e}")
+
+    def release_later(self, conn):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        logger.warning("Database connection was not closed; returning it to the pool")
+        try:
+            loop.call_soon_threadsafe(lambda: loop.create_task(self.release(conn)))
+        except RuntimeError:
+            pass
+
+    def stats(self):
+        pool = self._pool
+        return {
+            "size": pool.get_size() if pool is not None else 0,
+            "idle": pool.get_idle_size() if pool is not None else 0,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "acquires": self.acquires,
+            "timeouts": self.timeouts,
+            "slow_acquires": self.slow_acquires,
+            "avg_wait_ms": round(1000 * self.total_wait / self.acquires, 2) if self.acquires else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 2),
+        }
@@ -0,0 +1,330 @@
+# app/utils/company_index.py
+"""
+אינדקס שמות חברות בזיכרון, משותף לכל מי שמזהה חברה מטקסט חופשי.
+
+find_matching_company, parse_user_usage_text, extract_coupon_detail_sms והבוט
+בטלגרם טענו בכל קריאה את כל טבלת החברות והריצו fuzzy מול כולה. כאן הרשימה
+נטענת פעם אחת לכל תהליך: לכל חברה נשמר מפתח מנורמל (עברית/אנגלית, בלי ניקוד,
+אותיות סופיות, מספרים ומילות קישור), מפת כינויים ואינדקס n-gram, כך שהתאמה
+בודקת רק את המועמדים הקרובים. האינדקס נבנה מחדש כשהגרסה המשותפת (ב-cache)
+מתקדמת - אחרי כל שינוי בטבלת companies.
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter
+
+from fuzzywuzzy import fuzz
+
+logger = logging.getLogger(__name__)
+
+COMPANY_INDEX_VERSION_KEY = "company_index_version"
+# How often a process looks at the shared version; local changes apply at once.
+COMPANY_INDEX_CHECK_SECONDS = 5
+# An index this old is rebuilt once on a miss, to pick up rows written outside
+# the ORM (e.g. the Telegram bot's asyncpg inserts).
+COMPANY_INDEX_MISS_REFRESH_SECONDS = 60
+MATCH_THRESHOLD = 80
+CANDIDATE_LIMIT = 30
+NGRAM_SIZE = 3
+# Free-text prefiltering (prompt_companies): how many companies to send, the
+# score a mention needs for the short list to be trusted, and the longest
+# company name (in words) to look for.
+PROMPT_TOP_K = 15
+PROMPT_CONFIDENCE = 85
+MAX_NAME_WORDS = 3
+
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+_CURRENCY_RE = re.compile(r"₪|ש״ח|ש\"ח|שח")
+_STOPWORDS_RE = re.compile(
+    r"\b(קופון|שובר|ל|של|עם|כרטיס|גיפט|gift|card)\b", flags=re.IGNORECASE
+)
+_NON_WORD_RE = re.compile(r"[^\w\s]|_")
+# One-letter Hebrew prefixes glued to a name in running text ("בקרפור", "ווולט").
+_HEBREW_PREFIXES = "בלומהש"
+
+# Common spelling -> canonical spelling. Both sides are normalized into
+# _ALIASES and resolved against the index, so an alias only matches when the
+# company actually exists.
+COMPANY_ALIASES = {
+    "דרים קארד": "dream card",
+    "מקדונלדס": "mcdonalds",
+    "מקדונלד": "מקדונלדס",
+    "מקדונלדז": "מקדונלדס",
+    "בורגר קינג": "burger king",
+    "פיצה האט": "pizza hut",
+    "דומינוס": "dominos",
+    "קפה קפה": "cafe cafe",
+    "רולדין": "roladin",
+    "roladin": "רולדין",
+    "קרפור": "carrefour",
+    "סופר סל": "שופרסל",
+    "גוד פארם": "goodpharm",
+    "פרי פיט": "freefit",
+    "ביי מי": "buyme",
+    "וולט": "wolt",
+}
+
+
+def normalize_company_name(text):
+    """Lowercase, drop niqqud/punctuation/digits/currency/filler words, unify final letters."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _CURRENCY_RE.sub(" ", text.lower())
+    text = re.sub(r"\d+", " ", text)
+    text = _STOPWORDS_RE.sub(" ", text)
+    text = _NON_WORD_RE.sub(" ", text)
+    return " ".join(text.translate(_FINAL_LETTERS).split())
+
+
+_ALIASES = {normalize_company_name(alias): normalize_company_name(target)
+            for alias, target in COMPANY_ALIASES.items()}
+
+
+def _grams(key):
+    compact = f" {key.replace(' ', '')} "
+    if len(compact) <= NGRAM_SIZE:
+        return {compact}
+    return {compact[i:i + NGRAM_SIZE] for i in range(len(compact) - NGRAM_SIZE + 1)}
+
+
+def _window_score(a, b):
+    # No partial_ratio here: a short window is a substring of too many names.
+    return max(fuzz.ratio(a, b), fuzz.token_sort_ratio(a, b))
+
+
+def _fuzzy_score(a, b):
+    return max(
+        fuzz.ratio(a, b),
+        fuzz.partial_ratio(a, b),
+        fuzz.token_sort_ratio(a, b),
+        fuzz.token_set_ratio(a, b),
+    )
+
+
+class CompanyIndex:
+    """Immutable snapshot of the company names with exact, alias and n-gram lookups."""
+
+    def __init__(self, names, version=None):
+        self.names = sorted({name for name in names if name})
+        self.version = version
+        self.built_at = time.monotonic()
+        self._by_key = {}
+        self._by_lower = {}
+        self._keys = {}
+        self._grams = {}
+        self._short = []
+        for name in self.names:
+            key = normalize_company_name(name) or name.lower()
+            self._by_key.setdefault(key, name)
+            self._by_key.setdefault(key.replace(" ", ""), name)
+            self._by_lower.setdefault(name.lower(), name)
+            self._keys[name] = key
+            grams = _grams(key)
+            if len(key.replace(" ", "")) < NGRAM_SIZE:
+                self._short.append(name)
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(name)
+        self._gram_counts = {name: len(_grams(key)) for name, key in self._keys.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lower_map(self):
+        """{name.lower(): name}, as the GPT prompts expect."""
+        return dict(self._by_lower)
+
+    def exact(self, text):
+        """The company whose normalized name (or alias) equals text's, else None."""
+        key = normalize_company_name(text)
+        if not key:
+            return None
+        for candidate in (key, _ALIASES.get(key)):
+            if candidate:
+                name = self._by_key.get(candidate) or self._by_key.get(candidate.replace(" ", ""))
+                if name:
+                    return name
+        return None
+
+    def candidates(self, text, limit=CANDIDATE_LIMIT):
+        """Names sharing the most n-grams with text (by containment), best first."""
+        query = _grams(normalize_company_name(text) or str(text).lower())
+        shared = Counter()
+        for gram in query:
+            for name in self._grams.get(gram, ()):
+                shared[name] += 1
+        ranked = sorted(
+            shared,
+            key=lambda name: (
+                -max(shared[name] / self._gram_counts[name], shared[name] / len(query)),
+                name,
+            ),
+        )
+        result = ranked[:limit]
+        result.extend(name for name in self._short if name not in shared)
+        return result
+
+    def scored(self, text, scorer=_fuzzy_score, min_score=0, limit=CANDIDATE_LIMIT):
+        """
+        [(name, score)] for the n-gram candidates, best first. Raw lowercase
+        text is scored against the raw lowercase name, and the normalized text
+        (and its alias) against the normalized name; the higher score wins.
+        """
+        raw = str(text).lower()
+        key = normalize_company_name(text)
+        keys = [k for k in (key, _ALIASES.get(key)) if k]
+
+        results = []
+        for name in self.candidates(text, limit=limit):
+            scores = [scorer(raw, name.lower())] if raw.strip() else [0]
+            scores.extend(scorer(k, self._keys[name]) for k in keys)
+            score = max(scores)
+            if score >= min_score:
+                results.append((name, score))
+        results.sort(key=lambda item: -item[1])
+        return results
+
+    def text_candidates(self, text, k=PROMPT_TOP_K):
+        """
+        [(name, score)] for the k companies most likely mentioned anywhere in
+        a free text, best first. Every window of 1..MAX_NAME_WORDS words is
+        matched exactly/by alias (100) and fuzzily against its n-gram candidates,
+        with and without a leading Hebrew prefix letter.
+        """
+        words = normalize_company_name(text).split()
+        best = {}
+        for size in range(1, MAX_NAME_WORDS + 1):
+            for start in range(len(words) - size + 1):
+                window = " ".join(words[start:start + size])
+                variants = [window]
+                if window[0] in _HEBREW_PREFIXES:
+                    variants.append(window[1:])
+                for variant in variants:
+                    if len(variant.replace(" ", "")) < 2:
+                        continue
+                    hits = [(self.exact(variant), 100)]
+                    hits.extend(self.scored(variant, scorer=_window_score, limit=5))
+                    for name, score in hits:
+                        if name and score > best.get(name, 0):
+                            best[name] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+    def prompt_companies(self, text, k=PROMPT_TOP_K, min_confidence=PROMPT_CONFIDENCE):
+        """
+        (names, narrowed): the top-k companies for a GPT prompt about text, or
+        every company when no mention reaches min_confidence (narrowed=False).
+        """
+        ranked = self.text_candidates(text, k)
+        if len(self.names) <= k or not ranked or ranked[0][1] < min_confidence:
+            return list(self.names), False
+        return [name for name, _ in ranked], True
+
+    def match(self, text, threshold=MATCH_THRESHOLD):
+        """(name, score) of the best match at or above threshold, else (None, best_score)."""
+        name = self.exact(text)
+        if name:
+            return name, 100
+        scored = self.scored(text)
+        if scored and scored[0][1] >= threshold:
+            return scored[0]
+        return None, scored[0][1] if scored else 0
+
+
+# ---------------------------------------------------------------------------
+# Process-wide index for the Flask app
+# ---------------------------------------------------------------------------
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _shared_version():
+    from app.extensions import cache
+
+    try:
+        return cache.get(COMPANY_INDEX_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not read company index version: {e}")
+        return None
+
+
+def _build(version):
+    from app.extensions import db
+    from app.models import Company
+
+    names = [row[0] for row in db.session.query(Company.name).all()]
+    index = CompanyIndex(names, version=version)
+    logger.info("Built company index with %d companies (version %s)", len(index), version)
+    return index
+
+
+def get_company_index(force=False):
+    """The current CompanyIndex, rebuilt when the shared version moved on."""
+    global _index, _checked_at
+    now = time.monotonic()
+    if not force and _index is not None and now - _checked_at < COMPANY_INDEX_CHECK_SECONDS:
+        return _index
+    with _lock:
+        version = _shared_version()
+        _checked_at = now
+        if force or _index is None or _index.version != version:
+            _index = _build(version)
+        return _index
+
+
+def bump_company_index_version():
+    """Marks every process's company index as stale; call after changing companies."""
+    global _index
+    from app.extensions import cache
+
+    try:
+        cache.set(COMPANY_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception as e:
+        logger.warning(f"Could not bump company index version: {e}")
+    with _lock:
+        _index = None
+
+
+def match_company(text, threshold=MATCH_THRESHOLD):
+    """
+    (name, score) for text against the company index. On a miss, an index
+    older than COMPANY_INDEX_MISS_REFRESH_SECONDS is rebuilt once first.
+    """
+    index = get_company_index()
+    name, score = index.match(text, threshold)
+    if name is None and time.monotonic() - index.built_at > COMPANY_INDEX_MISS_REFRESH_SECONDS:
+        name, score = get_company_index(force=True).match(text, threshold)
+    return name, score
+
+
+def _register_listeners():
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    from app.models import Company
+
+    def _mark(mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info["company_index_dirty"] = True
+
+    for name in ("after_insert", "after_update", "after_delete"):
+        event.listen(Company, name, _mark)
+
+    @event.listens_for(Session, "after_commit")
+    def _bump_after_commit(session):
+        if session.info.pop("company_index_dirty", False):
+            bump_company_index_version()
+
+    @event.listens_for(Session, "after_soft_rollback")
+    def _discard(session, previous_transaction):
+        session.info.pop("company_index_dirty", None)
+
+
+_register_listeners()
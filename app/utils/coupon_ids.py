@@ -0,0 +1,214 @@
+# app/utils/coupon_ids.py
+"""
+הקצאת מזהי קופונים בבלוקים.
+
+במקום להגריל מזהה ולבדוק ב-SELECT אם הוא פנוי (שאילתה אחת או יותר לכל קופון),
+כל תהליך שומר לעצמו בלוק של מספרים רצים מ-sequence משותף (nextval ב-Postgres,
+טבלת מונה בשאר המסדים), וכל מספר רץ עובר פרמוטציה מפותחת (Feistel עם HMAC)
+לתוך טווח המזהים. כך המזהים לא עוקבים ולא ניתנים לניחוש, שני תהליכים לא
+יקבלו אותו מזהה, והקצאה היא O(1) בלי שאילתה לכל קופון - רק שאילתה אחת לבלוק.
+
+המזהים החדשים נמצאים בטווח נפרד מהמזהים האקראיים הישנים (1000-10000),
+ובכל זאת כל בלוק נבדק פעם אחת מול הטבלה ומזהים תפוסים מדולגים.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+COUPON_ID_OFFSET = 100_000
+COUPON_ID_BITS = 24  # 16.7M IDs above the offset, still inside a 32-bit INTEGER
+COUPON_ID_SPACE = 1 << COUPON_ID_BITS
+COUPON_ID_SEQUENCE = "coupon_id_block_seq"
+COUPON_ID_COUNTER_NAME = "coupon"
+# Block number -> ID range must agree across all processes, so this is a
+# constant rather than a setting.
+COUPON_ID_BLOCK_SIZE = 64
+
+_HALF_BITS = COUPON_ID_BITS // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def coupon_id_key():
+    """
+    Permutation key shared by every process (web, workers, Telegram bot).
+    Derived from ENCRYPTION_KEY unless COUPON_ID_KEY is set, like CODE_HASH_KEY.
+    """
+    explicit = os.environ.get("COUPON_ID_KEY")
+    if explicit:
+        return explicit.encode()
+    return hashlib.sha256(
+        b"coupon-id-permutation:" + os.environ.get("ENCRYPTION_KEY", "").encode()
+    ).digest()
+
+
+def permute_coupon_id(n, key):
+    """Maps sequence number n (0 <= n < COUPON_ID_SPACE) to a coupon ID, bijectively."""
+    if not 0 <= n < COUPON_ID_SPACE:
+        raise RuntimeError("Coupon ID space exhausted")
+    left, right = n >> _HALF_BITS, n & _HALF_MASK
+    for round_no in range(_ROUNDS):
+        digest = hmac.new(
+            key, bytes((round_no,)) + right.to_bytes(4, "big"), hashlib.sha256
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:4], "big") & _HALF_MASK)
+    return COUPON_ID_OFFSET + ((left << _HALF_BITS) | right)
+
+
+def block_coupon_ids(block_no, block_size, key):
+    """The coupon IDs of block number block_no (1-based, as nextval returns)."""
+    start = (block_no - 1) * block_size
+    return [permute_coupon_id(n, key) for n in range(start, start + block_size)]
+
+
+class CouponIdAllocator:
+    """
+    Hands out IDs from blocks reserved through `reserve_block()` (returns the
+    next block number) and filtered through `taken_ids(ids)` (returns the ones
+    already used). Both are called once per block, never per ID.
+
+    Async callers (the Telegram bot) pass no callbacks and feed blocks
+    themselves: while needs_block(), add_block(block_no, taken), then take().
+    """
+
+    def __init__(self, reserve_block=None, taken_ids=None, block_size=COUPON_ID_BLOCK_SIZE, key=None):
+        self._reserve_block = reserve_block
+        self._taken_ids = taken_ids
+        self.block_size = block_size
+        self._key = key
+        self._ids = deque()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.blocks_reserved = 0
+
+    def block_ids(self, block_no):
+        if self._key is None:
+            self._key = coupon_id_key()
+        return block_coupon_ids(block_no, self.block_size, self._key)
+
+    def add_block(self, block_no, taken=()):
+        ids = self.block_ids(block_no)
+        taken = set(taken)
+        if taken:
+            logger.warning("Skipping %d coupon IDs already in use in block %s", len(taken), block_no)
+        with self._lock:
+            self._ids.extend(i for i in ids if i not in taken)
+            self.blocks_reserved += 1
+
+    def needs_block(self, count=1):
+        with self._lock:
+            # A forked worker must not reuse the IDs its parent had buffered.
+            if self._pid != os.getpid():
+                self._ids.clear()
+                self._pid = os.getpid()
+            return len(self._ids) < count
+
+    def take(self, count=1):
+        with self._lock:
+            if len(self._ids) < count:
+                raise RuntimeError("Not enough reserved coupon IDs")
+            return [self._ids.popleft() for _ in range(count)]
+
+    def next_ids(self, count):
+        while self.needs_block(count):
+            block_no = self._reserve_block()
+            self.add_block(block_no, self._taken_ids(self.block_ids(block_no)))
+        return self.take(count)
+
+    def next_id(self):
+        return self.next_ids(1)[0]
+
+
+# ---------------------------------------------------------------------------
+# SQLAlchemy-backed allocator for the Flask app / RQ workers
+# ---------------------------------------------------------------------------
+_allocator = None
+_allocator_lock = threading.Lock()
+# Highest block this process took from the counter table; keeps a rolled-back
+# reservation from being handed out twice (see _reserve_block_from_table).
+_table_floor = 0
+
+
+def _reserve_block_from_sequence():
+    from app.extensions import db
+
+    return db.session.execute(db.text(f"SELECT nextval('{COUPON_ID_SEQUENCE}')")).scalar_one()
+
+
+def _reserve_block_from_table():
+    """
+    Fallback for databases without sequences (SQLite in dev/tests). The counter
+    row is bumped on the session's own connection, so a rollback can undo it;
+    the in-process floor makes sure we never go backwards.
+    """
+    global _table_floor
+    from sqlalchemy import case, select, update
+
+    from app.extensions import db
+    from app.models import coupon_id_blocks
+    from app.utils.db_utils import insert_ignore_conflicts
+
+    counter = coupon_id_blocks.c.next_block
+    insert_ignore_conflicts(
+        coupon_id_blocks,
+        [{"name": COUPON_ID_COUNTER_NAME, "next_block": 0}],
+        index_elements=["name"],
+    )
+    db.session.execute(
+        update(coupon_id_blocks)
+        .where(coupon_id_blocks.c.name == COUPON_ID_COUNTER_NAME)
+        .values(next_block=case((counter < _table_floor, _table_floor), else_=counter) + 1)
+    )
+    block_no = db.session.execute(
+        select(counter).where(coupon_id_blocks.c.name == COUPON_ID_COUNTER_NAME)
+    ).scalar_one()
+    _table_floor = block_no
+    return block_no
+
+
+def _reserve_block():
+    from app.extensions import db
+
+    with db.session.no_autoflush:
+        if db.session.get_bind().dialect.name == "postgresql":
+            return _reserve_block_from_sequence()
+        return _reserve_block_from_table()
+
+
+def _taken_ids(ids):
+    from app.extensions import db
+
+    with db.session.no_autoflush:
+        rows = db.session.execute(
+            db.text("SELECT id FROM coupon WHERE id IN :ids").bindparams(
+                db.bindparam("ids", expanding=True)
+            ),
+            {"ids": list(ids)},
+        )
+        return {row[0] for row in rows}
+
+
+def get_coupon_id_allocator():
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = CouponIdAllocator(_reserve_block, _taken_ids)
+    return _allocator
+
+
+def allocate_coupon_id():
+    """A fresh coupon ID; queries the database only when a new block is needed."""
+    return get_coupon_id_allocator().next_id()
+
+
+def allocate_coupon_ids(count):
+    """`count` fresh coupon IDs, for bulk inserts."""
+    if count <= 0:
+        return []
+    return get_coupon_id_allocator().next_ids(count)
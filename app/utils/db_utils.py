@@ -21,3 +21,33 @@ def safe_commit() -> bool:
         logger.exception("db.session.commit() failed; rolling back")
         db.session.rollback()
         return False
+
+
+def dialect_insert(table):
+    """
+    מחזיר insert() של הדיאלקט הפעיל (PostgreSQL בפרודקשן, SQLite בטסטים),
+    כדי שאפשר יהיה להשתמש ב-ON CONFLICT.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT is not supported for dialect {dialect!r}")
+    return insert(table)
+
+
+def insert_ignore_conflicts(table, rows, index_elements, chunk_size=1000):
+    """
+    INSERT ... ON CONFLICT (index_elements) DO NOTHING במנות.
+    מחזיר את מספר השורות שנוספו בפועל.
+    """
+    inserted = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        stmt = dialect_insert(table).values(chunk).on_conflict_do_nothing(
+            index_elements=index_elements
+        )
+        inserted += db.session.execute(stmt).rowcount or 0
+    return inserted
@@ -0,0 +1,266 @@
+# app/utils/driver_pool.py
+"""
+מאגר דרייברים חמים של Chrome לגריפת יתרות.
+
+פתיחת Chrome היא רוב זמן העדכון של קופון. המאגר שומר מספר קטן של דרייברים
+פתוחים לכל אתר, מנקה עוגיות ואחסון בין קופונים, וממחזר דרייבר אחרי N שימושים,
+אחרי זמן סרק ארוך או כשהוא קורס. גודל המאגר צמוד ל-SCRAPER_MAX_CHROME, כך
+שמספר הדפדפנים החיים לא עולה על המגבלה של get_scrape_limiter().
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from app.utils.scrape_limits import _env_int
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledDriver:
+    __slots__ = ("driver", "cleanup", "site", "uses", "created_at", "last_used_at")
+
+    def __init__(self, driver, cleanup, site):
+        self.driver = driver
+        self.cleanup = cleanup
+        self.site = site
+        self.uses = 0
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+class DriverLease:
+    """
+    A driver reserved for one coupon. The driver itself is created (or taken
+    from the pool) only on the first get(), because the Chrome options are
+    built by the scraper for the specific site.
+    """
+
+    def __init__(self, pool, site):
+        self._pool = pool
+        self.site = site
+        self._entry = None
+        self.broken = False
+
+    def get(self, factory):
+        """factory() -> (driver, cleanup), same contract as _create_chrome_driver."""
+        if self._entry is None:
+            self._entry = self._pool._checkout(self.site, factory)
+        return self._entry.driver
+
+    def discard(self):
+        """Retire the driver instead of returning it to the pool."""
+        self.broken = True
+
+
+class ChromeDriverPool:
+    def __init__(self, max_size, max_uses=20, max_idle_seconds=300):
+        self.max_size = max_size
+        self.max_uses = max_uses
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = {}
+        self._leased = 0
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    # ---- leasing ----
+    @contextmanager
+    def lease(self, site):
+        lease = DriverLease(self, (site or "unknown").lower())
+        try:
+            yield lease
+        except BaseException:
+            lease.broken = True
+            raise
+        finally:
+            if lease._entry is not None:
+                self._checkin(lease._entry, broken=lease.broken)
+
+    def _checkout(self, site, factory):
+        stale = []
+        entry = None
+        with self._lock:
+            stale.extend(self._pop_expired())
+            idle = self._idle.get(site)
+            if idle:
+                entry = idle.pop()
+                self._counters["reused"] += 1
+            else:
+                if self._live() >= self.max_size:
+                    victim = self._pop_oldest_idle()
+                    if victim is not None:
+                        stale.append((victim, "evicted"))
+            self._leased += 1
+
+        for old, reason in stale:
+            self._retire(old, reason)
+
+        if entry is not None and not self._is_alive(entry.driver):
+            self._retire(entry, "crashed")
+            entry = None
+
+        if entry is None:
+            try:
+                driver, cleanup = factory()
+            except BaseException:
+                with self._lock:
+                    self._leased -= 1
+                raise
+            entry = _PooledDriver(driver, cleanup, site)
+            with self._lock:
+                self._counters["created"] += 1
+
+        entry.uses += 1
+        with self._lock:
+            self._counters["leases"] += 1
+        return entry
+
+    def _checkin(self, entry, broken=False):
+        entry.last_used_at = time.monotonic()
+        reason = None
+        if broken:
+            reason = "crashed"
+        elif entry.uses >= self.max_uses:
+            reason = "max_uses"
+        elif not self._reset(entry.driver):
+            reason = "crashed"
+
+        with self._lock:
+            self._leased -= 1
+            if reason is None:
+                if self._live() < self.max_size:
+                    self._idle.setdefault(entry.site, []).append(entry)
+                else:
+                    reason = "evicted"
+        if reason is not None:
+            self._retire(entry, reason)
+
+    # ---- driver housekeeping ----
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        """Clear cookies and storage so the next coupon starts from a clean session."""
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            try:
+                driver.execute_script(
+                    "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+                )
+                driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+                driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin", {"origin": "*", "storageTypes": "all"}
+                )
+            except Exception as e:
+                logger.debug("CDP storage reset failed, falling back to cookies only: %s", e)
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            logger.warning("Chrome driver reset failed, retiring it: %s", e)
+            return False
+
+    def _retire(self, entry, reason):
+        with self._lock:
+            self._counters[f"retired_{reason}"] += 1
+        try:
+            entry.driver.quit()
+        except Exception:
+            pass
+        if entry.cleanup:
+            try:
+                entry.cleanup()
+            except Exception:
+                pass
+        logger.debug("Retired %s driver after %d uses (%s)", entry.site, entry.uses, reason)
+
+    def _live(self):
+        return self._leased + sum(len(v) for v in self._idle.values())
+
+    def _pop_expired(self):
+        if not self.max_idle_seconds:
+            return []
+        cutoff = time.monotonic() - self.max_idle_seconds
+        expired = []
+        for site, entries in self._idle.items():
+            keep = [e for e in entries if e.last_used_at >= cutoff]
+            expired.extend((e, "idle") for e in entries if e.last_used_at < cutoff)
+            self._idle[site] = keep
+        return expired
+
+    def _pop_oldest_idle(self):
+        oldest_site = None
+        oldest = None
+        for site, entries in self._idle.items():
+            if entries and (oldest is None or entries[0].last_used_at < oldest.last_used_at):
+                oldest_site, oldest = site, entries[0]
+        if oldest is not None:
+            self._idle[oldest_site].pop(0)
+        return oldest
+
+    def close_all(self):
+        with self._lock:
+            entries = [e for v in self._idle.values() for e in v]
+            self._idle = {}
+        for entry in entries:
+            self._retire(entry, "closed")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "max_uses": self.max_uses,
+                "leased": self._leased,
+                "idle": {site: len(v) for site, v in self._idle.items() if v},
+                **dict(self._counters),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_driver_pool():
+    """
+    מחזיר את מאגר הדרייברים של התהליך, או None אם SCRAPER_DRIVER_POOL=0.
+    SCRAPER_DRIVER_MAX_USES - מספר קופונים לדרייבר לפני מחזור (ברירת מחדל 20).
+    SCRAPER_DRIVER_IDLE_SECONDS - זמן סרק מקסימלי לדרייבר במאגר (ברירת מחדל 300).
+    """
+    global _pool
+    if os.getenv("SCRAPER_DRIVER_POOL", "1").lower() in ("0", "false", "no", "off"):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ChromeDriverPool(
+                    max_size=_env_int("SCRAPER_MAX_CHROME", 3),
+                    max_uses=_env_int("SCRAPER_DRIVER_MAX_USES", 20),
+                    max_idle_seconds=_env_int("SCRAPER_DRIVER_IDLE_SECONDS", 300),
+                )
+                atexit.register(_pool.close_all)
+    return _pool
+
+
+def close_driver_pool():
+    """
+    Quits the idle drivers of this process's pool, if one was created.
+
+    Jobs that scrape must call this when they finish: RQ work horses exit with
+    os._exit, so the atexit hook never runs there and the Chrome/chromedriver
+    processes (and their temp profiles) would outlive the job.
+    """
+    if _pool is not None:
+        _pool.close_all()
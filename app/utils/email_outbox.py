@@ -0,0 +1,463 @@
+# app/utils/email_outbox.py
+"""
+שליחת מיילים דרך Brevo: לקוח HTTP אחד לכל תהליך ותור email_outbox.
+
+send_html_email בנה Configuration, ApiClient ו-TransactionalEmailsApi חדשים לכל
+מייל ושלח בתוך הבקשה/ה-job. כאן:
+- BrevoTransport מחזיק requests.Session אחד (pool של חיבורי keep-alive) לכל
+  תהליך, וקורא ישירות ל-REST API. BREVO_API_URL מאפשר להפנות אותו לשרת מקומי
+  בבדיקות.
+- enqueue_email כותב שורה ל-email_outbox ומעיר את ה-worker; הבקשה לא מחכה
+  לרשת.
+- drain_outbox תופס שורות ממתינות, מקבץ שורות עם אותו שולח/נושא/HTML לקריאת
+  messageVersions אחת (עד 1000 נמענים), ומתזמן ניסיון חוזר עם backoff לשגיאות
+  זמניות (429/5xx/רשת). on_outbox_result מאפשר למודול אחר (ניוזלטר) לעדכן
+  את הרשומות שלו בתוצאה הסופית של השליחה.
+- OutboxWorker הוא thread רקע שמרוקן את התור בתהליכי ה-web (מופעל מ-wsgi.py).
+  תהליך בלי worker כזה (work horse של RQ שיוצא ב-os._exit, סקריפטים) שולח את
+  מה שהכניס לתור בסוף ה-app context שלו, כדי ששורות לא יישארו pending.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BREVO_API_URL = "https://api.brevo.com/v3"
+# Brevo accepts up to 1000 messageVersions per call.
+MAX_VERSIONS_PER_CALL = 1000
+DRAIN_BATCH_SIZE = 500
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# A claimed ('sending') row whose worker died becomes claimable again after this.
+CLAIM_LEASE_SECONDS = 600
+WORKER_POLL_SECONDS = 30
+
+
+class BrevoError(Exception):
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class BrevoTransport:
+    """Brevo transactional email API over one pooled requests.Session."""
+
+    def __init__(self, api_key=None, base_url=None, timeout=15, pool_size=10):
+        self.api_key = api_key if api_key is not None else os.getenv("BREVO_API_KEY")
+        self.base_url = (base_url or os.getenv("BREVO_API_URL") or DEFAULT_BREVO_API_URL).rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @property
+    def session(self):
+        # A forked worker must not share the parent's sockets.
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"accept": "application/json", "content-type": "application/json"})
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def send(self, sender, subject, html_content, to=None, params=None, versions=None, api_key=None):
+        """
+        POST /smtp/email. Either to (+ params) for one message, or versions:
+        [{"to": [...], "params": {...}}] for a batch. Returns the JSON response.
+        """
+        payload = {"sender": sender, "subject": subject, "htmlContent": html_content}
+        if versions:
+            payload["messageVersions"] = versions
+        else:
+            payload["to"] = to
+            if params:
+                payload["params"] = params
+        try:
+            response = self.session.post(
+                f"{self.base_url}/smtp/email",
+                json=payload,
+                headers={"api-key": api_key or self.api_key or ""},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise BrevoError(f"Brevo request failed: {e}", retryable=True) from e
+        self.calls += 1
+        if response.status_code >= 400:
+            raise BrevoError(
+                f"Brevo returned {response.status_code}: {response.text[:500]}",
+                status=response.status_code,
+                retryable=response.status_code == 429 or response.status_code >= 500,
+            )
+        try:
+            return response.json() if response.content else {}
+        except ValueError:
+            return {}
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = BrevoTransport()
+        return _transport
+
+
+def set_transport(transport):
+    """Replaces the process transport (e.g. one pointed at a stub); None resets it."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+def timestamped_subject(subject):
+    israel_time = datetime.now(ZoneInfo("Asia/Jerusalem"))
+    return f"{subject} - {israel_time.strftime('%d%m%Y %H:%M')}"
+
+
+def template_key(sender_email, sender_name, subject, html_content):
+    payload = "\x1f".join([sender_email or "", sender_name or "", subject or "", html_content or ""])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def send_now(sender_email, sender_name, recipient_email, recipient_name, subject,
+             html_content, params=None, api_key=None):
+    """Sends one email immediately through the pooled transport (raises BrevoError)."""
+    return get_transport().send(
+        sender={"email": sender_email, "name": sender_name},
+        subject=subject,
+        html_content=html_content,
+        to=[{"email": recipient_email, "name": recipient_name}],
+        params=params,
+        api_key=api_key,
+    )
+
+
+def _outbox_values(recipient_email, recipient_name, subject, html_content,
+                   sender_email, sender_name=None, params=None):
+    return {
+        "sender_email": sender_email,
+        "sender_name": sender_name,
+        "recipient_email": recipient_email,
+        "recipient_name": recipient_name,
+        "subject": subject,
+        "html_content": html_content,
+        "params": json.dumps(params, ensure_ascii=False) if params else None,
+        "template_key": template_key(sender_email, sender_name, subject, html_content),
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": datetime.now(timezone.utc),
+    }
+
+
+def enqueue_email(recipient_email, recipient_name, subject, html_content,
+                  sender_email, sender_name=None, params=None):
+    """
+    Queues an email in email_outbox and wakes the worker; returns the row id.
+    The row is written on its own connection, so the caller's session is left
+    alone. Without an app context the email is sent immediately instead.
+    """
+    from flask import has_app_context
+
+    if not has_app_context():
+        send_now(sender_email, sender_name, recipient_email, recipient_name,
+                 subject, html_content, params=params)
+        return None
+
+    from app.extensions import db
+    from app.models import EmailOutbox
+
+    values = _outbox_values(recipient_email, recipient_name, subject, html_content,
+                            sender_email, sender_name, params)
+    with db.engine.begin() as conn:
+        result = conn.execute(EmailOutbox.__table__.insert().values(**values))
+        row_id = result.inserted_primary_key[0]
+    wake_outbox_worker()
+    return row_id
+
+
+def stage_email(session, recipient_email, recipient_name, subject, html_content,
+                sender_email, sender_name=None, params=None):
+    """
+    Adds an outbox row to session without committing, so it is queued in the
+    same transaction as the caller's own bookkeeping. Call wake_outbox_worker()
+    after the commit.
+    """
+    from app.models import EmailOutbox
+
+    row = EmailOutbox(**_outbox_values(recipient_email, recipient_name, subject, html_content,
+                                       sender_email, sender_name, params))
+    session.add(row)
+    return row
+
+
+_result_listeners = []
+
+
+def on_outbox_result(listener):
+    """
+    Registers listener(session, outbox_ids, status, error) for rows reaching
+    a final status ("sent" or "failed"). It runs in drain_outbox's session
+    before the status is committed, so both are written together.
+    """
+    _result_listeners.append(listener)
+    return listener
+
+
+def _notify_result(session, outbox_ids, status, error=None):
+    for listener in _result_listeners:
+        listener(session, outbox_ids, status, error)
+
+
+def wake_outbox_worker():
+    """
+    Tells this process's OutboxWorker there is mail. Without one (RQ work
+    horse, script) the current app context is marked to flush the outbox when
+    it ends instead, since a thread started here could die with the process.
+    """
+    from flask import current_app, g, has_app_context
+
+    if not has_app_context():
+        return
+    if _worker is not None:
+        worker = ensure_outbox_worker(current_app._get_current_object())
+        if worker is not None:
+            worker.wake()
+            return
+    g._email_outbox_flush = True
+
+
+def _retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+def _claim(limit, now):
+    from app.extensions import db
+    from app.models import EmailOutbox
+
+    query = (
+        EmailOutbox.query
+        .filter(EmailOutbox.status.in_(("pending", "sending")), EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.id)
+        .limit(limit)
+    )
+    if db.engine.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    rows = query.all()
+    claimed = []
+    for row in rows:
+        row.status = "sending"
+        row.attempts = (row.attempts or 0) + 1
+        row.next_attempt_at = now + timedelta(seconds=CLAIM_LEASE_SECONDS)
+        claimed.append({
+            "id": row.id,
+            "sender": {"email": row.sender_email, "name": row.sender_name},
+            "to": {"email": row.recipient_email, "name": row.recipient_name},
+            "subject": row.subject,
+            "html_content": row.html_content,
+            "params": json.loads(row.params) if row.params else None,
+            "template_key": row.template_key,
+            "attempts": row.attempts,
+        })
+    db.session.commit()
+    return claimed
+
+
+def _version(item):
+    version = {"to": [item["to"]]}
+    if item["params"]:
+        version["params"] = item["params"]
+    return version
+
+
+def _send_group(transport, items):
+    """Sends rows sharing a template; returns one Brevo message id (or None) per row."""
+    first = items[0]
+    if len(items) == 1:
+        response = transport.send(
+            sender=first["sender"], subject=first["subject"], html_content=first["html_content"],
+            to=[first["to"]], params=first["params"],
+        )
+        return [response.get("messageId")]
+    response = transport.send(
+        sender=first["sender"], subject=first["subject"], html_content=first["html_content"],
+        versions=[_version(item) for item in items],
+    )
+    message_ids = response.get("messageIds") or []
+    return [message_ids[i] if i < len(message_ids) else None for i in range(len(items))]
+
+
+# A finished row keeps only its metadata; the body is not retained at rest.
+_CLEARED_CONTENT = {"html_content": None, "params": None}
+
+
+def drain_outbox(limit=DRAIN_BATCH_SIZE, transport=None):
+    """
+    Sends up to limit due outbox rows. Returns counts:
+    {"claimed", "sent", "retry", "failed", "calls"}.
+    """
+    from app.extensions import db
+    from app.models import EmailOutbox
+
+    transport = transport or get_transport()
+    now = datetime.now(timezone.utc)
+    items = _claim(limit, now)
+    stats = {"claimed": len(items), "sent": 0, "retry": 0, "failed": 0, "calls": 0}
+
+    groups = {}
+    for item in items:
+        groups.setdefault(item["template_key"], []).append(item)
+
+    table = EmailOutbox.__table__
+    for group in groups.values():
+        for start in range(0, len(group), MAX_VERSIONS_PER_CALL):
+            chunk = group[start:start + MAX_VERSIONS_PER_CALL]
+            stats["calls"] += 1
+            try:
+                message_ids = _send_group(transport, chunk)
+            except Exception as e:
+                retryable = getattr(e, "retryable", True)
+                logger.warning(f"Sending {len(chunk)} queued emails failed: {e}")
+                given_up = []
+                for item in chunk:
+                    give_up = not retryable or item["attempts"] >= MAX_ATTEMPTS
+                    values = {
+                        "status": "failed" if give_up else "pending",
+                        "last_error": str(e)[:2000],
+                        "next_attempt_at": now + timedelta(seconds=_retry_delay(item["attempts"])),
+                    }
+                    if give_up:
+                        values.update(_CLEARED_CONTENT)
+                    db.session.execute(table.update().where(table.c.id == item["id"]).values(**values))
+                    stats["failed" if give_up else "retry"] += 1
+                    if give_up:
+                        given_up.append(item["id"])
+                if given_up:
+                    _notify_result(db.session, given_up, "failed", str(e)[:2000])
+                db.session.commit()
+                continue
+
+            sent_at = datetime.now(timezone.utc)
+            for item, message_id in zip(chunk, message_ids):
+                db.session.execute(
+                    table.update().where(table.c.id == item["id"]).values(
+                        status="sent", sent_at=sent_at, message_id=message_id, last_error=None,
+                        **_CLEARED_CONTENT,
+                    )
+                )
+            _notify_result(db.session, [item["id"] for item in chunk], "sent")
+            db.session.commit()
+            stats["sent"] += len(chunk)
+
+    if items:
+        logger.info(f"Email outbox drained: {stats}")
+    return stats
+
+
+def flush_outbox(transport=None):
+    """Sends every due row now, in this thread. Returns the summed drain counts."""
+    totals = {"claimed": 0, "sent": 0, "retry": 0, "failed": 0, "calls": 0}
+    while True:
+        stats = drain_outbox(transport=transport)
+        for key, value in stats.items():
+            totals[key] += value
+        if not stats["claimed"]:
+            return totals
+
+
+def _flush_at_teardown(exc):
+    from flask import current_app, g
+
+    if not g.pop("_email_outbox_flush", False):
+        return
+    if current_app.config.get("TESTING") or not current_app.config.get("EMAIL_OUTBOX_WORKER", True):
+        return
+
+    from app.extensions import db
+
+    try:
+        # Whatever the context left uncommitted is discarded at teardown anyway.
+        db.session.rollback()
+        flush_outbox()
+    except Exception as e:
+        logger.error(f"Flushing the email outbox failed: {e}")
+        db.session.rollback()
+
+
+def init_outbox(app):
+    """Registers the end-of-context flush for processes without an OutboxWorker."""
+    app.teardown_appcontext(_flush_at_teardown)
+
+
+class OutboxWorker:
+    """Background thread that drains email_outbox when woken (and every poll_seconds)."""
+
+    def __init__(self, app, poll_seconds=WORKER_POLL_SECONDS):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+        logger.info("Email outbox worker started")
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        from app.extensions import db
+
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    while drain_outbox()["claimed"]:
+                        pass
+                except Exception as e:
+                    logger.error(f"Email outbox worker error: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def ensure_outbox_worker(app):
+    """
+    The process's OutboxWorker; None when disabled (tests). wsgi.py starts it
+    in each web process, and a forked child of such a process restarts it.
+    """
+    global _worker, _worker_pid
+    if app.config.get("TESTING") or not app.config.get("EMAIL_OUTBOX_WORKER", True):
+        return None
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid():
+            _worker = OutboxWorker(app)
+            _worker_pid = os.getpid()
+            _worker.start()
+        return _worker
@@ -0,0 +1,133 @@
+# app/utils/event_loop.py
+"""
+כלים לשמירה על לולאת ה-asyncio של הבוט פנויה.
+
+הבוט רץ בלולאה אחת (run_polling בתוך thread של ה-wsgi), כך שכל קריאה חוסמת
+בתוך handler - שאילתת psycopg2, קריאה ל-OpenAI דרך requests - עוצרת את הבוט
+לכל המשתמשים. run_blocking מריץ קוד סינכרוני ב-thread pool חסום בגודל.
+
+LoopLagMonitor מודד את ההשהיה של הלולאה: משימה ברקע מעדכנת heartbeat,
+ו-thread שומר בודק אותו. כשהלולאה תקועה מעבר לסף, נרשם ל-log ה-stack של
+ה-thread של הלולאה - כלומר ה-handler שחוסם אותה באותו רגע.
+"""
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+BLOCKING_WORKERS = max(int(_env_float("TELEGRAM_BLOCKING_WORKERS", 4)), 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_blocking_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=BLOCKING_WORKERS, thread_name_prefix="bot-blocking"
+            )
+        return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a synchronous call on the bounded executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_blocking_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+class LoopLagMonitor:
+    """
+    Logs whenever the event loop is blocked for longer than threshold seconds.
+    start() must be called from inside the loop to watch; stop() from anywhere.
+    """
+
+    def __init__(self, threshold=None, interval=None):
+        self.threshold = threshold if threshold is not None else _env_float("LOOP_LAG_THRESHOLD_SECONDS", 1.0)
+        self.interval = interval if interval is not None else min(self.threshold / 4, 0.25)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-lag-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info("Loop lag monitor started (threshold %.2fs)", self.threshold)
+
+    async def _beat(self):
+        while not self._stop.is_set():
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - expected
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._heartbeat = now
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.threshold:
+                if reported:
+                    logger.warning("Event loop resumed after being blocked %.2fs", self.last_lag)
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no stack)"
+            logger.warning(
+                "Event loop blocked for %.2fs (threshold %.2fs); loop thread is at:\n%s",
+                stalled, self.threshold, stack,
+            )
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "max_lag_ms": round(1000 * self.max_lag, 2),
+            "stalls": self.stalls,
+        }
@@ -0,0 +1,309 @@
+# app/utils/excel_importer.py
+"""
+ייבוא קופונים מקובץ Excel בזרימה ובמנות.
+
+השורות נקראות ב-openpyxl במצב read-only (בלי לטעון את כל הגיליון ל-DataFrame),
+כל מנה עוברת ולידציה ונרמול וקטוריים, מזהי הקופונים מוקצים בבת אחת,
+החברות והתגיות נשלפות פעם אחת למנה, והקופונים וקישורי coupon_tags נכתבים
+בפקודות רב-שורתיות. הודעות השגיאה/האזהרה זהות לאלה של process_coupons_excel.
+"""
+import logging
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import func
+
+from app.extensions import db
+from app.models import Company, Coupon, Tag, coupon_tags
+from app.utils.coupon_ids import allocate_coupon_ids
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+
+COLUMN_CODE = "קוד קופון"
+COLUMN_VALUE = "ערך מקורי"
+COLUMN_COST = "עלות"
+COLUMN_COMPANY = "חברה"
+COLUMN_DESCRIPTION = "תיאור"
+COLUMN_EXPIRATION = "תאריך תפוגה"
+COLUMN_ONE_TIME = "קוד לשימוש חד פעמי"
+COLUMN_PURPOSE = "מטרת הקופון"
+COLUMN_TAGS = "תגיות"
+COLUMN_SOURCE = "מאיפה קיבלת את הקופון"
+COLUMN_BUYME_URL = "כתובת URL של הקופון ל-BuyMe"
+COLUMN_STRAUSS_URL = "כתובת URL של הקופון שטראוס פלוס"
+COLUMN_XGIFTCARD_URL = "כתובת URL של הקופון מXgiftcard"
+
+TEXT_COLUMNS = (
+    COLUMN_CODE, COLUMN_VALUE, COLUMN_COST, COLUMN_COMPANY, COLUMN_DESCRIPTION,
+    COLUMN_EXPIRATION, COLUMN_PURPOSE, COLUMN_TAGS, COLUMN_SOURCE,
+    COLUMN_BUYME_URL, COLUMN_STRAUSS_URL, COLUMN_XGIFTCARD_URL,
+)
+
+EXPIRATION_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y")
+
+# Cell texts pd.read_excel treats as missing by default.
+_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+})
+
+
+def _cell_text(value):
+    """A cell as pd.read_excel(dtype=str) would see it; None for missing."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer():
+            value = int(value)
+    text = str(value)
+    return None if text in _NA_STRINGS else text
+
+
+def iter_excel_rows(file_path):
+    """
+    Yields (row_number, {column: text}) for every data row, reading the first
+    sheet in read-only mode. row_number is the sheet row (header is row 1).
+    Trailing empty rows are dropped, like pd.read_excel.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = {}
+        for position, name in enumerate(header):
+            name = _cell_text(name)
+            if name is not None and name not in columns:
+                columns[name] = position
+
+        pending_blank = []
+        for row_number, values in enumerate(rows, start=2):
+            record = {
+                name: _cell_text(values[position]) if position < len(values) else None
+                for name, position in columns.items()
+            }
+            if all(v is None for v in record.values()):
+                # Held back until we know it is not a trailing empty row.
+                pending_blank.append((row_number, record))
+                continue
+            yield from pending_blank
+            pending_blank = []
+            yield row_number, record
+    finally:
+        workbook.close()
+
+
+def _parse_floats(series):
+    """float() over a text Series, vectorized; None where float() would fail."""
+    values = pd.to_numeric(series, errors="coerce")
+    leftovers = values.isna() & series.ne("")
+    if leftovers.any():
+        def _to_float(text):
+            try:
+                return float(text)
+            except ValueError:
+                return None
+
+        values = values.astype(object)
+        values[leftovers] = series[leftovers].map(_to_float)
+    values = values.astype(object)
+    values[series.eq("")] = 0.0
+    return values.where(values.notna(), None)
+
+
+def _parse_expiration(text):
+    for fmt in EXPIRATION_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def _normalize_chunk(records):
+    """Vectorized strip / missing-field / number / date / boolean handling."""
+    frame = pd.DataFrame([record for _, record in records])
+    for column in TEXT_COLUMNS:
+        if column in frame.columns:
+            frame[column] = frame[column].fillna("").astype(str).str.strip()
+        else:
+            frame[column] = ""
+    one_time = (
+        frame[COLUMN_ONE_TIME].fillna("False").astype(str).str.strip()
+        if COLUMN_ONE_TIME in frame.columns
+        else pd.Series("False", index=frame.index)
+    )
+    frame["is_one_time"] = one_time.str.lower().isin(["true", "1", "כן"])
+    frame["row_number"] = [row_number for row_number, _ in records]
+
+    frame["value"] = _parse_floats(frame[COLUMN_VALUE])
+    frame["cost"] = _parse_floats(frame[COLUMN_COST])
+
+    dates = frame[COLUMN_EXPIRATION]
+    parsed = {text: _parse_expiration(text) for text in dates.unique() if text}
+    frame["expiration"] = dates.map(lambda text: parsed.get(text) if text else None)
+    return frame
+
+
+def _most_common_tags(company_names):
+    """{lower(company): Tag} for the tag used most by each company's coupons."""
+    lowered = {name.lower() for name in company_names}
+    if not lowered:
+        return {}
+    rows = (
+        db.session.query(func.lower(Coupon.company), Tag, func.count(Tag.id))
+        .join(coupon_tags, Tag.id == coupon_tags.c.tag_id)
+        .join(Coupon, Coupon.id == coupon_tags.c.coupon_id)
+        .filter(func.lower(Coupon.company).in_(lowered))
+        .group_by(func.lower(Coupon.company), Tag.id)
+        .all()
+    )
+    best = {}
+    for company, tag, count in rows:
+        if company not in best or count > best[company][1]:
+            best[company] = (tag, count)
+    return {company: tag for company, (tag, _) in best.items()}
+
+
+def import_coupons_excel(file_path, user, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """
+    מייבא את הקופונים מהקובץ עבור user. לא עושה commit.
+
+    progress(processed_rows, added_coupons) נקרא אחרי כל מנה.
+    מחזיר (invalid_coupons, missing_optional_fields_messages, new_coupons)
+    באותו פורמט של process_coupons_excel.
+    """
+    invalid_coupons = []
+    missing_optional_fields_messages = []
+    new_coupons = []
+
+    companies = {company.name: company for company in Company.query.all()}
+    tags_by_name = {tag.name: tag for tag in Tag.query.all()}
+    company_tags = {}
+    processed = 0
+
+    def flush_chunk(records):
+        nonlocal processed
+        frame = _normalize_chunk(records)
+        valid = []
+        for data in frame.to_dict("records"):
+            row_number = data["row_number"]
+
+            missing_fields = [
+                label for label, column in (
+                    ("קוד קופון", COLUMN_CODE),
+                    ("ערך מקורי", COLUMN_VALUE),
+                    ("עלות", COLUMN_COST),
+                    ("חברה", COLUMN_COMPANY),
+                ) if not data[column]
+            ]
+            if missing_fields:
+                invalid_coupons.append(
+                    f'שורה {row_number}: חסרים שדות חובה: {", ".join(missing_fields)}'
+                )
+                continue
+            if data["value"] is None:
+                invalid_coupons.append(
+                    f"שורה {row_number}: ערך מקורי אינו מספר תקין ({data[COLUMN_VALUE]})."
+                )
+                continue
+            if data["cost"] is None:
+                invalid_coupons.append(
+                    f"שורה {row_number}: עלות אינה מספר תקין ({data[COLUMN_COST]})."
+                )
+                continue
+            if data[COLUMN_EXPIRATION] and data["expiration"] is None:
+                missing_optional_fields_messages.append(
+                    f'שורה {row_number}: תאריך תפוגה בפורמט לא תקין (הוזן "{data[COLUMN_EXPIRATION]}"). הוגדר כ-None.'
+                )
+            valid.append(data)
+
+        # One lookup per chunk for the tags of companies we have not seen yet.
+        unseen = {d[COLUMN_COMPANY] for d in valid if d[COLUMN_COMPANY].lower() not in company_tags}
+        if unseen:
+            with db.session.no_autoflush:
+                company_tags.update(_most_common_tags(unseen))
+
+        ids = allocate_coupon_ids(len(valid))
+
+        links = []
+        chunk_coupons = []
+        for data, coupon_id in zip(valid, ids):
+            try:
+                company_name = data[COLUMN_COMPANY]
+                company = companies.get(company_name)
+                if company is None:
+                    company = Company(name=company_name, image_path="default_logo.png")
+                    db.session.add(company)
+                    companies[company_name] = company
+
+                tag = company_tags.get(company_name.lower())
+                if tag is None:
+                    tag_name = f"Tag for {company_name}"
+                    tag = tags_by_name.get(tag_name)
+                    if tag is None:
+                        tag = Tag(name=tag_name, count=0)
+                        db.session.add(tag)
+                        tags_by_name[tag_name] = tag
+                    company_tags[company_name.lower()] = tag
+                tag.count = (tag.count or 0) + 1
+
+                coupon = Coupon(
+                    id=coupon_id,
+                    code=data[COLUMN_CODE],
+                    value=float(data["value"]),
+                    cost=float(data["cost"]),
+                    company=company.name,
+                    description=str(data[COLUMN_DESCRIPTION]),
+                    expiration=data["expiration"],
+                    user_id=user.id,
+                    status="פעיל",
+                    is_one_time=bool(data["is_one_time"]),
+                    purpose=data[COLUMN_PURPOSE],
+                    source=data[COLUMN_SOURCE],
+                    buyme_coupon_url=data[COLUMN_BUYME_URL],
+                    strauss_coupon_url=data[COLUMN_STRAUSS_URL],
+                    xgiftcard_coupon_url=data[COLUMN_XGIFTCARD_URL],
+                )
+                db.session.add(coupon)
+                chunk_coupons.append(coupon)
+                links.append((coupon_id, tag))
+            except Exception as e:
+                invalid_coupons.append(f"שורה {data['row_number']}: {str(e)}")
+
+        # Coupons (and any new companies/tags) go out as batched INSERTs; the
+        # coupon_tags links follow as one multi-row INSERT once tag ids exist.
+        db.session.flush()
+        if links:
+            db.session.execute(
+                coupon_tags.insert(),
+                [{"coupon_id": coupon_id, "tag_id": tag.id} for coupon_id, tag in links],
+            )
+        new_coupons.extend(chunk_coupons)
+
+        processed += len(records)
+        logger.info(
+            "Excel import for user %s: %d rows processed, %d coupons added",
+            user.id, processed, len(new_coupons),
+        )
+        if progress:
+            progress(processed, len(new_coupons))
+
+    chunk = []
+    for row_number, record in iter_excel_rows(file_path):
+        chunk.append((row_number, record))
+        if len(chunk) >= chunk_size:
+            flush_chunk(chunk)
+            chunk = []
+    if chunk:
+        flush_chunk(chunk)
+
+    return invalid_coupons, missing_optional_fields_messages, new_coupons
@@ -0,0 +1,235 @@
+# app/utils/expiration_reminders.py
+"""
+תזכורות תפוגת קופונים: מייל מרוכז אחד לכל משתמש.
+
+cron_send_expiration_reminders עבר על כל חלון (30/7/1 ימים ו-2–6 ימים) בשאילתה
+נפרדת, ולכל קופון: שאילתת Company, קריאת הלוגו מהדיסק וקידוד base64, רינדור
+תבנית לקופון אחד, מייל אחד ו-commit. כאן:
+- due_reminders מביא את כל התזכורות הנדרשות בשאילתה אחת (כולל הלוגו של החברה).
+- send_expiration_digests מקבץ אותן למייל אחד לכל משתמש, עם כל הקופונים שלו.
+- הלוגואים המקודדים נשמרים בזיכרון (LogoCache) לפי mtime של הקובץ.
+- המיילים נכנסים ל-email_outbox, ודגלי reminder_sent_* מסומנים ב-UPDATE אחד
+  לכל דגל — באותה טרנזקציה.
+"""
+import base64
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from flask import current_app, render_template
+from sqlalchemy import and_, or_, update
+
+from app.extensions import db
+from app.models import Company, Coupon, User
+
+logger = logging.getLogger(__name__)
+
+STATUS_ACTIVE = "פעיל"
+DEFAULT_LOGO = "default_logo.png"
+SENDER_EMAIL = "noreply@couponmasteril.com"
+SENDER_NAME = "Coupon Master"
+COUPON_DETAIL_URL = "https://www.couponmasteril.com/coupon_detail/{}"
+
+# Days before expiration -> the flag recording that reminder. The 2-6 day
+# catch-up window shares reminder_sent_7_days.
+REMINDER_FLAGS = {
+    30: "reminder_sent_30_days",
+    7: "reminder_sent_7_days",
+    1: "reminder_sent_1_day",
+}
+CATCH_UP_DAYS = (2, 6)
+
+
+def reminder_flag(days_left):
+    return REMINDER_FLAGS.get(days_left, "reminder_sent_7_days")
+
+
+def reminder_type(days_left):
+    return "1_day" if days_left == 1 else f"{days_left}_days"
+
+
+class LogoCache:
+    """Base64 logos keyed by path; an entry is reused while the file's mtime is unchanged."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Could not read logo file {path}: {e}")
+            return ""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self.hits += 1
+                return entry[1]
+        try:
+            with open(path, "rb") as image_file:
+                encoded = base64.b64encode(image_file.read()).decode("utf-8")
+        except OSError as e:
+            logger.warning(f"Could not read logo file {path}: {e}")
+            return ""
+        with self._lock:
+            self._entries[path] = (mtime, encoded)
+            self.misses += 1
+        return encoded
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+logo_cache = LogoCache()
+
+
+def company_logo(image_path):
+    filename = image_path or DEFAULT_LOGO
+    return logo_cache.get(os.path.join(current_app.root_path, "static", filename))
+
+
+def due_reminders(today):
+    """
+    Every reminder due on today, in one query: [(coupon, user, logo image_path, days_left)].
+    """
+    at = {days: today + timedelta(days=days) for days in REMINDER_FLAGS}
+    catch_up_start = today + timedelta(days=CATCH_UP_DAYS[0])
+    catch_up_end = today + timedelta(days=CATCH_UP_DAYS[1])
+
+    rows = (
+        db.session.query(Coupon, User, Company.image_path)
+        .join(User, Coupon.user_id == User.id)
+        .outerjoin(Company, Company.name == Coupon.company)
+        .filter(
+            Coupon.status == STATUS_ACTIVE,
+            Coupon.is_for_sale == False,  # noqa: E712
+            or_(
+                and_(Coupon.expiration == at[30], Coupon.reminder_sent_30_days == False),  # noqa: E712
+                and_(Coupon.expiration == at[7], Coupon.reminder_sent_7_days == False),  # noqa: E712
+                and_(Coupon.expiration == at[1], Coupon.reminder_sent_1_day == False),  # noqa: E712
+                and_(
+                    Coupon.expiration >= catch_up_start,
+                    Coupon.expiration <= catch_up_end,
+                    Coupon.reminder_sent_7_days == False,  # noqa: E712
+                    Coupon.reminder_sent_1_day == False,  # noqa: E712
+                ),
+            ),
+        )
+        .order_by(Coupon.user_id, Coupon.expiration, Coupon.id)
+        .all()
+    )
+    return [(coupon, user, image_path, (coupon.expiration - today).days) for coupon, user, image_path in rows]
+
+
+def group_by_user(reminders):
+    """{user_id: {"user": User, "reminders": [(coupon, image_path, days_left)]}}, keeping order."""
+    grouped = {}
+    for coupon, user, image_path, days_left in reminders:
+        entry = grouped.setdefault(user.id, {"user": user, "reminders": []})
+        entry["reminders"].append((coupon, image_path, days_left))
+    return grouped
+
+
+def digest_subject(days_left_values):
+    if len(days_left_values) == 1:
+        days_left = days_left_values[0]
+        if days_left == 30:
+            return "תזכורת: קופון פג תוקף בעוד 30 יום"
+        if days_left == 7:
+            return "תזכורת: קופון פג תוקף בעוד שבוע"
+        if days_left == 1:
+            return "תזכורת דחופה: קופון פג תוקף מחר!"
+        return f"תזכורת: קופון פג תוקף בעוד {days_left} ימים"
+    if min(days_left_values) == 1:
+        return f"תזכורת דחופה: {len(days_left_values)} קופונים פגים בקרוב, אחד מהם מחר!"
+    return f"תזכורת: {len(days_left_values)} קופונים פגים בקרוב"
+
+
+def _coupon_data(coupon, image_path, days_left):
+    return {
+        "company": coupon.company,
+        "company_logo_base64": company_logo(image_path),
+        "code": coupon.code,
+        "remaining_value": coupon.remaining_value,
+        "expiration": coupon.expiration.strftime("%Y-%m-%d"),
+        "expiration_formatted": coupon.expiration.strftime("%d/%m/%Y"),
+        "days_left": days_left,
+        "coupon_detail_link": COUPON_DETAIL_URL.format(coupon.id),
+    }
+
+
+def send_expiration_digests(today):
+    """
+    Queues one digest email per user for every due reminder and sets the
+    reminder flags, all in one transaction. Returns
+    {"emails", "sent": [...], "failed": [...]} with one entry per coupon.
+    """
+    from app.utils.email_outbox import stage_email, wake_outbox_worker
+
+    grouped = group_by_user(due_reminders(today))
+    flagged = {flag: [] for flag in set(REMINDER_FLAGS.values())}
+    result = {"emails": 0, "sent": [], "failed": []}
+
+    for entry in grouped.values():
+        user = entry["user"]
+        reminders = entry["reminders"]
+        items = [
+            {
+                "type": reminder_type(days_left),
+                "coupon_id": coupon.id,
+                "user_email": user.email,
+                "company": coupon.company,
+                "code": coupon.code,
+            }
+            for coupon, _, days_left in reminders
+        ]
+        try:
+            html_content = render_template(
+                "emails/coupon_expiration_warning.html",
+                user={"first_name": user.first_name, "email": user.email},
+                coupons=[_coupon_data(coupon, image_path, days_left) for coupon, image_path, days_left in reminders],
+                current_year=today.year,
+            )
+            stage_email(
+                db.session,
+                recipient_email=user.email,
+                recipient_name=f"{user.first_name} {user.last_name}",
+                subject=digest_subject([days_left for _, _, days_left in reminders]),
+                html_content=html_content,
+                sender_email=SENDER_EMAIL,
+                sender_name=SENDER_NAME,
+            )
+        except Exception as e:
+            logger.error(f"Could not prepare expiration digest for user {user.id}: {e}")
+            result["failed"].extend(
+                {key: item[key] for key in ("type", "coupon_id", "user_email")} | {"error": str(e)}
+                for item in items
+            )
+            continue
+        for coupon, _, days_left in reminders:
+            flagged[reminder_flag(days_left)].append(coupon.id)
+        result["emails"] += 1
+        result["sent"].extend(items)
+
+    for flag, coupon_ids in flagged.items():
+        if coupon_ids:
+            db.session.execute(
+                update(Coupon)
+                .where(Coupon.id.in_(coupon_ids))
+                .values({flag: True})
+                .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
+    if result["emails"]:
+        wake_outbox_worker()
+
+    logger.info(
+        f"Expiration digests: {result['emails']} emails for {len(result['sent'])} coupons, "
+        f"{len(result['failed'])} failed (logo cache hits={logo_cache.hits}, misses={logo_cache.misses})"
+    )
+    return result
@@ -0,0 +1,219 @@
+# app/utils/gpt_cache.py
+"""
+מטמון תשובות לקריאות חילוץ של OpenAI (SMS, תמונות, טקסט שימוש).
+
+המפתח הוא hash של הקלט המנורמל (טקסט אחרי איחוד רווחים, או תוכן התמונה),
+סוג הקריאה, גרסת הפרומפט, המודל ותוכן רשימת החברות שנשלחה. שליחה חוזרת של
+אותו SMS או אותה תמונה מחזירה את התשובה השמורה מיד ובלי עלות; בשורת GptUsage
+נרשם cache_hit עם 0 טוקנים.
+
+רמה ראשונה: LRU בזיכרון התהליך, חסום בגודל ועם TTL. רמה שנייה: ה-cache של
+האפליקציה (Redis בפרודקשן) כשיש app context, כדי שגם workers אחרים ייהנו.
+לבדיקות אפשר להחליף את הלקוח ב-set_chat_client.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bump the matching entry whenever a prompt, schema or parsing changes, so
+# answers produced for the old prompt are not served for the new one.
+PROMPT_VERSIONS = {
+    "sms": 1,
+    "image_file": 1,
+    "image_base64": 1,
+    "usage": 1,
+}
+
+SHARED_CACHE_PREFIX = "gpt_response:"
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class GptResponseCache:
+    """
+    Bounded, thread-safe LRU of cache key -> response dict with a TTL.
+    A max_size of 0 disables caching.
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max(int(max_size), 0)
+        self.ttl_seconds = max(int(ttl_seconds), 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl_seconds > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+gpt_response_cache = GptResponseCache(
+    _env_int("GPT_CACHE_MAX_ENTRIES", 512),
+    _env_int("GPT_CACHE_TTL_SECONDS", 24 * 3600),
+)
+
+_chat_client = None
+
+
+def set_chat_client(client):
+    """Replaces the chat client (anything with .create(**kwargs)); None restores openai."""
+    global _chat_client
+    _chat_client = client
+
+
+def get_chat_client():
+    if _chat_client is not None:
+        return _chat_client
+    import openai
+
+    return openai.ChatCompletion
+
+
+def normalize_text_input(text):
+    """NFC, trimmed, with runs of whitespace collapsed - resubmits differ only in spacing."""
+    return " ".join(unicodedata.normalize("NFC", str(text or "")).split())
+
+
+def image_digest(image_bytes=None, base64_image=None):
+    """sha256 of the image content, from raw bytes or a base64 string."""
+    if image_bytes is None:
+        try:
+            image_bytes = base64.b64decode(base64_image or "", validate=False)
+        except (ValueError, TypeError):
+            image_bytes = str(base64_image or "").encode()
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def companies_digest(companies):
+    return hashlib.sha256("\n".join(sorted(companies or ())).encode()).hexdigest()
+
+
+def gpt_cache_key(kind, normalized_input, companies=(), model=""):
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "prompt_version": PROMPT_VERSIONS.get(kind, 0),
+            "model": model,
+            "companies": companies_digest(companies),
+            "input": normalized_input,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _shared_get(key):
+    try:
+        from flask import has_app_context
+
+        if not has_app_context():
+            return None
+        from app.extensions import cache
+
+        return cache.get(SHARED_CACHE_PREFIX + key)
+    except Exception as e:
+        logger.warning(f"GPT cache lookup failed: {e}")
+        return None
+
+
+def _shared_put(key, response):
+    try:
+        from flask import has_app_context
+
+        if not has_app_context():
+            return
+        from app.extensions import cache
+
+        cache.set(SHARED_CACHE_PREFIX + key, response, timeout=gpt_response_cache.ttl_seconds)
+    except Exception as e:
+        logger.warning(f"GPT cache store failed: {e}")
+
+
+def cached_chat_completion(key, **create_kwargs):
+    """
+    Returns (response, cache_hit). On a miss the chat client is called with
+    create_kwargs and a response with choices is stored under key.
+    """
+    if gpt_response_cache.enabled:
+        response = gpt_response_cache.get(key)
+        if response is None:
+            response = _shared_get(key)
+            if response is not None:
+                gpt_response_cache.put(key, response)
+        if response is not None:
+            logger.info("GPT cache hit %s", key[:12])
+            return response, True
+
+    response = get_chat_client().create(**create_kwargs)
+    # Plain dicts: picklable for the shared cache and safe to hand out twice.
+    response = json.loads(json.dumps(response))
+    if gpt_response_cache.enabled and response.get("choices"):
+        gpt_response_cache.put(key, response)
+        _shared_put(key, response)
+    return response, False
+
+
+def billable_usage(response, cache_hit):
+    """Token counts to bill for a response: the real usage, or zeros for a cache hit."""
+    if cache_hit:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    usage = response.get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+    }
@@ -0,0 +1,284 @@
+# app/utils/multipass_fetchers.py
+"""
+שכבת "fetchers" לשליפת יתרת Multipass.
+
+ה-fetcher הראשון הוא HTTP בלבד (requests): GET לעמוד GetBalance, שליחת הטופס
+של ASP.NET עם מספר הכרטיס וטוקן reCAPTCHA מ-Capsolver, ומעבר על דפי הטבלה -
+סבב HTTP אחד או כמה במקום דפדפן שלם. אם מזוהה אתגר (reCAPTCHA ללא מפתח
+Capsolver, Cloudflare, עמוד לא מוכר) get_coupon_data חוזר למסלול Selenium.
+
+לכל fetcher (כולל selenium) נרשמים אחוז הצלחה וזמני תגובה ב-get_fetcher_stats().
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+MULTIPASS_BALANCE_URL = "https://multipass.co.il/GetBalance"
+MULTIPASS_RECAPTCHA_SITE_KEY = "6LeqFAgsAAAAAALL04uUwCrtSk-jibWHfzjFr0af"
+MULTIPASS_MAX_PAGES = 30
+
+_CHALLENGE_MARKERS = ("cf-chl", "challenge-platform", "just a moment", "attention required")
+_POSTBACK_RE = re.compile(r"__doPostBack\('([^']+)','([^']*)'\)")
+
+
+class MultipassChallenge(Exception):
+    """The site answered with something only a real browser can get past."""
+
+
+def solve_capsolver_recaptcha(api_key, website_url, website_key,
+                              debug_print=lambda *_: None, max_wait=180):
+    debug_print("Requesting Capsolver to solve reCAPTCHA...")
+    payload = {
+        "clientKey": api_key,
+        "task": {
+            "type": "ReCaptchaV2TaskProxyless",
+            "websiteURL": website_url,
+            "websiteKey": website_key
+        }
+    }
+    try:
+        res = requests.post("https://api.capsolver.com/createTask", json=payload, timeout=30).json()
+        if res.get("errorId") != 0:
+            debug_print(f"Capsolver createTask error: {res.get('errorDescription')}")
+            return None
+
+        task_id = res.get("taskId")
+        deadline = time.monotonic() + max_wait
+        while time.monotonic() < deadline:
+            time.sleep(3)
+            res = requests.post("https://api.capsolver.com/getTaskResult", json={
+                "clientKey": api_key,
+                "taskId": task_id
+            }, timeout=30).json()
+
+            status = res.get("status")
+            if status == "ready":
+                debug_print("Capsolver solved reCAPTCHA successfully.")
+                return res.get("solution", {}).get("gRecaptchaResponse")
+            elif status == "failed" or res.get("errorId") != 0:
+                debug_print(f"Capsolver getTaskResult error: {res.get('errorDescription')}")
+                return None
+        debug_print("Capsolver did not return a solution in time.")
+        return None
+    except Exception as ex:
+        debug_print(f"Capsolver exception: {ex}")
+        return None
+
+
+# ---- metrics ----
+
+class FetcherMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, outcome, seconds):
+        """outcome: 'success', 'challenge' or 'error'."""
+        with self._lock:
+            entry = self._stats.setdefault(
+                name, {"attempts": 0, "success": 0, "challenge": 0, "error": 0,
+                       "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            entry["attempts"] += 1
+            entry[outcome] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for name, entry in self._stats.items():
+                attempts = entry["attempts"]
+                result[name] = {
+                    **entry,
+                    "success_rate": round(entry["success"] / attempts, 3) if attempts else 0.0,
+                    "avg_seconds": round(entry["total_seconds"] / attempts, 3) if attempts else 0.0,
+                }
+            return result
+
+
+fetcher_metrics = FetcherMetrics()
+
+
+def get_fetcher_stats():
+    return fetcher_metrics.stats()
+
+
+# ---- fetchers ----
+
+class MultipassFetcher:
+    """
+    Base class for pluggable Multipass fetchers.
+
+    fetch() returns (tables, html): the raw balance tables (one DataFrame per
+    page, before normalize_multipass_dataframe) and the last page's HTML.
+    It raises MultipassChallenge when the caller should fall back to a browser.
+    """
+
+    name = "base"
+
+    def fetch(self, card_number, debug_print=lambda *_: None):
+        raise NotImplementedError
+
+
+# Connection pool shared by every fetch; cookies stay per-session (per coupon).
+_http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+
+
+class HttpMultipassFetcher(MultipassFetcher):
+    name = "http"
+
+    def __init__(self, timeout=20, capsolver_key=None):
+        self.timeout = timeout
+        self.capsolver_key = capsolver_key
+
+    def _session(self):
+        session = requests.Session()
+        session.mount("https://", _http_adapter)
+        session.headers.update({
+            "User-Agent": (
+                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+            ),
+            "Accept-Language": "he-IL,he;q=0.9,en;q=0.8",
+        })
+        return session
+
+    def _check_response(self, response):
+        body = response.text.lower()
+        if response.status_code in (403, 429, 503) or any(m in body for m in _CHALLENGE_MARKERS):
+            raise MultipassChallenge(f"blocked (HTTP {response.status_code})")
+        response.raise_for_status()
+        return BeautifulSoup(response.text, "html.parser")
+
+    @staticmethod
+    def _form_fields(soup):
+        form = soup.find("form") or soup
+        return {
+            field["name"]: field.get("value", "")
+            for field in form.find_all("input", attrs={"type": "hidden"})
+            if field.get("name")
+        }
+
+    @staticmethod
+    def _postback_fields(element):
+        """Form fields that trigger a click on an ASP.NET button or link button."""
+        if element.name == "input" and element.get("name"):
+            return {element["name"]: element.get("value", "")}
+        match = _POSTBACK_RE.search(element.get("href", "") or "")
+        if match:
+            return {"__EVENTTARGET": match.group(1), "__EVENTARGUMENT": match.group(2)}
+        return None
+
+    @staticmethod
+    def _read_table(soup):
+        # Parsed with BeautifulSoup directly: pd.read_html would need lxml.
+        table = soup.find(id="MainContent_GV")
+        if table is None:
+            return None
+        rows = table.find_all("tr")
+        if not rows:
+            return pd.DataFrame()
+        columns = [cell.get_text(strip=True) for cell in rows[0].find_all(["th", "td"])]
+        data = []
+        for row in rows[1:]:
+            cells = [cell.get_text(strip=True) for cell in row.find_all("td")]
+            # Skip the pager row and other rows that don't match the header.
+            if len(cells) == len(columns):
+                data.append(cells)
+        return pd.DataFrame(data, columns=columns)
+
+    def fetch(self, card_number, debug_print=lambda *_: None):
+        session = self._session()
+        try:
+            soup = self._check_response(session.get(MULTIPASS_BALANCE_URL, timeout=self.timeout))
+            card_input = soup.find(id="MainContent_CardNumberTxt")
+            submit = soup.find(id="MainContent_GetBalanceBtn")
+            if card_input is None or submit is None:
+                raise MultipassChallenge("balance form not found")
+
+            fields = self._form_fields(soup)
+            fields[card_input["name"]] = card_number
+            if soup.find(class_="g-recaptcha") or "recaptcha" in str(soup).lower():
+                if not self.capsolver_key:
+                    raise MultipassChallenge("reCAPTCHA without CAPSOLVER_API_KEY")
+                token = solve_capsolver_recaptcha(
+                    self.capsolver_key, MULTIPASS_BALANCE_URL,
+                    MULTIPASS_RECAPTCHA_SITE_KEY, debug_print,
+                )
+                if not token:
+                    raise MultipassChallenge("reCAPTCHA could not be solved")
+                fields["g-recaptcha-response"] = token
+            fields.update(self._postback_fields(submit) or {})
+
+            tables = []
+            for page_index in range(1, MULTIPASS_MAX_PAGES + 1):
+                response = session.post(MULTIPASS_BALANCE_URL, data=fields, timeout=self.timeout)
+                soup = self._check_response(response)
+                table = self._read_table(soup)
+                if table is None:
+                    raise MultipassChallenge(f"no balance table on page {page_index}")
+                tables.append(table)
+
+                next_button = soup.find(id="MainContent_btnNext")
+                if (
+                    next_button is None
+                    or next_button.has_attr("disabled")
+                    or "aspNetDisabled" in (next_button.get("class") or [])
+                ):
+                    break
+                next_fields = self._postback_fields(next_button)
+                if next_fields is None:
+                    # Stopping here would pass off a partial history as complete.
+                    raise MultipassChallenge(f"next page link not followable on page {page_index}")
+                fields = self._form_fields(soup)
+                fields.update(next_fields)
+            else:
+                raise MultipassChallenge(f"history longer than {MULTIPASS_MAX_PAGES} pages")
+
+            debug_print(f"HTTP fetcher collected {len(tables)} Multipass page(s)")
+            return tables, response.text
+        finally:
+            session.close()
+
+
+def get_multipass_fetchers():
+    """
+    The fast fetchers to try, in order, before falling back to Selenium.
+    MULTIPASS_HTTP_FETCH=0 disables the HTTP fetcher.
+    """
+    fetchers = []
+    if os.getenv("MULTIPASS_HTTP_FETCH", "1").lower() not in ("0", "false", "no", "off"):
+        fetchers.append(HttpMultipassFetcher(capsolver_key=os.getenv("CAPSOLVER_API_KEY")))
+    return fetchers
+
+
+def fetch_multipass_tables(card_number, debug_print=lambda *_: None, fetchers=None):
+    """
+    Try each fast fetcher in turn. Returns (tables, html, fetcher_name), or None
+    when every fetcher hit a challenge or failed and the browser path is needed.
+    """
+    for fetcher in (get_multipass_fetchers() if fetchers is None else fetchers):
+        started = time.monotonic()
+        try:
+            tables, html = fetcher.fetch(card_number, debug_print)
+        except MultipassChallenge as e:
+            fetcher_metrics.record(fetcher.name, "challenge", time.monotonic() - started)
+            debug_print(f"Multipass {fetcher.name} fetcher hit a challenge: {e}")
+            continue
+        except Exception as e:
+            fetcher_metrics.record(fetcher.name, "error", time.monotonic() - started)
+            logger.warning("Multipass %s fetcher failed: %s", fetcher.name, e)
+            continue
+        fetcher_metrics.record(fetcher.name, "success", time.monotonic() - started)
+        return tables, html, fetcher.name
+    return None
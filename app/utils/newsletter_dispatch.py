@@ -0,0 +1,360 @@
+# app/utils/newsletter_dispatch.py
+"""
+שליחת ניוזלטר ברקע, במנות, עם המשך מנקודת העצירה.
+
+send_newsletter (אדמין) ו-send_newsletter_to_subscribers (cron) עברו על כל
+המנויים בתוך בקשת ה-HTTP: בנו קישורים, ביצעו החלפות מחרוזת על כל ה-HTML
+(או render_template מלא) ושלחו מייל אחד-אחד. כאן:
+- compile_newsletter בונה את ה-HTML פעם אחת, עם פרמטרים של Brevo
+  ({{ params.first_name }} וכו') במקום הערכים האישיים, כולל קישורי ביטול
+  ההרשמה/העדפות. כל הנמענים מקבלים אותו HTML והערכים נשלחים כ-params, כך
+  שה-outbox שולח אותם בקריאות messageVersions מקובצות.
+- render_for_user ממלא את הפרמטרים במעבר regex אחד (תצוגה מקדימה/בדיקות).
+- dispatch_newsletter עובר על הנמענים במנות לפי id; בכל מנה שורות
+  NewsletterSending (בסטטוס queued) ושורות email_outbox נכתבות באותה
+  טרנזקציה. שורת NewsletterSending היא נקודת הביקורת: ריצה שנקטעה ממשיכה
+  ממי שעדיין אין לו שורה (או שנכשל), ולא שולחת שוב למי שכבר בתור.
+- _record_outbox_result מעדכן את השורה ל-sent/failed כשה-outbox מסיים איתה,
+  כך שמייל שנכשל סופית יישלח שוב בריצה הבאה של dispatch_newsletter.
+- start_newsletter_dispatch מריץ את זה כ-job של RQ, ואם Redis לא זמין —
+  ב-thread רקע, כך שהשליחה לא תלויה בבקשה שמחכה לה.
+"""
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+from flask import current_app, render_template, url_for
+from markupsafe import escape
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app.utils.email_outbox import on_outbox_result
+
+logger = logging.getLogger(__name__)
+
+SITE_URL = "https://couponmasteril.com"
+NEWSLETTER_SENDER_NAME = "Coupon Master"
+CHUNK_SIZE = 200
+
+_PLACEHOLDER_RE = re.compile(r"__cm_([a-z_]+?)__")
+_PARAM_RE = re.compile(r"\{\{ params\.([a-z_]+) \}\}")
+
+
+def _placeholder(name):
+    return f"__cm_{name}__"
+
+
+def _custom_footer(newsletter, first_name, unsubscribe_link, preferences_link):
+    image_section = ""
+    if newsletter.image_path:
+        image_url = f"{SITE_URL}/static/{newsletter.image_path}"
+        image_section = f'''
+            <br>
+            <!-- Newsletter Image -->
+            <div style="text-align: center; margin: 20px 0;">
+                <img src="{image_url}" alt="תמונת הניוזלטר" style="max-width: 100%; max-height: 300px; border-radius: 10px; box-shadow: 0 5px 15px rgba(0,0,0,0.1);">
+            </div>
+            '''
+    return f'''
+            {image_section}
+            <br>
+            <!-- Footer -->
+            <div style="max-width: 500px; margin: 20px auto; background-color: #34495e; color: #bdc3c7; text-align: center; padding: 18px 25px; border-radius: 10px; font-family: Arial, sans-serif;">
+                <p style="margin: 0 0 12px 0; font-size: 14px;"><strong>Coupon Master</strong></p>
+                <div style="font-size: 12px; color: #95a5a6; margin: 12px 0;">
+                    <p style="margin: 0 0 10px 0;">שלום {first_name}, קיבלת את המייל הזה כי אתה רשום לניוזלטר שלנו.</p>
+                    <p style="margin: 0;">
+                        <a href="{unsubscribe_link}" style="color: #95a5a6; text-decoration: underline;">ביטול מנוי</a>
+                        |
+                        <a href="{preferences_link}" style="color: #95a5a6; text-decoration: underline;">עדכון העדפות</a>
+                    </p>
+                </div>
+                <p style="margin: 12px 0 0 0; font-size: 11px;">© {datetime.now().year} Coupon Master. כל הזכויות שמורות.</p>
+            </div>
+        '''
+
+
+def compile_newsletter(newsletter):
+    """
+    Renders the newsletter once with Brevo {{ params.* }} in place of the
+    per-user values. Needs a request context (url_for/render_template).
+    Returns {"subject", "html"}.
+    """
+    from app.helpers import get_current_month_year_hebrew
+
+    placeholder_user = SimpleNamespace(
+        id=_placeholder("user_id"),
+        first_name=_placeholder("first_name"),
+        last_name=_placeholder("last_name"),
+        email=_placeholder("email"),
+    )
+    unsubscribe_link = SITE_URL + url_for(
+        "profile.unsubscribe_newsletter",
+        user_id=placeholder_user.id,
+        token=_placeholder("unsubscribe_token"),
+    )
+    preferences_link = SITE_URL + url_for(
+        "profile.preferences_from_email",
+        user_id=placeholder_user.id,
+        token=_placeholder("preferences_token"),
+    )
+
+    if newsletter.newsletter_type == "custom":
+        html = newsletter.custom_html or ""
+        footer = _custom_footer(newsletter, placeholder_user.first_name, unsubscribe_link, preferences_link)
+        if "</body>" in html:
+            html = html.replace("</body>", footer + "</body>")
+        elif "</html>" in html:
+            html = html.replace("</html>", footer + "</html>")
+        else:
+            html += footer
+        html = html.replace("{{ user.first_name }}", placeholder_user.first_name)
+        html = html.replace("{{ user.last_name }}", placeholder_user.last_name)
+        html = html.replace("{{ user.email }}", placeholder_user.email)
+        html = html.replace("{{ unsubscribe_link }}", unsubscribe_link)
+        image_url = f"{SITE_URL}/static/{newsletter.image_path}" if newsletter.image_path else ""
+        html = html.replace("{{ newsletter_image_url }}", image_url)
+    else:
+        html = render_template(
+            "emails/newsletter_template.html",
+            newsletter=newsletter,
+            user=placeholder_user,
+            unsubscribe_link=unsubscribe_link,
+            generate_unsubscribe_token=lambda user: _placeholder("unsubscribe_token"),
+            generate_preferences_token=lambda user: _placeholder("preferences_token"),
+            hebrew_month_year=get_current_month_year_hebrew(),
+            current_year=datetime.now().year,
+        )
+    # The placeholders survive url_for/escaping; swap them for Brevo params last.
+    html = _PLACEHOLDER_RE.sub(lambda m: "{{ params.%s }}" % m.group(1), html)
+    return {"subject": newsletter.title, "html": html}
+
+
+def user_values(user):
+    """Brevo params for one user (names/email HTML-escaped)."""
+    from app.utils.tokens import generate_preferences_token, generate_unsubscribe_token
+
+    return {
+        "user_id": str(user.id),
+        "first_name": str(escape(user.first_name or "")),
+        "last_name": str(escape(user.last_name or "")),
+        "email": str(escape(user.email or "")),
+        "unsubscribe_token": generate_unsubscribe_token(user),
+        "preferences_token": generate_preferences_token(user),
+    }
+
+
+def render_for_user(compiled, values):
+    """Fills the compiled HTML's params in a single pass, as Brevo would."""
+    return _PARAM_RE.sub(lambda m: values.get(m.group(1), m.group(0)), compiled["html"])
+
+
+def newsletter_audience(user_ids=None):
+    """Confirmed, non-deleted, subscribed users (optionally only user_ids)."""
+    from app.models import User
+
+    query = User.query.filter(
+        User.is_deleted == False,  # noqa: E712
+        User.is_confirmed == True,  # noqa: E712
+        User.newsletter_subscription == True,  # noqa: E712
+    )
+    if user_ids is not None:
+        query = query.filter(User.id.in_([int(user_id) for user_id in user_ids]))
+    return query
+
+
+def _pending_chunk(newsletter_id, user_ids, after_id, limit):
+    """Next audience users (by id) with no NewsletterSending row, or a failed one."""
+    from app.models import NewsletterSending, User
+
+    return (
+        newsletter_audience(user_ids)
+        .outerjoin(
+            NewsletterSending,
+            and_(NewsletterSending.user_id == User.id, NewsletterSending.newsletter_id == newsletter_id),
+        )
+        .filter(User.id > after_id)
+        .filter(or_(NewsletterSending.id.is_(None), NewsletterSending.delivery_status == "failed"))
+        .order_by(User.id)
+        .limit(limit)
+        .with_entities(User.id, User.first_name, User.last_name, User.email,
+                       NewsletterSending.id.label("sending_id"))
+        .all()
+    )
+
+
+def _record(session, newsletter_id, row, status, error=None, outbox_id=None):
+    from app.models import NewsletterSending
+
+    if row.sending_id is not None:
+        sending = session.get(NewsletterSending, row.sending_id)
+        sending.delivery_status = status
+        sending.sent_at = datetime.utcnow()
+        sending.error_message = error
+        sending.outbox_id = outbox_id
+    else:
+        session.add(NewsletterSending(
+            newsletter_id=newsletter_id,
+            user_id=row.id,
+            delivery_status=status,
+            error_message=error,
+            outbox_id=outbox_id,
+        ))
+
+
+def _sent_count_query(newsletter_id):
+    from app.models import NewsletterSending
+
+    return (
+        select(func.count())
+        .select_from(NewsletterSending)
+        .where(NewsletterSending.newsletter_id == newsletter_id,
+               NewsletterSending.delivery_status.in_(("queued", "sent")))
+        .scalar_subquery()
+    )
+
+
+@on_outbox_result
+def _record_outbox_result(session, outbox_ids, status, error=None):
+    """Copies the outbox's final status to the queued sendings of outbox_ids."""
+    from app.models import Newsletter, NewsletterSending
+
+    sendings = NewsletterSending.__table__
+    newsletter_ids = session.execute(
+        select(sendings.c.newsletter_id).distinct()
+        .where(sendings.c.outbox_id.in_(outbox_ids), sendings.c.delivery_status == "queued")
+    ).scalars().all()
+    if not newsletter_ids:
+        return
+    values = {"delivery_status": status, "error_message": error}
+    if status == "sent":
+        values["sent_at"] = func.now()
+    session.execute(
+        sendings.update()
+        .where(sendings.c.outbox_id.in_(outbox_ids), sendings.c.delivery_status == "queued")
+        .values(**values)
+    )
+    if status == "failed":
+        for newsletter_id in newsletter_ids:
+            session.execute(
+                Newsletter.__table__.update()
+                .where(Newsletter.__table__.c.id == newsletter_id)
+                .values(sent_count=_sent_count_query(newsletter_id))
+            )
+
+
+def dispatch_newsletter(newsletter_id, user_ids=None, mark_sent=False, chunk_size=CHUNK_SIZE):
+    """
+    Queues the newsletter for its audience, chunk_size users per transaction.
+    Needs an app context. Returns {"queued", "failed", "chunks"}.
+    """
+    from app.extensions import db
+    from app.models import Newsletter
+    from app.utils.email_outbox import stage_email, wake_outbox_worker
+
+    newsletter = db.session.get(Newsletter, newsletter_id)
+    if newsletter is None:
+        logger.warning(f"Newsletter {newsletter_id} no longer exists; nothing to send")
+        return {"queued": 0, "failed": 0, "chunks": 0}
+
+    with current_app.test_request_context(base_url=SITE_URL):
+        compiled = compile_newsletter(newsletter)
+    sender_email = os.getenv("SENDER_EMAIL", "noreply@couponmaster.co.il")
+
+    stats = {"queued": 0, "failed": 0, "chunks": 0}
+    after_id = 0
+    while True:
+        rows = _pending_chunk(newsletter_id, user_ids, after_id, chunk_size)
+        if not rows:
+            break
+        queued = failed = 0
+        raced = False
+        for row in rows:
+            try:
+                outbox_row = stage_email(
+                    db.session,
+                    recipient_email=row.email,
+                    recipient_name=f"{row.first_name} {row.last_name}",
+                    subject=compiled["subject"],
+                    html_content=compiled["html"],
+                    sender_email=sender_email,
+                    sender_name=NEWSLETTER_SENDER_NAME,
+                    params=user_values(row),
+                )
+                db.session.flush()
+                _record(db.session, newsletter_id, row, "queued", outbox_id=outbox_row.id)
+                # Flushed here so a duplicate sending surfaces as IntegrityError below.
+                db.session.flush()
+                queued += 1
+            except IntegrityError:
+                raced = True
+                break
+            except Exception as e:
+                logger.error(f"Failed to prepare newsletter {newsletter_id} for {row.email}: {e}")
+                _record(db.session, newsletter_id, row, "failed", str(e))
+                failed += 1
+        if not raced:
+            try:
+                db.session.commit()
+            except IntegrityError:
+                raced = True
+        if raced:
+            # Another dispatch of this newsletter took some of these users; re-read the chunk.
+            db.session.rollback()
+            logger.warning(f"Newsletter {newsletter_id}: chunk after user {after_id} raced another dispatch")
+            continue
+        after_id = rows[-1].id
+        stats["queued"] += queued
+        stats["failed"] += failed
+        stats["chunks"] += 1
+        wake_outbox_worker()
+        logger.info(f"Newsletter {newsletter_id}: chunk up to user {after_id} queued ({stats})")
+
+    # Queued sendings count as sent; the outbox listener lowers it if one fails.
+    newsletter.sent_count = db.session.execute(select(_sent_count_query(newsletter_id))).scalar()
+    newsletter.is_published = True
+    if mark_sent:
+        newsletter.is_sent = True
+    db.session.commit()
+    logger.info(f"Newsletter {newsletter_id} dispatch finished: {stats}")
+    return stats
+
+
+def _dispatch_in_thread(app, newsletter_id, user_ids, mark_sent):
+    from app.extensions import db
+
+    with app.app_context():
+        try:
+            dispatch_newsletter(newsletter_id, user_ids=user_ids, mark_sent=mark_sent)
+        except Exception as e:
+            logger.error(f"Newsletter {newsletter_id} dispatch failed: {e}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def start_newsletter_dispatch(newsletter_id, user_ids=None, mark_sent=False):
+    """
+    Starts dispatch_newsletter in the background: an RQ job, or a thread in
+    this process when the queue is unavailable. Returns "rq" or "thread".
+    """
+    try:
+        from app.tasks import enqueue_newsletter_dispatch
+
+        enqueue_newsletter_dispatch(newsletter_id, user_ids=user_ids, mark_sent=mark_sent)
+        return "rq"
+    except Exception as e:
+        logger.warning(f"RQ unavailable for newsletter {newsletter_id} ({e}); sending from a thread")
+
+    app = current_app._get_current_object()
+    thread = threading.Thread(
+        target=_dispatch_in_thread,
+        args=(app, newsletter_id, user_ids, mark_sent),
+        name=f"newsletter-{newsletter_id}",
+        daemon=True,
+    )
+    thread.start()
+    return "thread"
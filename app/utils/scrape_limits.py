@@ -0,0 +1,96 @@
+# app/utils/scrape_limits.py
+"""
+מגבלות מקביליות לגריפת יתרות (Selenium).
+
+כל קריאה ל-get_coupon_data רצה בתוך slot: מגבלה גלובלית על מספר מופעי Chrome
+חיים בתהליך, ומגבלה נפרדת לכל אתר (Multipass / Max / BuyMe) כדי לא להעמיס
+על אתר אחד כשמריצים עדכון אצווה במקביל.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class ScrapeLimiter:
+    """Global browser cap plus per-site concurrency caps."""
+
+    def __init__(self, max_browsers, max_per_site, site_overrides=None):
+        self.max_browsers = max_browsers
+        self.max_per_site = max_per_site
+        self._site_overrides = {k.lower(): v for k, v in (site_overrides or {}).items()}
+        self._browsers = threading.BoundedSemaphore(max_browsers)
+        self._sites = {}
+        self._lock = threading.Lock()
+        self._active = {}
+        self._peak = 0
+
+    def _site_semaphore(self, site):
+        with self._lock:
+            semaphore = self._sites.get(site)
+            if semaphore is None:
+                limit = self._site_overrides.get(site, self.max_per_site)
+                semaphore = threading.BoundedSemaphore(min(limit, self.max_browsers))
+                self._sites[site] = semaphore
+            return semaphore
+
+    @contextmanager
+    def slot(self, site):
+        # Take the site slot first so a waiting scrape never holds a browser slot.
+        site = (site or "unknown").lower()
+        with self._site_semaphore(site), self._browsers:
+            with self._lock:
+                self._active[site] = self._active.get(site, 0) + 1
+                self._peak = max(self._peak, sum(self._active.values()))
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._active[site] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_browsers": self.max_browsers,
+                "max_per_site": self.max_per_site,
+                "active": {site: n for site, n in self._active.items() if n},
+                "peak": self._peak,
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_scrape_limiter():
+    """
+    מחזיר את ה-limiter של התהליך (נוצר בקריאה הראשונה).
+    SCRAPER_MAX_CHROME - מספר מופעי Chrome מקסימלי (ברירת מחדל 3).
+    SCRAPER_MAX_PER_SITE - מקביליות מקסימלית לאתר (ברירת מחדל 2),
+    וניתן לדרוס לאתר ספציפי, למשל SCRAPER_MAX_PER_SITE_BUYME=1.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                overrides = {
+                    site: _env_int(f"SCRAPER_MAX_PER_SITE_{site.upper()}", 0)
+                    for site in ("multipass", "max", "buyme")
+                    if os.getenv(f"SCRAPER_MAX_PER_SITE_{site.upper()}")
+                }
+                _limiter = ScrapeLimiter(
+                    max_browsers=_env_int("SCRAPER_MAX_CHROME", 3),
+                    max_per_site=_env_int("SCRAPER_MAX_PER_SITE", 2),
+                    site_overrides=overrides,
+                )
+                logger.info("Scrape limiter initialised: %s", _limiter.stats())
+    return _limiter
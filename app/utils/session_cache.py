@@ -0,0 +1,156 @@
+# app/utils/session_cache.py
+"""
+מטמון סשנים של בוט הטלגרם עם הארכת תוקף ב-write-behind.
+
+כל אינטראקציה עם הבוט קראה ל-check_session_validity (שאילתה על telegram_users
+ועוד אחת על users בשביל המגדר) ואחריה ל-update_session_expiry (UPDATE נוסף).
+כאן נשמר לכל chat_id מזהה המשתמש, המגדר ותוקף הסשן, עם TTL; שיחה פעילה
+נענית בלי לגשת למסד. הארכות התוקף ו-last_interaction נאספות בזיכרון ונכתבות
+יחד ב-UPDATE אחד כל כמה שניות.
+
+ה-TTL מגביל את הזמן שבו ניתוק מהאתר (שלא עובר דרך הבוט) עדיין לא נראה בבוט.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EXPIRY_SQL = """
+    UPDATE telegram_users AS tu
+    SET verification_expires_at = GREATEST(tu.verification_expires_at, v.expires_at),
+        last_interaction = v.touched_at
+    FROM unnest($1::bigint[], $2::timestamptz[], $3::timestamptz[])
+        AS v(chat_id, expires_at, touched_at)
+    WHERE tu.telegram_chat_id = v.chat_id
+    AND tu.is_verified = true
+"""
+
+
+class TelegramSessionCache:
+    """
+    chat_id -> {"user_id", "gender", "expires_at"} for ttl seconds, plus
+    user_id -> gender, plus the expiry extensions still waiting for flush().
+    """
+
+    def __init__(self, session_timeout_minutes, ttl_seconds=60, max_size=10000):
+        self.session_timeout = timedelta(minutes=session_timeout_minutes)
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._sessions = {}
+        self._genders = {}
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry["cached_at"] < self.ttl_seconds
+
+    def get(self, chat_id, now=None):
+        """The cached session if it is still fresh and not expired, else None."""
+        entry = self._sessions.get(chat_id)
+        now = now or datetime.now(timezone.utc)
+        if not self._fresh(entry) or entry["expires_at"] <= now:
+            self._sessions.pop(chat_id, None)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, chat_id, user_id, gender, expires_at):
+        if len(self._sessions) >= self.max_size:
+            self._evict()
+        pending = self._pending.get(chat_id)
+        if pending and pending[0] > expires_at:
+            expires_at = pending[0]
+        entry = {
+            "user_id": user_id,
+            "gender": gender,
+            "expires_at": expires_at,
+            "cached_at": time.monotonic(),
+        }
+        self._sessions[chat_id] = entry
+        self.put_gender(user_id, gender)
+        return entry
+
+    def _evict(self):
+        for chat_id in [c for c, e in self._sessions.items() if not self._fresh(e)]:
+            del self._sessions[chat_id]
+        if len(self._sessions) >= self.max_size:
+            self._sessions.clear()
+        if len(self._genders) >= self.max_size:
+            self._genders.clear()
+
+    def gender(self, user_id):
+        """(found, gender) for a user whose gender was read within ttl."""
+        entry = self._genders.get(user_id)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl_seconds:
+            return False, None
+        return True, entry[0]
+
+    def put_gender(self, user_id, gender):
+        if user_id is not None:
+            self._genders[user_id] = (gender, time.monotonic())
+
+    def invalidate(self, chat_id):
+        """Forgets a chat's session and any unflushed extension (disconnect, re-verify)."""
+        entry = self._sessions.pop(chat_id, None)
+        self._pending.pop(chat_id, None)
+        if entry is not None:
+            self._genders.pop(entry["user_id"], None)
+
+    def extend(self, chat_id, now=None):
+        """Pushes the chat's expiry to now + session timeout; written on the next flush."""
+        now = now or datetime.now(timezone.utc)
+        expires_at = now + self.session_timeout
+        self._pending[chat_id] = (expires_at, now)
+        entry = self._sessions.get(chat_id)
+        if entry is not None:
+            entry["expires_at"] = expires_at
+        return expires_at
+
+    def effective_expiry(self, chat_id, stored_expiry):
+        """stored_expiry, or a later extension that has not been flushed yet."""
+        pending = self._pending.get(chat_id)
+        if pending and (stored_expiry is None or pending[0] > stored_expiry):
+            return pending[0]
+        return stored_expiry
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    async def flush(self, conn):
+        """Writes every pending extension in one UPDATE; re-queues them on failure."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        chat_ids = list(pending)
+        try:
+            await conn.execute(
+                FLUSH_EXPIRY_SQL,
+                chat_ids,
+                [pending[c][0] for c in chat_ids],
+                [pending[c][1] for c in chat_ids],
+            )
+        except Exception:
+            for chat_id, value in pending.items():
+                newer = self._pending.get(chat_id)
+                if newer is None or newer[0] < value[0]:
+                    self._pending[chat_id] = value
+            raise
+        self.flushes += 1
+        self.flushed_rows += len(chat_ids)
+        return len(chat_ids)
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
@@ -0,0 +1,128 @@
+# app/utils/settings_registry.py
+"""
+מטמון בתהליך להגדרות האדמין (admin_settings).
+
+AdminSettings.get_setting הריץ שאילתה ופירסר את הערך בכל קריאה, גם בנתיבי
+בקשה (LogoFetcher.is_auto_fetch_enabled, חסימת ההרשמה). כאן כל השורות נטענות
+פעם אחת ל-dict עם ערכים מפורסרים לפי setting_type, וקריאה היא חיפוש ב-dict.
+
+set_setting מעלה מונה גרסה במטמון המשותף (Redis); כל תהליך בודק את הגרסה לכל
+היותר פעם ב-SETTINGS_CHECK_SECONDS וטוען מחדש כשהיא השתנתה, כך ששינוי באחד
+מה-workers נראה בכולם תוך כמה שניות. טעינה מלאה נעשית בכל מקרה אחרי
+SETTINGS_MAX_AGE_SECONDS, בשביל שינויים שנכתבו ישירות למסד.
+"""
+import copy
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_VERSION_KEY = "admin_settings_version"
+# How often a process looks at the shared version; local changes apply at once.
+SETTINGS_CHECK_SECONDS = 5
+SETTINGS_MAX_AGE_SECONDS = 300
+
+_INVALID = object()
+
+
+def parse_setting_value(setting_type, raw):
+    """The typed value of a stored setting; _INVALID when it does not parse."""
+    try:
+        if setting_type == "boolean":
+            return raw.lower() in ["true", "1", "yes", "on"]
+        if setting_type == "integer":
+            return int(raw)
+        if setting_type == "float":
+            return float(raw)
+        if setting_type == "json":
+            return json.loads(raw)
+    except (AttributeError, ValueError, TypeError):
+        return _INVALID
+    return raw
+
+
+class SettingsRegistry:
+    """All admin settings of one app, parsed, refreshed by the shared version stamp."""
+
+    def __init__(self, check_seconds=SETTINGS_CHECK_SECONDS, max_age_seconds=SETTINGS_MAX_AGE_SECONDS):
+        self.check_seconds = check_seconds
+        self.max_age_seconds = max_age_seconds
+        self._values = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _shared_version(self):
+        from app.extensions import cache
+
+        try:
+            return cache.get(SETTINGS_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Could not read admin settings version: {e}")
+            return self._version
+
+    def _load(self, version):
+        from app.models import AdminSettings
+
+        rows = AdminSettings.query.with_entities(
+            AdminSettings.setting_key, AdminSettings.setting_type, AdminSettings.setting_value
+        ).all()
+        self._values = {key: parse_setting_value(setting_type, raw) for key, setting_type, raw in rows}
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.debug("Loaded %d admin settings (version %s)", len(self._values), version)
+
+    def values(self):
+        """The current {key: value} dict, reloaded when stale."""
+        now = time.monotonic()
+        if self._values is not None and now - self._checked_at < self.check_seconds:
+            return self._values
+        with self._lock:
+            if self._values is not None and now - self._checked_at < self.check_seconds:
+                return self._values
+            version = self._shared_version()
+            if (self._values is None or version != self._version
+                    or now - self._loaded_at >= self.max_age_seconds):
+                self._load(version)
+            self._checked_at = now
+            return self._values
+
+    def get(self, key, default=None):
+        value = self.values().get(key, _INVALID)
+        if value is _INVALID:
+            return default
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._values = None
+
+
+def get_settings_registry(app=None):
+    """The registry of app (default: the current app), created on first use."""
+    from flask import current_app
+
+    app = app or current_app._get_current_object()
+    registry = app.extensions.get("admin_settings_registry")
+    if registry is None:
+        registry = app.extensions.setdefault("admin_settings_registry", SettingsRegistry())
+    return registry
+
+
+def bump_settings_version():
+    """Marks every process's settings as stale; call after changing admin_settings."""
+    from app.extensions import cache
+
+    try:
+        cache.set(SETTINGS_VERSION_KEY, uuid.uuid4().hex, timeout=0)
+    except Exception as e:
+        logger.warning(f"Could not bump admin settings version: {e}")
+    get_settings_registry().invalidate()
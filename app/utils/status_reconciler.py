@@ -0,0 +1,144 @@
+# app/utils/status_reconciler.py
+"""
+תיאום סטטוס קופונים ברמת סטים.
+
+במקום לטעון כל קופון ולהריץ update_coupon_status אחד-אחד, כל הקופונים שצריכים
+מעבר סטטוס מעודכנים בכמה פקודות UPDATE (נוצל / פג תוקף / חזרה לפעיל), וההתראות
+המתאימות נוספות ב-INSERT אחד עם ON CONFLICT DO NOTHING על Notification.dedupe_key.
+"""
+import logging
+from datetime import datetime, timezone
+
+from flask import current_app, has_request_context, url_for
+from sqlalchemy import or_, update
+
+from app.extensions import db
+from app.models import Coupon, Notification
+from app.utils.db_utils import insert_ignore_conflicts
+
+logger = logging.getLogger(__name__)
+
+STATUS_ACTIVE = "פעיל"
+STATUS_USED = "נוצל"
+STATUS_EXPIRED = "פג תוקף"
+
+
+def _scoped(stmt, coupon_ids, user_ids):
+    if coupon_ids is not None:
+        stmt = stmt.where(Coupon.id.in_(coupon_ids))
+    if user_ids is not None:
+        stmt = stmt.where(Coupon.user_id.in_(user_ids))
+    return stmt
+
+
+def _run(stmt):
+    return db.session.execute(
+        stmt, execution_options={"synchronize_session": False}
+    ).all()
+
+
+def _detail_links(coupon_ids):
+    def build():
+        return {cid: url_for("coupons.coupon_detail", id=cid) for cid in coupon_ids}
+
+    if has_request_context():
+        return build()
+    with current_app.test_request_context():
+        return build()
+
+
+def _notification_rows(rows, kind, message_template):
+    links = _detail_links([row.id for row in rows])
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "user_id": row.user_id,
+            "message": message_template.format(code=row.code),
+            "link": links[row.id],
+            "timestamp": now,
+            "viewed": False,
+            "hide_from_view": False,
+            "shown": False,
+            "dedupe_key": f"coupon:{row.id}:{kind}",
+        }
+        for row in rows
+        if row.user_id is not None
+    ]
+
+
+def reconcile_coupon_statuses(coupon_ids=None, user_ids=None, reference_date=None,
+                              notify=True, commit=True):
+    """
+    מעדכן את הסטטוס של כל הקופונים (או רק coupon_ids / user_ids) לפי אותם כללים
+    של update_coupon_status: נוצל גובר על פג תוקף, וקופון שאינו נוצל ואינו פג
+    תוקף חוזר לפעיל.
+
+    מחזיר dict עם ספירות: used, expired, reactivated, notifications.
+    """
+    if coupon_ids is not None and not coupon_ids:
+        return {"used": 0, "expired": 0, "reactivated": 0, "notifications": 0}
+    if reference_date is None:
+        reference_date = datetime.now(timezone.utc).date()
+
+    not_used = Coupon.used_value < Coupon.value
+
+    used_rows = _run(_scoped(
+        update(Coupon)
+        .where(Coupon.used_value >= Coupon.value, Coupon.status != STATUS_USED)
+        .values(status=STATUS_USED, notification_sent_nutzel=True)
+        .returning(Coupon.id, Coupon.user_id, Coupon.code),
+        coupon_ids, user_ids,
+    ))
+
+    expired_rows = _run(_scoped(
+        update(Coupon)
+        .where(
+            not_used,
+            Coupon.expiration < reference_date,
+            Coupon.status != STATUS_EXPIRED,
+        )
+        .values(status=STATUS_EXPIRED, notification_sent_pagh_tokev=True)
+        .returning(Coupon.id, Coupon.user_id, Coupon.code),
+        coupon_ids, user_ids,
+    ))
+
+    reactivated_rows = _run(_scoped(
+        update(Coupon)
+        .where(
+            not_used,
+            or_(Coupon.expiration.is_(None), Coupon.expiration >= reference_date),
+            Coupon.status.in_([STATUS_USED, STATUS_EXPIRED]),
+        )
+        .values(status=STATUS_ACTIVE)
+        .returning(Coupon.id, Coupon.user_id),
+        coupon_ids, user_ids,
+    ))
+
+    notifications = 0
+    if notify and (used_rows or expired_rows):
+        rows = _notification_rows(used_rows, "used", "הקופון {code} נוצל במלואו.")
+        rows += _notification_rows(expired_rows, "expired", "הקופון {code} פג תוקף.")
+        notifications = insert_ignore_conflicts(
+            Notification.__table__, rows, index_elements=["dedupe_key"]
+        )
+
+    # Bulk UPDATEs bypass the ORM hooks that maintain user_coupon_summary.
+    affected_users = {
+        row.user_id for row in (*used_rows, *expired_rows, *reactivated_rows)
+    }
+    if affected_users:
+        from app.analytics.user_summary import rebuild_user_summaries
+
+        rebuild_user_summaries(affected_users)
+
+    if commit:
+        db.session.commit()
+
+    result = {
+        "used": len(used_rows),
+        "expired": len(expired_rows),
+        "reactivated": len(reactivated_rows),
+        "notifications": notifications,
+    }
+    logger.info("Coupon status reconciliation: %s", result)
+    return result
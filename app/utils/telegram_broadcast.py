@@ -0,0 +1,184 @@
+# app/utils/telegram_broadcast.py
+"""
+שליחה מרוכזת של הודעות טלגרם (תזכורות תפוגה, סיכומים חודשיים).
+
+במקום לולאה סדרתית עם asyncio.sleep בין משתמשים, ההודעות נשלחות במקביל דרך
+TelegramBroadcaster: token bucket גלובלי לפי מגבלת טלגרם לבוט (כ-30 הודעות
+בשנייה), מרווח מינימלי לכל צ'אט (הודעה לשנייה), ומספר שליחות חסום בו-זמנית.
+תשובת 429 (RetryAfter) עוצרת את כל השליחה למשך retry_after ששלח טלגרם ואז
+ההודעה נשלחת שוב; שגיאת חיבור שקרתה לפני שהבקשה יצאה מקבלת backoff. timeout
+או שגיאת רשת אחרי שהבקשה נשלחה לא נשלחים שוב, כי טלגרם אולי כבר מסר את
+ההודעה. זמן השידור נקבע לפי מגבלת הקצב ולא לפי מספר הסבבים מול המסד.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Telegram allows about 30 messages per second per bot and 1 per second per chat.
+GLOBAL_RATE_PER_SECOND = _env_float("TELEGRAM_BROADCAST_RATE", 25)
+PER_CHAT_INTERVAL_SECONDS = _env_float("TELEGRAM_PER_CHAT_INTERVAL", 1.0)
+BROADCAST_CONCURRENCY = max(int(_env_float("TELEGRAM_BROADCAST_CONCURRENCY", 8)), 1)
+MAX_SEND_ATTEMPTS = 4
+
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second, bursts up to capacity."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = float(capacity if capacity is not None else max(self.rate, 1))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stops handing out tokens for seconds (Telegram's flood wait)."""
+        now = self._clock()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+
+def retry_after_seconds(error):
+    """Seconds from a RetryAfter-style error (int or timedelta), else None."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# httpx errors raised before the request left this process.
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def failed_before_sending(error):
+    """
+    True when the request never reached Telegram, so sending again cannot
+    duplicate the message. python-telegram-bot wraps httpx errors in
+    TimedOut/NetworkError, so the cause chain is checked as well.
+    """
+    while error is not None:
+        if isinstance(error, _NOT_SENT_ERRORS):
+            return True
+        error = error.__cause__
+    return False
+
+
+class TelegramBroadcaster:
+    """
+    Sends many messages through send(**message) (e.g. bot.send_message)
+    within Telegram's limits. Errors of a permanent_errors type (user blocked
+    the bot, bad request) are not retried, and neither are timeouts or network
+    errors after the request was sent (counted as "unconfirmed").
+    """
+
+    def __init__(self, send, rate=None, per_chat_interval=None, concurrency=None,
+                 max_attempts=MAX_SEND_ATTEMPTS, permanent_errors=(), backoff=1.0):
+        self._send = send
+        self.bucket = TokenBucket(rate if rate is not None else GLOBAL_RATE_PER_SECOND)
+        self.per_chat_interval = (
+            per_chat_interval if per_chat_interval is not None else PER_CHAT_INTERVAL_SECONDS
+        )
+        self._semaphore = asyncio.Semaphore(concurrency or BROADCAST_CONCURRENCY)
+        self.max_attempts = max(int(max_attempts), 1)
+        self.permanent_errors = tuple(permanent_errors)
+        self.backoff = backoff
+        self._next_for_chat = {}
+        self.stats = {"sent": 0, "failed": 0, "unconfirmed": 0, "retries": 0, "flood_waits": 0}
+
+    async def _chat_turn(self, chat_id):
+        # Reserve the chat's next slot before sleeping so concurrent sends queue up.
+        now = time.monotonic()
+        slot = max(now, self._next_for_chat.get(chat_id, 0.0))
+        self._next_for_chat[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(self, chat_id, **message):
+        """Sends one message; True on success, False if it failed or may not have arrived."""
+        async with self._semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                await self._chat_turn(chat_id)
+                await self.bucket.acquire()
+                try:
+                    await self._send(chat_id=chat_id, **message)
+                    self.stats["sent"] += 1
+                    return True
+                except self.permanent_errors as e:
+                    logger.warning(f"Not retrying message to chat {chat_id}: {e}")
+                    break
+                except Exception as e:
+                    wait = retry_after_seconds(e)
+                    if wait is None and not failed_before_sending(e):
+                        # Telegram may have delivered it already; a resend would duplicate.
+                        logger.warning(f"Message to chat {chat_id} may not have been delivered: {e!r}")
+                        self.stats["unconfirmed"] += 1
+                        return False
+                    if attempt == self.max_attempts:
+                        logger.error(f"Giving up on message to chat {chat_id}: {e}")
+                        break
+                    self.stats["retries"] += 1
+                    if wait is not None:
+                        self.stats["flood_waits"] += 1
+                        logger.warning(f"Telegram flood control: pausing sends for {wait}s")
+                        self.bucket.pause(wait)
+                    else:
+                        await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            self.stats["failed"] += 1
+            return False
+
+    async def send_all(self, messages):
+        """Sends every {"chat_id": ..., **kwargs} message concurrently; returns stats."""
+        await asyncio.gather(*(self.send(**message) for message in messages))
+        return dict(self.stats)
+
+
+def group_rows_by_chat(rows, fields=("user_id", "gender")):
+    """Groups joined (chat, item) rows into {chat_id: {fields..., "items": [row]}}, keeping order."""
+    grouped = {}
+    for row in rows:
+        entry = grouped.get(row["telegram_chat_id"])
+        if entry is None:
+            entry = {field: row[field] for field in fields}
+            entry["items"] = []
+            grouped[row["telegram_chat_id"]] = entry
+        entry["items"].append(row)
+    return grouped
@@ -0,0 +1,141 @@
+# app/utils/transaction_ingest.py
+"""
+קליטת עסקאות קופון שנגרפו (Multipass / Max / BuyMe / GitHub JSON).
+
+במקום לקרוא את האסמכתאות הקיימות, למחוק את כל ההיסטוריה ולהוסיף שורה-שורה,
+כל העסקאות נכנסות ב-INSERT רב-שורות אחד עם ON CONFLICT DO NOTHING על
+(coupon_id, reference_number), ו-used_value מחושב מחדש מיד אחר כך באותה
+טרנזקציה. ריצה חוזרת עם אותם נתונים לא משנה דבר.
+"""
+import logging
+import math
+
+import pandas as pd
+from sqlalchemy import delete, func, select
+
+from app.extensions import db
+from app.models import CouponTransaction
+from app.utils.db_utils import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_SIZE = 1000
+
+
+def _clean_amount(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+def _clean_date(value):
+    if value is None or pd.isna(value) or str(value) in ("NaT", "NaN", "nat", "nan"):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def _transaction_rows(coupon_id, df, source):
+    rows = {}
+    for record in df.to_dict("records"):
+        reference = str(record.get("reference_number", "") or "")
+        location = record.get("location", "")
+        location = "" if location is None or pd.isna(location) else str(location)
+        if (CouponTransaction.has_invalid_text(location)
+                or CouponTransaction.has_invalid_text(reference)):
+            logger.info(
+                "Skipping invalid transaction for coupon %s: %r / %r",
+                coupon_id, location, reference,
+            )
+            continue
+        # The first row wins, like the unique constraint would.
+        rows.setdefault(reference, {
+            "coupon_id": coupon_id,
+            "transaction_date": _clean_date(record.get("transaction_date")),
+            "location": location,
+            "recharge_amount": _clean_amount(record.get("recharge_amount", 0.0)),
+            "usage_amount": _clean_amount(record.get("usage_amount", 0.0)),
+            "reference_number": reference,
+            "source": source,
+        })
+    return list(rows.values())
+
+
+def ingest_coupon_transactions(coupon, df, source, history_complete=False,
+                               update_value=False, recompute_always=True, commit=True):
+    """
+    מכניס את עסקאות ה-DataFrame (אחרי normalize) לקופון ומעדכן את used_value
+    לפי סכום כל העסקאות שלו.
+
+    history_complete - הקורא מאשר שהגריפה מכילה את כל ההיסטוריה (למשל כל
+    הדפים עד שכפתור "הבא" כבוי). רק אז נמחקות עסקאות של אותו source שכבר לא
+    מופיעות בגריפה, כך שהטבלה משקפת את האתר בלי לגעת בעסקאות שהוזנו ידנית.
+    גריפה חלקית בלי האישור הזה לעולם לא מוחקת דבר.
+    update_value - מעדכן גם את value לסכום הטעינות, אם יש כאלה.
+    recompute_always=False - אם לא נוספה ולא נמחקה אף עסקה, הקופון לא נוגע.
+
+    מחזיר dict: inserted, inserted_refs, pruned, used_value, recharged_value.
+    """
+    table = CouponTransaction.__table__
+    rows = _transaction_rows(coupon.id, df, source)
+
+    inserted_refs = set()
+    for start in range(0, len(rows), INGEST_CHUNK_SIZE):
+        stmt = (
+            dialect_insert(table)
+            .values(rows[start:start + INGEST_CHUNK_SIZE])
+            .on_conflict_do_nothing(index_elements=["coupon_id", "reference_number"])
+            .returning(table.c.reference_number)
+        )
+        inserted_refs.update(db.session.execute(stmt).scalars())
+
+    pruned = 0
+    if history_complete and rows:
+        pruned = db.session.execute(
+            delete(table).where(
+                table.c.coupon_id == coupon.id,
+                table.c.source == source,
+                table.c.reference_number.notin_([row["reference_number"] for row in rows]),
+            )
+        ).rowcount or 0
+
+    if not recompute_always and not inserted_refs and not pruned:
+        return {
+            "inserted": 0,
+            "inserted_refs": inserted_refs,
+            "pruned": 0,
+            "used_value": coupon.used_value,
+            "recharged_value": None,
+        }
+
+    totals = db.session.execute(
+        select(
+            func.coalesce(func.sum(table.c.usage_amount), 0.0),
+            func.coalesce(func.sum(table.c.recharge_amount), 0.0),
+        ).where(table.c.coupon_id == coupon.id)
+    ).one()
+    used_value, recharged_value = float(totals[0]), float(totals[1])
+
+    # Assigned through the ORM so the user_coupon_summary hooks see the change.
+    coupon.used_value = used_value
+    if update_value and recharged_value > 0:
+        coupon.value = recharged_value
+
+    if commit:
+        db.session.commit()
+
+    result = {
+        "inserted": len(inserted_refs),
+        "inserted_refs": inserted_refs,
+        "pruned": pruned,
+        "used_value": used_value,
+        "recharged_value": recharged_value,
+    }
+    logger.info(
+        "Ingested transactions for coupon %s: %d new, %d pruned, used_value=%.2f",
+        coupon.id, result["inserted"], pruned, used_value,
+    )
+    return result
@@ -0,0 +1,172 @@
+# app/utils/user_identity.py
+"""
+מטמון זהות משתמש עבור ה-user_loader של Flask-Login.
+
+load_user הריץ User.query.get בתחילת כל בקשה מחוברת, גם בבקשות polling
+(/update_code_view, /track_coupon_viewer, /get_active_viewers) שצריכות רק את
+current_user.id. כאן:
+- snapshot קטן (dict, לא ORM) של השדות שנדרשים להרשאות ולתבניות נשמר במטמון
+  המשותף ל-USER_IDENTITY_TTL_SECONDS; בקשה שמוצאת אותו לא ניגשת לטבלת users.
+- CachedUser עונה מה-snapshot, וטוען את ה-User המלא רק כשה-view ניגש לשדה
+  אחר, לקשר (coupons וכו'), למתודה, או כותב שדה.
+- כל UPDATE/DELETE של User דרך ה-ORM (פרופיל, אדמין, סלוטים, מחיקה) מוחק את
+  ה-snapshot אחרי ה-commit, בכל ה-workers.
+- בבקשות שמשנות מצב (POST וכו') יתרות הסלוטים נקראות תמיד מהשורה עצמה, כדי
+  ש-"current_user.slots -= 1" לא יתבסס על ערך מהמטמון.
+"""
+import logging
+
+from flask import g, has_request_context, request
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import cache, db
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+USER_IDENTITY_TTL_SECONDS = 30
+USER_IDENTITY_KEY_PREFIX = "user_identity:v1:"
+
+# Only columns that are written through the ORM (so every change invalidates).
+# show_whatsapp_banner / dismissed_message_id are reset with bulk UPDATEs, and
+# the Telegram bot decrements slots_automatic_coupons with raw SQL; those are
+# therefore read from the row.
+SNAPSHOT_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "gender",
+    "is_admin",
+    "is_confirmed",
+    "is_deleted",
+    "slots",
+    "newsletter_subscription",
+    "telegram_monthly_summary",
+    "profile_image",
+)
+# Read-modify-write targets: taken from the row on state-changing requests.
+BALANCE_FIELDS = frozenset({"slots"})
+_SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+_DIRTY_KEY = "user_identity_dirty"
+
+
+def _cache_key(user_id):
+    return f"{USER_IDENTITY_KEY_PREFIX}{user_id}"
+
+
+def snapshot_of(user):
+    return {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+
+
+class CachedUser(UserMixin):
+    """
+    current_user backed by a snapshot dict; anything outside it (and every
+    write) goes to the ORM User, loaded at most once per request.
+    """
+
+    def __init__(self, snapshot, user=None):
+        object.__setattr__(self, "_snapshot", snapshot)
+        object.__setattr__(self, "_user", user)
+        object.__setattr__(self, "_stale", False)
+
+    @property
+    def orm(self):
+        """The full User row (loaded on first use)."""
+        user = self._user
+        if user is None:
+            user = db.session.get(User, self._snapshot["id"])
+            object.__setattr__(self, "_user", user)
+        return user
+
+    def _from_snapshot(self, name):
+        if self._user is not None or self._stale or name not in self._snapshot:
+            return False
+        if name in BALANCE_FIELDS and has_request_context() and request.method not in _SAFE_METHODS:
+            return False
+        return True
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if self._from_snapshot(name):
+            return self._snapshot[name]
+        user = self.orm
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.orm, name, value)
+
+    def expire(self):
+        """Stops serving the snapshot for the rest of the request."""
+        object.__setattr__(self, "_stale", True)
+
+    def get_id(self):
+        return str(self._snapshot["id"])
+
+    def __repr__(self):
+        return f"<CachedUser {self._snapshot['id']}>"
+
+
+def load_user_identity(user_id):
+    """Flask-Login user_loader: a CachedUser from the shared cache, else from the row."""
+    user_id = int(user_id)
+    key = _cache_key(user_id)
+    try:
+        snapshot = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Could not read user identity {user_id} from cache: {e}")
+        snapshot = None
+    if snapshot is not None:
+        return CachedUser(snapshot)
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    snapshot = snapshot_of(user)
+    try:
+        cache.set(key, snapshot, timeout=USER_IDENTITY_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not cache user identity {user_id}: {e}")
+    return CachedUser(snapshot, user)
+
+
+def invalidate_user_identity(*user_ids):
+    """Drops the cached identity of user_ids, here and for every worker."""
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if not user_ids:
+        return
+    try:
+        cache.delete_many(*[_cache_key(user_id) for user_id in user_ids])
+    except Exception as e:
+        logger.warning(f"Could not invalidate user identities {user_ids}: {e}")
+    if has_request_context():
+        current = g.get("_login_user")
+        if isinstance(current, CachedUser) and current._snapshot["id"] in user_ids:
+            current.expire()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_dirty(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_DIRTY_KEY, set()).add(target.id)
+
+
+# Ids left over from a rolled-back transaction are simply invalidated with the
+# next commit; an extra cache miss is harmless.
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session):
+    user_ids = session.info.pop(_DIRTY_KEY, None)
+    if user_ids:
+        invalidate_user_identity(*user_ids)
+
@@ -0,0 +1,61 @@
+"""Add code_hash blind index column to coupon table
+
+Revision ID: add_coupon_code_hash
+Revises: 6b5676ac5bc0
+Create Date: 2026-10-18 09:00:00.000000
+
+Coupon.code is stored as randomized Fernet ciphertext, so lookups by code had
+to decrypt the whole table. code_hash holds a keyed HMAC of the plaintext code
+(app.models.compute_code_hash) and is indexed for equality lookups.
+Existing rows are backfilled here; the key must match the running app
+(CODE_HASH_KEY, or the default derived from ENCRYPTION_KEY).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_coupon_code_hash'
+down_revision = '6b5676ac5bc0'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def upgrade():
+    with op.batch_alter_table('coupon', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('code_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_coupon_code_hash', 'coupon', ['code_hash'])
+
+    from app.models import compute_code_hash
+
+    bind = op.get_bind()
+    last_id = None
+    while True:
+        params = {"limit": BACKFILL_BATCH_SIZE}
+        where = "code_hash IS NULL"
+        if last_id is not None:
+            where += " AND id > :last_id"
+            params["last_id"] = last_id
+        rows = bind.execute(
+            sa.text(f"SELECT id, code FROM coupon WHERE {where} ORDER BY id LIMIT :limit"),
+            params,
+        ).fetchall()
+        if not rows:
+            break
+        updates = [
+            {"id": row.id, "code_hash": compute_code_hash(row.code)}
+            for row in rows
+        ]
+        bind.execute(
+            sa.text("UPDATE coupon SET code_hash = :code_hash WHERE id = :id"),
+            updates,
+        )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index('ix_coupon_code_hash', table_name='coupon')
+    with op.batch_alter_table('coupon', schema=None) as batch_op:
+        batch_op.drop_column('code_hash')
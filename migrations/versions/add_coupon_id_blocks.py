@@ -0,0 +1,36 @@
+"""Add coupon ID block sequence / counter
+
+Revision ID: add_coupon_id_blocks
+Revises: add_notification_dedupe_key
+Create Date: 2026-10-18 16:00:00.000000
+
+Coupon IDs are handed out from per-process blocks (app/utils/coupon_ids.py).
+On Postgres the block numbers come from coupon_id_block_seq; the
+coupon_id_blocks counter table is the fallback for databases without sequences.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_coupon_id_blocks'
+down_revision = 'add_notification_dedupe_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'coupon_id_blocks',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('next_block', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE SEQUENCE IF NOT EXISTS coupon_id_block_seq')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP SEQUENCE IF EXISTS coupon_id_block_seq')
+    op.drop_table('coupon_id_blocks')
@@ -0,0 +1,48 @@
+"""Add email_outbox table
+
+Revision ID: add_email_outbox
+Revises: add_gpt_usage_cache_hit
+Create Date: 2026-10-18 19:00:00.000000
+
+Queue of outgoing emails drained in Brevo batches by app/utils/email_outbox.py.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_email_outbox'
+down_revision = 'add_gpt_usage_cache_hit'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sender_email', sa.String(length=255), nullable=False),
+        sa.Column('sender_name', sa.String(length=255), nullable=True),
+        sa.Column('recipient_email', sa.String(length=255), nullable=False),
+        sa.Column('recipient_name', sa.String(length=255), nullable=True),
+        sa.Column('subject', sa.String(length=998), nullable=False),
+        sa.Column('html_content', sa.Text(), nullable=False),
+        sa.Column('params', sa.Text(), nullable=True),
+        sa.Column('template_key', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.text('now()')),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('message_id', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('sent_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_outbox_template_key', 'email_outbox', ['template_key'])
+    op.create_index('ix_email_outbox_status_next_attempt', 'email_outbox', ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_status_next_attempt', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_template_key', table_name='email_outbox')
+    op.drop_table('email_outbox')
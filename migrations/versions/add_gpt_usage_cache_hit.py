@@ -0,0 +1,30 @@
+"""Add cache_hit to gpt_usage
+
+Revision ID: add_gpt_usage_cache_hit
+Revises: add_coupon_id_blocks
+Create Date: 2026-10-18 17:00:00.000000
+
+Marks GPT usage rows answered from the extraction response cache
+(app/utils/gpt_cache.py); those rows carry zero tokens and zero cost.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_gpt_usage_cache_hit'
+down_revision = 'add_coupon_id_blocks'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('gpt_usage', schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column('cache_hit', sa.Boolean(), nullable=False, server_default=sa.false())
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('gpt_usage', schema=None) as batch_op:
+        batch_op.drop_column('cache_hit')
@@ -0,0 +1,30 @@
+"""Add outbox_id to newsletter_sendings
+
+Revision ID: add_newsletter_sending_outbox_id
+Revises: add_email_outbox
+Create Date: 2026-10-18 21:00:00.000000
+
+Links a queued newsletter sending to its email_outbox row, so the outbox's
+sent/failed result is copied back to the sending.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_newsletter_sending_outbox_id'
+down_revision = 'add_email_outbox'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('newsletter_sendings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('outbox_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_newsletter_sendings_outbox_id', ['outbox_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('newsletter_sendings', schema=None) as batch_op:
+        batch_op.drop_index('ix_newsletter_sendings_outbox_id')
+        batch_op.drop_column('outbox_id')
@@ -0,0 +1,30 @@
+"""Add dedupe_key to notifications
+
+Revision ID: add_notification_dedupe_key
+Revises: add_user_coupon_summary
+Create Date: 2026-10-18 14:00:00.000000
+
+Unique, nullable key used by the bulk coupon status reconciler to insert
+expired/fully-used notifications with ON CONFLICT DO NOTHING.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_notification_dedupe_key'
+down_revision = 'add_user_coupon_summary'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dedupe_key', sa.String(length=100), nullable=True))
+        batch_op.create_unique_constraint('uq_notifications_dedupe_key', ['dedupe_key'])
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_notifications_dedupe_key', type_='unique')
+        batch_op.drop_column('dedupe_key')
@@ -0,0 +1,77 @@
+"""Add user_coupon_summary table
+
+Revision ID: add_user_coupon_summary
+Revises: add_coupon_code_hash
+Create Date: 2026-10-18 12:00:00.000000
+
+Per-user coupon totals (one row per user and category) maintained
+incrementally by app.analytics.user_summary. The table is filled here from
+the current coupon rows; scripts/rebuild_user_coupon_summary.py repeats the
+same rebuild for repair.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_user_coupon_summary'
+down_revision = 'add_coupon_code_hash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_coupon_summary',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('category', sa.String(length=20), nullable=False),
+        sa.Column('coupon_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('active_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('active_one_time_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('one_time_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_value', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('used_value', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('remaining_value', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('savings', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'category'),
+    )
+
+    op.execute(
+        """
+        INSERT INTO user_coupon_summary (
+            user_id, category, coupon_count, active_count, active_one_time_count,
+            one_time_count, total_value, used_value, remaining_value, savings, updated_at
+        )
+        SELECT
+            user_id,
+            CASE
+                WHEN is_for_sale = true THEN 'for_sale'
+                WHEN exclude_saving = true THEN 'excluded'
+                ELSE 'countable'
+            END,
+            COUNT(id),
+            SUM(CASE WHEN status = 'פעיל' AND NOT COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 'פעיל' AND COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+            SUM(CASE WHEN COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+            COALESCE(SUM(value), 0),
+            COALESCE(SUM(used_value), 0),
+            SUM(CASE WHEN value > used_value THEN value - used_value ELSE 0 END),
+            SUM(CASE WHEN value > cost THEN value - cost ELSE 0 END),
+            CURRENT_TIMESTAMP
+        FROM coupon
+        WHERE user_id IS NOT NULL
+        GROUP BY
+            user_id,
+            CASE
+                WHEN is_for_sale = true THEN 'for_sale'
+                WHEN exclude_saving = true THEN 'excluded'
+                ELSE 'countable'
+            END
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('user_coupon_summary')
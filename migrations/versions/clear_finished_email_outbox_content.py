@@ -0,0 +1,34 @@
+"""Clear the body of finished email_outbox rows
+
+Revision ID: clear_finished_email_outbox_content
+Revises: add_newsletter_sending_outbox_id
+Create Date: 2026-10-18 22:00:00.000000
+
+drain_outbox now drops html_content/params once a row is sent or failed
+(they can hold reset links, tokens and decrypted coupon codes), so the
+column becomes nullable and rows finished before this change are cleared.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'clear_finished_email_outbox_content'
+down_revision = 'add_newsletter_sending_outbox_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.alter_column('html_content', existing_type=sa.Text(), nullable=True)
+    op.execute(
+        "UPDATE email_outbox SET html_content = NULL, params = NULL "
+        "WHERE status IN ('sent', 'failed')"
+    )
+
+
+def downgrade():
+    op.execute("UPDATE email_outbox SET html_content = '' WHERE html_content IS NULL")
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.alter_column('html_content', existing_type=sa.Text(), nullable=False)
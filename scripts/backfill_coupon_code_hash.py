@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Fill in coupon.code_hash for rows that were written without it.
+
+The Flask app and the Telegram bot always store the hash, but clients that
+insert coupons directly (the iOS app, manual SQL) leave it NULL. Lookups
+still find those rows by decrypting them; render.yaml runs this script every
+15 minutes as a cron job to keep that fallback small. To run it by hand:
+
+    python scripts/backfill_coupon_code_hash.py
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Rows decrypted and updated per batch (default: 500).',
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    logger = logging.getLogger('backfill_coupon_code_hash')
+
+    from app import create_app
+    from app.extensions import db
+    from app.models import Coupon
+
+    app = create_app()
+    with app.app_context():
+        try:
+            updated = Coupon.backfill_code_hashes(batch_size=args.batch_size)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Backfilling coupon.code_hash failed")
+            sys.exit(1)
+
+    logger.info(f"coupon.code_hash filled in for {updated} rows")
+
+
+if __name__ == '__main__':
+    main()
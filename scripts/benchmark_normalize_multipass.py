@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for normalize_multipass_dataframe on synthetic Multipass tables.
+
+Compares the vectorized implementation against the previous per-cell
+Series.apply / DataFrame.apply(axis=1) version, and checks both produce the
+same frame:
+
+    python scripts/benchmark_normalize_multipass.py
+    python scripts/benchmark_normalize_multipass.py --rows 50000 --repeat 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pandas as pd
+
+
+def build_table(rows, seed=0):
+    """
+    A raw Multipass table as read from the site, with the usual noise: each
+    row is either a budget load or a redemption, so the other amount column
+    holds ₪0.00, and most rows have no discount.
+    """
+    rng = random.Random(seed)
+    formats = ["₪{:,.2f}", "{:,.2f} ₪", "\u200f{:.2f}\u200e"]
+    recharge, original, usage = [], [], []
+    for _ in range(rows):
+        amount = rng.choice(formats).format(round(rng.uniform(5, 2000), 1))
+        if rng.random() < 0.1:
+            recharge.append(amount)
+            original.append("₪0.00")
+            usage.append("₪0.00")
+        else:
+            recharge.append("₪0.00")
+            original.append(amount)
+            usage.append(amount.replace("₪", "−₪") if rng.random() < 0.02 else amount)
+    return pd.DataFrame({
+        "תאריך ושעה": [
+            f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024 {rng.randint(0, 23):02d}:00"
+            for _ in range(rows)
+        ],
+        "סוג פעולה": [rng.choice(["מימוש", "טעינה"]) for _ in range(rows)],
+        "בית עסק": [rng.choice([" שופרסל ", "רמי לוי", "Fox"]) for _ in range(rows)],
+        "סכום טעינת תקציב": recharge,
+        "סכום עסקה מקורי": original,
+        "סכום מימוש תקציב": usage,
+        "הנחה": [rng.choice(["", None, "₪0.00", "₪0.00", "₪5.00"]) for _ in range(rows)],
+        "אסמכתא": [
+            rng.choice([f"R {rng.randint(1, 10**8)}", f"R {rng.randint(1, 10**8)}", "", None])
+            for _ in range(rows)
+        ],
+    })
+
+
+def legacy_normalize(df, coupon_number, debug_print=lambda *_: None):
+    """The previous implementation: per-cell Series.apply and row-wise apply."""
+    if df is None or df.empty:
+        debug_print("No Multipass rows provided for normalization")
+        return df
+
+    df = df.copy()
+    df.columns = [str(col).strip() for col in df.columns]
+
+    rename_map = {
+        "תאריך ושעה": "transaction_date",
+        "תאריך": "transaction_date",
+        "סוג פעולה": "operation_type",
+        "בית עסק": "location",
+        "שם בית עסק": "location",
+        "סכום טעינת תקציב": "recharge_amount",
+        "סכום עסקה מקורי": "original_amount",
+        "סכום מימוש תקציב": "usage_amount",
+        "הנחה": "discount",
+        "שם הטבה": "benefit_name",
+        "כמות": "quantity",
+        "אסמכתא": "reference_number",
+        "מספר אסמכתא": "reference_number",
+    }
+
+    df.rename(columns=rename_map, inplace=True)
+
+    def _parse_currency(value):
+        if pd.isna(value):
+            return 0.0
+        text = str(value)
+        text = (
+            text.replace("₪", "")
+            .replace("\u20aa", "")
+            .replace(",", "")
+            .replace("\u200e", "")
+            .replace("\u200f", "")
+            .replace("−", "-")
+        )
+        text = "".join(ch for ch in text if ch.isdigit() or ch in ".-")
+        if not text or text in {"-", ""}:
+            return 0.0
+        try:
+            return float(text)
+        except ValueError:
+            return 0.0
+
+    numeric_columns = ["recharge_amount", "original_amount", "usage_amount", "discount"]
+    for column in numeric_columns:
+        if column in df.columns:
+            df[column] = df[column].apply(_parse_currency)
+        else:
+            df[column] = 0.0
+
+    if "transaction_date" in df.columns:
+        df["transaction_date"] = pd.to_datetime(
+            df["transaction_date"], dayfirst=True, errors="coerce"
+        )
+    else:
+        df["transaction_date"] = pd.NaT
+
+    for text_column in ["location", "operation_type", "benefit_name", "quantity"]:
+        if text_column in df.columns:
+            df[text_column] = df[text_column].astype(str).str.strip()
+        else:
+            df[text_column] = ""
+
+    if "reference_number" not in df.columns:
+        df["reference_number"] = ""
+
+    df["reference_number"] = (
+        df["reference_number"]
+        .astype(str)
+        .fillna("")
+        .str.replace(r"\s+", "", regex=True)
+    )
+
+    def _ensure_reference(row):
+        value = row["reference_number"]
+        if value in {"", "-", "nan", "None"}:
+            return f"{coupon_number}|{int(row.name) + 1}"
+        return value
+
+    df["reference_number"] = df.apply(_ensure_reference, axis=1)
+    df.reset_index(drop=True, inplace=True)
+
+    debug_print(
+        f"Normalized Multipass DataFrame with {len(df)} rows and columns: {list(df.columns)}"
+    )
+    return df
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000, help='Rows per synthetic table')
+    parser.add_argument('--repeat', type=int, default=5, help='Best-of repetitions')
+    args = parser.parse_args()
+
+    os.environ.setdefault("TESTING", "1")
+    from app.helpers import normalize_multipass_dataframe
+
+    raw = build_table(args.rows)
+    coupon_number = "123456789"
+
+    new_seconds, normalized = best_of(
+        args.repeat, lambda: normalize_multipass_dataframe(raw, coupon_number)
+    )
+
+    old_seconds, legacy = best_of(
+        args.repeat, lambda: legacy_normalize(raw, coupon_number)
+    )
+
+    pd.testing.assert_frame_equal(normalized, legacy)
+
+    print(f"rows: {args.rows}")
+    print(f"legacy (per-cell apply):   {old_seconds * 1000:8.1f} ms")
+    print(f"vectorized:                {new_seconds * 1000:8.1f} ms")
+    print(f"speedup:                   {old_seconds / new_seconds:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
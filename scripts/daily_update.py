@@ -100,8 +100,8 @@ def main():
                     try:
                         df = get_coupon_data_with_retry(cpn, max_retries=3)  
                         if df is not None:
-                            total_usage = float(df["usage_amount"].sum())
-                            cpn.used_value = total_usage
+                            # get_coupon_data already set used_value from all stored transactions.
+                            total_usage = float(cpn.used_value or 0)
                             update_coupon_status(cpn)
 
                             usage = CouponUsage(
@@ -201,6 +201,10 @@ def main():
     except Exception as e:
         logger.error(f"Fatal error in daily update: {str(e)}")
         sys.exit(1)
+    finally:
+        # The synchronous fallback scrapes in this process; quit pooled Chrome.
+        from app.utils.driver_pool import close_driver_pool
+        close_driver_pool()
 
 if __name__ == "__main__":
     main()
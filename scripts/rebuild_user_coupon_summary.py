@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Rebuild the user_coupon_summary table from the coupon table.
+
+The summary is maintained incrementally by the Flask app, but writers that
+bypass the ORM (the iOS app, manual SQL) can leave it out of date. render.yaml
+runs this script hourly as a cron job; it can also be run by hand, either for
+everyone or for specific users:
+
+    python scripts/rebuild_user_coupon_summary.py
+    python scripts/rebuild_user_coupon_summary.py --user-id 12 --user-id 34
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--user-id',
+        type=int,
+        action='append',
+        dest='user_ids',
+        help='Rebuild only this user (can be repeated). Default: all users.',
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    logger = logging.getLogger('rebuild_user_coupon_summary')
+
+    from app import create_app
+    from app.extensions import db
+    from app.analytics.user_summary import rebuild_user_summaries
+
+    app = create_app()
+    with app.app_context():
+        try:
+            rebuild_user_summaries(args.user_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Rebuilding user_coupon_summary failed")
+            sys.exit(1)
+
+    scope = f"users {args.user_ids}" if args.user_ids else "all users"
+    logger.info(f"user_coupon_summary rebuilt for {scope}")
+
+
+if __name__ == '__main__':
+    main()
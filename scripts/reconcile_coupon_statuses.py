@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Set-based coupon status reconciliation for cron jobs.
+
+Marks fully used and expired coupons (and re-activates coupons that no longer
+qualify for either) with a few bulk UPDATE statements, then inserts the
+matching notifications once each:
+
+    python scripts/reconcile_coupon_statuses.py
+    python scripts/reconcile_coupon_statuses.py --user-id 12 --no-notify
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+# Add the app directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--user-id',
+        type=int,
+        action='append',
+        dest='user_ids',
+        help='Reconcile only this user (can be repeated). Default: all users.',
+    )
+    parser.add_argument(
+        '--no-notify',
+        action='store_true',
+        help='Update statuses without creating notifications.',
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    logger = logging.getLogger('reconcile_coupon_statuses')
+
+    from app import create_app
+    from app.extensions import db
+    from app.utils.status_reconciler import reconcile_coupon_statuses
+
+    app = create_app()
+    with app.app_context():
+        try:
+            counts = reconcile_coupon_statuses(
+                user_ids=args.user_ids, notify=not args.no_notify
+            )
+        except Exception:
+            db.session.rollback()
+            logger.exception("Coupon status reconciliation failed")
+            sys.exit(1)
+
+    logger.info(
+        f"Marked used: {counts['used']}, expired: {counts['expired']}, "
+        f"re-activated: {counts['reactivated']}, notifications: {counts['notifications']}"
+    )
+
+
+if __name__ == '__main__':
+    main()
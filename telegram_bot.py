@@ -2,7 +2,7 @@ import os
 import logging
 import requests
 import asyncio
-import psycopg2
+import time
 import hashlib
 import secrets
 from datetime import datetime, timezone, timedelta
@@ -22,10 +22,10 @@ else:
     PYTHON_313_INCOMPATIBLE = False
 
 from telegram import Update
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
 from cryptography.fernet import Fernet
-import asyncpg
 from enum import Enum
 import httpx
 import re
@@ -35,7 +35,14 @@ from fuzzywuzzy import fuzz
 import sys
 sys.path.append('/app')
 from app.helpers import extract_coupon_detail_sms
+from app.models import compute_code_hash
 from app.telegram_bot_flag import get_telegram_bot_flag
+from app.utils.async_db_pool import AsyncConnectionPool
+from app.utils.company_index import CompanyIndex
+from app.utils.coupon_ids import COUPON_ID_SEQUENCE, CouponIdAllocator
+from app.utils.event_loop import LoopLagMonitor, run_blocking
+from app.utils.session_cache import TelegramSessionCache
+from app.utils.telegram_broadcast import TelegramBroadcaster, group_rows_by_chat
 
 # Load environment variables
 load_dotenv()
@@ -66,6 +73,10 @@ ENABLE_BOT, ENABLE_BOT_SOURCE = get_telegram_bot_flag()
 
 # Session timeout configuration - configurable via environment variable
 SESSION_TIMEOUT_MINUTES = int(os.getenv('SESSION_TIMEOUT_MINUTES', '10080'))
+# How long a validated session is trusted without re-reading telegram_users,
+# and how often coalesced expiry extensions are written back
+SESSION_CACHE_TTL_SECONDS = int(os.getenv('SESSION_CACHE_TTL_SECONDS', '60'))
+SESSION_FLUSH_INTERVAL_SECONDS = float(os.getenv('SESSION_FLUSH_INTERVAL_SECONDS', '5'))
 
 # Reminder time configuration (hour and minute in Israel time)
 REMINDER_HOUR = int(os.getenv('REMINDER_HOUR', '10'))
@@ -440,57 +451,149 @@ def validate_ai_text_input(text):
     return True, None
 
 # Setup database connection
-def get_db_connection():
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is not set")
-    # Remove the +psycopg2 part from the URL for direct psycopg2 connection
-    if database_url.startswith('postgresql+psycopg2://'):
-        database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-    return psycopg2.connect(database_url)
+# All bot DB access goes through the asyncpg pool below; anything synchronous
+# (OpenAI calls, psycopg2) must go through run_blocking so it never stalls the
+# single event loop that serves every chat.
+# One asyncpg pool for the whole bot, opened at startup (or on first use) on the
+# bot's event loop. Sized by TELEGRAM_DB_POOL_MIN_SIZE / TELEGRAM_DB_POOL_MAX_SIZE,
+# TELEGRAM_DB_POOL_ACQUIRE_TIMEOUT caps the wait for a free connection.
+db_pool = AsyncConnectionPool()
 
 async def get_async_db_connection():
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL environment variable is not set")
-    # Remove the +psycopg2 part from the URL for asyncpg connection
-    if database_url.startswith('postgresql+psycopg2://'):
-        database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-    return await asyncpg.connect(database_url, statement_cache_size=0)
+    """A connection from db_pool; conn.close() returns it to the pool."""
+    return await db_pool.connection()
+
+async def open_db_pool(application=None):
+    await db_pool.open()
+    logger.info(f"Database pool ready: {db_pool.stats()}")
+
+async def close_db_pool(application=None):
+    logger.info(f"Closing database pool: {db_pool.stats()}")
+    await db_pool.close()
+
+# Logs (with the loop thread's stack) whenever a handler blocks the event loop
+# for longer than LOOP_LAG_THRESHOLD_SECONDS.
+loop_lag_monitor = LoopLagMonitor()
+
+# Hot sessions are answered from memory; expiry extensions are written back in
+# batches by session_flush_loop
+session_cache = TelegramSessionCache(SESSION_TIMEOUT_MINUTES, ttl_seconds=SESSION_CACHE_TTL_SECONDS)
+session_flush_task = None
+
+async def flush_session_expiry():
+    if not session_cache.pending_count:
+        return
+    try:
+        async with db_pool.acquire() as conn:
+            await session_cache.flush(conn)
+    except Exception as e:
+        logger.error(f"Error flushing session expiry updates: {e}")
+
+async def session_flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL_SECONDS)
+        await flush_session_expiry()
+
+async def on_bot_startup(application=None):
+    global session_flush_task
+    await open_db_pool(application)
+    loop_lag_monitor.start()
+    if session_flush_task is None or session_flush_task.done():
+        session_flush_task = asyncio.create_task(session_flush_loop())
+
+async def on_bot_shutdown(application=None):
+    global session_flush_task
+    if session_flush_task is not None:
+        session_flush_task.cancel()
+        session_flush_task = None
+    await flush_session_expiry()
+    logger.info(f"Session cache stats: {session_cache.stats()}")
+    loop_lag_monitor.stop()
+    logger.info(f"Loop lag stats: {loop_lag_monitor.stats()}")
+    await close_db_pool(application)
+
+# Same aggregate as app.analytics.user_summary; the bot writes coupons with raw
+# SQL, so the ORM hooks that maintain user_coupon_summary never see them.
+USER_COUPON_SUMMARY_REBUILD_SQL = """
+    INSERT INTO user_coupon_summary (
+        user_id, category, coupon_count, active_count, active_one_time_count,
+        one_time_count, total_value, used_value, remaining_value, savings, updated_at
+    )
+    SELECT
+        user_id,
+        CASE
+            WHEN is_for_sale = true THEN 'for_sale'
+            WHEN exclude_saving = true THEN 'excluded'
+            ELSE 'countable'
+        END AS category,
+        COUNT(id),
+        SUM(CASE WHEN status = 'פעיל' AND NOT COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+        SUM(CASE WHEN status = 'פעיל' AND COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+        SUM(CASE WHEN COALESCE(is_one_time, false) THEN 1 ELSE 0 END),
+        COALESCE(SUM(value), 0),
+        COALESCE(SUM(used_value), 0),
+        SUM(CASE WHEN value > used_value THEN value - used_value ELSE 0 END),
+        SUM(CASE WHEN value > cost THEN value - cost ELSE 0 END),
+        NOW()
+    FROM coupon
+    WHERE user_id = $1
+    GROUP BY user_id, category
+"""
+
+async def refresh_user_coupon_summary(conn, user_id):
+    """Recompute the user's user_coupon_summary rows after a raw coupon write."""
+    try:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM user_coupon_summary WHERE user_id = $1", user_id)
+            await conn.execute(USER_COUPON_SUMMARY_REBUILD_SQL, user_id)
+    except Exception as e:
+        logger.error(f"Error refreshing coupon summary for user {user_id}: {e}")
+
+# Coupon IDs come from the same block allocator as the web app (app/utils/coupon_ids.py)
+coupon_id_allocator = CouponIdAllocator()
+
+async def allocate_coupon_id(conn):
+    """Next coupon ID; hits the database only when the reserved block runs out."""
+    while coupon_id_allocator.needs_block():
+        block_no = await conn.fetchval(f"SELECT nextval('{COUPON_ID_SEQUENCE}')")
+        ids = coupon_id_allocator.block_ids(block_no)
+        taken = await conn.fetch("SELECT id FROM coupon WHERE id = ANY($1::int[])", ids)
+        coupon_id_allocator.add_block(block_no, {row['id'] for row in taken})
+    return coupon_id_allocator.take()[0]
 
 async def check_session_validity(chat_id):
     """
     Check if user session is still valid based on verification_expires_at timestamp
     Returns (is_valid, user_id, user_gender)
     """
+    cached = session_cache.get(chat_id)
+    if cached:
+        return True, cached['user_id'], cached['gender']
     try:
-        conn = await get_async_db_connection()
-        
-        # Check if user exists and session is valid
-        query = """
-            SELECT user_id, verification_expires_at 
-            FROM telegram_users 
-            WHERE telegram_chat_id = $1 
-            AND is_verified = true
-        """
-        user = await conn.fetchrow(query, chat_id)
-        
-        if not user:
-            await conn.close()
-            return False, None, None
-        
-        # Check if session has expired
-        current_time = datetime.now(timezone.utc)
-        if user['verification_expires_at'] <= current_time:
-            # Session expired - disconnect user
-            await disconnect_user_session(conn, chat_id)
-            await conn.close()
-            return False, None, None
+        async with db_pool.acquire() as conn:
+            # Check if user exists and session is valid (gender in the same round trip)
+            query = """
+                SELECT tu.user_id, tu.verification_expires_at, u.gender
+                FROM telegram_users tu
+                LEFT JOIN users u ON u.id = tu.user_id
+                WHERE tu.telegram_chat_id = $1 
+                AND tu.is_verified = true
+            """
+            user = await conn.fetchrow(query, chat_id)
+            
+            if not user:
+                return False, None, None
+            
+            # Check if session has expired (counting extensions not yet flushed)
+            current_time = datetime.now(timezone.utc)
+            expires_at = session_cache.effective_expiry(chat_id, user['verification_expires_at'])
+            if expires_at <= current_time:
+                # Session expired - disconnect user
+                await disconnect_user_session(conn, chat_id)
+                return False, None, None
         
-        # Session is valid - get user gender
-        user_gender = await get_user_gender(user['user_id'])
-        await conn.close()
-        return True, user['user_id'], user_gender
+        session_cache.put(chat_id, user['user_id'], user['gender'], expires_at)
+        return True, user['user_id'], user['gender']
         
     except Exception as e:
         logger.error(f"Error checking session validity: {e}")
@@ -500,6 +603,7 @@ async def disconnect_user_session(conn, chat_id):
     """
     Disconnect user session by updating database
     """
+    session_cache.invalidate(chat_id)
     try:
         update_query = """
             UPDATE telegram_users 
@@ -518,35 +622,18 @@ async def disconnect_user_session(conn, chat_id):
 
 async def update_session_expiry(chat_id):
     """
-    Update session expiry time for active user
+    Update session expiry time for active user. The new expiry (now +
+    SESSION_TIMEOUT_MINUTES) is applied to the cache at once and written to
+    telegram_users, together with last_interaction, on the next flush.
     """
-    try:
-        conn = await get_async_db_connection()
-        
-        # Update expiry time to current time + SESSION_TIMEOUT_MINUTES
-        new_expiry = datetime.now(timezone.utc) + timedelta(minutes=SESSION_TIMEOUT_MINUTES)
-        
-        update_query = """
-            UPDATE telegram_users 
-            SET verification_expires_at = $1,
-                last_interaction = NOW()
-            WHERE telegram_chat_id = $2
-            AND is_verified = true
-        """
-        await conn.execute(update_query, new_expiry, chat_id)
-        await conn.close()
-        
-    except Exception as e:
-        logger.error(f"Error updating session expiry: {e}")
+    session_cache.extend(chat_id)
 
 # Check if user is admin
 async def is_user_admin(user_id):
     """Check if user has admin privileges"""
     try:
-        conn = await get_async_db_connection()
-        query = "SELECT is_admin FROM users WHERE id = $1"
-        result = await conn.fetchrow(query, user_id)
-        await conn.close()
+        async with db_pool.acquire() as conn:
+            result = await conn.fetchrow("SELECT is_admin FROM users WHERE id = $1", user_id)
         return result['is_admin'] if result else False
     except Exception as e:
         logger.error(f"Error checking admin status: {e}")
@@ -1201,6 +1288,7 @@ async def handle_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
             """
             
             logger.warning(f"[DEBUG] handle_code: Updating user user_id={user['user_id']} chat_id={chat_id}")
+            session_cache.invalidate(chat_id)
             updated_user = await conn.fetchrow(
                 update_query, 
                 chat_id,
@@ -1328,6 +1416,7 @@ async def disconnect(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_gender = await get_user_gender(user['user_id'])
         
         # Update user status and save disconnection time
+        session_cache.invalidate(chat_id)
         update_query = """
             UPDATE telegram_users 
             SET telegram_chat_id = NULL,
@@ -1426,7 +1515,8 @@ async def handle_company_choice(update: Update, context: ContextTypes.DEFAULT_TY
         # Fetch coupons for selected company
         selected_company = companies[choice - 1]['company']
         coupons_query = """
-            SELECT c.*, 
+            SELECT c.id, c.code, c.value, c.used_value, c.company,
+                   c.expiration, c.is_one_time, c.purpose,
                    CASE 
                        WHEN c.expiration IS NULL OR c.expiration::timestamp > NOW() THEN true 
                        ELSE false 
@@ -1734,7 +1824,8 @@ async def handle_menu_option(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if user_message == "1":
             # Fetch user's active coupons
             coupons_query = """
-                SELECT c.*, 
+                SELECT c.id, c.code, c.value, c.used_value, c.company,
+                       c.expiration, c.is_one_time, c.purpose,
                        CASE 
                            WHEN c.expiration IS NULL OR c.expiration::timestamp > NOW() THEN true 
                            ELSE false 
@@ -2209,7 +2300,7 @@ async def handle_ai_text_analysis(update: Update, context: ContextTypes.DEFAULT_
         companies = await get_companies_list(user_id)
         
         # Call GPT function
-        extracted_data_df, pricing_df = extract_coupon_detail_sms(text, companies)
+        extracted_data_df, pricing_df = await run_blocking(extract_coupon_detail_sms, text, companies)
         
         if not extracted_data_df.empty:
             # Convert data to dictionary
@@ -2367,17 +2458,26 @@ async def send_ai_coupon_summary(update, data, user_gender):
     
     await update.message.reply_text(summary)
 
-# Get companies list from DB
+# Company index / companies list from DB.
+# The bot has no Flask cache to watch for version bumps, so it reloads the
+# company index after a short TTL (and right after it inserts a company).
+COMPANY_INDEX_TTL_SECONDS = 60
+_company_index = None
+_company_index_loaded_at = 0.0
+
+async def get_company_index(force=False):
+    global _company_index, _company_index_loaded_at
+    now = time.monotonic()
+    if force or _company_index is None or now - _company_index_loaded_at > COMPANY_INDEX_TTL_SECONDS:
+        async with db_pool.acquire() as conn:
+            # Query to show all companies in system
+            companies = await conn.fetch("SELECT DISTINCT name FROM companies ORDER BY name ASC")
+        _company_index = CompanyIndex([c['name'] for c in companies])
+        _company_index_loaded_at = now
+    return _company_index
+
 async def get_companies_list(user_id):
-    database_url = os.getenv('DATABASE_URL')
-    if database_url.startswith('postgresql+psycopg2://'):
-        database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-    import asyncpg
-    conn = await asyncpg.connect(database_url, statement_cache_size=0)
-    # Query to show all companies in system
-    companies = await conn.fetch("SELECT DISTINCT name FROM companies ORDER BY name ASC")
-    await conn.close()
-    return [c['name'] for c in companies]
+    return list((await get_company_index()).names)
 
 # Start coupon creation process
 async def start_coupon_creation(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id):
@@ -2638,15 +2738,9 @@ async def handle_coupon_creation(update: Update, context: ContextTypes.DEFAULT_T
     # Fuzzy company name matching stage
     if state == CouponCreationState.FUZZY_MATCH:
         
-        # Find best matches
-        matches = []
-        for company in companies:
-            ratio = fuzz.ratio(text.lower(), company.lower())
-            if ratio >= 90:  # Only matches above 90%
-                matches.append((company, ratio))
-        
-        # Sort by match percentage
-        matches.sort(key=lambda x: x[1], reverse=True)
+        # Find best matches (only matches above 90%, best first)
+        company_index = await get_company_index()
+        matches = company_index.scored(text, scorer=fuzz.ratio, min_score=90)
         
         if matches:
             # Show matches to user
@@ -3321,6 +3415,7 @@ async def execute_coupon_deletion(update: Update, context: ContextTypes.DEFAULT_
                         "DELETE FROM coupon WHERE id = $1 AND user_id = $2",
                         selected_coupon['id'], user_id
                     )
+                await refresh_user_coupon_summary(conn, user_id)
                 
                 decrypted_code = decrypt_coupon_code(selected_coupon['code'])
                 success_msg = get_gender_specific_text(
@@ -3351,6 +3446,7 @@ async def execute_coupon_deletion(update: Update, context: ContextTypes.DEFAULT_
                 "DELETE FROM coupon WHERE id = $1 AND user_id = $2",
                 selected_coupon['id'], user_id
             )
+            await refresh_user_coupon_summary(conn, user_id)
             
             if result == "DELETE 1":
                 decrypted_code = decrypt_coupon_code(selected_coupon['code'])
@@ -3572,6 +3668,7 @@ async def execute_usage_update(update: Update, context: ContextTypes.DEFAULT_TYP
             WHERE id = $3
         """
         await conn.execute(update_coupon_query, new_used_value, new_status, selected_coupon['id'])
+        await refresh_user_coupon_summary(conn, user_id)
         
         # Add entry to coupon_usage table
         if will_be_fully_used or usage_type == 'full':
@@ -3972,17 +4069,7 @@ async def send_coupon_summary(update, data, user_gender):
 
 # Save coupon to DB
 async def save_coupon_to_db(update, data, user_id):
-    database_url = os.getenv('DATABASE_URL')
-    if database_url.startswith('postgresql+psycopg2://'):
-        database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-    import asyncpg
-    conn = await asyncpg.connect(database_url, statement_cache_size=0)
-    # Check if company exists, if not - add it
-    company_name = data.get('company')
-    company_row = await conn.fetchrow("SELECT id FROM companies WHERE name = $1", company_name)
-    if not company_row:
-        await conn.execute("INSERT INTO companies (name, image_path) VALUES ($1, $2)", company_name, 'default_logo.png')
-    
+    global _company_index
     # Convert date to string if exists
     expiration_date = data.get('expiration')
     if expiration_date:
@@ -3991,22 +4078,34 @@ async def save_coupon_to_db(update, data, user_id):
     # Encrypt code and description
     code = data.get('code')
     description = data.get('description')
+    # Written here because this INSERT bypasses Coupon's code_hash validator
+    code_hash = compute_code_hash(code)
     if code and not code.startswith('gAAAAA'):
         code = cipher_suite.encrypt(code.encode()).decode()
     if description and not description.startswith('gAAAAA'):
         description = cipher_suite.encrypt(description.encode()).decode()
     
-    # Add coupon
-    await conn.execute(
-        """
-        INSERT INTO coupon (code, value, cost, company, expiration, description, source, cvv, card_exp, is_one_time, purpose, user_id, status, used_value, date_added, is_available, is_for_sale)
-        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, 'פעיל', 0, NOW(), true, false)
-        """,
-        code, data.get('value'), data.get('cost'), company_name,
-        expiration_date, description, data.get('source'),
-        data.get('cvv'), data.get('card_exp'), data.get('is_one_time'), data.get('purpose'), user_id
-    )
-    await conn.close()
+    company_name = data.get('company')
+    async with db_pool.acquire() as conn:
+        # Check if company exists, if not - add it
+        company_row = await conn.fetchrow("SELECT id FROM companies WHERE name = $1", company_name)
+        if not company_row:
+            await conn.execute("INSERT INTO companies (name, image_path) VALUES ($1, $2)", company_name, 'default_logo.png')
+            _company_index = None
+        
+        # Add coupon
+        coupon_id = await allocate_coupon_id(conn)
+        await conn.execute(
+            """
+            INSERT INTO coupon (id, code, code_hash, value, cost, company, expiration, description, source, cvv, card_exp, is_one_time, purpose, user_id, status, used_value, date_added, is_available, is_for_sale)
+            VALUES ($13, $1, $14, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, 'פעיל', 0, NOW(), true, false)
+            """,
+            code, data.get('value'), data.get('cost'), company_name,
+            expiration_date, description, data.get('source'),
+            data.get('cvv'), data.get('card_exp'), data.get('is_one_time'), data.get('purpose'), user_id,
+            coupon_id, code_hash
+        )
+        await refresh_user_coupon_summary(conn, user_id)
 
 # Add general handler to continue coupon addition process
 async def handle_coupon_fsm(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -4014,13 +4113,8 @@ async def handle_coupon_fsm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     state_obj = user_coupon_states.get(chat_id)
     if state_obj:
         # Fetch user_id
-        database_url = os.getenv('DATABASE_URL')
-        if database_url.startswith('postgresql+psycopg2://'):
-            database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-        import asyncpg
-        conn = await asyncpg.connect(database_url, statement_cache_size=0)
-        user = await conn.fetchrow("SELECT user_id FROM telegram_users WHERE telegram_chat_id = $1 AND is_verified = true", chat_id)
-        await conn.close()
+        async with db_pool.acquire() as conn:
+            user = await conn.fetchrow("SELECT user_id FROM telegram_users WHERE telegram_chat_id = $1 AND is_verified = true", chat_id)
         if user:
             await handle_coupon_creation(update, context, user['user_id'])
             return
@@ -4045,13 +4139,6 @@ async def handle_number_message(update: Update, context: ContextTypes.DEFAULT_TY
     await update_session_expiry(chat_id)
     
     try:
-        # Check if user is connected
-        database_url = os.getenv('DATABASE_URL')
-        if database_url.startswith('postgresql+psycopg2://'):
-            database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-        
-        conn = await asyncpg.connect(database_url, statement_cache_size=0)
-        
         # Handle menu selection
         if user_message in ['1', '2', '3', '4', '5', '6', '7']:
             await handle_menu_option(update, context)
@@ -4059,15 +4146,14 @@ async def handle_number_message(update: Update, context: ContextTypes.DEFAULT_TY
             # Send menu again if choice is invalid
             slots = 0
             try:
-                slots_row = await conn.fetchrow("SELECT slots_automatic_coupons FROM users WHERE id = $1", user_id)
+                async with db_pool.acquire() as conn:
+                    slots_row = await conn.fetchrow("SELECT slots_automatic_coupons FROM users WHERE id = $1", user_id)
                 if slots_row:
                     slots = slots_row['slots_automatic_coupons']
             except Exception as e:
                 logger.error(f"Error fetching slots_automatic_coupons: {e}")
             await update.message.reply_text(get_main_menu_text(user_gender, slots))
         
-        await conn.close()
-        
     except Exception as e:
         logger.error(f"Error in handle_number_message: {e}")
         await update.message.reply_text(
@@ -4076,17 +4162,16 @@ async def handle_number_message(update: Update, context: ContextTypes.DEFAULT_TY
 
 # Function to get user gender
 async def get_user_gender(user_id):
-    """Fetch user gender from database"""
+    """Fetch user gender from database (or the session cache)"""
+    found, gender = session_cache.gender(user_id)
+    if found:
+        return gender
     try:
-        database_url = os.getenv('DATABASE_URL')
-        if database_url.startswith('postgresql+psycopg2://'):
-            database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-        
-        conn = await asyncpg.connect(database_url, statement_cache_size=0)
-        query = "SELECT gender FROM users WHERE id = $1"
-        result = await conn.fetchrow(query, user_id)
-        await conn.close()
-        return result['gender'] if result else None
+        async with db_pool.acquire() as conn:
+            result = await conn.fetchrow("SELECT gender FROM users WHERE id = $1", user_id)
+        gender = result['gender'] if result else None
+        session_cache.put_gender(user_id, gender)
+        return gender
     except Exception as e:
         logger.error(f"Error getting user gender: {e}")
         return None
@@ -4094,18 +4179,13 @@ async def get_user_gender(user_id):
 async def is_user_verified_for_deletion(user_id):
     """Check if user is verified and has permission to delete coupons"""
     try:
-        database_url = os.getenv('DATABASE_URL')
-        if database_url.startswith('postgresql+psycopg2://'):
-            database_url = database_url.replace('postgresql+psycopg2://', 'postgresql://', 1)
-        
-        conn = await asyncpg.connect(database_url, statement_cache_size=0)
         query = """
             SELECT is_verified, is_active 
             FROM telegram_users 
             WHERE user_id = $1 AND is_active = true AND is_verified = true
         """
-        result = await conn.fetchrow(query, user_id)
-        await conn.close()
+        async with db_pool.acquire() as conn:
+            result = await conn.fetchrow(query, user_id)
         
         # User is verified if they have an active and verified telegram connection
         return result is not None
@@ -4133,6 +4213,53 @@ def format_days_remaining(days):
     else:
         return f"בעוד {days} ימים"
 
+def build_expiration_reminder_text(coupons, user_gender):
+    """Reminder message listing the user's soon-to-expire coupons"""
+    message = get_gender_specific_text(
+        user_gender,
+        "🔔 **תזכורת קופונים**\n\n"
+        "התוקף של הקופונים הבאים שלך יפוגו בקרוב:\n\n",
+        "🔔 **תזכורת קופונים**\n\n"
+        "התוקף של הקופונים הבאים שלך יפוגו בקרוב:\n\n"
+    )
+    
+    today = datetime.now(pytz.timezone('Asia/Jerusalem')).date()
+    for coupon in coupons:
+        # Calculate days remaining
+        expiration_date = coupon['expiration']
+        if isinstance(expiration_date, str):
+            expiration_date = datetime.strptime(expiration_date, '%Y-%m-%d').date()
+        
+        days_remaining = (expiration_date - today).days
+        
+        remaining_value = coupon['value'] - coupon['used_value']
+        decrypted_code = decrypt_coupon_code(coupon['code'])
+        
+        time_text = format_days_remaining(days_remaining)
+        
+        message += (
+            f"🏢 **{coupon['company']}**\n"
+            f"🏷️ קוד: {decrypted_code}\n"
+            f"💰 ערך: {coupon['value']}₪\n"
+            f"💵 נותר: {remaining_value}₪\n"
+            f"⏰ יפוג תוקף: {time_text}\n\n"
+        )
+    
+    message += get_gender_specific_text(
+        user_gender,
+        "💡 זכור להשתמש בקופונים לפני שיפוגו!",
+        "💡 זכרי להשתמש בקופונים לפני שיפוגו!"
+    )
+    return message
+
+def get_broadcaster():
+    """Rate-limited concurrent sender for reminder/summary fan-out, or None without a bot"""
+    if context_app is None or context_app.bot is None:
+        logger.error("Bot instance not available for broadcasting - context_app is None")
+        return None
+    # Blocked bots and bad chat ids will not succeed on retry
+    return TelegramBroadcaster(context_app.bot.send_message, permanent_errors=(Forbidden, BadRequest))
+
 async def send_expiration_reminder(chat_id, coupons, user_gender):
     """Send expiration reminder message to user"""
     try:
@@ -4146,43 +4273,7 @@ async def send_expiration_reminder(chat_id, coupons, user_gender):
             logger.error("Bot object is None")
             return
         
-        logger.info(f"Bot instance available, preparing message for {len(coupons)} coupons")
-        
-        message = get_gender_specific_text(
-            user_gender,
-            "🔔 **תזכורת קופונים**\n\n"
-            "התוקף של הקופונים הבאים שלך יפוגו בקרוב:\n\n",
-            "🔔 **תזכורת קופונים**\n\n"
-            "התוקף של הקופונים הבאים שלך יפוגו בקרוב:\n\n"
-        )
-        
-        for coupon in coupons:
-            # Calculate days remaining
-            expiration_date = coupon['expiration']
-            if isinstance(expiration_date, str):
-                expiration_date = datetime.strptime(expiration_date, '%Y-%m-%d').date()
-            
-            today = datetime.now(pytz.timezone('Asia/Jerusalem')).date()
-            days_remaining = (expiration_date - today).days
-            
-            remaining_value = coupon['value'] - coupon['used_value']
-            decrypted_code = decrypt_coupon_code(coupon['code'])
-            
-            time_text = format_days_remaining(days_remaining)
-            
-            message += (
-                f"🏢 **{coupon['company']}**\n"
-                f"🏷️ קוד: {decrypted_code}\n"
-                f"💰 ערך: {coupon['value']}₪\n"
-                f"💵 נותר: {remaining_value}₪\n"
-                f"⏰ יפוג תוקף: {time_text}\n\n"
-            )
-        
-        message += get_gender_specific_text(
-            user_gender,
-            "💡 זכור להשתמש בקופונים לפני שיפוגו!",
-            "💡 זכרי להשתמש בקופונים לפני שיפוגו!"
-        )
+        message = build_expiration_reminder_text(coupons, user_gender)
         
         logger.info(f"Sending message to chat_id {chat_id}")
         await bot.send_message(chat_id=chat_id, text=message)
@@ -4191,56 +4282,49 @@ async def send_expiration_reminder(chat_id, coupons, user_gender):
     except Exception as e:
         logger.error(f"Error sending expiration reminder to chat_id {chat_id}: {e}")
 
-async def send_monthly_summary(chat_id, user_id, user_gender):
-    """Send GPT-powered monthly summary message to user"""
+def build_monthly_summary_text(user_id, user_gender, flask_app=None):
+    """
+    GPT-powered summary of last month for the user, or a basic fallback text.
+    Synchronous (Flask app context + OpenAI call): run it through run_blocking.
+    """
+    # Get current month and year 
+    now = datetime.now()
+    prev_month = now.month - 1 if now.month > 1 else 12
+    prev_year = now.year if now.month > 1 else now.year - 1
+    
+    # Generate GPT-powered summary text
     try:
-        logger.info(f"Attempting to send GPT-powered monthly summary to user {user_id}, chat_id {chat_id}")
-        if context_app is None:
-            logger.error("Bot instance not available for sending monthly summary - context_app is None")
-            return
+        # Import the GPT function from statistics routes
+        from app.routes.statistics_routes import get_monthly_summary_text_with_gpt
         
-        bot = context_app.bot
-        if bot is None:
-            logger.error("Bot object is None")
-            return
+        # Create Flask app context
+        if flask_app is None:
+            from app import create_app
+            flask_app = create_app()
+        with flask_app.app_context():
+            gpt_message = get_monthly_summary_text_with_gpt(
+                user_id=user_id, 
+                month=prev_month, 
+                year=prev_year,
+                user_gender=user_gender or 'male'
+            )
         
-        # Get current month and year 
-        now = datetime.now()
-        prev_month = now.month - 1 if now.month > 1 else 12
-        prev_year = now.year if now.month > 1 else now.year - 1
+        logger.info(f"GPT message generated successfully for user {user_id}")
+        return gpt_message
         
-        # Generate GPT-powered summary text
-        try:
-            # Import the GPT function from statistics routes
-            from app.routes.statistics_routes import get_monthly_summary_text_with_gpt
-            from app import create_app
-            
-            # Create Flask app context
-            app = create_app()
-            with app.app_context():
-                gpt_message = get_monthly_summary_text_with_gpt(
-                    user_id=user_id, 
-                    month=prev_month, 
-                    year=prev_year,
-                    user_gender=user_gender or 'male'
-                )
-            
-            logger.info(f"GPT message generated successfully for user {user_id}")
-            summary_text = gpt_message
-            
-        except Exception as gpt_error:
-            logger.error(f"Error generating GPT message for user {user_id}: {str(gpt_error)}")
-            
-            # Fallback to basic message
-            month_names = {
-                1: 'ינואר', 2: 'פברואר', 3: 'מרץ', 4: 'אפריל',
-                5: 'מאי', 6: 'יוני', 7: 'יולי', 8: 'אוגוסט',
-                9: 'ספטמבר', 10: 'אוקטובר', 11: 'נובמבר', 12: 'דצמבר'
-            }
-            
-            month_name = month_names.get(prev_month, str(prev_month))
-            
-            summary_text = f"""📅 הסיכום החודשי שלך - {month_name} {prev_year}
+    except Exception as gpt_error:
+        logger.error(f"Error generating GPT message for user {user_id}: {str(gpt_error)}")
+        
+        # Fallback to basic message
+        month_names = {
+            1: 'ינואר', 2: 'פברואר', 3: 'מרץ', 4: 'אפריל',
+            5: 'מאי', 6: 'יוני', 7: 'יולי', 8: 'אוגוסט',
+            9: 'ספטמבר', 10: 'אוקטובר', 11: 'נובמבר', 12: 'דצמבר'
+        }
+        
+        month_name = month_names.get(prev_month, str(prev_month))
+        
+        summary_text = f"""📅 הסיכום החודשי שלך - {month_name} {prev_year}
 
 🎯 **נתונים מהחודש שעבר:**
 • זה הסיכום החודשי האוטומטי שלך
@@ -4252,6 +4336,22 @@ async def send_monthly_summary(chat_id, user_id, user_gender):
 • מידע על חיסכון, שימוש וחברות פופולריות
 
 💬 רוצה לנהל את הקופונים שלך? כתוב לי בכל עת!"""
+        return summary_text
+
+async def send_monthly_summary(chat_id, user_id, user_gender):
+    """Send GPT-powered monthly summary message to user"""
+    try:
+        logger.info(f"Attempting to send GPT-powered monthly summary to user {user_id}, chat_id {chat_id}")
+        if context_app is None:
+            logger.error("Bot instance not available for sending monthly summary - context_app is None")
+            return
+        
+        bot = context_app.bot
+        if bot is None:
+            logger.error("Bot object is None")
+            return
+        
+        summary_text = await run_blocking(build_monthly_summary_text, user_id, user_gender)
         
         logger.info(f"Sending monthly summary to chat_id {chat_id}")
         await bot.send_message(chat_id=chat_id, text=summary_text, parse_mode='Markdown')
@@ -4260,41 +4360,64 @@ async def send_monthly_summary(chat_id, user_id, user_gender):
     except Exception as e:
         logger.error(f"Error sending monthly summary to user {user_id}, chat_id {chat_id}: {e}")
 
+# Connected users with a live session, with the gender the messages need
+CONNECTED_USERS_QUERY = """
+    SELECT DISTINCT tu.telegram_chat_id, tu.user_id, u.gender
+    FROM telegram_users tu
+    LEFT JOIN users u ON u.id = tu.user_id
+    WHERE tu.is_verified = true 
+    AND tu.telegram_chat_id IS NOT NULL
+    AND tu.verification_expires_at > NOW()
+"""
+
+# Every (connected chat, coupon expiring within 7 days) pair in one round trip
+EXPIRING_COUPONS_QUERY = """
+    SELECT tu.telegram_chat_id, tu.user_id, u.gender,
+           c.id, c.code, c.value, c.used_value, c.company, c.expiration
+    FROM telegram_users tu
+    JOIN coupon c ON c.user_id = tu.user_id
+    LEFT JOIN users u ON u.id = tu.user_id
+    WHERE tu.is_verified = true
+      AND tu.telegram_chat_id IS NOT NULL
+      AND tu.verification_expires_at > NOW()
+      AND c.status = 'פעיל'
+      AND c.expiration IS NOT NULL
+      AND c.expiration::date >= CURRENT_DATE
+      AND c.expiration::date < CURRENT_DATE + INTERVAL '7 days'
+    ORDER BY tu.telegram_chat_id, c.expiration, c.id
+"""
+
+async def fetch_expiring_coupons_by_chat():
+    """{chat_id: {"user_id", "gender", "items": [coupon rows]}} for all due reminders"""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(EXPIRING_COUPONS_QUERY)
+    return group_rows_by_chat(rows)
+
 async def send_monthly_summaries_to_all_users():
     """Send monthly summary to all connected users on the first day of the month"""
     try:
         logger.info("Starting monthly summary send to all users")
-        conn = await get_async_db_connection()
+        broadcaster = get_broadcaster()
+        if broadcaster is None:
+            return
         
-        # Get all connected users
-        users_query = """
-            SELECT DISTINCT tu.telegram_chat_id, tu.user_id
-            FROM telegram_users tu
-            WHERE tu.is_verified = true 
-            AND tu.telegram_chat_id IS NOT NULL
-            AND tu.verification_expires_at > NOW()
-        """
-        users = await conn.fetch(users_query)
+        async with db_pool.acquire() as conn:
+            users = await conn.fetch(CONNECTED_USERS_QUERY)
         
         logger.info(f"Sending monthly summaries to {len(users)} connected users")
         
-        for user in users:
-            user_id = user['user_id']
-            chat_id = user['telegram_chat_id']
-            
-            # Get user gender
-            user_gender = await get_user_gender(user_id)
-            
-            # Send monthly summary
-            await send_monthly_summary(chat_id, user_id, user_gender)
-            
-            # Add a small delay between sends to avoid hitting rate limits
-            await asyncio.sleep(0.1)
-            
-            logger.info(f"Sent monthly summary to user {user_id}")
+        from app import create_app
+        flask_app = await run_blocking(create_app)
         
-        await conn.close()
-        logger.info("Completed sending monthly summaries to all users")
+        async def summarize_and_send(user):
+            # Summaries are generated on the blocking executor, sends are rate limited
+            summary_text = await run_blocking(
+                build_monthly_summary_text, user['user_id'], user['gender'], flask_app
+            )
+            await broadcaster.send(user['telegram_chat_id'], text=summary_text, parse_mode='Markdown')
+        
+        await asyncio.gather(*(summarize_and_send(user) for user in users))
+        logger.info(f"Completed sending monthly summaries to all users: {broadcaster.stats}")
         
     except Exception as e:
         logger.error(f"Error in send_monthly_summaries_to_all_users: {e}", exc_info=True)
@@ -4303,47 +4426,19 @@ async def check_expiring_coupons_for_all_users(source="unknown"):
     """Check all users for expiring coupons and send reminders"""
     try:
         logger.info(f"Starting coupon expiration check from source: {source}")
-        conn = await get_async_db_connection()
+        broadcaster = get_broadcaster()
+        if broadcaster is None:
+            return
         
-        # Get all connected users
-        users_query = """
-            SELECT DISTINCT tu.telegram_chat_id, tu.user_id
-            FROM telegram_users tu
-            WHERE tu.is_verified = true 
-            AND tu.telegram_chat_id IS NOT NULL
-            AND tu.verification_expires_at > NOW()
-        """
-        users = await conn.fetch(users_query)
+        due = await fetch_expiring_coupons_by_chat()
+        logger.info(f"Sending expiration reminders to {len(due)} connected users")
         
-        logger.info(f"Checking expiring coupons for {len(users)} connected users")
-        
-        for user in users:
-            user_id = user['user_id']
-            chat_id = user['telegram_chat_id']
-            
-            # Get user's expiring coupons
-            coupons_query = """
-                SELECT * 
-                FROM coupon
-                WHERE user_id = $1
-                  AND status = 'פעיל'
-                  AND expiration IS NOT NULL
-                  AND expiration::date >= CURRENT_DATE
-                  AND expiration::date < CURRENT_DATE + INTERVAL '7 days'
-            """
-            coupons = await conn.fetch(coupons_query, user_id)
-            
-            if coupons:
-                # Get user gender
-                user_gender = await get_user_gender(user_id)
-                
-                # Send reminder
-                await send_expiration_reminder(chat_id, coupons, user_gender)
-                
-                logger.info(f"Sent reminder to user {user_id} for {len(coupons)} expiring coupons")
-        
-        await conn.close()
-        logger.info("Completed checking expiring coupons for all users")
+        messages = [
+            {"chat_id": chat_id, "text": build_expiration_reminder_text(entry['items'], entry['gender'])}
+            for chat_id, entry in due.items()
+        ]
+        stats = await broadcaster.send_all(messages)
+        logger.info(f"Completed checking expiring coupons for all users: {stats}")
         
     except Exception as e:
         logger.error(f"Error in check_expiring_coupons_for_all_users: {e}", exc_info=True)
@@ -4356,73 +4451,14 @@ async def test_check_expiring_coupons(admin_chat_id):
         app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
         bot = app.bot
         logger.info("Starting test coupon expiration check")
-        conn = await get_async_db_connection()
-        
-        # Get all connected users
-        users_query = """
-            SELECT DISTINCT tu.telegram_chat_id, tu.user_id
-            FROM telegram_users tu
-            WHERE tu.is_verified = true 
-            AND tu.telegram_chat_id IS NOT NULL
-            AND tu.verification_expires_at > NOW()
-        """
-        users = await conn.fetch(users_query)
-        
-        total_users = len(users)
-        users_with_expiring_coupons = 0
-        total_expiring_coupons = 0
         
-        for user in users:
-            user_id = user['user_id']
-            chat_id = user['telegram_chat_id']
-            
-            # Get user's expiring coupons
-            coupons_query = """
-                SELECT * 
-                FROM coupon
-                WHERE user_id = $1
-                  AND status = 'פעיל'
-                  AND expiration IS NOT NULL
-                  AND expiration::date >= CURRENT_DATE
-                  AND expiration::date < CURRENT_DATE + INTERVAL '7 days'
-            """
-            coupons = await conn.fetch(coupons_query, user_id)
-            
-            if coupons:
-                users_with_expiring_coupons += 1
-                total_expiring_coupons += len(coupons)
-                
-                # Get user gender
-                user_gender = await get_user_gender(user_id)
-                
-                # Build the message that WOULD be sent (for preview)
-                coupons_list = []
-                for coupon in coupons:
-                    # Handle expiration date - could be string or date object
-                    expiration_date = coupon['expiration']
-                    if isinstance(expiration_date, str):
-                        from datetime import datetime
-                        expiration_date = datetime.strptime(expiration_date, '%Y-%m-%d').date()
-                    elif hasattr(expiration_date, 'date'):
-                        expiration_date = expiration_date.date()
-                    
-                    days_until_expiry = (expiration_date - datetime.now().date()).days
-                    if days_until_expiry == 0:
-                        expiry_text = "היום"
-                    elif days_until_expiry == 1:
-                        expiry_text = "מחר"
-                    else:
-                        expiry_text = f"בעוד {days_until_expiry} ימים"
-                    
-                    remaining_value = coupon.get('remaining_value', coupon.get('value', 0))
-                    coupon_text = f"🏢 {coupon['company']}\n"
-                    coupon_text += f"🏷️ קוד: {coupon['code']}\n"
-                    coupon_text += f"💰 ערך: {coupon['value']}₪\n"
-                    coupon_text += f"💵 נותר: {remaining_value}₪\n"
-                    coupon_text += f"⏰ יפוג תוקף: {expiry_text}"
-                    coupons_list.append(coupon_text)
-                
-                # Just count, don't send preview messages
+        # Same single query the real reminder run uses; only count, don't send
+        due = await fetch_expiring_coupons_by_chat()
+        users_with_expiring_coupons = len(due)
+        total_expiring_coupons = sum(len(entry['items']) for entry in due.values())
+        logger.info(
+            f"Test check: {users_with_expiring_coupons} users, {total_expiring_coupons} expiring coupons"
+        )
         
         # Send brief summary only to the admin who requested the test
         if users_with_expiring_coupons > 0:
@@ -4432,7 +4468,6 @@ async def test_check_expiring_coupons(admin_chat_id):
         
         await bot.send_message(chat_id=admin_chat_id, text=summary_message)
         
-        await conn.close()
         logger.info("Completed test check for expiring coupons")
         
     except Exception as e:
@@ -4620,6 +4655,8 @@ def create_bot_application():
                .connect_timeout(30.0)  # 30 seconds connection timeout
                .read_timeout(30.0)     # 30 seconds read timeout
                .write_timeout(30.0)    # 30 seconds write timeout
+               .post_init(on_bot_startup)
+               .post_shutdown(on_bot_shutdown)
                .build())
         
         logger.info("Application created successfully")
@@ -4672,6 +4709,7 @@ def run_bot():
         # Start daily reminder scheduler in background
         async def start_scheduler(app):
             global scheduler_task, scheduler_stop_event
+            await on_bot_startup(app)
             # Fix monthly summary day to 20 (one-time fix)
             await update_monthly_summary_day_to_20()
             # Load reminder config from database first
@@ -0,0 +1,162 @@
+import asyncio
+import gc
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.async_db_pool import AsyncConnectionPool, asyncpg_database_url
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    async def fetchval(self, query, *args):
+        return self.number
+
+    async def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+
+class FakePool:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.created = 0
+        self.idle = []
+        self.in_use = set()
+        self.closed = False
+        self._released = asyncio.Condition()
+
+    async def acquire(self, timeout=None):
+        async def wait_for_connection():
+            async with self._released:
+                while not self.idle and len(self.in_use) >= self.max_size:
+                    await self._released.wait()
+                if self.idle:
+                    conn = self.idle.pop()
+                else:
+                    self.created += 1
+                    conn = FakeConnection(self.created)
+                self.in_use.add(conn)
+                return conn
+
+        return await asyncio.wait_for(wait_for_connection(), timeout)
+
+    async def release(self, conn):
+        async with self._released:
+            self.in_use.discard(conn)
+            self.idle.append(conn)
+            self._released.notify()
+
+    async def close(self):
+        self.closed = True
+
+    def get_size(self):
+        return len(self.idle) + len(self.in_use)
+
+    def get_idle_size(self):
+        return len(self.idle)
+
+
+def _pool(**kwargs):
+    pools = []
+
+    async def create_pool(min_size, max_size):
+        pools.append(FakePool(max_size))
+        return pools[-1]
+
+    kwargs.setdefault("min_size", 1)
+    kwargs.setdefault("max_size", 2)
+    kwargs.setdefault("acquire_timeout", 0.2)
+    return AsyncConnectionPool(create_pool=create_pool, **kwargs), pools
+
+
+def test_asyncpg_database_url_strips_driver(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    assert asyncpg_database_url("postgresql+psycopg2://u:p@h/db") == "postgresql://u:p@h/db"
+    with pytest.raises(ValueError):
+        asyncpg_database_url("")
+
+
+def test_connections_are_reused_and_counted():
+    pool, pools = _pool()
+
+    async def scenario():
+        for _ in range(5):
+            conn = await pool.connection()
+            assert await conn.fetchval("SELECT 1") == 1
+            await conn.close()
+            await conn.close()
+        async with pool.acquire() as conn:
+            assert not conn.is_closed()
+        assert conn.is_closed()
+
+    asyncio.run(scenario())
+    assert len(pools) == 1 and pools[0].created == 1
+    stats = pool.stats()
+    assert stats["acquires"] == 6 and stats["size"] == 1 and stats["idle"] == 1
+
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    pool, pools = _pool(max_size=1)
+
+    async def scenario():
+        held = await pool.connection()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.connection()
+        await held.close()
+        async with pool.acquire():
+            pass
+
+    asyncio.run(scenario())
+    assert pool.stats()["timeouts"] == 1
+    assert pools[0].created == 1
+
+
+def test_unclosed_connection_returns_to_pool():
+    pool, pools = _pool(max_size=1)
+
+    async def leak():
+        conn = await pool.connection()
+        await conn.fetchval("SELECT 1")
+
+    async def scenario():
+        await leak()
+        gc.collect()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        async with pool.acquire():
+            pass
+
+    asyncio.run(scenario())
+    assert pool.stats()["timeouts"] == 0
+
+
+def test_new_event_loop_gets_a_new_pool():
+    pool, pools = _pool()
+
+    async def use():
+        async with pool.acquire():
+            pass
+
+    asyncio.run(use())
+    asyncio.run(use())
+    assert len(pools) == 2
+
+    asyncio.run(pool.close())
+    assert pool.stats()["size"] == 0
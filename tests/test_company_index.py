@@ -0,0 +1,135 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+from fuzzywuzzy import fuzz
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_company_index_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import Company
+from app.utils import company_index
+from app.utils.company_index import (
+    CompanyIndex,
+    get_company_index,
+    match_company,
+    normalize_company_name,
+)
+
+NAMES = ["שופרסל", "Carrefour", "Dream Card", "רולדין", "Fox", "BuyMe", "מקדונלדס", "Wolt"]
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for name in NAMES:
+            db.session.add(Company(name=name, image_path="default_logo.png"))
+        db.session.commit()
+        company_index._index = None
+
+    yield app
+
+
+def test_normalize_company_name():
+    assert normalize_company_name("  קופון 50 ₪ לרולדין! ") == "לרולדינ"
+    assert normalize_company_name("Gift Card - Fox") == "fox"
+    assert normalize_company_name("מַקְדּוֹנַלְדְּס") == "מקדונלדס"
+
+
+def test_index_exact_alias_and_fuzzy_matches():
+    index = CompanyIndex(NAMES)
+    assert index.match("carrefour ")[0] == "Carrefour"
+    assert index.match("dreamcard")[0] == "Dream Card"
+    assert index.match("קרפור") == ("Carrefour", 100)
+    assert index.match("סופר סל") == ("שופרסל", 100)
+    assert index.match("מקדונלד")[0] == "מקדונלדס"
+    assert index.match("50 ₪ דרים קארד")[0] == "Dream Card"
+    assert index.match("שופרסאל")[0] == "שופרסל"
+    assert index.match("Buy me gift card")[0] == "BuyMe"
+    assert index.match("איקאה")[0] is None
+
+
+def test_scored_keeps_ratio_threshold_semantics():
+    index = CompanyIndex(NAMES)
+    matches = index.scored("wolt", scorer=fuzz.ratio, min_score=90)
+    assert matches == [("Wolt", 100)]
+    assert index.scored("zzzz", scorer=fuzz.ratio, min_score=90) == []
+
+
+def test_candidates_only_score_a_small_subset():
+    names = [f"Company {i:05d}" for i in range(5000)] + ["Roladin Bakery"]
+    index = CompanyIndex(names)
+    candidates = index.candidates("roladin bakry")
+    assert candidates[0] == "Roladin Bakery"
+    assert len(candidates) <= 30
+
+
+def test_index_is_rebuilt_after_company_changes(app):
+    with app.app_context():
+        first = get_company_index()
+        assert get_company_index() is first
+        assert match_company("Castro")[0] is None
+
+        db.session.add(Company(name="Castro", image_path="default_logo.png"))
+        db.session.commit()
+
+        second = get_company_index()
+        assert second is not first
+        assert match_company("castro") == ("Castro", 100)
+
+        company = Company.query.filter_by(name="Castro").one()
+        db.session.delete(company)
+        db.session.commit()
+        assert "Castro" not in get_company_index().names
+
+
+def test_rolled_back_company_does_not_bump(app):
+    with app.app_context():
+        first = get_company_index()
+        db.session.add(Company(name="Golf", image_path="default_logo.png"))
+        db.session.flush()
+        db.session.rollback()
+        assert get_company_index() is first
+
+
+def test_prompt_companies_narrows_to_mentioned_companies():
+    names = [f"Company {i:05d}" for i in range(2000)] + NAMES
+    index = CompanyIndex(names)
+
+    selected, narrowed = index.prompt_companies("השתמשתי ב-50 ₪ בקרפור ו-30 בוולט אתמול")
+    assert narrowed
+    assert len(selected) <= company_index.PROMPT_TOP_K
+    assert selected[:2] == ["Carrefour", "Wolt"]
+
+    selected, narrowed = index.prompt_companies("קניתי ב שופרסאל ב 40 שח")
+    assert narrowed and selected[0] == "שופרסל"
+
+
+def test_prompt_companies_widens_when_unsure():
+    index = CompanyIndex([f"Company {i:05d}" for i in range(100)] + NAMES)
+    selected, narrowed = index.prompt_companies("השתמשתי ב-50 שקל בחנות")
+    assert not narrowed
+    assert selected == index.names
+
+    small = CompanyIndex(NAMES)
+    assert small.prompt_companies("קרפור 50") == (small.names, False)
@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_code_hash_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon, compute_code_hash
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        user = User(
+            email="owner@example.com",
+            first_name="Owner",
+            last_name="O",
+            is_confirmed=True,
+        )
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+
+        db.session.add_all([
+            Coupon(code="ABC-123", value=100, cost=80, company="TestCo", user_id=user.id),
+            Coupon(code="XYZ-999", value=50, cost=40, company="TestCo", user_id=user.id),
+        ])
+        db.session.commit()
+
+    yield app
+
+
+def test_code_hash_is_deterministic_and_normalized():
+    assert compute_code_hash("ABC-123") == compute_code_hash("  ABC-123 ")
+    assert compute_code_hash("ABC-123") != compute_code_hash("ABC-124")
+    assert compute_code_hash("") is None
+    assert compute_code_hash(None) is None
+
+
+def test_code_hash_is_written_on_insert_and_update(app):
+    with app.app_context():
+        coupon = Coupon.find_by_code("ABC-123")
+        assert coupon is not None
+        assert coupon.code_hash == compute_code_hash("ABC-123")
+
+        coupon.code = "ABC-456"
+        db.session.commit()
+
+        assert Coupon.find_by_code("ABC-123") is None
+        assert Coupon.find_by_code("ABC-456").id == coupon.id
+
+
+def test_find_by_codes_matches_unindexed_rows_and_backfill_stores_hash(app):
+    with app.app_context():
+        legacy = Coupon.find_by_code("XYZ-999")
+        # Simulate a row written by a client that bypasses the ORM.
+        db.session.execute(
+            db.text("UPDATE coupon SET code_hash = NULL WHERE id = :id"),
+            {"id": legacy.id},
+        )
+        db.session.commit()
+        db.session.expire_all()
+
+        found = Coupon.find_by_codes(["ABC-123", " XYZ-999", "MISSING"])
+        assert set(found) == {"ABC-123", " XYZ-999"}
+        assert found[" XYZ-999"].id == legacy.id
+        # Lookups only read; the hash is left for the backfill.
+        assert not db.session.dirty
+
+        assert Coupon.backfill_code_hashes(batch_size=1) == 1
+        db.session.commit()
+        stored = db.session.execute(
+            db.text("SELECT code_hash FROM coupon WHERE id = :id"),
+            {"id": legacy.id},
+        ).scalar()
+        assert stored == compute_code_hash("XYZ-999")
+        assert Coupon.backfill_code_hashes() == 0
+
+
+def test_non_admin_code_lookup_is_scoped_to_own_coupons(app):
+    with app.app_context():
+        other = User(email="other@example.com", first_name="Other", last_name="O", is_confirmed=True)
+        other.set_password("StrongPass123!")
+        db.session.add(other)
+        db.session.commit()
+
+    app.config.update(LOGIN_MAX_ATTEMPTS=10)
+    client = app.test_client()
+    login = client.post("/api/auth/login", json={"email": "other@example.com", "password": "StrongPass123!"})
+    assert login.status_code == 200
+
+    response = client.post("/update_coupon_transactions", data={"coupon_code": "ABC-123"})
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/my_transactions")
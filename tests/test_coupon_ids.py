@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_coupon_ids_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from sqlalchemy import event
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon
+from app.utils import coupon_ids
+from app.utils.coupon_ids import (
+    COUPON_ID_OFFSET,
+    COUPON_ID_SPACE,
+    CouponIdAllocator,
+    allocate_coupon_ids,
+    permute_coupon_id,
+)
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        coupon_ids._allocator = None
+        coupon_ids._table_floor = 0
+
+        user = User(email="owner@example.com", first_name="O", last_name="O", is_confirmed=True)
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+
+    yield app
+
+
+def test_permutation_is_a_bijection_on_a_small_sample():
+    key = b"k" * 32
+    ids = [permute_coupon_id(n, key) for n in range(5000)]
+    assert len(set(ids)) == len(ids)
+    assert all(COUPON_ID_OFFSET <= i < COUPON_ID_OFFSET + COUPON_ID_SPACE for i in ids)
+    # Consecutive sequence numbers must not give consecutive IDs.
+    assert sum(1 for a, b in zip(ids, ids[1:]) if b == a + 1) == 0
+    assert [permute_coupon_id(n, b"other") for n in range(5)] != ids[:5]
+
+    with pytest.raises(RuntimeError):
+        permute_coupon_id(COUPON_ID_SPACE, key)
+
+
+def test_allocator_reserves_once_per_block_and_skips_taken_ids():
+    blocks = iter([1, 2, 3])
+    reserved = []
+
+    def reserve():
+        reserved.append(next(blocks))
+        return reserved[-1]
+
+    key = b"k" * 32
+    taken = {permute_coupon_id(0, key), permute_coupon_id(5, key)}
+    allocator = CouponIdAllocator(
+        reserve, lambda ids: taken.intersection(ids), block_size=8, key=key
+    )
+
+    ids = [allocator.next_id() for _ in range(6)]
+    assert reserved == [1]
+    assert not taken.intersection(ids)
+
+    ids += allocator.next_ids(5)
+    assert reserved == [1, 2]
+    assert len(set(ids)) == 11
+
+
+def test_coupons_get_ids_without_a_query_per_insert(app):
+    with app.app_context():
+        user = User.query.one()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if "coupon_id_blocks" in statement or "FROM coupon WHERE id IN" in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            coupons = [
+                Coupon(code=f"C-{i}", value=10, cost=5, company="Fox", user_id=user.id)
+                for i in range(100)
+            ]
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        # Two blocks of 64: insert-if-missing + bump + read + taken-check each.
+        assert len(statements) == 8
+        db.session.add_all(coupons)
+        db.session.commit()
+
+        ids = [c.id for c in coupons] + allocate_coupon_ids(30)
+        assert len(set(ids)) == 130
+        assert Coupon.query.count() == 100
+
+
+def test_rolled_back_reservation_is_not_handed_out_again(app):
+    with app.app_context():
+        first = allocate_coupon_ids(64)
+        db.session.rollback()
+        second = allocate_coupon_ids(64)
+        assert not set(first) & set(second)
@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_dashboard_summary_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon
+from app.analytics.dashboard_summary import (
+    get_dashboard_cards,
+    get_dashboard_summary,
+    get_expiring_coupons,
+    refresh_stale_statuses,
+)
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        user = User(
+            email="owner@example.com",
+            first_name="Owner",
+            last_name="O",
+            is_confirmed=True,
+        )
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+
+        jan = datetime(2026, 1, 10, tzinfo=timezone.utc)
+        feb = datetime(2026, 2, 10, tzinfo=timezone.utc)
+        db.session.add_all([
+            Coupon(code="A-1", value=100, cost=80, used_value=30, company="Alpha",
+                   user_id=user.id, date_added=jan,
+                   expiration=date.today() + timedelta(days=3)),
+            Coupon(code="A-2", value=50, cost=50, used_value=50, company="Alpha",
+                   user_id=user.id, date_added=feb, status="נוצל"),
+            Coupon(code="B-1", value=200, cost=150, company="Beta", is_one_time=True,
+                   user_id=user.id, date_added=feb),
+            # Stored as active but already past its expiration date.
+            Coupon(code="B-2", value=40, cost=20, company="Beta", user_id=user.id,
+                   date_added=feb, expiration=date.today() - timedelta(days=2)),
+            Coupon(code="S-1", value=300, cost=250, company="Gamma", is_for_sale=True,
+                   user_id=user.id, date_added=feb),
+            Coupon(code="X-1", value=999, cost=0, company="Hidden", exclude_saving=True,
+                   user_id=user.id, date_added=feb),
+        ])
+        db.session.commit()
+        app.config["TEST_USER_ID"] = user.id
+
+    yield app
+
+
+def test_summary_matches_per_coupon_totals(app):
+    with app.app_context():
+        user_id = app.config["TEST_USER_ID"]
+        summary = get_dashboard_summary(user_id)
+
+        assert summary["total_coupons_count"] == 4
+        assert summary["total_coupons_value"] == 390
+        assert summary["total_used_value"] == 80
+        assert summary["total_remaining"] == 310
+        assert summary["total_savings"] == 20 + 50 + 20
+        assert summary["one_time_count"] == 1
+        assert summary["for_sale_count"] == 1
+
+        assert set(summary["companies"]) == {"Alpha", "Beta"}
+        assert summary["companies"]["Alpha"]["count"] == 2
+        assert summary["companies"]["Alpha"]["remaining_value"] == 70
+        assert summary["companies"]["Alpha"]["active_coupons"] == 1
+
+        assert summary["monthly"]["2026-01"]["count"] == 1
+        assert summary["monthly"]["2026-02"]["count"] == 3
+        assert summary["monthly"]["2026-02"]["companies"] == {"Alpha", "Beta"}
+
+
+def test_refresh_only_touches_stale_statuses(app):
+    with app.app_context():
+        user_id = app.config["TEST_USER_ID"]
+
+        assert refresh_stale_statuses(user_id) == 1
+        expired = Coupon.find_by_code("B-2")
+        assert expired.status == "פג תוקף"
+        assert refresh_stale_statuses(user_id) == 0
+
+        summary = get_dashboard_summary(user_id)
+        assert summary["active_count"] == 1
+        assert summary["active_one_time_count"] == 1
+        assert summary["used_count"] == 2
+
+
+def test_cards_only_load_visible_coupons_and_are_capped(app):
+    with app.app_context():
+        user_id = app.config["TEST_USER_ID"]
+        refresh_stale_statuses(user_id)
+
+        cards = get_dashboard_cards(user_id)
+        assert [c.code for c in cards["active"]] == ["A-1"]
+        assert [c.code for c in cards["active_one_time"]] == ["B-1"]
+        assert [c.code for c in cards["for_sale"]] == ["S-1"]
+        assert cards["remaining_count"] == 0
+
+        capped = get_dashboard_cards(user_id, limit=2)
+        shown = capped["active"] + capped["active_one_time"] + capped["for_sale"]
+        assert len(shown) == 2
+        assert capped["remaining_count"] == 1
+
+        assert [c.code for c in get_expiring_coupons(user_id)] == ["A-1"]
@@ -0,0 +1,141 @@
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.driver_pool import ChromeDriverPool, close_driver_pool, get_driver_pool
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        pass
+
+
+class FakeDriver:
+    """Just enough of the WebDriver surface for the pool's health checks and reset."""
+
+    def __init__(self):
+        self.cookies = {"session": "abc"}
+        self.quit_called = False
+        self.dead = False
+        self.switch_to = FakeSwitchTo(self)
+
+    @property
+    def window_handles(self):
+        if self.dead:
+            raise RuntimeError("chrome not reachable")
+        return ["main"]
+
+    def close(self):
+        pass
+
+    def execute_script(self, script):
+        pass
+
+    def execute_cdp_cmd(self, cmd, params):
+        pass
+
+    def delete_all_cookies(self):
+        self.cookies = {}
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+def _factory(created):
+    def factory():
+        driver = FakeDriver()
+        created.append(driver)
+        return driver, None
+    return factory
+
+
+def test_drivers_are_reused_and_reset_between_leases():
+    pool = ChromeDriverPool(max_size=2, max_uses=10)
+    created = []
+
+    with pool.lease("Multipass") as lease:
+        first = lease.get(_factory(created))
+    assert first.cookies == {}
+
+    with pool.lease("Multipass") as lease:
+        second = lease.get(_factory(created))
+
+    assert second is first
+    assert len(created) == 1
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 1
+    assert stats["idle"] == {"multipass": 1}
+    assert stats["leased"] == 0
+
+
+def test_drivers_are_recycled_after_max_uses_and_on_crash():
+    pool = ChromeDriverPool(max_size=2, max_uses=2)
+    created = []
+
+    for _ in range(3):
+        with pool.lease("max") as lease:
+            lease.get(_factory(created))
+    assert len(created) == 2
+    assert created[0].quit_called
+    assert pool.stats()["retired_max_uses"] == 1
+
+    # A driver that dies while idle is replaced on the next lease.
+    created[1].dead = True
+    with pool.lease("max") as lease:
+        driver = lease.get(_factory(created))
+    assert driver is created[2]
+    assert pool.stats()["retired_crashed"] == 1
+
+    # An exception inside the lease retires the driver instead of pooling it.
+    with pytest.raises(ValueError):
+        with pool.lease("max") as lease:
+            lease.get(_factory(created))
+            raise ValueError("boom")
+    assert created[2].quit_called
+    assert pool.stats()["idle"] == {}
+
+
+def test_pool_size_is_capped_across_sites():
+    pool = ChromeDriverPool(max_size=1, max_uses=10)
+    created = []
+
+    with pool.lease("multipass") as lease:
+        lease.get(_factory(created))
+    with pool.lease("buyme") as lease:
+        lease.get(_factory(created))
+
+    # The idle Multipass driver was evicted to stay within max_size.
+    assert created[0].quit_called
+    assert pool.stats()["idle"] == {"buyme": 1}
+    assert pool.stats()["retired_evicted"] == 1
+
+
+def test_close_driver_pool_quits_idle_drivers():
+    # Called at the end of every scraping job, since work horses skip atexit.
+    pool = get_driver_pool()
+    created = []
+    with pool.lease("multipass") as lease:
+        lease.get(_factory(created))
+    assert not created[0].quit_called
+
+    close_driver_pool()
+    assert created[0].quit_called
+    assert pool.stats()["idle"] == {}
@@ -0,0 +1,188 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_email_outbox_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app import helpers
+from app.extensions import db
+from app.models import EmailOutbox
+from app.utils.email_outbox import BrevoTransport, drain_outbox, enqueue_email, set_transport
+
+
+class StubBrevo:
+    """Local HTTP server standing in for POST /smtp/email."""
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append({"path": self.path, "api_key": self.headers.get("api-key"),
+                                      "payload": json.loads(body)})
+                status = stub.statuses.pop(0) if stub.statuses else 201
+                payload = stub.requests[-1]["payload"]
+                if status >= 400:
+                    response = {"code": "error", "message": "stub failure"}
+                elif "messageVersions" in payload:
+                    response = {"messageIds": [f"<m{i}>" for i in range(len(payload["messageVersions"]))]}
+                else:
+                    response = {"messageId": "<single>"}
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v3"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture()
+def app():
+    application = create_app()
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def brevo():
+    stub = StubBrevo()
+    transport = BrevoTransport(api_key="test-key", base_url=stub.url)
+    set_transport(transport)
+    yield stub
+    set_transport(None)
+    stub.close()
+
+
+def _enqueue(recipient, subject="שלום", html="<p>hi</p>", params=None):
+    return enqueue_email(
+        recipient_email=recipient,
+        recipient_name=recipient.split("@")[0],
+        subject=subject,
+        html_content=html,
+        sender_email="noreply@example.com",
+        sender_name="Coupon Master",
+        params=params,
+    )
+
+
+def test_identical_emails_are_sent_in_one_batch_call(app, brevo):
+    for i in range(3):
+        _enqueue(f"user{i}@example.com", params={"name": f"user{i}"})
+    _enqueue("other@example.com", subject="נושא אחר")
+
+    stats = drain_outbox()
+
+    assert stats == {"claimed": 4, "sent": 4, "retry": 0, "failed": 0, "calls": 2}
+    assert len(brevo.requests) == 2
+    batch = next(r["payload"] for r in brevo.requests if "messageVersions" in r["payload"])
+    assert [v["to"][0]["email"] for v in batch["messageVersions"]] == [
+        "user0@example.com", "user1@example.com", "user2@example.com",
+    ]
+    assert batch["messageVersions"][1]["params"] == {"name": "user1"}
+    assert all(r["api_key"] == "test-key" and r["path"] == "/v3/smtp/email" for r in brevo.requests)
+
+    rows = EmailOutbox.query.order_by(EmailOutbox.id).all()
+    assert [row.status for row in rows] == ["sent"] * 4
+    assert rows[1].message_id == "<m1>"
+    assert all(row.html_content is None and row.params is None for row in rows)
+    assert drain_outbox()["claimed"] == 0
+
+
+def test_transient_errors_are_retried_and_client_errors_fail(app, brevo):
+    _enqueue("retry@example.com")
+    brevo.statuses = [500]
+
+    stats = drain_outbox()
+    assert stats["retry"] == 1 and stats["sent"] == 0
+    row = EmailOutbox.query.one()
+    assert row.status == "pending" and row.attempts == 1 and "500" in row.last_error
+    assert row.html_content == "<p>hi</p>"
+    # Backed off: not due yet.
+    assert drain_outbox()["claimed"] == 0
+
+    row.next_attempt_at = db.func.now()
+    db.session.commit()
+    brevo.statuses = [400]
+    stats = drain_outbox()
+    assert stats["failed"] == 1
+    row = EmailOutbox.query.one()
+    assert row.status == "failed" and row.html_content is None
+
+
+def test_send_email_queues_instead_of_sending(app, brevo):
+    helpers.send_email(
+        sender_email="noreply@example.com",
+        sender_name="Coupon Master",
+        recipient_email="queued@example.com",
+        recipient_name="Queued",
+        subject="בדיקה",
+        html_content="<p>queued</p>",
+        add_timestamp=False,
+    )
+
+    assert brevo.requests == []
+    row = EmailOutbox.query.one()
+    assert row.status == "pending" and row.subject == "בדיקה"
+
+    assert drain_outbox()["sent"] == 1
+    assert brevo.requests[0]["payload"]["to"] == [{"email": "queued@example.com", "name": "Queued"}]
+
+
+def test_processes_without_a_worker_flush_when_the_context_ends(app, brevo):
+    # An RQ work horse or script: no OutboxWorker, so nothing would drain later.
+    app.config["TESTING"] = False
+    try:
+        with app.app_context():
+            _enqueue("job@example.com")
+            assert brevo.requests == []
+    finally:
+        app.config["TESTING"] = True
+
+    assert [r["payload"]["to"][0]["email"] for r in brevo.requests] == ["job@example.com"]
+    assert EmailOutbox.query.one().status == "sent"
+
+
+def test_transport_reuses_one_session(brevo):
+    transport = BrevoTransport(api_key="k", base_url=brevo.url)
+    session = transport.session
+    for i in range(3):
+        transport.send(sender={"email": "a@example.com"}, subject="s", html_content="h",
+                       to=[{"email": f"{i}@example.com"}])
+    assert transport.session is session
+    assert transport.calls == 3
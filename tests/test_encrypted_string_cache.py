@@ -0,0 +1,61 @@
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+
+from app.models import DecryptionCache, EncryptedString, cipher_suite, decryption_cache
+
+
+def test_decrypted_values_are_memoized():
+    decryption_cache.clear()
+    ciphertext = cipher_suite.encrypt(b"SECRET-1").decode()
+    column_type = EncryptedString()
+
+    assert column_type.process_result_value(ciphertext, None) == "SECRET-1"
+    assert column_type.process_result_value(ciphertext, None) == "SECRET-1"
+
+    stats = decryption_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+def test_plain_and_undecryptable_values_pass_through():
+    decryption_cache.clear()
+    column_type = EncryptedString()
+
+    assert column_type.process_result_value("plain", None) == "plain"
+    assert column_type.process_result_value(None, None) is None
+
+    bogus = "gAAAAA-not-a-token"
+    assert column_type.process_result_value(bogus, None) == bogus
+    stats = decryption_cache.stats()
+    assert stats["fallback"] == 0
+    assert stats["failures"] == 1
+
+    # Failures are retried rather than memoized.
+    assert column_type.process_result_value(bogus, None) == bogus
+    stats = decryption_cache.stats()
+    assert stats["failures"] == 2
+    assert stats["size"] == 0
+
+
+def test_cache_is_bounded_and_can_be_disabled():
+    cache = DecryptionCache(2)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    assert cache.stats()["size"] == 2
+
+    disabled = DecryptionCache(0)
+    disabled.put("a", "A")
+    assert disabled.get("a") is None
+    assert disabled.stats()["enabled"] is False
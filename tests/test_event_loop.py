@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.event_loop import LoopLagMonitor, run_blocking
+
+
+def test_run_blocking_keeps_the_loop_responsive():
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        task = asyncio.create_task(ticker())
+        result = await run_blocking(lambda seconds, value=None: time.sleep(seconds) or value, 0.2, value=7)
+        task.cancel()
+        return result
+
+    assert asyncio.run(scenario()) == 7
+    assert len(ticks) >= 5
+
+
+def test_monitor_reports_a_blocking_handler(caplog):
+    monitor = LoopLagMonitor(threshold=0.1, interval=0.02)
+
+    def slow_handler():
+        time.sleep(0.4)
+
+    async def scenario():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        slow_handler()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+    with caplog.at_level(logging.WARNING, logger="app.utils.event_loop"):
+        asyncio.run(scenario())
+
+    assert monitor.stalls == 1
+    assert monitor.max_lag >= 0.3
+    blocked = [r.getMessage() for r in caplog.records if "blocked for" in r.getMessage()]
+    assert blocked and "slow_handler" in blocked[0]
@@ -0,0 +1,127 @@
+import os
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+from openpyxl import Workbook
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_excel_importer_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon, Company, Tag
+from app.utils.coupon_ids import COUPON_ID_OFFSET
+from app.utils.excel_importer import import_coupons_excel, iter_excel_rows
+
+HEADER = ["קוד קופון", "ערך מקורי", "עלות", "חברה", "תיאור", "תאריך תפוגה", "קוד לשימוש חד פעמי"]
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        user = User(email="owner@example.com", first_name="O", last_name="O", is_confirmed=True)
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.add(Company(name="Shufersal", image_path="default_logo.png"))
+
+        food = Tag(name="food", count=1)
+        coupon = Coupon(code="OLD-1", value=50, cost=40, company="Shufersal", user=user)
+        coupon.tags.append(food)
+        db.session.add(coupon)
+        db.session.commit()
+
+    yield app
+
+
+def _workbook(tmp_path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    path = tmp_path / "coupons.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+def test_iter_excel_rows_keeps_row_numbers_and_drops_trailing_blanks(tmp_path):
+    path = _workbook(tmp_path, [
+        ["A1", 100, 90.0, "Fox", None, None, None],
+        [None] * 7,
+        ["A2", "N/A", 1.5, "Fox", None, None, None],
+        [None] * 7,
+    ])
+    rows = list(iter_excel_rows(path))
+    assert [number for number, _ in rows] == [2, 3, 4]
+    assert rows[0][1]["ערך מקורי"] == "100"
+    assert rows[0][1]["עלות"] == "90"
+    assert rows[2][1]["ערך מקורי"] is None
+    assert rows[2][1]["עלות"] == "1.5"
+
+
+def test_import_reports_invalid_rows_and_inserts_the_rest(app, tmp_path):
+    path = _workbook(tmp_path, [
+        ["C1", 100, 80, "Shufersal", "desc", "2030-01-31", "כן"],
+        ["", 100, 80, "", None, None, None],
+        ["C3", "abc", 80, "Fox", None, None, None],
+        ["C4", 100, "x", "Fox", None, None, None],
+        ["C5", 200, 150, "Fox", None, "31.12.2030", "false"],
+        ["C6", 300, 250, "Fox", None, "25/12/2030", None],
+    ])
+    progress_calls = []
+
+    with app.app_context():
+        user = User.query.filter_by(email="owner@example.com").one()
+        invalid, warnings, new_coupons = import_coupons_excel(
+            path, user, chunk_size=4, progress=lambda *args: progress_calls.append(args)
+        )
+        db.session.commit()
+
+        assert invalid == [
+            "שורה 3: חסרים שדות חובה: קוד קופון, חברה",
+            "שורה 4: ערך מקורי אינו מספר תקין (abc).",
+            "שורה 5: עלות אינה מספר תקין (x).",
+        ]
+        assert warnings == [
+            'שורה 6: תאריך תפוגה בפורמט לא תקין (הוזן "31.12.2030"). הוגדר כ-None.'
+        ]
+        assert [c.code for c in new_coupons] == ["C1", "C5", "C6"]
+        assert progress_calls == [(4, 1), (6, 3)]
+
+        c1 = Coupon.find_by_code("C1")
+        assert c1.value == 100 and c1.cost == 80
+        assert c1.expiration == date(2030, 1, 31)
+        assert c1.is_one_time is True
+        assert c1.status == "פעיל"
+        assert [t.name for t in c1.tags] == ["food"]
+        assert Tag.query.filter_by(name="food").one().count == 2
+
+        c6 = Coupon.find_by_code("C6")
+        assert c6.expiration == date(2030, 12, 25)
+        assert [t.name for t in c6.tags] == ["Tag for Fox"]
+        assert Tag.query.filter_by(name="Tag for Fox").one().count == 2
+        assert Company.query.filter_by(name="Fox").count() == 1
+
+        ids = [c.id for c in new_coupons]
+        assert len(set(ids)) == 3
+        assert all(coupon_id >= COUPON_ID_OFFSET for coupon_id in ids)
@@ -0,0 +1,145 @@
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_expiration_reminders_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import Company, Coupon, EmailOutbox, User
+from app.utils.expiration_reminders import (
+    LogoCache,
+    digest_subject,
+    due_reminders,
+    logo_cache,
+    send_expiration_digests,
+)
+
+
+def _user(email):
+    user = User(email=email, first_name=email.split("@")[0], last_name="T", is_confirmed=True)
+    user.set_password("StrongPass123!")
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+@pytest.fixture()
+def app():
+    application = create_app()
+    application.config.update(TESTING=True, CRON_API_TOKEN="cron-token")
+    today = date.today()
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        logo_cache.clear()
+        many = _user("many@example.com")
+        one = _user("one@example.com")
+        db.session.add(Company(name="Fox", image_path="images/fox_missing.png"))
+        db.session.add_all([
+            Coupon(code="M-30", value=100, cost=50, company="Fox", user_id=many.id,
+                   expiration=today + timedelta(days=30)),
+            Coupon(code="M-7", value=100, cost=50, company="Fox", user_id=many.id,
+                   expiration=today + timedelta(days=7)),
+            Coupon(code="M-3", value=100, cost=50, company="Wolt", user_id=many.id,
+                   expiration=today + timedelta(days=3)),
+            Coupon(code="O-1", value=40, cost=20, company="Fox", user_id=one.id,
+                   expiration=today + timedelta(days=1)),
+            # Not due: already reminded, for sale, or outside every window.
+            Coupon(code="O-30-SENT", value=10, cost=5, company="Fox", user_id=one.id,
+                   expiration=today + timedelta(days=30), reminder_sent_30_days=True),
+            Coupon(code="O-SALE", value=10, cost=5, company="Fox", user_id=one.id,
+                   expiration=today + timedelta(days=7), is_for_sale=True),
+            Coupon(code="O-20", value=10, cost=5, company="Fox", user_id=one.id,
+                   expiration=today + timedelta(days=20)),
+        ])
+        db.session.commit()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def test_due_reminders_come_from_one_query(app):
+    due = due_reminders(date.today())
+
+    assert sorted((coupon.code, days_left) for coupon, _, _, days_left in due) == [
+        ("M-3", 3), ("M-30", 30), ("M-7", 7), ("O-1", 1),
+    ]
+    image_paths = {coupon.code: image_path for coupon, _, image_path, _ in due}
+    assert image_paths["M-7"] == "images/fox_missing.png"
+    assert image_paths["M-3"] is None
+
+
+def test_one_digest_per_user_and_flags_set_in_bulk(app):
+    result = send_expiration_digests(date.today())
+
+    assert result["emails"] == 2
+    assert len(result["sent"]) == 4 and result["failed"] == []
+
+    emails = {row.recipient_email: row for row in EmailOutbox.query.all()}
+    assert set(emails) == {"many@example.com", "one@example.com"}
+    digest = emails["many@example.com"].html_content
+    assert all(code in digest for code in ("M-30", "M-7", "M-3"))
+    assert emails["many@example.com"].subject == "תזכורת: 3 קופונים פגים בקרוב"
+    assert emails["one@example.com"].subject == "תזכורת דחופה: קופון פג תוקף מחר!"
+
+    flags = {
+        c.code: (c.reminder_sent_30_days, c.reminder_sent_7_days, c.reminder_sent_1_day)
+        for c in Coupon.query.all()
+    }
+    assert flags["M-30"] == (True, False, False)
+    assert flags["M-7"] == (False, True, False)
+    assert flags["M-3"] == (False, True, False)
+    assert flags["O-1"] == (False, False, True)
+
+    # Nothing is due the second time around.
+    assert send_expiration_digests(date.today())["emails"] == 0
+    assert EmailOutbox.query.count() == 2
+
+
+def test_cron_endpoint_reports_digests(app):
+    client = app.test_client()
+    response = client.post(
+        "/admin/scheduled-emails/api/cron/send-expiration-reminders",
+        headers={"Authorization": "Bearer cron-token"},
+    )
+
+    assert response.status_code == 200
+    summary = response.get_json()["summary"]
+    assert summary["total_sent"] == 4 and summary["emails_sent"] == 2
+    assert summary["reminders_30_days"] == 1 and summary["reminders_1_day"] == 1
+
+
+def test_logo_cache_reencodes_only_when_file_changes(tmp_path):
+    cache = LogoCache()
+    logo = tmp_path / "logo.png"
+    logo.write_bytes(b"one")
+
+    first = cache.get(str(logo))
+    assert cache.get(str(logo)) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    logo.write_bytes(b"two!")
+    os.utime(logo, ns=(logo.stat().st_atime_ns, logo.stat().st_mtime_ns + 1_000_000))
+    assert cache.get(str(logo)) != first
+    assert cache.misses == 2
+    assert cache.get(str(tmp_path / "missing.png")) == ""
+
+
+def test_digest_subject():
+    assert digest_subject([7]) == "תזכורת: קופון פג תוקף בעוד שבוע"
+    assert digest_subject([30, 1]).startswith("תזכורת דחופה: 2 קופונים")
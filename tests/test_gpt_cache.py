@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_gpt_cache_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app import helpers
+from app.utils.gpt_cache import (
+    GptResponseCache,
+    gpt_cache_key,
+    gpt_response_cache,
+    image_digest,
+    normalize_text_input,
+    set_chat_client,
+)
+
+
+class StubChatClient:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        arguments = json.dumps({
+            "קוד קופון": "ABC123",
+            "ערך מקורי": 100,
+            "עלות": 80,
+            "חברה": "Fox",
+            "תיאור": "",
+            "תאריך תפוגה": None,
+            "תגיות": "",
+            "סטטוס": "פעיל",
+        })
+        return {
+            "id": f"chatcmpl-{len(self.calls)}",
+            "object": "chat.completion",
+            "created": 1700000000,
+            "model": kwargs["model"],
+            "choices": [{"message": {"tool_calls": [{"function": {"arguments": arguments}}]}}],
+            "usage": {"prompt_tokens": 900, "completion_tokens": 100, "total_tokens": 1000},
+        }
+
+
+@pytest.fixture()
+def stub_client(monkeypatch):
+    client = StubChatClient()
+    set_chat_client(client)
+    gpt_response_cache.clear()
+
+    def no_network(*args, **kwargs):
+        raise RuntimeError("network disabled in tests")
+
+    monkeypatch.setattr(helpers.requests, "get", no_network)
+    yield client
+    set_chat_client(None)
+    gpt_response_cache.clear()
+
+
+def test_cache_key_normalizes_input_and_tracks_versions():
+    base = gpt_cache_key("sms", normalize_text_input(" קוד  ABC\n123 "), ["Fox", "Wolt"], "gpt-4o")
+    assert base == gpt_cache_key("sms", normalize_text_input("קוד ABC 123"), ["Wolt", "Fox"], "gpt-4o")
+    assert base != gpt_cache_key("sms", normalize_text_input("קוד ABC 124"), ["Fox", "Wolt"], "gpt-4o")
+    assert base != gpt_cache_key("sms", normalize_text_input("קוד ABC 123"), ["Fox"], "gpt-4o")
+    assert base != gpt_cache_key("usage", normalize_text_input("קוד ABC 123"), ["Fox", "Wolt"], "gpt-4o")
+    assert image_digest(image_bytes=b"png") == image_digest(base64_image="cG5n")
+
+
+def test_cache_evicts_least_recent_and_expires():
+    cache = GptResponseCache(max_size=2, ttl_seconds=60)
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.put("c", {"n": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+
+    expired = GptResponseCache(max_size=2, ttl_seconds=0)
+    expired.put("a", {"n": 1})
+    assert expired.get("a") is None
+
+
+def test_repeat_sms_extraction_is_served_from_cache(stub_client):
+    app = create_app()
+    with app.test_request_context():
+        first_df, first_pricing = helpers.extract_coupon_detail_sms("קוד ABC123 בשווי 100", ["Fox"])
+        second_df, second_pricing = helpers.extract_coupon_detail_sms("  קוד ABC123   בשווי 100 ", ["Fox"])
+
+    assert len(stub_client.calls) == 1
+    assert first_df.to_dict("records") == second_df.to_dict("records")
+
+    first, second = first_pricing.iloc[0], second_pricing.iloc[0]
+    assert not first["cache_hit"] and first["total_tokens"] == 1000
+    assert second["cache_hit"] and second["total_tokens"] == 0
+    assert second["cost_usd"] == 0
+    assert second["id"] == first["id"]
+
+    with app.test_request_context():
+        helpers.extract_coupon_detail_sms("קוד ABC123 בשווי 100", ["Fox", "Wolt"])
+    assert len(stub_client.calls) == 2
@@ -0,0 +1,130 @@
+import os
+import sys
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils import multipass_fetchers
+from app.utils.multipass_fetchers import (
+    FetcherMetrics,
+    HttpMultipassFetcher,
+    fetch_multipass_tables,
+    fetcher_metrics,
+)
+
+FORM_PAGE = """
+<html><body><form method="post">
+<input type="hidden" name="__VIEWSTATE" value="vs0" />
+<input type="hidden" name="__EVENTVALIDATION" value="ev0" />
+<input type="text" id="MainContent_CardNumberTxt" name="ctl00$MainContent$CardNumberTxt" />
+<input type="submit" id="MainContent_GetBalanceBtn" name="ctl00$MainContent$GetBalanceBtn" value="submit" />
+</form></body></html>
+"""
+
+TABLE_PAGE = """
+<html><body><form method="post">
+<input type="hidden" name="__VIEWSTATE" value="vs{page}" />
+<table id="MainContent_GV">
+<tr><th>תאריך ושעה</th><th>בית עסק</th><th>סכום מימוש תקציב</th><th>אסמכתא</th></tr>
+<tr><td>01/0{page}/2024 10:00</td><td>Shop {page}</td><td>₪{page}0.00</td><td>R{page}</td></tr>
+</table>
+<a id="MainContent_btnNext" {next_attrs}>next</a>
+</form></body></html>
+"""
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeSession:
+    def __init__(self, get_page, post_pages):
+        self.get_page = get_page
+        self.post_pages = list(post_pages)
+        self.posted = []
+
+    def get(self, url, timeout=None):
+        return FakeResponse(self.get_page)
+
+    def post(self, url, data=None, timeout=None):
+        self.posted.append(dict(data))
+        return FakeResponse(self.post_pages.pop(0))
+
+    def close(self):
+        pass
+
+
+class CannedFetcher(HttpMultipassFetcher):
+    def __init__(self, session):
+        super().__init__()
+        self.fake_session = session
+
+    def _session(self):
+        return self.fake_session
+
+
+def test_http_fetcher_submits_form_and_follows_pagination():
+    session = FakeSession(FORM_PAGE, [
+        TABLE_PAGE.format(page=1, next_attrs="href=\"javascript:__doPostBack('ctl00$MainContent$btnNext','')\""),
+        TABLE_PAGE.format(page=2, next_attrs='class="aspNetDisabled"'),
+    ])
+    tables, html, name = fetch_multipass_tables(
+        "1234", fetchers=[CannedFetcher(session)]
+    )
+
+    assert name == "http"
+    assert len(tables) == 2
+    assert "R2" in html
+    first_post, second_post = session.posted
+    assert first_post["ctl00$MainContent$CardNumberTxt"] == "1234"
+    assert first_post["ctl00$MainContent$GetBalanceBtn"] == "submit"
+    assert first_post["__VIEWSTATE"] == "vs0"
+    # Pagination posts back the new page's view state plus the next-button target.
+    assert second_post["__VIEWSTATE"] == "vs1"
+    assert second_post["__EVENTTARGET"] == "ctl00$MainContent$btnNext"
+
+
+def test_truncated_history_falls_back_instead_of_returning_partial_pages(monkeypatch):
+    next_link = "href=\"javascript:__doPostBack('ctl00$MainContent$btnNext','')\""
+    monkeypatch.setattr(multipass_fetchers, "MULTIPASS_MAX_PAGES", 2)
+    capped = FakeSession(FORM_PAGE, [
+        TABLE_PAGE.format(page=1, next_attrs=next_link),
+        TABLE_PAGE.format(page=2, next_attrs=next_link),
+    ])
+    assert fetch_multipass_tables("1234", fetchers=[CannedFetcher(capped)]) is None
+
+    # An enabled Next button we cannot post back to is just as incomplete.
+    unfollowable = FakeSession(FORM_PAGE, [TABLE_PAGE.format(page=1, next_attrs="")])
+    assert fetch_multipass_tables("1234", fetchers=[CannedFetcher(unfollowable)]) is None
+
+
+def test_challenge_falls_back_and_is_recorded():
+    recaptcha_form = FORM_PAGE.replace("</form>", '<div class="g-recaptcha"></div></form>')
+    before = fetcher_metrics.stats().get("http", {}).get("challenge", 0)
+
+    assert fetch_multipass_tables("1234", fetchers=[CannedFetcher(FakeSession(recaptcha_form, []))]) is None
+
+    assert fetcher_metrics.stats()["http"]["challenge"] == before + 1
+
+
+def test_fetcher_metrics_success_rate():
+    metrics = FetcherMetrics()
+    metrics.record("http", "success", 0.2)
+    metrics.record("http", "challenge", 0.4)
+    stats = metrics.stats()["http"]
+    assert stats["success_rate"] == 0.5
+    assert stats["avg_seconds"] == 0.3
@@ -0,0 +1,229 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_newsletter_dispatch_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import EmailOutbox, Newsletter, NewsletterSending, User
+from app.utils import email_outbox
+from app.utils.newsletter_dispatch import (
+    compile_newsletter,
+    dispatch_newsletter,
+    render_for_user,
+    user_values,
+)
+from app.utils.tokens import generate_unsubscribe_token
+
+
+@pytest.fixture()
+def app():
+    application = create_app()
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        admin = User(email="admin@example.com", first_name="Admin", last_name="A", is_confirmed=True,
+                     newsletter_subscription=False)
+        admin.set_password("StrongPass123!")
+        db.session.add(admin)
+        for i in range(5):
+            user = User(email=f"reader{i}@example.com", first_name=f"Reader{i}", last_name="R",
+                        is_confirmed=True, newsletter_subscription=True)
+            user.set_password("StrongPass123!")
+            db.session.add(user)
+        unsubscribed = User(email="quiet@example.com", first_name="Quiet", last_name="Q",
+                            is_confirmed=True, newsletter_subscription=False)
+        unsubscribed.set_password("StrongPass123!")
+        db.session.add(unsubscribed)
+        db.session.flush()
+        db.session.add(Newsletter(
+            title="חדשות החודש",
+            newsletter_type="custom",
+            custom_html="<html><body><p>שלום {{ user.first_name }} ({{ user.email }})</p></body></html>",
+            created_by=admin.id,
+        ))
+        db.session.commit()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def _readers():
+    return User.query.filter_by(newsletter_subscription=True).order_by(User.id).all()
+
+
+def test_compiled_template_renders_per_user_values(app):
+    newsletter = Newsletter.query.one()
+    user = _readers()[0]
+    user.first_name = "<b>Dana</b>"
+
+    with app.test_request_context():
+        compiled = compile_newsletter(newsletter)
+    assert "{{ params.first_name }}" in compiled["html"] and "__cm_" not in compiled["html"]
+    html = render_for_user(compiled, user_values(user))
+
+    assert "{{ params." not in html
+    assert "שלום &lt;b&gt;Dana&lt;/b&gt; (reader0@example.com)" in html
+    assert f"user_id={user.id}&token={generate_unsubscribe_token(user)}" in html
+
+    newsletter.newsletter_type = "structured"
+    newsletter.content = "שורה ראשונה\nשורה שנייה"
+    with app.test_request_context():
+        compiled = compile_newsletter(newsletter)
+    html = render_for_user(compiled, user_values(user))
+    assert "__cm_" not in html and "{{ params." not in html
+    assert generate_unsubscribe_token(user) in html
+
+
+def test_dispatch_queues_each_subscriber_once(app):
+    newsletter_id = Newsletter.query.one().id
+
+    stats = dispatch_newsletter(newsletter_id, mark_sent=True, chunk_size=2)
+
+    assert stats == {"queued": 5, "failed": 0, "chunks": 3}
+    assert sorted(row.recipient_email for row in EmailOutbox.query.all()) == [
+        f"reader{i}@example.com" for i in range(5)
+    ]
+    newsletter = db.session.get(Newsletter, newsletter_id)
+    assert newsletter.sent_count == 5 and newsletter.is_sent
+
+    assert dispatch_newsletter(newsletter_id, chunk_size=2)["queued"] == 0
+    assert EmailOutbox.query.count() == 5
+
+
+class _Transport:
+    def __init__(self, fail_for=()):
+        self.fail_for = set(fail_for)
+        self.payloads = []
+
+    def send(self, sender, subject, html_content, to=None, params=None, versions=None, api_key=None):
+        self.payloads.append({"html": html_content, "to": to, "params": params, "versions": versions})
+        recipients = [v["to"][0]["email"] for v in versions] if versions else [to[0]["email"]]
+        if self.fail_for & set(recipients):
+            raise email_outbox.BrevoError("Brevo returned 400: invalid recipient", status=400)
+        return {"messageIds": [f"<{r}>" for r in recipients], "messageId": f"<{recipients[0]}>"}
+
+
+def test_newsletter_is_one_template_with_per_user_params(app):
+    newsletter_id = Newsletter.query.one().id
+    readers = _readers()
+
+    dispatch_newsletter(newsletter_id)
+
+    rows = EmailOutbox.query.order_by(EmailOutbox.id).all()
+    assert len({row.template_key for row in rows}) == 1
+    assert "{{ params.first_name }}" in rows[0].html_content
+
+    transport = _Transport()
+    assert email_outbox.flush_outbox(transport=transport)["calls"] == 1
+    (payload,) = transport.payloads
+    assert [v["params"]["first_name"] for v in payload["versions"]] == [r.first_name for r in readers]
+    statuses = {s.user_id: s.delivery_status for s in NewsletterSending.query.all()}
+    assert statuses == {reader.id: "sent" for reader in readers}
+
+
+def test_outbox_failure_is_retried_by_the_next_dispatch(app):
+    newsletter_id = Newsletter.query.one().id
+    readers = _readers()
+
+    dispatch_newsletter(newsletter_id)
+    # One version of the batch is rejected, so the whole call fails for good.
+    email_outbox.flush_outbox(transport=_Transport(fail_for={"reader2@example.com"}))
+
+    sendings = NewsletterSending.query.all()
+    assert {s.delivery_status for s in sendings} == {"failed"}
+    assert "invalid recipient" in sendings[0].error_message
+    assert db.session.get(Newsletter, newsletter_id).sent_count == 0
+
+    assert dispatch_newsletter(newsletter_id)["queued"] == 5
+    email_outbox.flush_outbox(transport=_Transport())
+    db.session.expire_all()
+    statuses = {s.user_id: s.delivery_status for s in NewsletterSending.query.all()}
+    assert statuses == {reader.id: "sent" for reader in readers}
+    assert db.session.get(Newsletter, newsletter_id).sent_count == 5
+
+
+def test_interrupted_dispatch_resumes_without_resending(app, monkeypatch):
+    newsletter_id = Newsletter.query.one().id
+    readers = _readers()
+    db.session.add(NewsletterSending(newsletter_id=newsletter_id, user_id=readers[4].id,
+                                     delivery_status="failed", error_message="boom"))
+    db.session.commit()
+
+    real_stage = email_outbox.stage_email
+    calls = {"n": 0}
+
+    def crash_on_third(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == 3:
+            raise SystemExit("worker killed")
+        return real_stage(*args, **kwargs)
+
+    monkeypatch.setattr(email_outbox, "stage_email", crash_on_third)
+    with pytest.raises(SystemExit):
+        dispatch_newsletter(newsletter_id, chunk_size=2)
+    db.session.rollback()
+    # The first chunk was committed; the interrupted one was not.
+    assert EmailOutbox.query.count() == 2
+
+    monkeypatch.setattr(email_outbox, "stage_email", real_stage)
+    stats = dispatch_newsletter(newsletter_id, chunk_size=2)
+
+    assert stats["queued"] == 3
+    recipients = sorted(row.recipient_email for row in EmailOutbox.query.all())
+    assert recipients == [f"reader{i}@example.com" for i in range(5)]
+    statuses = {s.user_id: s.delivery_status for s in NewsletterSending.query.all()}
+    assert statuses == {reader.id: "queued" for reader in readers}
+
+
+def test_dispatch_racing_another_run_skips_its_users(app, monkeypatch):
+    from app.utils import newsletter_dispatch
+
+    newsletter_id = Newsletter.query.one().id
+    readers = _readers()
+    real_pending = newsletter_dispatch._pending_chunk
+    seeded = {"done": False}
+
+    def pending_then_race(*args, **kwargs):
+        rows = real_pending(*args, **kwargs)
+        if rows and not seeded["done"]:
+            # Another dispatch commits the first reader after this chunk was read.
+            seeded["done"] = True
+            with db.engine.begin() as conn:
+                conn.execute(NewsletterSending.__table__.insert().values(
+                    newsletter_id=newsletter_id, user_id=readers[0].id, delivery_status="queued",
+                ))
+        return rows
+
+    monkeypatch.setattr(newsletter_dispatch, "_pending_chunk", pending_then_race)
+    stats = dispatch_newsletter(newsletter_id, chunk_size=2)
+
+    assert stats["queued"] == 4
+    recipients = sorted(row.recipient_email for row in EmailOutbox.query.all())
+    assert recipients == [f"reader{i}@example.com" for i in range(1, 5)]
+    assert NewsletterSending.query.count() == 5
+
+
+def test_selected_users_only(app):
+    newsletter_id = Newsletter.query.one().id
+    readers = _readers()
+    quiet = User.query.filter_by(email="quiet@example.com").one()
+
+    stats = dispatch_newsletter(newsletter_id, user_ids=[readers[1].id, quiet.id])
+
+    assert stats["queued"] == 1
+    assert EmailOutbox.query.one().recipient_email == "reader1@example.com"
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+os.environ.setdefault(
+    "DATABASE_URL",
+    f"sqlite:///{Path(tempfile.gettempdir()) / 'coupon_manager_normalize_multipass_test.db'}",
+)
+
+from app.helpers import normalize_multipass_dataframe
+
+
+def test_currency_cells_are_parsed_like_float():
+    raw = pd.DataFrame({
+        "סכום מימוש תקציב": [
+            "₪1,234.50", "‏12.00‎", "−₪7.25", "-", "", None, np.nan,
+            "1.2.3", 3.5, "٣",
+        ],
+        "אסמכתא": ["R1"] * 10,
+    })
+
+    df = normalize_multipass_dataframe(raw, "C")
+
+    assert df["usage_amount"].tolist() == [
+        1234.5, 12.0, -7.25, 0.0, 0.0, 0.0, 0.0, 0.0, 3.5, 3.0,
+    ]
+    assert df["usage_amount"].dtype == float
+    # Missing amount columns are filled with zeros.
+    assert df["recharge_amount"].tolist() == [0.0] * 10
+
+
+def test_missing_references_fall_back_to_row_label():
+    raw = pd.DataFrame(
+        {"אסמכתא": ["R 1", "", "-", None, "nan", "R2"]},
+        index=[10, 11, 12, 13, 14, 15],
+    )
+
+    df = normalize_multipass_dataframe(raw, "C-9")
+
+    assert df["reference_number"].tolist() == [
+        "R1", "C-9|12", "C-9|13", "C-9|14", "C-9|15", "R2",
+    ]
+    assert list(df.index) == list(range(6))
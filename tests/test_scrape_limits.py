@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.scrape_limits import ScrapeLimiter
+
+
+def _hammer(limiter, sites):
+    def work(site):
+        with limiter.slot(site):
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=work, args=(site,)) for site in sites]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_global_browser_cap_is_respected():
+    limiter = ScrapeLimiter(max_browsers=2, max_per_site=2)
+    _hammer(limiter, ["multipass", "max", "buyme"] * 4)
+
+    stats = limiter.stats()
+    assert stats["peak"] == 2
+    assert stats["active"] == {}
+
+
+def test_per_site_override_limits_a_single_site():
+    limiter = ScrapeLimiter(max_browsers=4, max_per_site=4, site_overrides={"BuyMe": 1})
+    seen = []
+    lock = threading.Lock()
+
+    def work():
+        with limiter.slot("buyme"):
+            with lock:
+                seen.append(limiter.stats()["active"].get("buyme", 0))
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(seen) == 1
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.session_cache import TelegramSessionCache
+
+
+class RecordingConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    async def execute(self, query, *args):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.calls.append((query, args))
+        return f"UPDATE {len(args[0])}"
+
+
+def test_hot_session_is_served_from_memory():
+    cache = TelegramSessionCache(session_timeout_minutes=60, ttl_seconds=60)
+    now = datetime.now(timezone.utc)
+    assert cache.get(10) is None
+
+    cache.put(10, user_id=7, gender="female", expires_at=now + timedelta(minutes=5))
+    entry = cache.get(10)
+    assert entry["user_id"] == 7 and entry["gender"] == "female"
+    assert cache.gender(7) == (True, "female")
+
+    assert cache.get(10, now=now + timedelta(minutes=6)) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = TelegramSessionCache(session_timeout_minutes=60, ttl_seconds=0)
+    cache.put(10, user_id=7, gender=None, expires_at=datetime.now(timezone.utc) + timedelta(hours=1))
+    assert cache.get(10) is None
+    assert cache.gender(7) == (False, None)
+
+
+def test_extensions_are_coalesced_into_one_update():
+    cache = TelegramSessionCache(session_timeout_minutes=60)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    cache.put(10, user_id=7, gender=None, expires_at=start)
+    for minute in range(5):
+        cache.extend(10, now=start + timedelta(minutes=minute))
+    cache.extend(11, now=start)
+
+    assert cache.get(10, now=start)["expires_at"] == start + timedelta(minutes=64)
+
+    conn = RecordingConnection()
+    assert asyncio.run(cache.flush(conn)) == 2
+    assert len(conn.calls) == 1
+    _, (chat_ids, expiries, touched) = conn.calls[0]
+    assert dict(zip(chat_ids, expiries))[10] == start + timedelta(minutes=64)
+    assert dict(zip(chat_ids, touched))[10] == start + timedelta(minutes=4)
+    assert cache.pending_count == 0
+    assert asyncio.run(cache.flush(conn)) == 0
+
+
+def test_failed_flush_keeps_pending_extensions():
+    cache = TelegramSessionCache(session_timeout_minutes=60)
+    cache.extend(10)
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.flush(RecordingConnection(fail=True)))
+    assert cache.pending_count == 1
+
+
+def test_invalidate_and_unflushed_expiry():
+    cache = TelegramSessionCache(session_timeout_minutes=60)
+    stored = datetime.now(timezone.utc) - timedelta(seconds=1)
+    extended = cache.extend(10)
+    assert cache.effective_expiry(10, stored) == extended
+    assert cache.put(10, 7, "male", stored)["expires_at"] == extended
+
+    cache.invalidate(10)
+    assert cache.get(10) is None
+    assert cache.pending_count == 0
+    assert cache.effective_expiry(10, stored) == stored
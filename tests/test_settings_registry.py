@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_settings_registry_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import AdminSettings
+from app.registration_guard import is_public_registration_enabled
+from app.utils.settings_registry import SettingsRegistry, get_settings_registry
+
+
+@pytest.fixture()
+def app():
+    application = create_app()
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all([
+            AdminSettings(setting_key="daily_email_enabled", setting_value="true", setting_type="boolean"),
+            AdminSettings(setting_key="daily_email_hour", setting_value="9", setting_type="integer"),
+            AdminSettings(setting_key="broken_hour", setting_value="nine", setting_type="integer"),
+            AdminSettings(setting_key="email_report_options", setting_value='{"a": [1]}', setting_type="json"),
+            AdminSettings(setting_key="daily_email_recipient", setting_value="x@example.com"),
+        ])
+        db.session.commit()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+def test_settings_are_typed_and_loaded_once(app):
+    registry = get_settings_registry()
+    registry.invalidate()
+    loads = registry.loads
+
+    for _ in range(50):
+        assert AdminSettings.get_setting("daily_email_enabled") is True
+        assert AdminSettings.get_setting("daily_email_hour", 0) == 9
+        assert AdminSettings.get_setting("daily_email_recipient") == "x@example.com"
+    assert AdminSettings.get_setting("broken_hour", 7) == 7
+    assert AdminSettings.get_setting("missing", "fallback") == "fallback"
+
+    options = AdminSettings.get_setting("email_report_options")
+    options["a"].append(2)
+    assert AdminSettings.get_setting("email_report_options") == {"a": [1]}
+
+    assert registry.loads == loads + 1
+
+
+def test_set_setting_applies_locally_at_once(app):
+    assert AdminSettings.get_setting("daily_email_hour") == 9
+    AdminSettings.set_setting("daily_email_hour", 11, "integer")
+    assert AdminSettings.get_setting("daily_email_hour") == 11
+
+    assert is_public_registration_enabled() is True
+    AdminSettings.set_setting("public_registration_enabled", False, "boolean")
+    assert is_public_registration_enabled() is False
+
+
+def test_other_workers_pick_up_the_version_bump(app):
+    # Another gunicorn worker: same shared cache, its own in-process registry.
+    other = SettingsRegistry(check_seconds=60)
+    assert other.values()["daily_email_hour"] == 9
+
+    AdminSettings.set_setting("daily_email_hour", 12, "integer")
+    # Within its check interval the other worker still serves its copy...
+    assert other.values()["daily_email_hour"] == 9
+    # ...and reloads on its next check because the shared version moved.
+    other.check_seconds = 0
+    assert other.values()["daily_email_hour"] == 12
+    loads = other.loads
+    assert other.values()["daily_email_hour"] == 12
+    assert other.loads == loads
@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_status_reconciler_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon, Notification
+from app.analytics.user_summary import get_user_summary
+from app.utils.status_reconciler import reconcile_coupon_statuses
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        user = User(email="owner@example.com", first_name="O", last_name="O", is_confirmed=True)
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+
+        yesterday = date.today() - timedelta(days=1)
+        db.session.add_all([
+            Coupon(code="USED-1", value=100, cost=50, used_value=100, company="Co",
+                   user_id=user.id),
+            Coupon(code="EXP-1", value=100, cost=50, company="Co", user_id=user.id,
+                   expiration=yesterday),
+            # Both fully used and expired: "used" wins, like update_coupon_status.
+            Coupon(code="BOTH-1", value=10, cost=5, used_value=10, company="Co",
+                   user_id=user.id, expiration=yesterday),
+            Coupon(code="BACK-1", value=100, cost=50, used_value=20, company="Co",
+                   user_id=user.id, status="נוצל"),
+            Coupon(code="OK-1", value=100, cost=50, company="Co", user_id=user.id,
+                   expiration=date.today() + timedelta(days=5)),
+        ])
+        db.session.commit()
+
+    yield app
+
+
+def _statuses():
+    return {c.code: c.status for c in Coupon.query.all()}
+
+
+def test_reconcile_updates_statuses_in_bulk_and_notifies_once(app):
+    with app.app_context():
+        counts = reconcile_coupon_statuses()
+        assert counts == {"used": 2, "expired": 1, "reactivated": 1, "notifications": 3}
+
+        db.session.expire_all()
+        assert _statuses() == {
+            "USED-1": "נוצל",
+            "EXP-1": "פג תוקף",
+            "BOTH-1": "נוצל",
+            "BACK-1": "פעיל",
+            "OK-1": "פעיל",
+        }
+        assert Coupon.find_by_code("EXP-1").notification_sent_pagh_tokev is True
+        messages = sorted(n.message for n in Notification.query.all())
+        assert "הקופון EXP-1 פג תוקף." in messages
+        assert all(n.link.startswith("/coupon_detail/") for n in Notification.query.all())
+
+        # The summary rows were rebuilt for the affected user.
+        user = User.query.first()
+        assert get_user_summary(user.id)["active_count"] == 2
+
+        # A second run finds nothing to do and never duplicates notifications.
+        assert reconcile_coupon_statuses() == {
+            "used": 0, "expired": 0, "reactivated": 0, "notifications": 0,
+        }
+        assert Notification.query.count() == 3
+
+
+def test_reconcile_respects_coupon_scope(app):
+    with app.app_context():
+        exp_id = Coupon.find_by_code("EXP-1").id
+        counts = reconcile_coupon_statuses(coupon_ids=[exp_id], notify=False)
+        assert counts["expired"] == 1
+        assert counts["used"] == 0
+        assert Notification.query.count() == 0
+
+        db.session.expire_all()
+        assert Coupon.find_by_code("USED-1").status == "פעיל"
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+
+from app.utils.telegram_broadcast import (
+    TelegramBroadcaster,
+    TokenBucket,
+    group_rows_by_chat,
+    retry_after_seconds,
+)
+
+
+class FloodError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Flood control exceeded")
+        self.retry_after = retry_after
+
+
+class BlockedError(Exception):
+    pass
+
+
+class FakeBot:
+    def __init__(self, flood_on_first=None, blocked=()):
+        self.sent = []
+        self.flood_on_first = set(flood_on_first or ())
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise BlockedError("bot was blocked by the user")
+        if chat_id in self.flood_on_first:
+            self.flood_on_first.discard(chat_id)
+            raise FloodError(0.2)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+def test_token_bucket_limits_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 5 burst tokens, then 10 more at 50/s
+    assert 0.15 <= asyncio.run(scenario()) < 0.6
+
+
+def test_broadcast_sends_concurrently_within_limits():
+    bot = FakeBot(blocked={3})
+    messages = [{"chat_id": chat_id, "text": f"hi {chat_id}"} for chat_id in range(20)]
+
+    async def scenario():
+        broadcaster = TelegramBroadcaster(
+            bot.send_message, rate=100, concurrency=5, permanent_errors=(BlockedError,)
+        )
+        return await broadcaster.send_all(messages)
+
+    stats = asyncio.run(scenario())
+    assert stats["sent"] == 19 and stats["failed"] == 1 and stats["retries"] == 0
+    assert sorted(chat for chat, _, _ in bot.sent) == [c for c in range(20) if c != 3]
+
+
+def test_flood_wait_pauses_and_retries():
+    bot = FakeBot(flood_on_first={1})
+
+    async def scenario():
+        broadcaster = TelegramBroadcaster(bot.send_message, rate=100, per_chat_interval=0)
+        started = time.monotonic()
+        stats = await broadcaster.send_all([{"chat_id": 1, "text": "a"}, {"chat_id": 2, "text": "b"}])
+        return stats, started
+
+    stats, started = asyncio.run(scenario())
+    assert stats["sent"] == 2 and stats["flood_waits"] == 1
+    retried = [at for chat, _, at in bot.sent if chat == 1][0]
+    assert retried - started >= 0.19
+
+
+def test_only_unsent_network_errors_are_retried():
+    calls = []
+
+    def wrapped(cause):
+        # Like python-telegram-bot: TimedOut/NetworkError raised from the httpx error.
+        error = RuntimeError("Timed out")
+        error.__cause__ = cause
+        return error
+
+    async def send_message(chat_id, text):
+        calls.append(chat_id)
+        if chat_id == 1 and calls.count(1) == 1:
+            raise wrapped(httpx.ConnectError("connection refused"))
+        if chat_id == 2:
+            raise wrapped(httpx.ReadTimeout("read timed out"))
+
+    async def scenario():
+        broadcaster = TelegramBroadcaster(send_message, rate=100, per_chat_interval=0, backoff=0)
+        return await broadcaster.send_all([{"chat_id": 1, "text": "a"}, {"chat_id": 2, "text": "b"}])
+
+    stats = asyncio.run(scenario())
+    assert calls.count(1) == 2 and calls.count(2) == 1
+    assert stats["sent"] == 1 and stats["unconfirmed"] == 1 and stats["retries"] == 1
+
+
+def test_per_chat_interval_spaces_messages_to_one_chat():
+    bot = FakeBot()
+
+    async def scenario():
+        broadcaster = TelegramBroadcaster(bot.send_message, rate=100, per_chat_interval=0.1)
+        await broadcaster.send_all([{"chat_id": 9, "text": str(i)} for i in range(3)])
+
+    asyncio.run(scenario())
+    times = [at for _, _, at in bot.sent]
+    assert times[2] - times[0] >= 0.19
+
+
+def test_retry_after_and_grouping_helpers():
+    assert retry_after_seconds(FloodError(3)) == 3
+    assert retry_after_seconds(FloodError(timedelta(seconds=2))) == 2
+    assert retry_after_seconds(ValueError()) is None
+
+    rows = [
+        {"telegram_chat_id": 1, "user_id": 10, "gender": "male", "id": 100},
+        {"telegram_chat_id": 2, "user_id": 20, "gender": None, "id": 200},
+        {"telegram_chat_id": 1, "user_id": 10, "gender": "male", "id": 101},
+    ]
+    grouped = group_rows_by_chat(rows)
+    assert list(grouped) == [1, 2]
+    assert [row["id"] for row in grouped[1]["items"]] == [100, 101]
+    assert grouped[2]["user_id"] == 20
@@ -0,0 +1,149 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_transaction_ingest_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon, CouponTransaction
+from app.utils.transaction_ingest import ingest_coupon_transactions
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        user = User(email="owner@example.com", first_name="O", last_name="O", is_confirmed=True)
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+
+        coupon = Coupon(code="MP-1", value=500, cost=400, company="Multipass", user_id=user.id)
+        db.session.add(coupon)
+        db.session.commit()
+
+        # A manually entered transaction that scrapes must never remove.
+        db.session.add(CouponTransaction(
+            coupon_id=coupon.id, usage_amount=5, recharge_amount=0,
+            reference_number="manual-1", source="User",
+        ))
+        db.session.commit()
+
+    yield app
+
+
+def _scrape(*rows):
+    return pd.DataFrame([
+        {
+            "transaction_date": pd.Timestamp("2024-05-01 10:00"),
+            "location": location,
+            "recharge_amount": 0.0,
+            "usage_amount": usage,
+            "reference_number": ref,
+        }
+        for ref, location, usage in rows
+    ])
+
+
+def test_ingest_is_idempotent_and_recomputes_used_value(app):
+    with app.app_context():
+        coupon = Coupon.query.filter_by(company="Multipass").one()
+        first = ingest_coupon_transactions(
+            coupon, _scrape(("R1", "Shop", 10.0), ("R2", "Shop", 20.0)), source="Multipass"
+        )
+        assert first["inserted"] == 2
+        assert first["inserted_refs"] == {"R1", "R2"}
+        assert coupon.used_value == 35.0
+
+        first_ids = {t.reference_number: t.id for t in CouponTransaction.query.all()}
+
+        again = ingest_coupon_transactions(
+            coupon,
+            _scrape(("R1", "Shop", 10.0), ("R2", "Shop", 20.0), ("R3", "Cafe", 7.5)),
+            source="Multipass",
+        )
+        assert again["inserted_refs"] == {"R3"}
+        assert coupon.used_value == 42.5
+
+        # Existing rows were not deleted and re-inserted.
+        ids = {t.reference_number: t.id for t in CouponTransaction.query.all()}
+        assert ids["R1"] == first_ids["R1"]
+        assert ids["R2"] == first_ids["R2"]
+
+
+def test_complete_history_prunes_only_the_scraped_source(app):
+    with app.app_context():
+        coupon = Coupon.query.filter_by(company="Multipass").one()
+        ingest_coupon_transactions(
+            coupon, _scrape(("R1", "Shop", 10.0), ("R2", "Shop", 20.0)), source="Multipass"
+        )
+
+        result = ingest_coupon_transactions(
+            coupon,
+            _scrape(("R2", "Shop", 20.0), ("X", "לא נמצאו רשומות מתאימות", 0.0)),
+            source="Multipass",
+            history_complete=True,
+        )
+
+        assert result["pruned"] == 1
+        assert result["inserted"] == 0
+        refs = sorted(t.reference_number for t in CouponTransaction.query.all())
+        assert refs == ["R2", "manual-1"]
+        assert coupon.used_value == 25.0
+
+
+def test_scrape_without_completeness_signal_never_prunes(app):
+    with app.app_context():
+        coupon = Coupon.query.filter_by(company="Multipass").one()
+        ingest_coupon_transactions(
+            coupon, _scrape(("R1", "Shop", 10.0), ("R2", "Shop", 20.0)), source="Multipass"
+        )
+
+        # Fewer rows than stored, e.g. a scrape that stopped after one page.
+        result = ingest_coupon_transactions(coupon, _scrape(("R2", "Shop", 20.0)), source="Multipass")
+
+        assert result["pruned"] == 0
+        refs = sorted(t.reference_number for t in CouponTransaction.query.all())
+        assert refs == ["R1", "R2", "manual-1"]
+        assert coupon.used_value == 35.0
+
+
+def test_background_update_keeps_used_value_from_the_ledger(app, monkeypatch):
+    import app.helpers as helpers
+    from app.tasks import _update_coupon
+
+    def fake_scrape(coupon, max_retries=3):
+        df = _scrape(("R1", "Shop", 10.0))
+        ingest_coupon_transactions(coupon, df, source="Multipass")
+        return df
+
+    monkeypatch.setattr(helpers, "get_coupon_data_with_retry", fake_scrape)
+    with app.app_context():
+        coupon_id = Coupon.query.filter_by(company="Multipass").one().id
+        result = _update_coupon(coupon_id)
+
+        assert result["success"] and result["new_usage"] == 15.0
+        # The manual 5 stays counted; the scrape alone would say 10.
+        assert db.session.get(Coupon, coupon_id).used_value == 15.0
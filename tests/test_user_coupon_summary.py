@@ -0,0 +1,155 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_user_summary_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import db
+from app.models import User, Coupon, UserCouponSummary
+from app.analytics.user_summary import get_user_summary, rebuild_user_summaries
+
+
+@pytest.fixture()
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        for email in ("a@example.com", "b@example.com"):
+            user = User(email=email, first_name="U", last_name="S", is_confirmed=True)
+            user.set_password("StrongPass123!")
+            db.session.add(user)
+        db.session.commit()
+
+    yield app
+
+
+def _summary_snapshot():
+    return sorted(
+        (
+            row.user_id,
+            row.category,
+            row.coupon_count,
+            row.active_count,
+            row.active_one_time_count,
+            row.one_time_count,
+            round(row.total_value, 2),
+            round(row.used_value, 2),
+            round(row.remaining_value, 2),
+            round(row.savings, 2),
+        )
+        for row in UserCouponSummary.query.all()
+        if row.coupon_count
+    )
+
+
+def _assert_matches_rebuild():
+    incremental = _summary_snapshot()
+    rebuild_user_summaries()
+    db.session.commit()
+    assert incremental == _summary_snapshot()
+
+
+def test_summary_follows_orm_writes(app):
+    with app.app_context():
+        user_a = User.query.filter_by(email="a@example.com").first()
+        user_b = User.query.filter_by(email="b@example.com").first()
+
+        first = Coupon(code="S-1", value=100, cost=70, company="Co", user_id=user_a.id)
+        second = Coupon(code="S-2", value=50, cost=50, company="Co", user_id=user_a.id,
+                        is_one_time=True)
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        totals = get_user_summary(user_a.id)
+        assert totals["coupon_count"] == 2
+        assert totals["active_count"] == 1
+        assert totals["active_one_time_count"] == 1
+        assert totals["total_value"] == 150
+        assert totals["savings"] == 30
+        _assert_matches_rebuild()
+
+        first.used_value = 100
+        first.status = "נוצל"
+        second.is_for_sale = True
+        db.session.commit()
+
+        assert get_user_summary(user_a.id)["remaining_value"] == 50
+        assert get_user_summary(user_a.id, ["for_sale"])["coupon_count"] == 1
+        _assert_matches_rebuild()
+
+        # Ownership transfer (marketplace) moves the totals between users.
+        second.user_id = user_b.id
+        db.session.commit()
+        assert get_user_summary(user_b.id)["coupon_count"] == 1
+        assert get_user_summary(user_a.id)["coupon_count"] == 1
+        _assert_matches_rebuild()
+
+        db.session.delete(first)
+        db.session.commit()
+        assert get_user_summary(user_a.id)["coupon_count"] == 0
+        _assert_matches_rebuild()
+
+
+def test_rolled_back_writes_do_not_leak_into_summary(app):
+    with app.app_context():
+        user_a = User.query.filter_by(email="a@example.com").first()
+        db.session.add(Coupon(code="R-1", value=10, cost=5, company="Co", user_id=user_a.id))
+        db.session.flush()
+        db.session.rollback()
+
+        assert get_user_summary(user_a.id)["coupon_count"] == 0
+
+        db.session.add(Coupon(code="R-2", value=20, cost=5, company="Co", user_id=user_a.id))
+        db.session.commit()
+        assert get_user_summary(user_a.id)["total_value"] == 20
+        _assert_matches_rebuild()
+
+
+def test_setting_expired_attributes_does_not_load_them(app):
+    with app.app_context():
+        user_a = User.query.filter_by(email="a@example.com").first()
+        user_b = User.query.filter_by(email="b@example.com").first()
+        coupon = Coupon(code="E-1", value=100, cost=60, company="Co", user_id=user_a.id)
+        db.session.add(coupon)
+        db.session.commit()
+        user_a_id, user_b_id = user_a.id, user_b.id
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            # Everything is expired after the commit; assigning must not SELECT.
+            coupon.used_value = 40
+            coupon.user_id = user_b_id
+            assert statements == []
+            db.session.commit()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        assert get_user_summary(user_a_id)["coupon_count"] == 0
+        assert get_user_summary(user_b_id)["used_value"] == 40
+        _assert_matches_rebuild()
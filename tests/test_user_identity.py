@@ -0,0 +1,147 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+import pytest
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode("utf-8"))
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("ENABLE_SCHEDULER", "0")
+os.environ.setdefault("ALLOW_INSECURE_OAUTH_TRANSPORT", "0")
+os.environ.setdefault("ENABLE_EXTERNAL_WIDGET", "0")
+
+_db_file = Path(tempfile.gettempdir()) / "coupon_manager_user_identity_test.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+
+from app import create_app
+from app.extensions import cache, db
+from app.models import Coupon, User
+from app.utils.user_identity import CachedUser, _cache_key, load_user_identity
+
+
+@pytest.fixture()
+def app():
+    application = create_app()
+    application.config.update(TESTING=True, WTF_CSRF_ENABLED=False, LOGIN_MAX_ATTEMPTS=10)
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(email="a@example.com", first_name="Dana", last_name="A", is_confirmed=True,
+                    slots=5, slots_automatic_coupons=5)
+        user.set_password("StrongPass123!")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Coupon(code="IDENTITY-1", value=100, cost=50, company="Co", user_id=user.id))
+        db.session.commit()
+        cache.clear()
+    yield application
+
+
+@pytest.fixture()
+def user_queries(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def test_polling_requests_skip_the_users_table(app, user_queries):
+    client = app.test_client()
+    assert client.post("/api/auth/login",
+                       json={"email": "a@example.com", "password": "StrongPass123!"}).status_code == 200
+    with app.app_context():
+        coupon_id = Coupon.query.one().id
+
+    assert client.get(f"/get_active_viewers/{coupon_id}").status_code == 200
+    user_queries.clear()
+    for _ in range(3):
+        assert client.get(f"/get_active_viewers/{coupon_id}").status_code == 200
+    assert user_queries == []
+
+
+def test_snapshot_serves_identity_and_loads_orm_lazily(app):
+    with app.test_request_context():
+        user_id = User.query.one().id
+        load_user_identity(user_id)
+        db.session.expunge_all()
+
+        identity = load_user_identity(user_id)
+        assert isinstance(identity, CachedUser)
+        assert identity._user is None
+        assert (identity.id, identity.first_name, identity.is_admin) == (user_id, "Dana", False)
+        assert identity.get_id() == str(user_id) and identity.is_authenticated
+        assert identity._user is None
+
+        assert [c.code for c in identity.coupons] == ["IDENTITY-1"]
+        assert isinstance(identity.orm, User)
+        assert identity.check_password("StrongPass123!")
+
+
+def test_orm_changes_invalidate_the_snapshot(app):
+    with app.test_request_context():
+        user_id = User.query.one().id
+        load_user_identity(user_id)
+        assert cache.get(_cache_key(user_id)) is not None
+
+        identity = load_user_identity(user_id)
+        identity.first_name = "Noa"
+        identity.slots -= 1
+        db.session.commit()
+        assert cache.get(_cache_key(user_id)) is None
+
+        fresh = load_user_identity(user_id)
+        assert fresh.first_name == "Noa" and fresh.slots == 4
+
+        user = db.session.get(User, user_id)
+        user.is_deleted = True
+        db.session.commit()
+        assert load_user_identity(user_id).is_deleted is True
+
+
+def test_balances_come_from_the_row_on_state_changing_requests(app):
+    with app.app_context():
+        user_id = User.query.one().id
+        with app.test_request_context():
+            load_user_identity(user_id)
+        # Changed behind the ORM's back, so only the row has the new value.
+        db.session.execute(db.text("UPDATE users SET slots = 2 WHERE id = :id"), {"id": user_id})
+        db.session.commit()
+        db.session.expunge_all()
+
+    with app.test_request_context(method="GET"):
+        assert load_user_identity(user_id).slots == 5
+    with app.test_request_context(method="POST"):
+        assert load_user_identity(user_id).slots == 2
+
+
+def test_automatic_coupon_slots_are_never_served_from_the_snapshot(app):
+    with app.app_context():
+        user_id = User.query.one().id
+        with app.test_request_context():
+            load_user_identity(user_id)
+        # The Telegram bot's raw UPDATE fires no ORM event.
+        db.session.execute(
+            db.text("UPDATE users SET slots_automatic_coupons = slots_automatic_coupons - 1 WHERE id = :id"),
+            {"id": user_id},
+        )
+        db.session.commit()
+        db.session.expunge_all()
+
+    with app.test_request_context(method="GET"):
+        identity = load_user_identity(user_id)
+        assert identity._user is None
+        assert identity.slots_automatic_coupons == 4
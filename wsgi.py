@@ -66,6 +66,10 @@ logger = logging.getLogger(__name__)
 # Create Flask application
 app = create_app()
 
+# Queued email is sent from a background thread in each web process.
+from app.utils.email_outbox import ensure_outbox_worker
+ensure_outbox_worker(app)
+
 def start_telegram_bot_thread():
     """
     Start Telegram bot in a separate thread with asyncio loop.